@@ -35,7 +35,7 @@ class SupplierAdmin(admin.ModelAdmin):
 
 @admin.register(Product)
 class ProductAdmin(admin.ModelAdmin):
-    list_display = ('id', 'product_name', 'category', 'brand', 'price', 'discount', 'stock_quantity', 'is_available', 'added_at')
+    list_display = ('id', 'product_name', 'category', 'brand', 'price', 'discount', 'final_price', 'stock_quantity', 'is_available', 'added_at')
     list_filter = ('category', 'brand', 'is_available')
     search_fields = ('product_name', 'product_description')
 
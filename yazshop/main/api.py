@@ -9,7 +9,7 @@ from .models import (
     Role, UserProfile, UserAddress, Category, Brand, Supplier, Product, ProductSize,
     Tag, ProductTag, Favorite, Cart, CartItem, Order, OrderItem, Payment,
     Delivery, Promotion, ProductReview, SupportTicket, ActivityLog,
-    SavedPaymentMethod, CardTransaction, BalanceTransaction, Receipt, ReceiptItem,
+    SavedPaymentMethod, CardTransaction, BalanceTransaction,
     OrganizationAccount, OrganizationTransaction
 )
 from .serializers import (
@@ -29,6 +29,15 @@ from django.db.models import Q, Sum, Count, Avg
 from django.utils import timezone
 from django.core.paginator import Paginator
 from .helpers import _user_is_admin, _user_is_manager, _log_activity
+from .search import filter_by_search, order_by_ids
+from .facets import filter_catalog
+from .pagination import is_cursor_mode, paginate_by_cursor, InvalidCursor
+from . import related, pricing, placement, ledger, idempotency, outbox, fulfillment, cancellation, wallet, statements
+from .suggest import suggest
+from . import membership
+from .conditional import conditional_on, CATALOG_TABLES
+from . import changes
+from .listing import parse_fields, listing_values, serialize_rows, serialize_products, serialize_ids
 
 
 # ===== Permissions =====
@@ -58,12 +67,16 @@ class UserAddressViewSet(viewsets.ModelViewSet):
     permission_classes = [ReadOnlyOrAuthenticated]
 
 
+@method_decorator(conditional_on('category'), name='list')
+@method_decorator(conditional_on('category'), name='retrieve')
 class CategoryViewSet(viewsets.ModelViewSet):
     queryset = Category.objects.all()
     serializer_class = CategorySerializer
     permission_classes = [ReadOnlyOrAuthenticated]
 
 
+@method_decorator(conditional_on('brand'), name='list')
+@method_decorator(conditional_on('brand'), name='retrieve')
 class BrandViewSet(viewsets.ModelViewSet):
     queryset = Brand.objects.all()
     serializer_class = BrandSerializer
@@ -77,10 +90,25 @@ class SupplierViewSet(viewsets.ModelViewSet):
 
 
 class ProductViewSet(viewsets.ModelViewSet):
-    queryset = Product.objects.select_related('category', 'brand', 'supplier').all()
+    queryset = Product.objects.select_related('category', 'brand', 'supplier').prefetch_related('images')
     serializer_class = ProductSerializer
     permission_classes = [ReadOnlyOrAuthenticated]
 
+    def list(self, request, *args, **kwargs):
+        """Список товаров через легкий сериализатор (поддерживает ?fields=)"""
+        try:
+            fields = parse_fields(request.GET.get('fields'))
+        except ValueError as e:
+            return Response({
+                'success': False,
+                'error': str(e)
+            }, status=status.HTTP_400_BAD_REQUEST)
+        queryset = listing_values(Product.objects.order_by('id'), fields)
+        page = self.paginate_queryset(queryset)
+        if page is not None:
+            return self.get_paginated_response(serialize_rows(page, fields))
+        return Response(serialize_rows(queryset, fields))
+
 
 class ProductSizeViewSet(viewsets.ModelViewSet):
     queryset = ProductSize.objects.select_related('product').all()
@@ -88,6 +116,8 @@ class ProductSizeViewSet(viewsets.ModelViewSet):
     permission_classes = [ReadOnlyOrAuthenticated]
 
 
+@method_decorator(conditional_on('tag'), name='list')
+@method_decorator(conditional_on('tag'), name='retrieve')
 class TagViewSet(viewsets.ModelViewSet):
     queryset = Tag.objects.all()
     serializer_class = TagSerializer
@@ -841,6 +871,7 @@ class OrderAPIView(APIView):
         serializer = OrderSerializer(orders, many=True)
         return Response(serializer.data)
 
+    @method_decorator(idempotency.idempotent('order_create'))
     def post(self, request):
         """Создать новый заказ (оформление заказа)"""
         cart = Cart.objects.filter(user=request.user).first()
@@ -868,15 +899,9 @@ class OrderAPIView(APIView):
                 'error': 'Выберите адрес доставки'
             }, status=status.HTTP_400_BAD_REQUEST)
 
-        # Проверка количества товара на складе
-        errors = []
-        for item in cart.items.all():
-            if item.size:
-                if item.size.size_stock < item.quantity:
-                    errors.append(f"Товар '{item.product.product_name}' размера {item.size.size_label}: недостаточно на складе (доступно: {item.size.size_stock}, запрошено: {item.quantity})")
-            elif item.product.stock_quantity < item.quantity:
-                errors.append(f"Товар '{item.product.product_name}': недостаточно на складе (доступно: {item.product.stock_quantity}, запрошено: {item.quantity})")
-        
+        # Проверка количества товара на складе (окончательно остатки проверяет списание)
+        items = placement.cart_items(cart)
+        errors = placement.stock_errors(items)
         if errors:
             return Response({
                 'success': False,
@@ -885,27 +910,13 @@ class OrderAPIView(APIView):
 
         # Проверка промокода
         promo = None
-        discount_amount = Decimal('0')
         if promo_code:
             try:
-                promo = Promotion.objects.get(promo_code=promo_code.upper(), is_active=True)
-                today = timezone.now().date()
-                if promo.start_date and promo.start_date > today:
-                    return Response({
-                        'success': False,
-                        'error': 'Промокод еще не действует'
-                    }, status=status.HTTP_400_BAD_REQUEST)
-                if promo.end_date and promo.end_date < today:
-                    return Response({
-                        'success': False,
-                        'error': 'Промокод истек'
-                    }, status=status.HTTP_400_BAD_REQUEST)
-                cart_total = cart.total_price()
-                discount_amount = cart_total * (promo.discount / Decimal('100'))
-            except Promotion.DoesNotExist:
+                promo = pricing.get_promo(promo_code)
+            except pricing.PromoError as e:
                 return Response({
                     'success': False,
-                    'error': 'Неверный промокод'
+                    'error': str(e)
                 }, status=status.HTTP_400_BAD_REQUEST)
 
         try:
@@ -916,17 +927,9 @@ class OrderAPIView(APIView):
                 'error': 'Адрес не найден'
             }, status=status.HTTP_404_NOT_FOUND)
         
-        # Вычисляем итоговую сумму
-        cart_total = cart.total_price()
-        delivery_cost = Decimal('1000.00')
-        subtotal_after_discount = cart_total - discount_amount
-        pre_vat_amount = subtotal_after_discount + delivery_cost
-        vat_rate = Decimal('20.00')
-        vat_amount = (pre_vat_amount * vat_rate / Decimal('100')).quantize(Decimal('0.01'))
-        amount_after_vat = pre_vat_amount + vat_amount
-        tax_rate = Decimal('13.00')
-        tax_amount = (amount_after_vat * tax_rate / Decimal('100')).quantize(Decimal('0.01'))
-        final_amount = amount_after_vat.quantize(Decimal('0.01'))
+        # Итоги заказа по проверенным позициям, а не по кэшу итогов корзины (pricing.py)
+        summary = pricing.items_summary(items, promo)
+        final_amount = summary.total
 
         # Проверяем способ оплаты
         paid_from_balance = False
@@ -947,13 +950,13 @@ class OrderAPIView(APIView):
                     user=request.user,
                     address=address,
                     total_amount=final_amount,
-                    delivery_cost=delivery_cost,
+                    delivery_cost=summary.delivery_cost,
                     promo_code=promo,
-                    discount_amount=discount_amount,
-                    vat_rate=vat_rate,
-                    vat_amount=vat_amount,
-                    tax_rate=tax_rate,
-                    tax_amount=tax_amount,
+                    discount_amount=summary.discount_amount,
+                    vat_rate=summary.vat_rate,
+                    vat_amount=summary.vat_amount,
+                    tax_rate=summary.tax_rate,
+                    tax_amount=summary.tax_amount,
                     paid_from_balance=paid_from_balance,
                     order_status='paid' if paid_from_balance else 'processing'
                 )
@@ -970,51 +973,14 @@ class OrderAPIView(APIView):
                     payment_method_type = 'balance'
                     payment_status = 'paid'
                     
-                    profile, _ = UserProfile.objects.select_for_update().get_or_create(user=request.user)
-                    if profile.balance < final_amount:
-                        return Response({
-                            'success': False,
-                            'error': f'Недостаточно средств на балансе. Текущий баланс: {profile.balance} ₽, требуется: {final_amount} ₽'
-                        }, status=status.HTTP_400_BAD_REQUEST)
-                    balance_before = profile.balance
-                    profile.balance -= final_amount
-                    profile.save()
-                    
-                    BalanceTransaction.objects.create(
-                        user=request.user,
-                        transaction_type='order_payment',
-                        amount=final_amount,
-                        balance_before=balance_before,
-                        balance_after=profile.balance,
-                        description=f'Оплата заказа #{order.id}',
-                        order=order,
-                        status='completed'
-                    )
+                    # Условный UPDATE (wallet.py); InsufficientBalance откатывает транзакцию заказа
+                    wallet.debit(request.user, final_amount, 'order_payment', f'Оплата заказа #{order.id}', order)
                 elif payment_method == 'card':
                     payment_status = 'paid'
                     if saved_payment_id and saved_payment_id != '':
-                        saved_payment = SavedPaymentMethod.objects.select_for_update().get(id=saved_payment_id, user=request.user)
+                        saved_payment = SavedPaymentMethod.objects.get(id=saved_payment_id, user=request.user)
                         payment_method_type = saved_payment.card_type or 'card'
-                        if saved_payment.balance < final_amount:
-                            return Response({
-                                'success': False,
-                                'error': f'Недостаточно средств на выбранной карте. Баланс карты: {saved_payment.balance} ₽, требуется: {final_amount} ₽'
-                            }, status=status.HTTP_400_BAD_REQUEST)
-                        new_card_balance = saved_payment.balance - final_amount
-                        if new_card_balance < 0:
-                            return Response({
-                                'success': False,
-                                'error': f'Недостаточно средств на выбранной карте. Баланс карты: {saved_payment.balance} ₽, требуется: {final_amount} ₽'
-                            }, status=status.HTTP_400_BAD_REQUEST)
-                        saved_payment.balance = new_card_balance
-                        saved_payment.save()
-                        CardTransaction.objects.create(
-                            saved_payment_method=saved_payment,
-                            transaction_type='withdrawal',
-                            amount=final_amount,
-                            description=f'Оплата заказа #{order.id}',
-                            status='completed'
-                        )
+                        wallet.debit_card(saved_payment, final_amount, f'Оплата заказа #{order.id}')
                     elif card_number and card_holder_name and expiry_month and expiry_year:
                         payment_method_type = 'visa' if card_number.startswith('4') else 'mastercard' if card_number.startswith('5') else 'card'
                         if save_card:
@@ -1030,26 +996,7 @@ class OrderAPIView(APIView):
                                 card_type=card_type,
                                 is_default=is_default
                             )
-                            if saved_payment.balance < final_amount:
-                                return Response({
-                                    'success': False,
-                                    'error': f'Недостаточно средств на карте. Баланс карты: {saved_payment.balance} ₽, требуется: {final_amount} ₽'
-                                }, status=status.HTTP_400_BAD_REQUEST)
-                            new_card_balance = saved_payment.balance - final_amount
-                            if new_card_balance < 0:
-                                return Response({
-                                    'success': False,
-                                    'error': f'Недостаточно средств на карте. Баланс карты: {saved_payment.balance} ₽, требуется: {final_amount} ₽'
-                                }, status=status.HTTP_400_BAD_REQUEST)
-                            saved_payment.balance = new_card_balance
-                            saved_payment.save()
-                            CardTransaction.objects.create(
-                                saved_payment_method=saved_payment,
-                                transaction_type='withdrawal',
-                                amount=final_amount,
-                                description=f'Оплата заказа #{order.id}',
-                                status='completed'
-                            )
+                            wallet.debit_card(saved_payment, final_amount, f'Оплата заказа #{order.id}')
                         else:
                             return Response({
                                 'success': False,
@@ -1075,93 +1022,13 @@ class OrderAPIView(APIView):
                     order.order_status = 'paid'
                     order.save(update_fields=['order_status'])
                 
-                # Переводим средства на счет организации (если платеж прошел, но не наличными)
-                if payment_status == 'paid' and payment_method != 'cash':
-                    org_account = OrganizationAccount.get_account()
-                    balance_before = org_account.balance
-                    tax_reserve_before = org_account.tax_reserve
-                    
-                    org_account.balance += final_amount
-                    org_account.tax_reserve += tax_amount
-                    org_account.save()
-                    
-                    OrganizationTransaction.objects.create(
-                        organization_account=org_account,
-                        transaction_type='order_payment',
-                        amount=final_amount,
-                        description=f'Поступление от заказа #{order.id}',
-                        order=order,
-                        created_by=request.user,
-                        balance_before=balance_before,
-                        balance_after=org_account.balance,
-                        tax_reserve_before=tax_reserve_before,
-                        tax_reserve_after=org_account.tax_reserve
-                    )
-
-                # Создаем позиции заказа и вычитаем количество со склада
-                for item in cart.items.all():
-                    OrderItem.objects.create(
-                        order=order,
-                        product=item.product,
-                        size=item.size,
-                        quantity=item.quantity,
-                        unit_price=item.unit_price,
-                    )
-                    
-                    if item.size:
-                        item.size.size_stock -= item.quantity
-                        item.size.save()
-                        item.product.stock_quantity -= item.quantity
-                        item.product.save()
-                    else:
-                        item.product.stock_quantity -= item.quantity
-                        item.product.save()
-                
-                cart.items.all().delete()
-
-                # Формируем чек
-                delivery_vat = (delivery_cost * vat_rate / Decimal('100')).quantize(Decimal('0.01'))
-                
-                receipt = Receipt.objects.create(
-                    user=request.user,
-                    order=order,
-                    status='executed',
-                    total_amount=final_amount,
-                    subtotal=cart_total,
-                    delivery_cost=delivery_cost,
-                    discount_amount=discount_amount,
-                    vat_rate=vat_rate,
-                    vat_amount=vat_amount,
-                    payment_method=payment_method if payment_method in ['cash', 'balance', 'card'] else 'card'
-                )
-                
-                for item in order.items.select_related('product').all():
-                    line_total = (item.unit_price * item.quantity).quantize(Decimal('0.01'))
-                    line_vat = (line_total * vat_rate / Decimal('100')).quantize(Decimal('0.01'))
-                    ReceiptItem.objects.create(
-                        receipt=receipt,
-                        product_name=item.product.product_name if item.product else 'Товар',
-                        article=str(item.product.id if item.product else ''),
-                        quantity=item.quantity,
-                        unit_price=item.unit_price,
-                        line_total=line_total,
-                        vat_amount=line_vat
-                    )
-                
-                ReceiptItem.objects.create(
-                    receipt=receipt,
-                    product_name='Доставка',
-                    article='DELIVERY',
-                    quantity=1,
-                    unit_price=delivery_cost,
-                    line_total=delivery_cost,
-                    vat_amount=delivery_vat
-                )
-                
-                receipt.total_amount = final_amount.quantize(Decimal('0.01'))
-                receipt.save()
-                
-                _log_activity(request.user, 'create', f'order_{order.id}', f'Создан заказ на сумму {final_amount} ₽', request)
+                # Позиции заказа, списание остатков и очистка корзины (placement.py)
+                placement.place_items(order, items)
+                placement.clear_cart(cart)
+                # Чек, поступление на счет организации и журнал действий — после коммита, в фоне
+                placement.after_checkout(order, payment_method,
+                                         credit=payment_status == 'paid' and payment_method != 'cash',
+                                         request=request)
                 
                 serializer = OrderSerializer(order)
                 return Response({
@@ -1169,6 +1036,16 @@ class OrderAPIView(APIView):
                     'order': serializer.data,
                     'order_id': order.id
                 }, status=status.HTTP_201_CREATED)
+        except placement.OutOfStock as e:
+            return Response({
+                'success': False,
+                'error': str(e)
+            }, status=status.HTTP_409_CONFLICT)
+        except wallet.InsufficientBalance as e:
+            return Response({
+                'success': False,
+                'error': f'{e}, требуется: {final_amount} ₽'
+            }, status=status.HTTP_400_BAD_REQUEST)
         except Exception as e:
             return Response({
                 'success': False,
@@ -1191,98 +1068,26 @@ class OrderDetailAPIView(APIView):
         """Отменить заказ"""
         order = get_object_or_404(Order, id=order_id, user=request.user)
         
-        if not order.can_be_cancelled:
+        if not order.can_cancel():
             return Response({
                 'success': False,
                 'error': 'Заказ нельзя отменить'
             }, status=status.HTTP_400_BAD_REQUEST)
 
-        try:
-            with transaction.atomic():
-                # Логика отмены заказа (из views.py cancel_order)
-                order.order_status = 'cancelled'
-                order.can_be_cancelled = False
-                order.save()
-
-                # Возвращаем товары на склад
-                for item in order.items.all():
-                    if item.size:
-                        item.size.size_stock += item.quantity
-                        item.size.save()
-                    item.product.stock_quantity += item.quantity
-                    item.product.save()
-
-                # Возвращаем средства (если заказ был оплачен)
-                was_paid = order.paid_from_balance or (order.payment_set.filter(payment_status='paid').exists())
-                
-                if was_paid:
-                    # Дебит со счета организации
-                    org_account = OrganizationAccount.objects.select_for_update().get(pk=1)
-                    balance_before = org_account.balance
-                    tax_reserve_before = org_account.tax_reserve
-                    
-                    org_account.balance -= order.total_amount
-                    org_account.tax_reserve -= order.tax_amount
-                    org_account.save()
-                    
-                    OrganizationTransaction.objects.create(
-                        organization_account=org_account,
-                        transaction_type='order_refund',
-                        amount=order.total_amount,
-                        description=f'Возврат средств по заказу #{order.id}',
-                        order=order,
-                        created_by=request.user,
-                        balance_before=balance_before,
-                        balance_after=org_account.balance,
-                        tax_reserve_before=tax_reserve_before,
-                        tax_reserve_after=org_account.tax_reserve
-                    )
-
-                    # Возврат средств пользователю
-                    if order.paid_from_balance:
-                        profile, _ = UserProfile.objects.select_for_update().get_or_create(user=request.user)
-                        balance_before = profile.balance
-                        profile.balance += order.total_amount
-                        profile.save()
-                        
-                        BalanceTransaction.objects.create(
-                            user=request.user,
-                            transaction_type='refund',
-                            amount=order.total_amount,
-                            balance_before=balance_before,
-                            balance_after=profile.balance,
-                            description=f'Возврат средств по заказу #{order.id}',
-                            order=order,
-                            status='completed'
-                        )
-                    else:
-                        # Возврат на карту
-                        payment = order.payment_set.filter(payment_status='paid').first()
-                        if payment and payment.saved_payment_method:
-                            card = payment.saved_payment_method
-                            card.balance += order.total_amount
-                            card.save()
-                            
-                            CardTransaction.objects.create(
-                                saved_payment_method=card,
-                                transaction_type='deposit',
-                                amount=order.total_amount,
-                                description=f'Возврат средств по заказу #{order.id}',
-                                status='completed'
-                            )
-
-                _log_activity(request.user, 'update', f'order_{order.id}', 'Заказ отменен пользователем', request)
-                
-                serializer = OrderSerializer(order)
-                return Response({
-                    'success': True,
-                    'order': serializer.data
-                })
-        except Exception as e:
+        # Возврат денег и товара на склад (cancellation.py)
+        result = cancellation.cancel_orders([order.pk], request.user, request)[0]
+        if not result['success']:
             return Response({
                 'success': False,
-                'error': f'Ошибка при отмене заказа: {str(e)}'
-            }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+                'error': result['error']
+            }, status=status.HTTP_409_CONFLICT)
+
+        order.refresh_from_db()
+        serializer = OrderSerializer(order)
+        return Response({
+            'success': True,
+            'order': serializer.data
+        })
 
 
 # ===== API для карт и платежей =====
@@ -1371,6 +1176,7 @@ class BalanceAPIView(APIView):
             'transactions': BalanceTransactionSerializer(transactions, many=True).data
         })
 
+    @method_decorator(idempotency.idempotent('balance_deposit'))
     def post(self, request):
         """Пополнить баланс с карты"""
         card_id = request.data.get('card_id')
@@ -1397,45 +1203,24 @@ class BalanceAPIView(APIView):
             }, status=status.HTTP_400_BAD_REQUEST)
 
         try:
-            card = SavedPaymentMethod.objects.select_for_update().get(id=card_id, user=request.user)
-            if card.balance < amount:
-                return Response({
-                    'success': False,
-                    'error': f'Недостаточно средств на карте. Баланс карты: {card.balance} ₽'
-                }, status=status.HTTP_400_BAD_REQUEST)
-
-            with transaction.atomic():
-                card.balance -= amount
-                card.save()
-
-                profile, _ = UserProfile.objects.select_for_update().get_or_create(user=request.user)
-                balance_before = profile.balance
-                profile.balance += amount
-                profile.save()
-
-                BalanceTransaction.objects.create(
-                    user=request.user,
-                    transaction_type='deposit',
-                    amount=amount,
-                    balance_before=balance_before,
-                    balance_after=profile.balance,
-                    description=f'Пополнение баланса с карты {card.mask_card_number()}',
-                    status='completed'
-                )
-
-                CardTransaction.objects.create(
-                    saved_payment_method=card,
-                    transaction_type='withdrawal',
-                    amount=amount,
-                    description='Пополнение баланса пользователя',
-                    status='completed'
-                )
+            card = SavedPaymentMethod.objects.get(id=card_id, user=request.user)
+            # Списание с карты и пополнение баланса — условными UPDATE (wallet.py)
+            balance_row, _ = wallet.card_to_balance(
+                request.user, card, amount,
+                f'Пополнение баланса с карты {card.mask_card_number()}',
+                'Пополнение баланса пользователя',
+            )
 
             return Response({
                 'success': True,
-                'balance': str(profile.balance),
+                'balance': str(balance_row.balance_after),
                 'message': f'Баланс пополнен на {amount} ₽'
             })
+        except wallet.InsufficientBalance as e:
+            return Response({
+                'success': False,
+                'error': str(e)
+            }, status=status.HTTP_400_BAD_REQUEST)
         except SavedPaymentMethod.DoesNotExist:
             return Response({
                 'success': False,
@@ -1448,66 +1233,94 @@ class BalanceAPIView(APIView):
             }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
 
-# ===== API для валидации промокода =====
 @method_decorator(csrf_exempt, name='dispatch')
-class ValidatePromoAPIView(APIView):
-    """API для валидации промокода"""
+class BalanceStatementAPIView(APIView):
+    """
+    Выписка по балансу или карте за период (statements.py).
+    Параметры: account=balance|card, card_id, date_from, date_to (YYYY-MM-DD),
+    cursor, page_size. Операции — по возрастанию даты с остатком после каждой.
+    """
     permission_classes = [permissions.IsAuthenticated]
 
-    def post(self, request):
-        """Проверить промокод"""
-        promo_code = request.data.get('promo_code', '').strip().upper()
-        cart_total_str = request.data.get('cart_total', '0')
-
-        if not promo_code:
+    def get(self, request):
+        account_type = request.GET.get('account', 'balance')
+        card_id = request.GET.get('card_id')
+        if account_type not in ('balance', 'card') or (account_type == 'card' and not card_id):
             return Response({
                 'success': False,
-                'error': 'Введите промокод'
+                'error': 'Укажите account=balance или account=card с card_id'
             }, status=status.HTTP_400_BAD_REQUEST)
 
         try:
-            cart_total = Decimal(cart_total_str)
-        except (ValueError, InvalidOperation):
-            cart_total = Decimal('0')
+            account = statements.account_for(request.user, card_id if account_type == 'card' else None)
+        except (SavedPaymentMethod.DoesNotExist, ValueError):
+            return Response({
+                'success': False,
+                'error': 'Карта не найдена'
+            }, status=status.HTTP_404_NOT_FOUND)
 
         try:
-            promo = Promotion.objects.get(promo_code=promo_code, is_active=True)
-            today = timezone.now().date()
-            
-            if promo.start_date and promo.start_date > today:
-                return Response({
-                    'success': False,
-                    'error': 'Промокод еще не действует'
-                }, status=status.HTTP_400_BAD_REQUEST)
-            
-            if promo.end_date and promo.end_date < today:
-                return Response({
-                    'success': False,
-                    'error': 'Промокод истек'
-                }, status=status.HTTP_400_BAD_REQUEST)
+            start, end = statements.parse_period(request.GET.get('date_from'), request.GET.get('date_to'))
+            page_size = int(request.GET.get('page_size', statements.PAGE_SIZE))
+            page = statements.statement_page(account, start, end, request.GET.get('cursor'), page_size)
+        except InvalidCursor as e:
+            return Response({'success': False, 'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        except ValueError as e:
+            return Response({'success': False, 'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        names = dict(
+            (CardTransaction if account_type == 'card' else BalanceTransaction).TRANSACTION_TYPES
+        )
+        for row in page['transactions']:
+            row['transaction_type_display'] = names.get(row['transaction_type'], row['transaction_type'])
+            row['created_at'] = row['created_at'].isoformat()
+            row['amount'] = str(row['amount'])
+            row['balance_after'] = str(row['balance_after'])
+        page.update({
+            'success': True,
+            'period_start': start.isoformat() if start else None,
+            'period_end': end.isoformat() if end else None,
+            'opening_balance': str(page['opening_balance']),
+            'closing_balance': str(page['closing_balance']),
+        })
+        return Response(page)
 
-            discount_amount = cart_total * (promo.discount / Decimal('100'))
-            delivery_cost = Decimal('1000.00')
-            subtotal_after_discount = cart_total - discount_amount
-            pre_vat_amount = subtotal_after_discount + delivery_cost
-            vat_rate = Decimal('20.00')
-            vat_amount = (pre_vat_amount * vat_rate / Decimal('100')).quantize(Decimal('0.01'))
-            total_with_vat = pre_vat_amount + vat_amount
 
-            return Response({
-                'success': True,
-                'discount': str(discount_amount),
-                'discount_percent': str(promo.discount),
-                'subtotal': str(subtotal_after_discount),
-                'delivery': str(delivery_cost),
-                'vat_amount': str(vat_amount),
-                'total': str(total_with_vat)
-            })
-        except Promotion.DoesNotExist:
+# ===== API для валидации промокода =====
+@method_decorator(csrf_exempt, name='dispatch')
+class ValidatePromoAPIView(APIView):
+    """API для валидации промокода"""
+    permission_classes = [permissions.IsAuthenticated]
+
+    def post(self, request):
+        """Проверить промокод и посчитать итоги корзины пользователя со скидкой"""
+        try:
+            promo = pricing.get_promo(request.data.get('promo_code', ''))
+        except pricing.PromoError as e:
             return Response({
                 'success': False,
-                'error': 'Неверный промокод'
-            }, status=status.HTTP_404_NOT_FOUND)
+                'error': str(e)
+            }, status=status.HTTP_404_NOT_FOUND if isinstance(e, pricing.PromoNotFound) else status.HTTP_400_BAD_REQUEST)
+
+        # Итоги считаются по корзине; cart_total из запроса — для клиентов без корзины на сервере
+        cart = Cart.objects.filter(user=request.user).first()
+        summary = pricing.cart_summary(cart, promo) if cart else None
+        if summary is None or not summary.line_count:
+            try:
+                cart_total = Decimal(str(request.data.get('cart_total', '0')))
+            except (ValueError, InvalidOperation):
+                cart_total = Decimal('0')
+            summary = pricing.OrderSummary(cart_total, promo.discount)
+
+        return Response({
+            'success': True,
+            'discount': str(summary.discount_amount),
+            'discount_percent': str(promo.discount),
+            'subtotal': str(summary.subtotal_after_discount),
+            'delivery': str(summary.delivery_cost),
+            'vat_amount': str(summary.vat_amount),
+            'total': str(summary.total)
+        })
 
 
 # ===== API для управления товарами (Менеджер/Админ) =====
@@ -1529,11 +1342,18 @@ class ProductManagementAPIView(APIView):
         brand_id = request.GET.get('brand')
         available_filter = request.GET.get('available')
         page = int(request.GET.get('page', 1))
+        try:
+            fields = parse_fields(request.GET.get('fields'))
+        except ValueError as e:
+            return Response({
+                'success': False,
+                'error': str(e)
+            }, status=status.HTTP_400_BAD_REQUEST)
 
-        qs = Product.objects.select_related('category', 'brand').prefetch_related('sizes', 'producttag_set__tag').all()
+        qs = Product.objects.all()
 
         if q:
-            qs = qs.filter(Q(product_name__icontains=q) | Q(product_description__icontains=q))
+            qs = filter_by_search(qs, q)
         if category_id:
             qs = qs.filter(category_id=category_id)
         if brand_id:
@@ -1544,13 +1364,12 @@ class ProductManagementAPIView(APIView):
             qs = qs.filter(is_available=False)
 
         qs = qs.order_by('-added_at')
-        paginator = Paginator(qs, 25)
+        paginator = Paginator(listing_values(qs, fields), 25)
         page_obj = paginator.get_page(page)
 
-        serializer = ProductSerializer(page_obj.object_list, many=True)
         return Response({
             'success': True,
-            'products': serializer.data,
+            'products': serialize_rows(page_obj.object_list, fields),
             'page': page_obj.number,
             'total_pages': paginator.num_pages,
             'total_count': paginator.count
@@ -1628,7 +1447,7 @@ class ProductManagementDetailAPIView(APIView):
     def get(self, request, product_id):
         """Получить товар"""
         product = get_object_or_404(Product, id=product_id)
-        serializer = ProductSerializer(product)
+        serializer = ProductSerializer(product, context={'request': request})
         return Response(serializer.data)
 
     def put(self, request, product_id):
@@ -1882,6 +1701,21 @@ class OrderManagementAPIView(APIView):
         if status_filter:
             qs = qs.filter(order_status=status_filter)
 
+        if is_cursor_mode(request):
+            try:
+                page_obj = paginate_by_cursor(qs, request.GET.get('cursor'), 25)
+            except InvalidCursor as e:
+                return Response({
+                    'success': False,
+                    'error': str(e)
+                }, status=status.HTTP_400_BAD_REQUEST)
+            serializer = OrderSerializer(page_obj.object_list, many=True)
+            return Response({
+                'success': True,
+                'orders': serializer.data,
+                **page_obj.as_dict()
+            })
+
         qs = qs.order_by('-created_at')
         paginator = Paginator(qs, 25)
         page_obj = paginator.get_page(page)
@@ -1949,6 +1783,95 @@ class OrderManagementDetailAPIView(APIView):
         })
 
 
+@method_decorator(csrf_exempt, name='dispatch')
+class OrderBulkStatusAPIView(APIView):
+    """API для массовой смены статуса заказов и назначения курьера (fulfillment.py)"""
+    permission_classes = [IsManagerOrReadOnly]
+
+    def post(self, request):
+        """
+        Перевести заказы в статус.
+        Параметры: order_ids (список или строка через запятую), status,
+        carrier_name, tracking_numbers ({номер заказа: номер отслеживания}).
+        """
+        if not _user_is_manager(request.user):
+            return Response({
+                'success': False,
+                'error': 'Доступ запрещен'
+            }, status=status.HTTP_403_FORBIDDEN)
+
+        tracking_numbers = request.data.get('tracking_numbers') or {}
+        if not isinstance(tracking_numbers, dict):
+            return Response({
+                'success': False,
+                'error': 'tracking_numbers должен быть объектом {номер заказа: номер отслеживания}'
+            }, status=status.HTTP_400_BAD_REQUEST)
+
+        order_ids = request.data.get('order_ids')
+        if hasattr(request.data, 'getlist') and len(request.data.getlist('order_ids')) > 1:
+            order_ids = request.data.getlist('order_ids')
+
+        try:
+            results = fulfillment.bulk_transition(
+                order_ids,
+                (request.data.get('status') or '').strip(),
+                request.user,
+                carrier_name=request.data.get('carrier_name'),
+                tracking_numbers=tracking_numbers,
+                request=request,
+            )
+        except ValueError as e:
+            return Response({
+                'success': False,
+                'error': str(e)
+            }, status=status.HTTP_400_BAD_REQUEST)
+
+        return Response({
+            'success': all(result['success'] for result in results),
+            'updated': sum(1 for result in results if result['changed']),
+            'failed': sum(1 for result in results if not result['success']),
+            'results': results
+        })
+
+
+@method_decorator(csrf_exempt, name='dispatch')
+class OrderBulkCancelAPIView(APIView):
+    """API для массовой отмены заказов с возвратом денег и товара (cancellation.py)"""
+    permission_classes = [IsAdminOrReadOnly]
+
+    def post(self, request):
+        """
+        Отменить заказы.
+        Параметры: order_ids (список или строка через запятую), reason.
+        """
+        if not _user_is_admin(request.user):
+            return Response({
+                'success': False,
+                'error': 'Доступ запрещен. Требуется роль администратора'
+            }, status=status.HTTP_403_FORBIDDEN)
+
+        order_ids = request.data.get('order_ids')
+        if hasattr(request.data, 'getlist') and len(request.data.getlist('order_ids')) > 1:
+            order_ids = request.data.getlist('order_ids')
+        reason = (request.data.get('reason') or '').strip()
+        description = 'Массовая отмена заказов администратором' + (f': {reason}' if reason else '')
+
+        try:
+            results = cancellation.cancel_orders(order_ids, request.user, request, description=description)
+        except ValueError as e:
+            return Response({
+                'success': False,
+                'error': str(e)
+            }, status=status.HTTP_400_BAD_REQUEST)
+
+        return Response({
+            'success': all(result['success'] for result in results),
+            'cancelled': sum(1 for result in results if result['success']),
+            'failed': sum(1 for result in results if not result['success']),
+            'results': results
+        })
+
+
 # ===== API для управления пользователями (Только Админ) =====
 @method_decorator(csrf_exempt, name='dispatch')
 class UserManagementAPIView(APIView):
@@ -2052,8 +1975,19 @@ class UserManagementAPIView(APIView):
             month_ago = timezone.now() - timedelta(days=30)
             qs = qs.exclude(order__created_at__gte=month_ago).distinct()
 
-        paginator = Paginator(qs, 25)
-        page_obj = paginator.get_page(page)
+        cursor_page = None
+        if is_cursor_mode(request):
+            try:
+                cursor_page = paginate_by_cursor(qs, request.GET.get('cursor'), 25, field='date_joined')
+            except InvalidCursor as e:
+                return Response({
+                    'success': False,
+                    'error': str(e)
+                }, status=status.HTTP_400_BAD_REQUEST)
+            page_obj = cursor_page
+        else:
+            paginator = Paginator(qs, 25)
+            page_obj = paginator.get_page(page)
 
         users_data = []
         for user in page_obj.object_list:
@@ -2086,6 +2020,13 @@ class UserManagementAPIView(APIView):
                     'profile': None
                 })
 
+        if cursor_page is not None:
+            return Response({
+                'success': True,
+                'users': users_data,
+                **cursor_page.as_dict()
+            })
+
         return Response({
             'success': True,
             'users': users_data,
@@ -2334,6 +2275,7 @@ class SupportTicketDetailAPIView(APIView):
 
 # ===== API для каталога и поиска =====
 @method_decorator(csrf_exempt, name='dispatch')
+@method_decorator(conditional_on(*CATALOG_TABLES), name='get')
 class CatalogAPIView(APIView):
     """API для каталога товаров с фильтрацией и поиском"""
     permission_classes = [permissions.AllowAny]
@@ -2346,18 +2288,26 @@ class CatalogAPIView(APIView):
         min_price = request.GET.get('min_price')
         max_price = request.GET.get('max_price')
         size_id = request.GET.get('size')
+        size_label = request.GET.get('size_label')
+        tag_id = request.GET.get('tag')
         available_only = request.GET.get('available_only', 'false').lower() == 'true'
         page = int(request.GET.get('page', 1))
         per_page = int(request.GET.get('per_page', 20))
+        try:
+            fields = parse_fields(request.GET.get('fields'))
+        except ValueError as e:
+            return Response({
+                'success': False,
+                'error': str(e)
+            }, status=status.HTTP_400_BAD_REQUEST)
 
-        qs = Product.objects.select_related('category', 'brand').prefetch_related('sizes', 'producttag_set__tag').filter(is_available=True)
+        qs = Product.objects.filter(is_available=True)
 
-        if q:
-            qs = qs.filter(Q(product_name__icontains=q) | Q(product_description__icontains=q))
-        if category_id:
-            qs = qs.filter(category_id=category_id)
-        if brand_id:
-            qs = qs.filter(brand_id=brand_id)
+        # Текст, категория, бренд, тег, размер и наличие фильтруются битовым индексом
+        qs, facet_counts = filter_catalog(
+            qs, query=q, category=category_id, brand=brand_id, tag=tag_id,
+            size=size_id, size_label=size_label, in_stock=available_only,
+        )
         if min_price:
             try:
                 qs = qs.filter(final_price__gte=Decimal(min_price))
@@ -2368,22 +2318,159 @@ class CatalogAPIView(APIView):
                 qs = qs.filter(final_price__lte=Decimal(max_price))
             except (ValueError, InvalidOperation):
                 pass
-        if size_id:
-            qs = qs.filter(sizes__id=size_id).distinct()
-        if available_only:
-            qs = qs.filter(stock_quantity__gt=0)
+        # Сортировка по цене со скидкой идет по индексу final_price
+        sort = request.GET.get('sort')
+        if sort == 'price_asc':
+            order_field, descending = 'final_price', False
+        elif sort == 'price_desc':
+            order_field, descending = 'final_price', True
+        elif sort == 'rating':
+            order_field, descending = 'avg_rating', True
+        elif sort == 'popular':
+            order_field, descending = 'popularity_score', True
+        else:
+            order_field, descending = 'added_at', True
 
-        qs = qs.order_by('-added_at')
-        paginator = Paginator(qs, per_page)
+        # Курсорный режим: сортировка по (поле, id) без COUNT и OFFSET
+        if is_cursor_mode(request):
+            try:
+                # Из БД читаются только id и поле сортировки, строки товаров — из снимка каталога
+                page_obj = paginate_by_cursor(qs.values('id', order_field),
+                                              request.GET.get('cursor'), per_page,
+                                              field=order_field, descending=descending)
+            except InvalidCursor as e:
+                return Response({
+                    'success': False,
+                    'error': str(e)
+                }, status=status.HTTP_400_BAD_REQUEST)
+            return Response({
+                'success': True,
+                'products': serialize_ids([row['id'] for row in page_obj.object_list], fields),
+                **page_obj.as_dict(),
+                'facets': facet_counts
+            })
+
+        if sort in ('price_asc', 'price_desc', 'rating', 'popular'):
+            qs = qs.order_by(f"{'-' if descending else ''}{order_field}", f"{'-' if descending else ''}id")
+        # При поиске сохраняем сортировку по релевантности
+        elif not qs.ordered:
+            qs = qs.order_by('-added_at')
+        paginator = Paginator(qs.values_list('id', flat=True), per_page)
         page_obj = paginator.get_page(page)
 
-        serializer = ProductSerializer(page_obj.object_list, many=True)
         return Response({
             'success': True,
-            'products': serializer.data,
+            'products': serialize_ids(page_obj.object_list, fields),
             'page': page_obj.number,
             'total_pages': paginator.num_pages,
-            'total_count': paginator.count
+            'total_count': paginator.count,
+            'facets': facet_counts
+        })
+
+
+@method_decorator(csrf_exempt, name='dispatch')
+class CatalogSuggestAPIView(APIView):
+    """Подсказки для строки поиска каталога (из индекса в памяти, без запросов к БД)"""
+    permission_classes = [permissions.AllowAny]
+    # Без аутентификации, чтобы не читать сессию из БД
+    authentication_classes = []
+
+    def get(self, request):
+        """Получить подсказки по началу строки"""
+        q = request.GET.get('q', '').strip()
+        try:
+            limit = min(max(int(request.GET.get('limit', 10)), 1), 50)
+        except ValueError:
+            limit = 10
+
+        if len(q) < 2:
+            return Response({
+                'success': True,
+                'suggestions': []
+            })
+
+        return Response({
+            'success': True,
+            'suggestions': suggest(q, limit)
+        })
+
+
+@method_decorator(csrf_exempt, name='dispatch')
+class CatalogStatusAPIView(APIView):
+    """Статусы товаров (в избранном / в корзине) для нескольких карточек каталога за один запрос"""
+    permission_classes = [permissions.AllowAny]
+
+    def get(self, request):
+        """Получить статусы товаров по списку ?ids=1,2,3"""
+        try:
+            product_ids = membership.parse_ids(request.GET.get('ids', ''))
+        except ValueError as e:
+            return Response({
+                'success': False,
+                'error': str(e)
+            }, status=status.HTTP_400_BAD_REQUEST)
+
+        statuses = membership.get_statuses(request.user, product_ids)
+        return Response({
+            'success': True,
+            'statuses': {str(product_id): flags for product_id, flags in statuses.items()}
+        })
+
+
+@method_decorator(csrf_exempt, name='dispatch')
+class CatalogChangesAPIView(APIView):
+    """Изменения каталога после токена синхронизации (дельта-синхронизация приложения)"""
+    permission_classes = [permissions.AllowAny]
+
+    def get(self, request):
+        """Получить изменения после ?since=<токен> порциями до ?limit= записей"""
+        try:
+            limit = min(max(int(request.GET.get('limit', changes.DEFAULT_BATCH)), 1), changes.MAX_BATCH)
+        except ValueError:
+            limit = changes.DEFAULT_BATCH
+
+        try:
+            result = changes.changes_since(request.GET.get('since', '').strip(), limit)
+        except changes.InvalidToken as e:
+            return Response({
+                'success': False,
+                'error': str(e)
+            }, status=status.HTTP_400_BAD_REQUEST)
+
+        return Response({
+            'success': True,
+            **result
+        })
+
+
+@method_decorator(conditional_on('product', 'relatedproduct'), name='get')
+class RelatedProductsAPIView(APIView):
+    """Товары, которые покупают вместе с данным (см. related.py)"""
+    permission_classes = [permissions.AllowAny]
+
+    def get(self, request, product_id):
+        """Получить до ?limit= товаров, чаще всего купленных вместе с товаром (поддерживает ?fields=)"""
+        try:
+            fields = parse_fields(request.GET.get('fields'))
+        except ValueError as e:
+            return Response({
+                'success': False,
+                'error': str(e)
+            }, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            limit = min(max(int(request.GET.get('limit', related.TOP_K)), 1), related.TOP_K)
+        except ValueError:
+            limit = related.TOP_K
+
+        if not Product.objects.filter(pk=product_id).exists():
+            return Response({
+                'success': False,
+                'error': 'Товар не найден'
+            }, status=status.HTTP_404_NOT_FOUND)
+
+        return Response({
+            'success': True,
+            'products': serialize_ids(related.related_ids(product_id, limit), fields)
         })
 
 
@@ -2395,10 +2482,20 @@ class FavoritesAPIView(APIView):
 
     def get(self, request):
         """Получить все избранные товары"""
-        favorites = Favorite.objects.filter(user=request.user).select_related('product')
-        products = [fav.product for fav in favorites]
-        serializer = ProductSerializer(products, many=True)
-        return Response(serializer.data)
+        try:
+            fields = parse_fields(request.GET.get('fields'))
+        except ValueError as e:
+            return Response({
+                'success': False,
+                'error': str(e)
+            }, status=status.HTTP_400_BAD_REQUEST)
+        product_ids = list(
+            Favorite.objects.filter(user=request.user).order_by('id').values_list('product_id', flat=True)
+        )
+        if not product_ids:
+            return Response([])
+        products = order_by_ids(Product.objects.filter(pk__in=product_ids), product_ids)
+        return Response(serialize_products(products, fields))
 
     def post(self, request):
         """Добавить товар в избранное"""
@@ -2454,7 +2551,10 @@ class ProductReviewAPIView(APIView):
     def post(self, request, product_id):
         """Добавить отзыв"""
         product = get_object_or_404(Product, id=product_id)
-        rating = int(request.data.get('rating', 0))
+        try:
+            rating = int(request.data.get('rating', 0))
+        except (TypeError, ValueError):
+            rating = 0
         comment = request.data.get('comment', '').strip()
 
         if not (1 <= rating <= 5):
@@ -2469,20 +2569,25 @@ class ProductReviewAPIView(APIView):
                 'error': 'Комментарий обязателен'
             }, status=status.HTTP_400_BAD_REQUEST)
 
-        # Проверяем, не оставлял ли пользователь уже отзыв
-        existing_review = ProductReview.objects.filter(user=request.user, product=product).first()
-        if existing_review:
-            return Response({
-                'success': False,
-                'error': 'Вы уже оставили отзыв на этот товар'
-            }, status=status.HTTP_400_BAD_REQUEST)
+        from .utils import filter_profanity
+        comment = filter_profanity(comment)
 
-        review = ProductReview.objects.create(
-            user=request.user,
-            product=product,
-            rating=rating,
-            comment=comment
-        )
+        # Сводка рейтинга товара обновляется сигналом в той же транзакции
+        with transaction.atomic():
+            # Проверяем, не оставлял ли пользователь уже отзыв
+            existing_review = ProductReview.objects.select_for_update().filter(user=request.user, product=product).first()
+            if existing_review:
+                return Response({
+                    'success': False,
+                    'error': 'Вы уже оставили отзыв на этот товар'
+                }, status=status.HTTP_400_BAD_REQUEST)
+
+            review = ProductReview.objects.create(
+                user=request.user,
+                product=product,
+                rating_value=rating,
+                review_text=comment
+            )
 
         serializer = ProductReviewSerializer(review)
         return Response({
@@ -2510,15 +2615,20 @@ class OrganizationAccountAPIView(APIView):
             organization_account=org_account
         ).select_related('order', 'created_by').order_by('-created_at')[:50]
 
-        serializer = OrganizationAccountSerializer(org_account)
+        # Баланс и резерв — с учетом еще не свернутых поступлений (ledger.py)
+        account = dict(OrganizationAccountSerializer(org_account).data)
+        balances = ledger.balances()
+        account['balance'] = str(balances.balance)
+        account['tax_reserve'] = str(balances.tax_reserve)
         transactions_serializer = OrganizationTransactionSerializer(transactions, many=True)
 
         return Response({
             'success': True,
-            'account': serializer.data,
+            'account': account,
             'transactions': transactions_serializer.data
         })
 
+    @method_decorator(idempotency.idempotent('org_account'))
     def post(self, request):
         """Вывод средств или оплата налога"""
         if not _user_is_admin(request.user):
@@ -2528,7 +2638,6 @@ class OrganizationAccountAPIView(APIView):
             }, status=status.HTTP_403_FORBIDDEN)
 
         action = request.data.get('action')
-        org_account = OrganizationAccount.get_account()
 
         if action == 'withdraw':
             # Вывод средств на карту админа
@@ -2548,14 +2657,6 @@ class OrganizationAccountAPIView(APIView):
                     'error': 'Сумма должна быть больше нуля'
                 }, status=status.HTTP_400_BAD_REQUEST)
 
-            org_account.refresh_from_db()
-
-            if not org_account.can_withdraw(amount):
-                return Response({
-                    'success': False,
-                    'error': f'Недостаточно средств на счете организации. Доступно: {org_account.balance} ₽, запрошено: {amount} ₽'
-                }, status=status.HTTP_400_BAD_REQUEST)
-
             if not card_id:
                 return Response({
                     'success': False,
@@ -2572,34 +2673,10 @@ class OrganizationAccountAPIView(APIView):
 
             try:
                 with transaction.atomic():
-                    org_account = OrganizationAccount.objects.select_for_update().get(pk=org_account.pk)
-                    
-                    if not org_account.can_withdraw(amount):
-                        return Response({
-                            'success': False,
-                            'error': f'Недостаточно средств на счете организации. Доступно: {org_account.balance} ₽, запрошено: {amount} ₽'
-                        }, status=status.HTTP_400_BAD_REQUEST)
+                    # Остаток проверяется под блокировкой счета (ledger.py)
+                    ledger.withdraw(amount, request.user, f'Вывод средств на карту {card.mask_card_number()}')
 
-                    balance_before = org_account.balance
-                    tax_reserve_before = org_account.tax_reserve
-
-                    org_account.balance -= amount
-                    org_account.save()
-
-                    card.balance += amount
-                    card.save()
-
-                    OrganizationTransaction.objects.create(
-                        organization_account=org_account,
-                        transaction_type='withdrawal',
-                        amount=amount,
-                        description=f'Вывод средств на карту {card.mask_card_number}',
-                        created_by=request.user,
-                        balance_before=balance_before,
-                        balance_after=org_account.balance,
-                        tax_reserve_before=tax_reserve_before,
-                        tax_reserve_after=org_account.tax_reserve
-                    )
+                    wallet.credit_card(card, amount, 'Поступление со счета организации')
 
                     _log_activity(request.user, 'update', 'org_account', f'Вывод средств {amount} ₽ на карту', request)
 
@@ -2607,6 +2684,11 @@ class OrganizationAccountAPIView(APIView):
                         'success': True,
                         'message': f'Средства в размере {amount} ₽ выведены на карту'
                     })
+            except ledger.InsufficientFunds as e:
+                return Response({
+                    'success': False,
+                    'error': str(e)
+                }, status=status.HTTP_400_BAD_REQUEST)
             except Exception as e:
                 return Response({
                     'success': False,
@@ -2629,61 +2711,21 @@ class OrganizationAccountAPIView(APIView):
                     'error': 'Сумма должна быть больше нуля'
                 }, status=status.HTTP_400_BAD_REQUEST)
 
-            org_account.refresh_from_db()
-
-            if not org_account.can_pay_tax(amount):
-                if org_account.tax_reserve < amount:
-                    error_msg = f'Недостаточно средств в резерве на налоги. Доступно: {org_account.tax_reserve} ₽, запрошено: {amount} ₽'
-                elif org_account.balance < amount:
-                    error_msg = f'Недостаточно средств на счете организации. Доступно: {org_account.balance} ₽, запрошено: {amount} ₽'
-                else:
-                    error_msg = f'Недостаточно средств для оплаты налога'
-                return Response({
-                    'success': False,
-                    'error': error_msg
-                }, status=status.HTTP_400_BAD_REQUEST)
-
             try:
                 with transaction.atomic():
-                    org_account = OrganizationAccount.objects.select_for_update().get(pk=org_account.pk)
-                    
-                    if not org_account.can_pay_tax(amount):
-                        if org_account.tax_reserve < amount:
-                            error_msg = f'Недостаточно средств в резерве на налоги. Доступно: {org_account.tax_reserve} ₽, запрошено: {amount} ₽'
-                        elif org_account.balance < amount:
-                            error_msg = f'Недостаточно средств на счете организации. Доступно: {org_account.balance} ₽, запрошено: {amount} ₽'
-                        else:
-                            error_msg = f'Недостаточно средств для оплаты налога'
-                        return Response({
-                            'success': False,
-                            'error': error_msg
-                        }, status=status.HTTP_400_BAD_REQUEST)
-                    
-                    balance_before = org_account.balance
-                    tax_reserve_before = org_account.tax_reserve
-                    
-                    org_account.balance -= amount
-                    org_account.tax_reserve -= amount
-                    org_account.save()
-                    
-                    OrganizationTransaction.objects.create(
-                        organization_account=org_account,
-                        transaction_type='tax_payment',
-                        amount=amount,
-                        description=f'Оплата налога',
-                        created_by=request.user,
-                        balance_before=balance_before,
-                        balance_after=org_account.balance,
-                        tax_reserve_before=tax_reserve_before,
-                        tax_reserve_after=org_account.tax_reserve
-                    )
-                    
+                    ledger.pay_tax(amount, request.user)
+
                     _log_activity(request.user, 'update', 'org_account', f'Оплата налога {amount} ₽', request)
 
                     return Response({
                         'success': True,
                         'message': f'Налог в размере {amount} ₽ оплачен'
                     })
+            except ledger.InsufficientFunds as e:
+                return Response({
+                    'success': False,
+                    'error': str(e)
+                }, status=status.HTTP_400_BAD_REQUEST)
             except Exception as e:
                 return Response({
                     'success': False,
@@ -3182,8 +3224,19 @@ class BackupManagementAPIView(APIView):
         page = int(request.GET.get('page', 1))
         qs = DatabaseBackup.objects.select_related('created_by').all().order_by('-created_at')
 
-        paginator = Paginator(qs, 25)
-        page_obj = paginator.get_page(page)
+        cursor_page = None
+        if is_cursor_mode(request):
+            try:
+                cursor_page = paginate_by_cursor(qs, request.GET.get('cursor'), 25)
+            except InvalidCursor as e:
+                return Response({
+                    'success': False,
+                    'error': str(e)
+                }, status=status.HTTP_400_BAD_REQUEST)
+            page_obj = cursor_page
+        else:
+            paginator = Paginator(qs, 25)
+            page_obj = paginator.get_page(page)
 
         backups_data = []
         for backup in page_obj.object_list:
@@ -3199,6 +3252,13 @@ class BackupManagementAPIView(APIView):
                 'notes': backup.notes
             })
 
+        if cursor_page is not None:
+            return Response({
+                'success': True,
+                'backups': backups_data,
+                **cursor_page.as_dict()
+            })
+
         return Response({
             'success': True,
             'backups': backups_data,
@@ -3324,3 +3384,22 @@ class BackupManagementDetailAPIView(APIView):
                 'success': False,
                 'error': f'Ошибка при удалении бэкапа: {str(e)}'
             }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+
+# ===== API очереди фоновой работы (Только Админ) =====
+@method_decorator(csrf_exempt, name='dispatch')
+class OutboxStatsAPIView(APIView):
+    """Метрики очереди outbox: глубина, ошибки, задержка"""
+    permission_classes = [IsAdminOrReadOnly]
+
+    def get(self, request):
+        if not _user_is_admin(request.user):
+            return Response({
+                'success': False,
+                'error': 'Доступ запрещен'
+            }, status=status.HTTP_403_FORBIDDEN)
+
+        return Response({
+            'success': True,
+            'outbox': outbox.stats()
+        })
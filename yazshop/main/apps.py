@@ -4,4 +4,7 @@ class MainConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'main'
 
+    def ready(self):
+        from . import signals  # noqa: F401
+
 
@@ -0,0 +1,270 @@
+"""
+Отмена заказов с возвратом денег и товара на склад.
+
+Отмена покупателем (views.cancel_order, OrderDetailAPIView.post) и массовая
+отмена администратором (например, когда поставщик не может отгрузить
+товар) выполняются одной функцией cancel_orders. Число запросов не зависит
+от числа заказов и позиций:
+
+- заказы переводятся в cancelled одним UPDATE, который повторно проверяет,
+  что заказ еще можно отменить (параллельная отмена или отправка не даст
+  вернуть деньги дважды);
+- остатки возвращаются одним UPDATE на таблицу размеров и одним на
+  таблицу товаров с суммами по всем позициям;
+- возвраты со счета организации — одна свертка и одна вставка
+  (ledger.refund_orders). Если на счете не хватает денег на возврат,
+  заказ остается в прежнем статусе, как и при отмене по одному;
+- деньги покупателям возвращаются одним UPDATE балансов профилей и одним
+  UPDATE балансов карт, операции создаются через bulk_create;
+- популярность, совместные покупки и чеки обновляются пачкой, в журнал
+  действий пишется одна запись.
+
+Правила те же, что и раньше при отмене по одному: со счета организации
+списываются заказы с проведенным платежом (payment_status='paid'), деньги
+возвращаются на баланс, если заказ оплачен с баланса, иначе — на карту,
+которой он оплачен. Массовый UPDATE не вызывает сигналов Order, поэтому
+популярность и совместные покупки обновляются здесь.
+"""
+from collections import defaultdict
+
+from django.db import transaction
+from django.db.models import Case, When, Value, F, DecimalField, IntegerField
+
+from . import changes, facets, fulfillment, ledger, outbox, placement, popularity, related
+from .helpers import _log_activity
+
+CANCELLABLE_STATUSES = ('processing', 'paid')
+
+
+def _result(order_id, error=None, refund_to=None, amount=None):
+    return {
+        'order_id': order_id,
+        'success': error is None,
+        'refund_to': refund_to,
+        'refund_amount': amount,
+        'error': error,
+    }
+
+
+def _add(model, field, amounts, output_field, key='pk'):
+    """Прибавляет к field суммы amounts ({ключ: сумма}) одним UPDATE"""
+    model.objects.filter(**{f'{key}__in': amounts}).update(**{field: F(field) + Case(
+        *[When(**{key: pk, 'then': Value(amount)}) for pk, amount in amounts.items()],
+        output_field=output_field,
+    )})
+
+
+def _money_field():
+    return DecimalField(max_digits=10, decimal_places=2)
+
+
+def _restore_stock(items):
+    """Возвращает на склад позиции items ((order_id, product_id, size_id, quantity)): по одному UPDATE на размеры и товары"""
+    from .models import Product, ProductSize
+
+    size_quantities = defaultdict(int)
+    product_quantities = defaultdict(int)
+    for _, product_id, size_id, quantity in items:
+        if product_id is None:
+            continue
+        if size_id:
+            size_quantities[size_id] += quantity
+        product_quantities[product_id] += quantity
+
+    if size_quantities:
+        _add(ProductSize, 'size_stock', size_quantities, IntegerField())
+        # Массовый UPDATE не вызывает сигналов (как при списании в placement.py)
+        changes.record('productsize', size_quantities)
+    if product_quantities:
+        # Журнал изменений ведет ProductQuerySet.update
+        _add(Product, 'stock_quantity', product_quantities, IntegerField())
+        product_ids = list(product_quantities)
+        transaction.on_commit(lambda: facets.refresh_products(product_ids))
+
+
+def _refund_balances(orders, user_ids):
+    """Возврат на баланс профилей: один UPDATE и одна вставка операций"""
+    from .models import BalanceTransaction, UserProfile
+
+    balances = dict(UserProfile.objects.select_for_update().filter(user_id__in=user_ids).values_list('user_id', 'balance'))
+    for user_id in set(user_ids) - set(balances):
+        profile, _ = UserProfile.objects.get_or_create(user_id=user_id)
+        balances[user_id] = profile.balance
+
+    amounts = defaultdict(lambda: ledger.ZERO)
+    rows = []
+    for order in orders:
+        balance_before = balances[order.user_id]
+        balances[order.user_id] = balance_before + order.total_amount
+        amounts[order.user_id] += order.total_amount
+        rows.append(BalanceTransaction(
+            user_id=order.user_id,
+            transaction_type='order_refund',
+            amount=order.total_amount,
+            balance_before=balance_before,
+            balance_after=balances[order.user_id],
+            description=f'Возврат за отмененный заказ #{order.id}',
+            order=order,
+            status='completed',
+        ))
+    _add(UserProfile, 'balance', amounts, _money_field(), key='user_id')
+    BalanceTransaction.objects.bulk_create(rows)
+
+
+def _refund_cards(orders, cards):
+    """Возврат на карты оплаты: один UPDATE и одна вставка операций"""
+    from .models import CardTransaction, SavedPaymentMethod
+
+    amounts = defaultdict(lambda: ledger.ZERO)
+    rows = []
+    for order in orders:
+        amounts[cards[order.pk]] += order.total_amount
+        rows.append(CardTransaction(
+            saved_payment_method_id=cards[order.pk],
+            transaction_type='deposit',
+            amount=order.total_amount,
+            description=f'Возврат за отмененный заказ #{order.id}',
+            status='completed',
+        ))
+    _add(SavedPaymentMethod, 'balance', amounts, _money_field())
+    CardTransaction.objects.bulk_create(rows)
+
+
+def _mark_cancelled(candidates, results):
+    """
+    Переводит заказы в cancelled одним UPDATE, который повторно проверяет,
+    что заказ еще можно отменить. Возвращает отмененные заказы.
+    """
+    from .models import Order
+
+    while candidates:
+        savepoint = transaction.savepoint()
+        cancelled = Order.objects.filter(
+            pk__in=[order.pk for order in candidates],
+            order_status__in=CANCELLABLE_STATUSES, can_be_cancelled=True,
+        ).update(order_status='cancelled', can_be_cancelled=False)
+        if cancelled == len(candidates):
+            transaction.savepoint_commit(savepoint)
+            return candidates
+        # Часть заказов изменили параллельно (на SQLite select_for_update не блокирует строки).
+        # По одному числу строк не понять, какие именно, поэтому UPDATE откатывается и статусы
+        # перечитываются: транзакция уже держит блокировку записи, и больше они не изменятся
+        transaction.savepoint_rollback(savepoint)
+        current = {
+            pk: (order_status, can_be_cancelled)
+            for pk, order_status, can_be_cancelled in Order.objects.filter(
+                pk__in=[order.pk for order in candidates]
+            ).values_list('pk', 'order_status', 'can_be_cancelled')
+        }
+        changed = [order for order in candidates if current.get(order.pk) != (order.order_status, True)] or candidates
+        for order in changed:
+            results[order.pk] = _result(order.pk, 'Статус заказа изменился, обновите страницу')
+        candidates = [order for order in candidates if order not in changed]
+    return candidates
+
+
+def cancel_orders(order_ids, user, request=None, description='Заказ отменен пользователем'):
+    """
+    Отменяет заказы order_ids с возвратом денег и товара. Возвращает
+    результат по каждому заказу в порядке order_ids; ValueError — пустая
+    или слишком большая пачка.
+    """
+    from .models import Order, OrderItem, Payment, Receipt
+
+    order_ids = fulfillment.parse_order_ids(order_ids)
+    if not order_ids:
+        raise ValueError('Не выбраны заказы')
+    if len(order_ids) > fulfillment.MAX_BATCH:
+        raise ValueError(f'За один раз можно отменить не больше {fulfillment.MAX_BATCH} заказов')
+
+    # Чек и поступление на счет по заказам должны быть проведены до возврата (outbox.py)
+    unfinished = outbox.flush_many([placement.order_key(order_id) for order_id in order_ids])
+
+    results = {}
+    with transaction.atomic():
+        orders = {
+            order.pk: order
+            for order in Order.objects.select_for_update().filter(pk__in=order_ids).only(
+                'id', 'user_id', 'order_status', 'can_be_cancelled', 'total_amount', 'tax_amount',
+                'paid_from_balance', 'created_at',
+            )
+        }
+        candidates = []
+        for order_id in order_ids:
+            order = orders.get(order_id)
+            if order is None:
+                results[order_id] = _result(order_id, 'Заказ не найден')
+            elif not order.can_cancel():
+                results[order_id] = _result(order_id, 'Этот заказ нельзя отменить')
+            elif placement.order_key(order_id) in unfinished:
+                results[order_id] = _result(order_id, 'Заказ еще обрабатывается, попробуйте отменить его через минуту')
+            else:
+                candidates.append(order)
+        if not candidates:
+            return [results[order_id] for order_id in order_ids]
+
+        candidates = _mark_cancelled(candidates, results)
+        if not candidates:
+            return [results[order_id] for order_id in order_ids]
+
+        # Первый платеж заказа решает, был ли он оплачен и на какую карту возвращать деньги
+        payments = {}
+        for order_id, payment_status, card_id in Payment.objects.filter(
+                order_id__in=[order.pk for order in candidates]).order_by('order_id', 'id').values_list(
+                'order_id', 'payment_status', 'saved_payment_method_id'):
+            payments.setdefault(order_id, (payment_status, card_id))
+        paid = [order for order in candidates if payments.get(order.pk, (None,))[0] == 'paid']
+
+        _, rejected = ledger.refund_orders(paid, user) if paid else ([], [])
+        if rejected:
+            # Без возврата со счета организации заказ не отменяется: прежний статус возвращается
+            by_status = defaultdict(list)
+            for order in rejected:
+                by_status[order.order_status].append(order.pk)
+                results[order.pk] = _result(order.pk, 'Недостаточно средств на счете организации для возврата.')
+            for order_status, group in by_status.items():
+                Order.objects.filter(pk__in=group).update(order_status=order_status, can_be_cancelled=True)
+            rejected_ids = {order.pk for order in rejected}
+            candidates = [order for order in candidates if order.pk not in rejected_ids]
+            paid = [order for order in paid if order.pk not in rejected_ids]
+        if not candidates:
+            return [results[order_id] for order_id in order_ids]
+
+        to_balance = [order for order in candidates if order.paid_from_balance and order.user_id]
+        balance_ids = {order.pk for order in to_balance}
+        cards = {order.pk: payments[order.pk][1] for order in paid
+                 if order.pk not in balance_ids and payments[order.pk][1]}
+        to_card = [order for order in paid if order.pk in cards]
+        if to_balance:
+            _refund_balances(to_balance, [order.user_id for order in to_balance])
+        if to_card:
+            _refund_cards(to_card, cards)
+
+        cancelled_ids = [order.pk for order in candidates]
+        items = list(OrderItem.objects.filter(order_id__in=cancelled_ids).values_list(
+            'order_id', 'product_id', 'size_id', 'quantity'))
+        _restore_stock(items)
+        Receipt.objects.filter(order_id__in=cancelled_ids).update(status='annulled')
+
+        created = {order.pk: order.created_at for order in candidates}
+        popularity.revert_orders((product_id, quantity, created[order_id]) for order_id, product_id, _, quantity in items)
+        baskets = defaultdict(list)
+        for order_id, product_id, _, _ in items:
+            baskets[order_id].append(product_id)
+        related.revert_baskets(baskets.values())
+
+        for order in candidates:
+            if order.pk in balance_ids:
+                results[order.pk] = _result(order.pk, refund_to='balance', amount=order.total_amount)
+            elif order.pk in cards:
+                results[order.pk] = _result(order.pk, refund_to='card', amount=order.total_amount)
+            else:
+                results[order.pk] = _result(order.pk)
+
+        if len(cancelled_ids) == 1:
+            _log_activity(user, 'update', f'order_{cancelled_ids[0]}', description, request)
+        else:
+            listed = ', '.join(f'#{order_id}' for order_id in cancelled_ids)
+            _log_activity(user, 'update', 'orders_bulk', f'{description} ({len(cancelled_ids)}): {listed}', request)
+
+    return [results[order_id] for order_id in order_ids]
@@ -0,0 +1,179 @@
+"""
+Журнал изменений каталога для дельта-синхронизации мобильного приложения.
+
+Сигналы (signals.py) и массовые операции ProductQuerySet пишут в CatalogChange
+строку на каждый измененный или удаленный товар, размер, тег товара, категорию
+и бренд в той же транзакции, что и само изменение. Клиент хранит токен —
+позицию в журнале — и запрашивает /api/catalog/changes/?since=<токен>: ответ
+содержит текущее состояние объектов, измененных после токена (или надгробие,
+если объект удален, а для товара — и если он снят с продажи), и новый токен.
+Массовые обновления только Product.UNSYNCED_FIELDS (оценка популярности) в
+журнал не пишутся.
+
+Записи моложе CATALOG_CHANGES_LAG секунд не отдаются: транзакции фиксируются не
+строго в порядке id, и без задержки клиент мог бы перескочить через запись,
+которая станет видна позже. Журнал чистится командой prune_catalog_changes;
+если токен старше самой ранней оставшейся записи, клиент получает reset и
+должен загрузить каталог заново.
+"""
+import base64
+from collections import OrderedDict
+
+from django.conf import settings
+from django.utils import timezone
+
+# Максимальное и стандартное количество записей журнала в одном ответе
+MAX_BATCH = 1000
+DEFAULT_BATCH = 200
+
+SYNC_LAG = getattr(settings, 'CATALOG_CHANGES_LAG', 2)
+
+
+class InvalidToken(ValueError):
+    """Токен синхронизации поврежден"""
+
+
+def encode_token(change_id):
+    return base64.urlsafe_b64encode(f'v1:{change_id}'.encode()).decode().rstrip('=')
+
+
+def decode_token(token):
+    """Позиция в журнале по токену"""
+    try:
+        padded = token + '=' * (-len(token) % 4)
+        prefix, change_id = base64.urlsafe_b64decode(padded.encode()).decode().split(':')
+        change_id = int(change_id)
+        if prefix != 'v1' or change_id < 0:
+            raise ValueError
+        return change_id
+    except (ValueError, UnicodeDecodeError) as e:
+        raise InvalidToken('Неверный токен синхронизации') from e
+
+
+def record(object_type, object_ids):
+    """Записывает изменения объектов object_type в журнал"""
+    from .models import CatalogChange
+
+    now = timezone.now()
+    CatalogChange.objects.bulk_create([
+        CatalogChange(object_type=object_type, object_id=object_id, changed_at=now)
+        for object_id in dict.fromkeys(object_ids) if object_id is not None
+    ])
+
+
+def head_token():
+    """Токен текущего конца журнала (для клиента, который загрузил каталог целиком)"""
+    from .models import CatalogChange
+
+    last_id = CatalogChange.objects.order_by('-id').values_list('id', flat=True).first()
+    return encode_token(last_id or 0)
+
+
+# ----- Текущее состояние объектов -----
+
+def _products(ids):
+    from .models import Product
+    from .listing import DEFAULT_FIELDS, serialize_products
+
+    rows = serialize_products(Product.objects.filter(pk__in=ids, is_available=True), DEFAULT_FIELDS)
+    return {row['id']: row for row in rows}
+
+
+def _sizes(ids):
+    from .models import ProductSize
+
+    rows = ProductSize.objects.filter(pk__in=ids).values('id', 'product_id', 'size_label', 'size_type', 'size_stock')
+    return {row['id']: row for row in rows}
+
+
+def _product_tags(ids):
+    from .models import ProductTag
+
+    rows = ProductTag.objects.filter(pk__in=ids).values('id', 'product_id', 'tag_id', 'tag__tag_name')
+    return {
+        row['id']: {'id': row['id'], 'product_id': row['product_id'],
+                    'tag_id': row['tag_id'], 'tag_name': row['tag__tag_name']}
+        for row in rows
+    }
+
+
+def _categories(ids):
+    from .models import Category
+
+    rows = Category.objects.filter(pk__in=ids).values(
+        'id', 'category_name', 'category_description', 'parent_category_id', 'tree_path', 'depth'
+    )
+    return {row['id']: row for row in rows}
+
+
+def _brands(ids):
+    from .models import Brand
+
+    rows = Brand.objects.filter(pk__in=ids).values('id', 'brand_name', 'brand_country', 'brand_description')
+    return {row['id']: row for row in rows}
+
+
+_LOADERS = {
+    'product': _products,
+    'productsize': _sizes,
+    'producttag': _product_tags,
+    'category': _categories,
+    'brand': _brands,
+}
+
+
+def changes_since(token, limit=DEFAULT_BATCH):
+    """
+    Изменения после токена, не более limit записей журнала.
+    Возвращает словарь ответа API; при неверном токене — InvalidToken.
+    """
+    from .models import CatalogChange
+
+    if not token:
+        # Без токена клиент загружает каталог целиком и продолжает с конца журнала
+        return {'reset': True, 'changes': [], 'next_token': head_token(), 'has_more': False}
+
+    since = decode_token(token)
+    if since:
+        oldest = CatalogChange.objects.order_by('id').values_list('id', flat=True).first()
+        if oldest is not None and since < oldest - 1:
+            # Нужные записи уже удалены из журнала
+            return {'reset': True, 'changes': [], 'next_token': head_token(), 'has_more': False}
+
+    cutoff = timezone.now() - timezone.timedelta(seconds=SYNC_LAG)
+    entries = list(
+        CatalogChange.objects.filter(id__gt=since, changed_at__lte=cutoff)
+        .order_by('id').values_list('id', 'object_type', 'object_id')[:limit + 1]
+    )
+    has_more = len(entries) > limit
+    entries = entries[:limit]
+
+    # Несколько изменений одного объекта схлопываются в одно (по последнему)
+    latest = OrderedDict()
+    for _, object_type, object_id in entries:
+        key = (object_type, object_id)
+        latest.pop(key, None)
+        latest[key] = True
+
+    ids_by_type = {}
+    for object_type, object_id in latest:
+        ids_by_type.setdefault(object_type, []).append(object_id)
+    current = {
+        object_type: _LOADERS[object_type](ids)
+        for object_type, ids in ids_by_type.items() if object_type in _LOADERS
+    }
+
+    changes = []
+    for object_type, object_id in latest:
+        data = current.get(object_type, {}).get(object_id)
+        if data is None:
+            changes.append({'type': object_type, 'id': object_id, 'action': 'delete'})
+        else:
+            changes.append({'type': object_type, 'id': object_id, 'action': 'upsert', 'data': data})
+
+    return {
+        'reset': False,
+        'changes': changes,
+        'next_token': encode_token(entries[-1][0]) if entries else encode_token(since),
+        'has_more': has_more,
+    }
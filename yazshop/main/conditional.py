@@ -0,0 +1,84 @@
+"""
+Условные GET-запросы (ETag / Last-Modified) по счетчикам версий таблиц.
+
+ETag ответа — хэш версий таблиц, от которых он зависит, Last-Modified — время
+последнего изменения любой из них (см. versions.py). Версии общие для всех
+воркеров (хранятся в БД), поэтому после изменения ни один воркер не ответит 304
+на старый ETag дольше VERSION_CHECK_INTERVAL. Проверка идет до вызова view:
+при совпадении клиент получает 304, а версии читаются одним запросом.
+
+Декоратор conditional_on подходит и для функций-view, и для методов DRF
+(через method_decorator). Для HTML-страниц нужен per_user=True: шаблон зависит
+от пользователя и CSRF-токена, поэтому они входят в ETag, а Last-Modified не
+отдается (по нему нельзя заметить вход или выход пользователя).
+
+Остатки и счетчики товаров (snapshot.VOLATILE_FIELDS) меняются с каждым заказом
+и отзывом, поэтому версию таблицы они не увеличивают. Чтобы клиент все же увидел
+их изменения, ответы по товарам и размерам учитывают окно времени VOLATILE_TTL:
+в новом окне ETag и Last-Modified меняются, и страница перезапрашивается.
+"""
+import hashlib
+import time
+from datetime import datetime, timezone as dt_timezone
+
+from django.conf import settings
+from django.views.decorators.http import condition
+
+from . import versions
+
+# Таблицы, из которых собираются страницы и списки каталога.
+# Их версии увеличиваются сигналами (signals.py) и массовыми операциями ProductQuerySet
+CATALOG_TABLES = ('product', 'productsize', 'producttag', 'category', 'brand', 'tag')
+
+# Таблицы с остатками и счетчиками, которые меняются без увеличения версии
+VOLATILE_TABLES = ('product', 'productsize')
+
+# Сколько секунд клиент может видеть прежние остатки и счетчики товаров
+VOLATILE_TTL = getattr(settings, 'CONDITIONAL_VOLATILE_TTL', 60)
+
+
+def _version_name(table):
+    return f'table:main.{table}'
+
+
+def volatile_window():
+    """Начало текущего окна VOLATILE_TTL (unix-время)"""
+    return int(time.time() // VOLATILE_TTL) * VOLATILE_TTL
+
+
+def has_pending_messages(request):
+    """Есть ли у запроса сообщения (django.contrib.messages), которые еще не показаны"""
+    storage = getattr(request, '_messages', None)
+    return storage is not None and len(storage) > 0
+
+
+def conditional_on(*tables, per_user=False):
+    """
+    Декоратор view: отдает 304, если таблицы tables (имена моделей в нижнем
+    регистре: product, category, ...) не менялись с версии клиента.
+    """
+    names = [_version_name(table) for table in tables]
+    volatile = any(table in VOLATILE_TABLES for table in tables)
+
+    def etag_func(request, *args, **kwargs):
+        # Страница с непоказанными сообщениями должна отрисоваться заново
+        if per_user and has_pending_messages(request):
+            return None
+        current = versions.get_versions(names)
+        parts = [f'{name}={current[name][0]}' for name in names]
+        if volatile:
+            parts.append(f'volatile={volatile_window()}')
+        if per_user:
+            parts.append(f'user={request.user.pk or 0}')
+            parts.append(f'csrf={request.COOKIES.get(settings.CSRF_COOKIE_NAME, "")}')
+        return hashlib.md5('|'.join(parts).encode()).hexdigest()
+
+    def last_modified_func(request, *args, **kwargs):
+        if per_user:
+            return None
+        modified_at = max(modified_at for _, modified_at in versions.get_versions(names).values())
+        if volatile:
+            modified_at = max(modified_at, volatile_window())
+        return datetime.fromtimestamp(modified_at, tz=dt_timezone.utc)
+
+    return condition(etag_func=etag_func, last_modified_func=last_modified_func)
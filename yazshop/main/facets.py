@@ -0,0 +1,436 @@
+"""
+Битовый индекс для фильтрации каталога и подсчета фасетов.
+
+Каждый процесс держит в памяти индекс: товару назначается позиция бита,
+для каждой категории, бренда, тега, размера и признака наличия хранится
+битовая маска (int). Любая комбинация фильтров сводится к побитовому AND,
+а количество товаров в фасете — к popcount. Маска категории включает товары
+всех ее подкатегорий (по материализованному пути Category.tree_path).
+
+Индекс обновляется точечно сигналами Product/ProductTag/ProductSize
+(см. signals.py). Изменения товаров в других воркерах индекс забирает из
+журнала изменений каталога (changes.py): раз в VERSION_CHECK_INTERVAL читаются
+записи о товарах, размерах и тегах товаров после последней учтенной, и эти
+товары перечитываются одной пачкой. Позиция в журнале сдвигается только за
+записи старше CATALOG_CHANGES_LAG, как и у клиентов синхронизации.
+
+Полностью индекс перестраивается при смене версии catalog_facets (versions.py)
+— только при изменении дерева категорий — и по истечении CATALOG_FACETS_TTL
+секунд: это страховка для изменений в обход сигналов и ProductQuerySet
+(например, прямым SQL).
+"""
+import threading
+import time
+from collections import defaultdict
+
+from django.conf import settings
+from django.utils import timezone
+
+from . import versions
+from .changes import SYNC_LAG
+from .versions import VERSION_CHECK_INTERVAL
+
+# Имя счетчика версий (см. versions.py)
+VERSION_NAME = 'catalog_facets'
+
+# Сколько секунд индекс считается актуальным без перестроения
+FACETS_TTL = getattr(settings, 'CATALOG_FACETS_TTL', 60)
+
+# Максимальное число id, которое передается в запрос через pk__in
+MAX_IN_IDS = getattr(settings, 'CATALOG_FACETS_MAX_IN_IDS', 5000)
+
+# Записи журнала изменений, от которых зависят биты товара
+_CHANGE_TYPES = ('product', 'productsize', 'producttag')
+
+_lock = threading.RLock()
+_index = None
+
+
+def _to_int(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+class FacetIndex:
+    """Битовый индекс товаров одного процесса"""
+
+    def __init__(self, version=None):
+        self.version = version
+        self.built_at = time.monotonic()
+        self.synced_at = self.built_at
+        # Последняя учтенная запись журнала изменений и учтенные записи после нее
+        self.change_id = 0
+        self.applied_changes = set()
+        self.positions = {}
+        self.ids = []
+        self.rows = {}
+        self.category_paths = {}
+        self.category_names = {}
+        self.categories = defaultdict(int)
+        self.brands = defaultdict(int)
+        self.tags = defaultdict(int)
+        self.size_labels = defaultdict(int)
+        self.size_ids = {}
+        self.product_tag_ids = {}
+        self.available = 0
+        self.in_stock = 0
+
+    # ----- Построение -----
+
+    @classmethod
+    def build(cls, version=None):
+        """Строит индекс пятью запросами без JOIN"""
+        from .models import CatalogChange, Category, Product, ProductTag, ProductSize
+
+        index = cls(version)
+        # Все, что записано в журнал до этой позиции, уже видно запросам ниже
+        index.change_id = CatalogChange.objects.filter(
+            changed_at__lte=timezone.now() - timezone.timedelta(seconds=SYNC_LAG)
+        ).order_by('-id').values_list('id', flat=True).first() or 0
+        for category_id, category_name, tree_path in Category.objects.values_list('id', 'category_name', 'tree_path'):
+            index.category_paths[category_id] = tree_path
+            index.category_names[category_id] = category_name
+
+        tags = defaultdict(list)
+        for product_tag_id, product_id, tag_id in ProductTag.objects.values_list('id', 'product_id', 'tag_id'):
+            tags[product_id].append((product_tag_id, tag_id))
+        sizes = defaultdict(list)
+        for size_id, product_id, size_label in ProductSize.objects.values_list('id', 'product_id', 'size_label'):
+            sizes[product_id].append((size_id, size_label))
+
+        rows = Product.objects.values_list('id', 'category_id', 'brand_id', 'is_available', 'stock_quantity')
+        for product_id, category_id, brand_id, is_available, stock_quantity in rows.iterator(chunk_size=2000):
+            index.add(product_id, category_id, brand_id, is_available, stock_quantity,
+                      tags.get(product_id, ()), sizes.get(product_id, ()))
+        return index
+
+    def add(self, product_id, category_id, brand_id, is_available, stock_quantity, tags, sizes):
+        """
+        Добавляет товар в индекс (предварительно убирая старые биты).
+        tags — пары (id ProductTag, id тега), sizes — пары (id размера, размер).
+        """
+        self.remove(product_id)
+        pos = self.positions.get(product_id)
+        if pos is None:
+            pos = len(self.ids)
+            self.positions[product_id] = pos
+            self.ids.append(product_id)
+        bit = 1 << pos
+
+        categories = self.category_ancestors(category_id)
+        for ancestor_id in categories:
+            self.categories[ancestor_id] |= bit
+        if brand_id is not None:
+            self.brands[brand_id] |= bit
+        for product_tag_id, tag_id in tags:
+            self.tags[tag_id] |= bit
+            self.product_tag_ids[product_tag_id] = product_id
+        for size_id, size_label in sizes:
+            self.size_labels[size_label] |= bit
+            self.size_ids[size_id] = product_id
+        if is_available:
+            self.available |= bit
+        if stock_quantity > 0:
+            self.in_stock |= bit
+
+        self.rows[product_id] = (categories, brand_id, tuple(tags), tuple(sizes))
+
+    def remove(self, product_id):
+        """Снимает все биты товара. Позиция сохраняется до перестроения."""
+        row = self.rows.pop(product_id, None)
+        if row is None:
+            return
+        mask = ~(1 << self.positions[product_id])
+        categories, brand_id, tags, sizes = row
+        for ancestor_id in categories:
+            self.categories[ancestor_id] &= mask
+        if brand_id is not None:
+            self.brands[brand_id] &= mask
+        for product_tag_id, tag_id in tags:
+            self.tags[tag_id] &= mask
+            self.product_tag_ids.pop(product_tag_id, None)
+        for size_id, size_label in sizes:
+            self.size_labels[size_label] &= mask
+            self.size_ids.pop(size_id, None)
+        self.available &= mask
+        self.in_stock &= mask
+
+    def category_ancestors(self, category_id):
+        """id категорий от корня до category_id включительно"""
+        if category_id is None:
+            return ()
+        path = self.category_paths.get(category_id)
+        if not path:
+            return (category_id,)
+        return tuple(int(part) for part in path.strip('/').split('/') if part)
+
+    def breadcrumbs(self, category_id):
+        """Хлебные крошки категории: [(id, название), ...] от корня"""
+        category_id = _to_int(category_id)
+        if category_id not in self.category_paths:
+            return []
+        return [(ancestor_id, self.category_names.get(ancestor_id, ''))
+                for ancestor_id in self.category_ancestors(category_id)]
+
+    def refresh_product(self, product_id):
+        """Перечитывает из БД данные одного товара"""
+        self.refresh_products([product_id])
+
+    def refresh_products(self, product_ids):
+        """Перечитывает из БД данные товаров: по три запроса на каждые MAX_IN_IDS товаров"""
+        from .models import Product, ProductTag, ProductSize
+
+        product_ids = list(dict.fromkeys(product_ids))
+        for start in range(0, len(product_ids), MAX_IN_IDS):
+            chunk = product_ids[start:start + MAX_IN_IDS]
+            rows = {
+                row[0]: row[1:] for row in Product.objects.filter(pk__in=chunk).values_list(
+                    'id', 'category_id', 'brand_id', 'is_available', 'stock_quantity')
+            }
+            tags = defaultdict(list)
+            for product_tag_id, product_id, tag_id in ProductTag.objects.filter(product_id__in=rows).values_list(
+                    'id', 'product_id', 'tag_id'):
+                tags[product_id].append((product_tag_id, tag_id))
+            sizes = defaultdict(list)
+            for size_id, product_id, size_label in ProductSize.objects.filter(product_id__in=rows).values_list(
+                    'id', 'product_id', 'size_label'):
+                sizes[product_id].append((size_id, size_label))
+            for product_id in chunk:
+                row = rows.get(product_id)
+                if row is None:
+                    self.remove(product_id)
+                else:
+                    self.add(product_id, *row, tags.get(product_id, ()), sizes.get(product_id, ()))
+
+    def sync(self):
+        """
+        Перечитывает товары, измененные по журналу изменений после последней
+        учтенной записи. Возвращает False, если записей больше MAX_IN_IDS и
+        индекс дешевле перестроить.
+        """
+        from .models import CatalogChange, ProductSize, ProductTag
+
+        entries = list(
+            CatalogChange.objects.filter(id__gt=self.change_id, object_type__in=_CHANGE_TYPES)
+            .order_by('id').values_list('id', 'object_type', 'object_id', 'changed_at')[:MAX_IN_IDS + 1]
+        )
+        if len(entries) > MAX_IN_IDS:
+            return False
+
+        product_ids = set()
+        unknown = {'productsize': set(), 'producttag': set()}
+        known = {'productsize': self.size_ids, 'producttag': self.product_tag_ids}
+        for change_id, object_type, object_id, _ in entries:
+            if change_id in self.applied_changes:
+                continue
+            if object_type == 'product':
+                product_ids.add(object_id)
+            elif object_id in known[object_type]:
+                product_ids.add(known[object_type][object_id])
+            else:
+                unknown[object_type].add(object_id)
+        # Новые размеры и теги товаров; удаленные, которых нет в индексе, битов не ставили
+        for model, ids in ((ProductSize, unknown['productsize']), (ProductTag, unknown['producttag'])):
+            if ids:
+                product_ids.update(model.objects.filter(pk__in=ids).values_list('product_id', flat=True))
+        if product_ids:
+            self.refresh_products(product_ids)
+
+        # Позиция сдвигается только за записи старше SYNC_LAG: более ранние по id
+        # транзакции могут зафиксироваться позже (см. changes.py)
+        cutoff = timezone.now() - timezone.timedelta(seconds=SYNC_LAG)
+        for change_id, _, _, changed_at in entries:
+            if changed_at > cutoff:
+                break
+            self.change_id = change_id
+        self.applied_changes = {change_id for change_id, _, _, _ in entries if change_id > self.change_id}
+        self.synced_at = time.monotonic()
+        return True
+
+    # ----- Фильтрация -----
+
+    def masks(self, category=None, brand=None, tag=None, size=None, size_label=None, in_stock=False):
+        """Возвращает маски по каждому измерению фильтра (только для заданных фильтров)"""
+        masks = {'available': self.available}
+        if category:
+            masks['category'] = self.categories.get(_to_int(category), 0)
+        if brand:
+            masks['brand'] = self.brands.get(_to_int(brand), 0)
+        if tag:
+            masks['tag'] = self.tags.get(_to_int(tag), 0)
+        if size_label:
+            masks['size'] = self.size_labels.get(size_label, 0)
+        if size:
+            product_id = self.size_ids.get(_to_int(size))
+            masks['size_id'] = 0 if product_id is None else 1 << self.positions[product_id]
+        if in_stock:
+            masks['in_stock'] = self.in_stock
+        return masks
+
+    def to_ids(self, bitmap):
+        """Переводит битовую маску в список id товаров"""
+        bits = bin(bitmap)[:1:-1]
+        ids = []
+        pos = bits.find('1')
+        while pos != -1:
+            ids.append(self.ids[pos])
+            pos = bits.find('1', pos + 1)
+        return ids
+
+    def from_ids(self, product_ids):
+        """Строит битовую маску по списку id товаров"""
+        bitmap = 0
+        for product_id in product_ids:
+            pos = self.positions.get(product_id)
+            if pos is not None:
+                bitmap |= 1 << pos
+        return bitmap
+
+    def counts(self, masks):
+        """
+        Считает количество товаров по значениям фасетов.
+        Для каждого измерения учитываются все фильтры, кроме его собственного,
+        чтобы можно было переключаться между значениями одного фасета.
+        """
+        def combined(*exclude):
+            result = -1
+            for name, mask in masks.items():
+                if name not in exclude:
+                    result &= mask
+            return result
+
+        def popcounts(bitmaps, base):
+            return {key: (bitmap & base).bit_count() for key, bitmap in bitmaps.items() if bitmap & base}
+
+        return {
+            'categories': popcounts(self.categories, combined('category')),
+            'brands': popcounts(self.brands, combined('brand')),
+            'tags': popcounts(self.tags, combined('tag')),
+            'sizes': popcounts(self.size_labels, combined('size')),
+            'in_stock': (self.in_stock & combined('in_stock')).bit_count(),
+        }
+
+
+def get_index():
+    """
+    Возвращает актуальный индекс процесса: перестраивает его при смене версии
+    или по TTL, а раз в VERSION_CHECK_INTERVAL догоняет журнал изменений
+    """
+    global _index
+    version = versions.get_version(VERSION_NAME)
+    index = _index
+    now = time.monotonic()
+    if index is not None and index.version == version and now - index.built_at < FACETS_TTL:
+        if now - index.synced_at < VERSION_CHECK_INTERVAL:
+            return index
+        with _lock:
+            if _index is index and time.monotonic() - index.synced_at >= VERSION_CHECK_INTERVAL \
+                    and not index.sync():
+                _index = FacetIndex.build(version)
+            return _index
+    with _lock:
+        if _index is index:
+            _index = FacetIndex.build(version)
+        return _index
+
+
+def refresh_product(product_id):
+    """Точечно обновляет товар в индексе процесса (остальные воркеры возьмут его из журнала изменений)"""
+    refresh_products([product_id])
+
+
+def refresh_products(product_ids):
+    """Обновляет товары в индексе процесса одной пачкой"""
+    with _lock:
+        if _index is not None:
+            _index.refresh_products(product_ids)
+
+
+def reset():
+    """Сбрасывает индекс процесса"""
+    global _index
+    with _lock:
+        _index = None
+
+
+def invalidate():
+    """Сбрасывает индексы всех воркеров (например, после изменения дерева категорий)"""
+    versions.bump(VERSION_NAME)
+    reset()
+
+
+def filter_catalog(queryset, query=None, query_fields=('product_name', 'product_description'), **filters):
+    """
+    Применяет фильтры каталога через битовый индекс.
+    queryset должен содержать только доступные товары (is_available=True).
+    Возвращает (queryset, counts), где counts — количество товаров по фасетам
+    (для категорий — вместе с подкатегориями), и breadcrumbs выбранной категории.
+    """
+    from .search import filter_by_search, search_product_ids, rank_by_search
+
+    index = get_index()
+    masks = index.masks(**filters)
+
+    ranked_ids = None
+    if query:
+        ranked_ids = search_product_ids(query)
+        if ranked_ids is None:
+            # Индекс поиска недоступен — берем id совпадений из БД
+            matched = filter_by_search(queryset, query, fields=query_fields).values_list('pk', flat=True)
+            masks['query'] = index.from_ids(matched)
+        else:
+            masks['query'] = index.from_ids(ranked_ids)
+
+    result = -1
+    for mask in masks.values():
+        result &= mask
+    counts = index.counts(masks)
+    counts['total'] = result.bit_count()
+    if filters.get('category'):
+        counts['breadcrumbs'] = [
+            {'id': category_id, 'category_name': name}
+            for category_id, name in index.breadcrumbs(filters['category'])
+        ]
+
+    if len(masks) > 1:
+        if counts['total'] <= MAX_IN_IDS:
+            queryset = queryset.filter(pk__in=index.to_ids(result))
+        else:
+            queryset = _filter_queryset(index, queryset, query, query_fields, **filters)
+    if ranked_ids:
+        # Сортировка подзапросом к индексу: список id может быть длинным
+        queryset = rank_by_search(queryset, query)
+    return queryset, counts
+
+
+def _filter_queryset(index, queryset, query, query_fields, category=None, brand=None, tag=None,
+                     size=None, size_label=None, in_stock=False):
+    """Фильтрация средствами БД для слишком больших выборок"""
+    from .search import filter_by_search
+
+    if query:
+        queryset = filter_by_search(queryset, query, fields=query_fields)
+    if category:
+        path = index.category_paths.get(_to_int(category))
+        if path:
+            queryset = queryset.filter(category_id__in=list(
+                category_id for category_id, tree_path in index.category_paths.items()
+                if tree_path.startswith(path)
+            ))
+        else:
+            queryset = queryset.filter(category_id=_to_int(category))
+    if brand:
+        queryset = queryset.filter(brand_id=_to_int(brand))
+    if tag:
+        queryset = queryset.filter(producttag__tag_id=_to_int(tag))
+    if size_label:
+        queryset = queryset.filter(sizes__size_label=size_label)
+    if size:
+        queryset = queryset.filter(sizes__id=_to_int(size))
+    if in_stock:
+        queryset = queryset.filter(stock_quantity__gt=0)
+    if tag or size or size_label:
+        queryset = queryset.distinct()
+    return queryset
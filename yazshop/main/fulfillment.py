@@ -0,0 +1,194 @@
+"""
+Массовая смена статусов заказов и назначение курьеров.
+
+Страница заказа менеджера и API управления заказами меняют один заказ за
+запрос: полное сохранение, get_or_create доставки и запись в журнал. Здесь
+та же работа выполняется для пачки заказов числом запросов, не зависящим
+от ее размера:
+
+- текущие статусы читаются одним запросом, переход каждого заказа
+  проверяется по TRANSITIONS (статусы — Order.ORDER_STATUSES);
+- статус меняется одним UPDATE на каждый прежний статус (их не больше
+  трех) и повторно проверяет прежний статус, поэтому заказ, параллельно
+  измененный другим менеджером, не перескочит через недопустимый переход,
+  а попадет в результат с ошибкой;
+- недостающие доставки создаются одним bulk_create, существующие
+  обновляются одним UPDATE (номера отслеживания — через CASE);
+- в журнал действий пишется одна запись на всю пачку.
+
+Отмена сюда не входит: она возвращает деньги и остатки (cancellation.py).
+Массовый UPDATE не вызывает сигналов Order, но для переходов
+из TRANSITIONS сигналы ничего не делают (они реагируют только на отмену).
+"""
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Case, When, Value, F, CharField
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from .helpers import _log_activity
+
+# Допустимые переходы: из статуса -> в статусы
+TRANSITIONS = {
+    'processing': ('paid', 'shipped'),
+    'paid': ('shipped',),
+    'shipped': ('delivered',),
+    'delivered': (),
+    'cancelled': (),
+}
+
+# Статус доставки, который ставится при переходе заказа
+DELIVERY_STATUSES = {
+    'shipped': 'in_transit',
+    'delivered': 'delivered',
+}
+
+MAX_BATCH = getattr(settings, 'ORDER_BULK_MAX', 500)
+
+
+def parse_order_ids(values):
+    """Номера заказов из списка или строки через запятую/пробел, без повторов"""
+    if isinstance(values, str):
+        values = values.replace(',', ' ').split()
+    order_ids = []
+    for value in values or []:
+        try:
+            order_id = int(value)
+        except (TypeError, ValueError):
+            raise ValueError(f'Неверный номер заказа: {value}')
+        if order_id not in order_ids:
+            order_ids.append(order_id)
+    return order_ids
+
+
+def _result(order_id, old_status, new_status, error=None):
+    return {
+        'order_id': order_id,
+        'success': error is None,
+        'old_status': old_status,
+        'status': new_status if error is None else old_status,
+        'changed': error is None and old_status != new_status,
+        'error': error,
+    }
+
+
+def _assign_deliveries(order_ids, moved_ids, new_status, carrier_name, tracking_numbers, now):
+    """Создает недостающие доставки и обновляет существующие"""
+    from .models import Delivery
+
+    delivery_status = DELIVERY_STATUSES.get(new_status)
+    existing = {}
+    for delivery_id, order_id in Delivery.objects.filter(order_id__in=order_ids).order_by('id').values_list('id', 'order_id'):
+        existing.setdefault(order_id, delivery_id)
+
+    Delivery.objects.bulk_create([
+        Delivery(
+            order_id=order_id,
+            carrier_name=carrier_name,
+            tracking_number=tracking_numbers.get(order_id),
+            delivery_status=delivery_status if order_id in moved_ids else None,
+            shipped_at=now if order_id in moved_ids and new_status == 'shipped' else None,
+            delivered_at=now if order_id in moved_ids and new_status == 'delivered' else None,
+        )
+        for order_id in order_ids if order_id not in existing
+    ])
+
+    if not existing:
+        return
+    queryset = Delivery.objects.filter(pk__in=existing.values())
+    fields = {}
+    if carrier_name:
+        fields['carrier_name'] = carrier_name
+    tracked = {existing[order_id]: number for order_id, number in tracking_numbers.items() if order_id in existing}
+    if tracked:
+        fields['tracking_number'] = Case(
+            *[When(pk=pk, then=Value(number)) for pk, number in tracked.items()],
+            default=F('tracking_number'),
+            output_field=CharField(),
+        )
+    if fields:
+        queryset.update(**fields)
+
+    moved = queryset.filter(order_id__in=moved_ids)
+    if new_status == 'shipped':
+        moved.update(delivery_status=delivery_status, shipped_at=Coalesce('shipped_at', Value(now)))
+    elif new_status == 'delivered':
+        moved.update(delivery_status=delivery_status, delivered_at=Coalesce('delivered_at', Value(now)))
+
+
+def bulk_transition(order_ids, new_status, user, carrier_name=None, tracking_numbers=None, request=None):
+    """
+    Переводит заказы order_ids в статус new_status и назначает курьера
+    carrier_name (tracking_numbers — {номер заказа: номер отслеживания}).
+    Возвращает результат по каждому заказу в порядке order_ids; ValueError —
+    неверный статус или слишком большая пачка.
+    """
+    from .models import Order
+
+    statuses = dict(Order.ORDER_STATUSES)
+    if new_status not in statuses:
+        raise ValueError('Неверный статус заказа')
+    if new_status == 'cancelled':
+        raise ValueError('Отмена заказов выполняется с возвратом средств, а не сменой статуса')
+    order_ids = parse_order_ids(order_ids)
+    if not order_ids:
+        raise ValueError('Не выбраны заказы')
+    if len(order_ids) > MAX_BATCH:
+        raise ValueError(f'За один раз можно изменить не больше {MAX_BATCH} заказов')
+    carrier_name = (carrier_name or '').strip() or None
+    tracking_numbers = {
+        int(order_id): str(number).strip()
+        for order_id, number in (tracking_numbers or {}).items()
+        if str(number or '').strip()
+    }
+
+    now = timezone.now()
+    results = {}
+    with transaction.atomic():
+        current = dict(Order.objects.select_for_update().filter(pk__in=order_ids).values_list('id', 'order_status'))
+        by_status = {}
+        for order_id in order_ids:
+            old_status = current.get(order_id)
+            if old_status is None:
+                results[order_id] = _result(order_id, None, new_status, 'Заказ не найден')
+            elif old_status == new_status:
+                results[order_id] = _result(order_id, old_status, new_status)
+            elif new_status not in TRANSITIONS.get(old_status, ()):
+                results[order_id] = _result(
+                    order_id, old_status, new_status,
+                    f'Переход «{statuses[old_status]}» → «{statuses[new_status]}» не разрешен'
+                )
+            else:
+                by_status.setdefault(old_status, []).append(order_id)
+
+        moved_ids = set()
+        for old_status, group in by_status.items():
+            updated = Order.objects.filter(pk__in=group, order_status=old_status).update(order_status=new_status)
+            if updated == len(group):
+                moved = group
+            else:
+                # Часть заказов успел изменить кто-то другой: они остаются со своим статусом
+                actual = dict(Order.objects.filter(pk__in=group).values_list('id', 'order_status'))
+                moved = [order_id for order_id in group if actual.get(order_id) == new_status]
+                for order_id in group:
+                    if order_id not in moved:
+                        results[order_id] = _result(order_id, actual.get(order_id), new_status,
+                                                    'Статус заказа изменился, обновите страницу')
+            for order_id in moved:
+                moved_ids.add(order_id)
+                results[order_id] = _result(order_id, old_status, new_status)
+
+        succeeded = [order_id for order_id in order_ids if results[order_id]['success']]
+        tracking_numbers = {order_id: number for order_id, number in tracking_numbers.items() if order_id in succeeded}
+        needs_delivery = bool(moved_ids) and new_status in DELIVERY_STATUSES
+        if succeeded and (needs_delivery or carrier_name or tracking_numbers):
+            _assign_deliveries(succeeded, moved_ids, new_status, carrier_name, tracking_numbers, now)
+
+        if moved_ids:
+            changed = ', '.join(f'#{order_id}' for order_id in order_ids if order_id in moved_ids)
+            description = f'Массовая смена статуса заказов -> {new_status} ({len(moved_ids)}): {changed}'
+            if carrier_name:
+                description += f'. Курьер: {carrier_name}'
+            _log_activity(user, 'update', 'orders_bulk', description, request)
+
+    return [results[order_id] for order_id in order_ids]
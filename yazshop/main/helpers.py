@@ -34,23 +34,25 @@ def _user_is_manager(user) -> bool:
         return False
 
 
-def _log_activity(user, action_type, target_object, description='', request=None):
+def _client_ip(request):
+    """IP-адрес клиента с учетом прокси"""
+    if not request:
+        return None
+    x_forwarded_for = request.META.get('HTTP_X_FORWARDED_FOR')
+    if x_forwarded_for:
+        return x_forwarded_for.split(',')[0]
+    return request.META.get('REMOTE_ADDR')
+
+
+def _log_activity(user, action_type, target_object, description='', request=None, ip_address=None):
     """Функция для логирования действий пользователей"""
     try:
-        ip_address = None
-        if request:
-            x_forwarded_for = request.META.get('HTTP_X_FORWARDED_FOR')
-            if x_forwarded_for:
-                ip_address = x_forwarded_for.split(',')[0]
-            else:
-                ip_address = request.META.get('REMOTE_ADDR')
-        
         ActivityLog.objects.create(
             user=user,
             action_type=action_type,
             target_object=target_object,
             action_description=description,
-            ip_address=ip_address
+            ip_address=ip_address or _client_ip(request)
         )
     except Exception:
         pass  # Не прерываем выполнение при ошибке логирования
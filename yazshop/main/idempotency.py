@@ -0,0 +1,265 @@
+"""
+Ключи идемпотентности для оформления заказа и денежных операций.
+
+Клиент передает ключ в заголовке Idempotency-Key (API, fetch) или в поле
+формы idempotency_key (обычные формы; ключ выдается при отрисовке страницы).
+Представления, обернутые idempotent(scope), работают так:
+
+- первый POST с ключом занимает строку IdempotencyKey (status='pending')
+  отдельной короткой транзакцией до основной работы, выполняется и сохраняет
+  ответ (status='done');
+- повтор с тем же ключом получает сохраненный ответ без повторного
+  выполнения (с заголовком Idempotent-Replayed);
+- повтор, пришедший, пока первый запрос еще выполняется: повтор формы
+  (двойное нажатие) ждет его завершения не дольше WAIT_TIMEOUT секунд и
+  получает сохраненный ответ, а если не дождался — перенаправляется обратно
+  с сообщением; запрос API сразу получает 409 с заголовком Retry-After
+  (клиент повторяет его сам, см. apiRequest в static/js/api.js);
+- тот же ключ с другими параметрами запроса — 422.
+
+Сохраняются только успешные ответы: запрос с ошибкой ничего не меняет и
+может быть повторен с тем же ключом, поэтому при ошибке или исключении ключ
+освобождается. Ошибкой считается статус >= 400; формы же сообщают об ошибке
+через messages и перенаправление, поэтому перенаправление сохраняется, только
+если представление отметило успех вызовом succeeded(request).
+
+Ключ живет TTL секунд; занятый ключ, который не завершился за STALE_AFTER
+секунд (воркер упал посреди запроса), считается брошенным и занимается
+заново. Просроченные ключи удаляет команда prune_idempotency_keys.
+"""
+import hashlib
+import json
+import time
+import uuid
+from datetime import timedelta
+from functools import wraps
+
+from django.conf import settings
+from django.contrib import messages
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import IntegrityError, transaction
+from django.http import HttpResponse
+from django.shortcuts import redirect
+from django.utils import timezone
+from django.utils.http import url_has_allowed_host_and_scheme
+
+KEY_HEADER = 'Idempotency-Key'
+KEY_FIELD = 'idempotency_key'
+REPLAY_HEADER = 'Idempotent-Replayed'
+MAX_KEY_LENGTH = 255
+
+TTL = getattr(settings, 'IDEMPOTENCY_KEY_TTL', 24 * 60 * 60)
+STALE_AFTER = getattr(settings, 'IDEMPOTENCY_STALE_AFTER', 120)
+# Через сколько секунд повторить запрос, пока первый с тем же ключом выполняется
+RETRY_AFTER = getattr(settings, 'IDEMPOTENCY_RETRY_AFTER', 1)
+# Сколько секунд повтор формы ждет завершения первого запроса с тем же ключом
+WAIT_TIMEOUT = getattr(settings, 'IDEMPOTENCY_WAIT_TIMEOUT', 3)
+
+CLAIM_ATTEMPTS = 3
+
+# Поля формы, которые не относятся к параметрам операции
+IGNORED_FIELDS = {'csrfmiddlewaretoken', KEY_FIELD}
+
+
+def new_key():
+    """Ключ для формы, отрисованной на сервере"""
+    return uuid.uuid4().hex
+
+
+def succeeded(request):
+    """Отмечает, что операция представления выполнена и ответ можно сохранить для повторов"""
+    request._idempotent_succeeded = True
+
+
+def _is_api(request):
+    # У запроса DRF есть data, у обычного запроса Django — нет
+    return hasattr(request, 'data')
+
+
+def request_key(request):
+    """Ключ идемпотентности запроса или None"""
+    key = request.headers.get(KEY_HEADER)
+    if not key:
+        data = request.data if _is_api(request) else request.POST
+        key = data.get(KEY_FIELD) if hasattr(data, 'get') else None
+    if not key:
+        return None
+    return str(key).strip() or None
+
+
+def fingerprint(request):
+    """Хэш метода, пути и параметров запроса"""
+    data = request.data if _is_api(request) else request.POST
+    if hasattr(data, 'lists'):
+        data = {name: values for name, values in data.lists() if name not in IGNORED_FIELDS}
+    elif isinstance(data, dict):
+        data = {name: value for name, value in data.items() if name not in IGNORED_FIELDS}
+    payload = json.dumps([request.method, request.path, data], sort_keys=True, cls=DjangoJSONEncoder)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+def _back(request):
+    """Перенаправление формы обратно на страницу, с которой она отправлена"""
+    referer = request.META.get('HTTP_REFERER')
+    if referer and url_has_allowed_host_and_scheme(referer, allowed_hosts={request.get_host()},
+                                                    require_https=request.is_secure()):
+        return redirect(referer)
+    return redirect(request.path)
+
+
+def _error(request, status, message):
+    # Формы сообщают об ошибке как сами представления: сообщением и перенаправлением
+    if _is_api(request):
+        from rest_framework.response import Response
+        return Response({'success': False, 'error': message}, status=status)
+    messages.error(request, message)
+    return _back(request)
+
+
+def _busy(request):
+    """Ответ на повтор, пока первый запрос с тем же ключом еще выполняется"""
+    if _is_api(request):
+        response = _error(request, 409, 'Запрос с этим ключом еще выполняется, повторите позже')
+        response['Retry-After'] = str(RETRY_AFTER)
+        return response
+    messages.info(request, 'Запрос уже обрабатывается. Обновите страницу через несколько секунд.')
+    return _back(request)
+
+
+def _wait(record):
+    """
+    Ждет, пока занятый ключ завершится, не дольше WAIT_TIMEOUT секунд.
+    Возвращает запись (status='done', если дождались) или None, если первый
+    запрос завершился ошибкой и ключ освобожден.
+    """
+    from .models import IdempotencyKey
+
+    deadline = time.monotonic() + WAIT_TIMEOUT
+    delay = 0.05
+    while record is not None and record.status != 'done' and time.monotonic() < deadline:
+        time.sleep(min(delay, max(deadline - time.monotonic(), 0)))
+        delay = min(delay * 2, 0.5)
+        record = IdempotencyKey.objects.filter(pk=record.pk).first()
+    return record
+
+
+def _claim(user_id, scope, key, request_hash):
+    """Занимает ключ: (запись, True) — ключ новый, (запись, False) — уже занят"""
+    from .models import IdempotencyKey
+
+    now = timezone.now()
+    try:
+        with transaction.atomic():
+            return IdempotencyKey.objects.create(
+                user_id=user_id, scope=scope, key=key, request_hash=request_hash,
+                created_at=now, expires_at=now + timedelta(seconds=TTL),
+            ), True
+    except IntegrityError:
+        return IdempotencyKey.objects.filter(user_id=user_id, scope=scope, key=key).first(), False
+
+
+def _abandoned(record):
+    now = timezone.now()
+    return record.expires_at <= now or (
+        record.status == 'pending' and record.created_at <= now - timedelta(seconds=STALE_AFTER)
+    )
+
+
+def _store(record, response):
+    from .models import IdempotencyKey
+
+    # Ответ DRF еще не отрисован: сохраняются данные, рендерер выберется при повторе
+    is_api = hasattr(response, 'data')
+    if is_api:
+        body, content_type = json.dumps(response.data, cls=DjangoJSONEncoder), ''
+    else:
+        body, content_type = response.content.decode(response.charset or 'utf-8'), response.get('Content-Type', '')
+    IdempotencyKey.objects.filter(pk=record.pk).update(
+        status='done',
+        response_status=response.status_code,
+        response_body=body,
+        response_content_type=content_type,
+        response_location=response.get('Location', ''),
+        is_api=is_api,
+    )
+
+
+def _replay(request, record):
+    if record.is_api:
+        from rest_framework.response import Response
+        response = Response(json.loads(record.response_body), status=record.response_status)
+    else:
+        response = HttpResponse(record.response_body, status=record.response_status,
+                                content_type=record.response_content_type or None)
+        if record.response_location:
+            response['Location'] = record.response_location
+            messages.info(request, 'Этот запрос уже был выполнен, повторно он не обрабатывался.')
+    response[REPLAY_HEADER] = 'true'
+    return response
+
+
+def _successful(request, response):
+    if response.status_code >= 400 or getattr(response, 'streaming', False):
+        return False
+    if 300 <= response.status_code < 400:
+        return getattr(request, '_idempotent_succeeded', False)
+    return True
+
+
+def _execute(record, view, request, args, kwargs):
+    try:
+        response = view(request, *args, **kwargs)
+    except BaseException:
+        record.delete()
+        raise
+    if _successful(request, response):
+        _store(record, response)
+    else:
+        record.delete()
+    return response
+
+
+def idempotent(scope):
+    """
+    Декоратор представления (для методов APIView — через method_decorator):
+    POST-запросы с ключом идемпотентности выполняются не более одного раза.
+    Запросы без ключа обрабатываются как обычно.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            if request.method != 'POST':
+                return view(request, *args, **kwargs)
+            key = request_key(request)
+            if key is None:
+                return view(request, *args, **kwargs)
+            if len(key) > MAX_KEY_LENGTH:
+                return _error(request, 400, 'Слишком длинный ключ идемпотентности')
+
+            user_id = request.user.pk if request.user.is_authenticated else None
+            request_hash = fingerprint(request)
+            waited = False
+            for _ in range(CLAIM_ATTEMPTS):
+                record, created = _claim(user_id, scope, key, request_hash)
+                if created:
+                    return _execute(record, view, request, args, kwargs)
+                if record is None:
+                    continue
+                if _abandoned(record):
+                    # Удаляется именно эта запись: параллельный запрос мог уже занять ключ заново
+                    record.__class__.objects.filter(pk=record.pk, status=record.status).delete()
+                    continue
+                if record.request_hash != request_hash:
+                    return _error(request, 422, 'Ключ идемпотентности уже использован для другого запроса')
+                if record.status != 'done' and not waited and not _is_api(request):
+                    # Двойная отправка формы: ждем первый запрос, а не отвечаем ошибкой
+                    waited = True
+                    record = _wait(record)
+                    if record is None:
+                        continue
+                if record.status == 'done':
+                    return _replay(request, record)
+                break
+            return _busy(request)
+        return wrapper
+    return decorator
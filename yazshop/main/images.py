@@ -0,0 +1,286 @@
+"""
+Производные изображения товаров (миниатюры WebP для srcset).
+
+Каждое изображение товара (main_image_url, image_url_1..4) скачивается один раз,
+уменьшается Pillow до ширин IMAGE_WIDTHS и сохраняется в MEDIA_ROOT как
+products/<hh>/<хэш>-<ширина>.webp. Имя файла строится по хэшу содержимого,
+поэтому одинаковые картинки разных товаров хранятся один раз, повторная
+обработка ничего не пересоздает, а файлы можно кэшировать навсегда.
+
+Исходные изображения читаются из MEDIA/STATIC или скачиваются только с хостов
+из PRODUCT_IMAGE_SOURCE_HOSTS, чей адрес публичный: адреса товаров задают
+менеджеры, и без этого сервер запрашивал бы внутренние адреса сети (SSRF).
+
+Результат хранится в ProductImage (ширина -> путь). Обработка запускается в
+фоновом потоке после сохранения товара (enqueue) и командой
+build_product_images для заполнения уже существующих товаров.
+"""
+import hashlib
+import io
+import ipaddress
+import logging
+import os
+import socket
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+
+from django.conf import settings
+from django.db import close_old_connections
+from django.http.request import validate_host
+
+logger = logging.getLogger(__name__)
+
+# Поля товара с адресами изображений
+IMAGE_SLOTS = ('main_image_url', 'image_url_1', 'image_url_2', 'image_url_3', 'image_url_4')
+
+IMAGE_WIDTHS = tuple(getattr(settings, 'PRODUCT_IMAGE_WIDTHS', (160, 320, 640, 960)))
+# Ширина миниатюры для src (браузеры без srcset)
+THUMBNAIL_WIDTH = getattr(settings, 'PRODUCT_IMAGE_THUMBNAIL_WIDTH', 320)
+WEBP_QUALITY = getattr(settings, 'PRODUCT_IMAGE_QUALITY', 80)
+# Обрабатывать изображения в фоне после сохранения товара
+BACKGROUND = getattr(settings, 'PRODUCT_IMAGE_BACKGROUND', True)
+
+# Хосты, с которых можно скачивать исходные изображения, в формате ALLOWED_HOSTS
+# ('cdn.example.com', '.example.com'). Пустой список — только файлы из MEDIA/STATIC
+SOURCE_HOSTS = list(getattr(settings, 'PRODUCT_IMAGE_SOURCE_HOSTS', []))
+
+MAX_SOURCE_BYTES = 20 * 1024 * 1024
+DOWNLOAD_TIMEOUT = 10
+
+_executor = None
+
+
+class ImageError(Exception):
+    """Исходное изображение недоступно или не читается"""
+
+
+# ----- Адреса для шаблонов и API -----
+
+def variant_urls(variants):
+    """{ширина: путь} -> {ширина: URL} по возрастанию ширины"""
+    return {
+        width: f'{settings.MEDIA_URL}{path}'
+        for width, path in sorted((variants or {}).items(), key=lambda item: int(item[0]))
+    }
+
+
+def srcset(variants):
+    """Значение атрибута srcset: 'url 160w, url 320w, ...'"""
+    return ', '.join(f'{url} {width}w' for width, url in variant_urls(variants).items())
+
+
+def thumbnail_url(variants):
+    """Наименьшая производная не уже THUMBNAIL_WIDTH (или самая широкая из имеющихся)"""
+    urls = variant_urls(variants)
+    if not urls:
+        return None
+    for width, url in urls.items():
+        if int(width) >= THUMBNAIL_WIDTH:
+            return url
+    return list(urls.values())[-1]
+
+
+def describe(variants):
+    """Представление изображения для API"""
+    return {
+        'srcset': srcset(variants),
+        'thumbnail': thumbnail_url(variants),
+        'urls': variant_urls(variants),
+    }
+
+
+# ----- Построение производных -----
+
+def _check_remote(url):
+    """
+    Проверяет, что адрес можно скачать: http(s), разрешенный хост и только публичные IP.
+    Возвращает проверенный IP: соединяться нужно с ним, а не разрешать имя заново,
+    иначе DNS между проверкой и загрузкой может вернуть внутренний адрес.
+    """
+    parts = urlsplit(url)
+    if parts.scheme not in ('http', 'https') or not parts.hostname:
+        raise ImageError('Недопустимый адрес изображения')
+    if not validate_host(parts.hostname, SOURCE_HOSTS):
+        raise ImageError(f'Хост {parts.hostname} не разрешен (PRODUCT_IMAGE_SOURCE_HOSTS)')
+    try:
+        addresses = socket.getaddrinfo(parts.hostname, parts.port or parts.scheme, proto=socket.IPPROTO_TCP)
+    except (OSError, ValueError) as e:
+        raise ImageError(str(e)) from e
+    checked = []
+    for *_, sockaddr in addresses:
+        address = ipaddress.ip_address(sockaddr[0].split('%')[0])
+        if not address.is_global or address.is_multicast:
+            raise ImageError(f'Хост {parts.hostname} указывает на внутренний адрес {address}')
+        checked.append(address)
+    if not checked:
+        raise ImageError(f'Хост {parts.hostname} не разрешается')
+    return checked[0]
+
+
+def _pinned_pool(url, address):
+    """
+    Пул соединений с проверенным адресом address. Имя хоста из url уходит
+    в SNI и проверку сертификата, заголовок Host передается в запросе.
+    """
+    import urllib3
+
+    parts = urlsplit(url)
+    timeout = urllib3.Timeout(connect=DOWNLOAD_TIMEOUT, read=DOWNLOAD_TIMEOUT)
+    if parts.scheme == 'https':
+        import certifi
+
+        return urllib3.HTTPSConnectionPool(
+            str(address), parts.port or 443, timeout=timeout, retries=False,
+            server_hostname=parts.hostname, assert_hostname=parts.hostname,
+            cert_reqs='CERT_REQUIRED', ca_certs=certifi.where(),
+        )
+    return urllib3.HTTPConnectionPool(str(address), parts.port or 80, timeout=timeout, retries=False)
+
+
+def _read_source(url):
+    """Байты исходного изображения: локальный файл из MEDIA/STATIC или загрузка с разрешенного хоста"""
+    for prefix, root in ((settings.MEDIA_URL, settings.MEDIA_ROOT), (settings.STATIC_URL, settings.STATIC_ROOT)):
+        if prefix and url.startswith(prefix):
+            path = os.path.normpath(os.path.join(root, url[len(prefix):]))
+            if not path.startswith(os.path.normpath(str(root)) + os.sep):
+                raise ImageError('Недопустимый путь к изображению')
+            try:
+                with open(path, 'rb') as f:
+                    return f.read(MAX_SOURCE_BYTES + 1)
+            except OSError as e:
+                raise ImageError(str(e)) from e
+
+    import urllib3
+
+    address = _check_remote(url)
+    parts = urlsplit(url)
+    target = (parts.path or '/') + (f'?{parts.query}' if parts.query else '')
+    pool = _pinned_pool(url, address)
+    try:
+        # Без перенаправлений: адрес перенаправления не проверен
+        response = pool.urlopen(
+            'GET', target, headers={'Host': parts.netloc.rpartition('@')[2]},
+            redirect=False, retries=False, preload_content=False,
+        )
+        try:
+            if response.get_redirect_location():
+                raise ImageError('Изображение перенаправлено на другой адрес')
+            if response.status >= 400:
+                raise ImageError(f'HTTP {response.status} для {url}')
+            data = b''
+            for chunk in response.stream(64 * 1024):
+                data += chunk
+                if len(data) > MAX_SOURCE_BYTES:
+                    raise ImageError('Изображение слишком большое')
+            return data
+        finally:
+            response.release_conn()
+    except urllib3.exceptions.HTTPError as e:
+        raise ImageError(str(e)) from e
+    finally:
+        pool.close()
+
+
+def build_variants(data):
+    """
+    Создает WebP-производные для байтов изображения.
+    Возвращает (хэш содержимого, ширина, высота, {ширина: путь относительно MEDIA_ROOT}).
+    """
+    from PIL import Image, ImageOps, UnidentifiedImageError
+
+    if len(data) > MAX_SOURCE_BYTES:
+        raise ImageError('Изображение слишком большое')
+    content_hash = hashlib.sha256(data).hexdigest()[:32]
+    try:
+        image = Image.open(io.BytesIO(data))
+        image = ImageOps.exif_transpose(image)
+    except (UnidentifiedImageError, OSError, Image.DecompressionBombError) as e:
+        raise ImageError(str(e)) from e
+    if image.mode not in ('RGB', 'RGBA'):
+        image = image.convert('RGBA' if 'A' in image.getbands() or 'transparency' in image.info else 'RGB')
+    width, height = image.size
+
+    # Не увеличиваем: ширины больше исходной заменяются одной производной исходного размера
+    widths = [w for w in IMAGE_WIDTHS if w < width] or []
+    widths.append(min(width, max(IMAGE_WIDTHS)))
+    widths = sorted(set(widths))
+
+    directory = os.path.join('products', content_hash[:2])
+    os.makedirs(os.path.join(settings.MEDIA_ROOT, directory), exist_ok=True)
+    variants = {}
+    for target in widths:
+        relative = f'{directory}/{content_hash}-{target}.webp'
+        path = os.path.join(settings.MEDIA_ROOT, relative)
+        if not os.path.exists(path):
+            resized = image if target == width else image.resize(
+                (target, max(1, round(height * target / width))), Image.LANCZOS
+            )
+            tmp_path = f'{path}.{os.getpid()}.tmp'
+            resized.save(tmp_path, 'WEBP', quality=WEBP_QUALITY, method=4)
+            os.replace(tmp_path, path)
+        variants[str(target)] = relative
+    return content_hash, width, height, variants
+
+
+def _files_exist(variants):
+    return all(os.path.exists(os.path.join(settings.MEDIA_ROOT, path)) for path in variants.values())
+
+
+def process_product(product_id, force=False):
+    """
+    Приводит производные изображений товара в соответствие с его полями.
+    Возвращает количество обработанных изображений.
+    """
+    from .models import Product, ProductImage
+
+    product = Product.objects.filter(pk=product_id).values(*IMAGE_SLOTS).first()
+    if product is None:
+        return 0
+    existing = {image.slot: image for image in ProductImage.objects.filter(product_id=product_id)}
+
+    processed = 0
+    for slot in IMAGE_SLOTS:
+        url = product[slot]
+        image = existing.get(slot)
+        if not url:
+            if image is not None:
+                image.delete()
+            continue
+        if image is not None and image.source_url == url and not force and _files_exist(image.variants):
+            continue
+        try:
+            content_hash, width, height, variants = build_variants(_read_source(url))
+        except ImageError as e:
+            logger.warning('Не удалось обработать изображение %s товара #%s: %s', url, product_id, e)
+            continue
+        ProductImage.objects.update_or_create(
+            product_id=product_id, slot=slot,
+            defaults={
+                'source_url': url,
+                'content_hash': content_hash,
+                'width': width,
+                'height': height,
+                'variants': variants,
+            },
+        )
+        processed += 1
+    return processed
+
+
+def _run(product_id):
+    try:
+        process_product(product_id)
+    except Exception:
+        logger.exception('Ошибка обработки изображений товара #%s', product_id)
+    finally:
+        close_old_connections()
+
+
+def enqueue(product_id):
+    """Ставит обработку изображений товара в фоновый поток процесса"""
+    global _executor
+    if not BACKGROUND:
+        return
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='product-images')
+    _executor.submit(_run, product_id)
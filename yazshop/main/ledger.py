@@ -0,0 +1,269 @@
+"""
+Счет организации как журнал операций.
+
+Раньше каждый оплаченный заказ читал и перезаписывал единственную строку
+OrganizationAccount (pk=1), и она становилась точкой сериализации всех
+заказов. Теперь:
+
+- поступление от заказа (credit_order) — только вставка строки
+  OrganizationTransaction с приращениями balance_delta/tax_reserve_delta и
+  rolled_up=False; строка счета не читается и не блокируется;
+- строка OrganizationAccount хранит свертку — сумму всех операций с
+  rolled_up=True. Свертку выполняет каждое списание перед проверкой остатка,
+  поступление после коммита, если ожидающих операций накопилось не меньше
+  ROLLUP_THRESHOLD, и команда rollup_org_ledger (по расписанию, чтобы
+  остатки «до/после» появлялись и при редких заказах);
+- текущий баланс (balances) — свертка плюс сумма еще не свернутых операций.
+  Их выбирает частичный индекс org_transaction_pending_idx, а их число
+  ограничено ROLLUP_THRESHOLD, поэтому чтение в админке не зависит от длины
+  истории;
+- списания (вывод средств, оплата налога, возвраты по отмене заказов)
+  блокируют строку счета, сворачивают ожидающие операции и проверяют
+  остаток уже по точному значению. Поступления только увеличивают баланс,
+  поэтому параллельные заказы не могут сделать его отрицательным, и
+  ограничения и триггеры на строке счета (миграции 0014, 0015) продолжают
+  действовать.
+
+Свертка помечает ровно те строки, которые прочитала, а не «все до id N»,
+поэтому операция, зафиксированная позже строк с большим id, не теряется,
+а попадает в следующую свертку. Остатки «до/после» у операций заказов
+заполняются при свертке.
+"""
+import logging
+from collections import namedtuple
+from decimal import Decimal
+
+from django.conf import settings
+from django.db import connection, transaction, DatabaseError
+from django.db.models import Sum
+
+logger = logging.getLogger(__name__)
+
+ACCOUNT_ID = 1
+
+# Число несвернутых операций, после которого поступление сворачивает журнал
+ROLLUP_THRESHOLD = getattr(settings, 'ORG_LEDGER_ROLLUP_THRESHOLD', 200)
+
+ZERO = Decimal('0.00')
+
+Balances = namedtuple('Balances', ['balance', 'tax_reserve'])
+
+_account_ready = False
+
+
+class InsufficientFunds(ValueError):
+    """На счете организации или в резерве на налоги недостаточно средств"""
+
+
+def _ensure_account():
+    """Создает строку счета при первом обращении процесса (дальше — без запросов)"""
+    global _account_ready
+    if not _account_ready:
+        from .models import OrganizationAccount
+        OrganizationAccount.get_account()
+        _account_ready = True
+    return ACCOUNT_ID
+
+
+def _locked_account():
+    from .models import OrganizationAccount
+    account, _ = OrganizationAccount.objects.select_for_update().get_or_create(pk=ACCOUNT_ID)
+    return account
+
+
+def _fold(account):
+    """Сворачивает ожидающие операции в заблокированную строку account"""
+    from .models import OrganizationTransaction
+
+    pending = list(
+        OrganizationTransaction.objects.filter(rolled_up=False).order_by('id')
+        .only('id', 'balance_delta', 'tax_reserve_delta')
+    )
+    if not pending:
+        return 0
+
+    balance, tax_reserve = account.balance, account.tax_reserve
+    for row in pending:
+        row.balance_before, row.tax_reserve_before = balance, tax_reserve
+        balance += row.balance_delta
+        tax_reserve += row.tax_reserve_delta
+        row.balance_after, row.tax_reserve_after = balance, tax_reserve
+        row.rolled_up = True
+    OrganizationTransaction.objects.bulk_update(
+        pending,
+        ['balance_before', 'balance_after', 'tax_reserve_before', 'tax_reserve_after', 'rolled_up'],
+        batch_size=500,
+    )
+    account.balance, account.tax_reserve = balance, tax_reserve
+    account.save(update_fields=['balance', 'tax_reserve', 'updated_at'])
+    return len(pending)
+
+
+def rollup():
+    """Сворачивает ожидающие операции в строку счета. Возвращает их количество."""
+    with transaction.atomic():
+        return _fold(_locked_account())
+
+
+def _rollup_if_needed():
+    """Сворачивает журнал, если ожидающих операций не меньше ROLLUP_THRESHOLD"""
+    from .models import OrganizationAccount, OrganizationTransaction
+
+    pending = OrganizationTransaction.objects.filter(rolled_up=False).values('id')[:ROLLUP_THRESHOLD].count()
+    if pending < ROLLUP_THRESHOLD:
+        return
+    try:
+        with transaction.atomic():
+            accounts = OrganizationAccount.objects.filter(pk=ACCOUNT_ID)
+            if connection.features.has_select_for_update_skip_locked:
+                # Счет заблокирован списанием или другой сверткой — они свернут журнал сами
+                accounts = accounts.select_for_update(skip_locked=True)
+            else:
+                accounts = accounts.select_for_update()
+            account = accounts.first()
+            if account is not None:
+                _fold(account)
+    except DatabaseError:
+        # Поступление уже зафиксировано; журнал свернет следующее поступление или команда
+        logger.exception('Не удалось свернуть журнал счета организации')
+
+
+def balances():
+    """Текущие баланс и резерв на налоги: свертка плюс ожидающие операции"""
+    from .models import OrganizationAccount, OrganizationTransaction
+
+    account = OrganizationAccount.get_account()
+    pending = OrganizationTransaction.objects.filter(rolled_up=False).aggregate(
+        balance=Sum('balance_delta'),
+        tax_reserve=Sum('tax_reserve_delta'),
+    )
+    return Balances(
+        account.balance + (pending['balance'] or ZERO),
+        account.tax_reserve + (pending['tax_reserve'] or ZERO),
+    )
+
+
+def credit_order(order, amount, tax_amount, user=None):
+    """Поступление от заказа и резерв налога с него — одна вставка без блокировки счета"""
+    from .models import OrganizationTransaction
+
+    conn = transaction.get_connection()
+    if not (conn.in_atomic_block and any(entry[1] is _rollup_if_needed for entry in conn.run_on_commit)):
+        transaction.on_commit(_rollup_if_needed)
+    return OrganizationTransaction.objects.create(
+        organization_account_id=_ensure_account(),
+        transaction_type='order_payment',
+        amount=amount,
+        balance_delta=amount,
+        tax_reserve_delta=tax_amount,
+        rolled_up=False,
+        description=f'Поступление от заказа #{order.id}',
+        order=order,
+        created_by=user,
+    )
+
+
+def _debit(account, transaction_type, amount, balance_delta, tax_reserve_delta, **fields):
+    """Применяет списание к заблокированной и свернутой строке account"""
+    from .models import OrganizationTransaction
+
+    balance_before, tax_reserve_before = account.balance, account.tax_reserve
+    account.balance += balance_delta
+    account.tax_reserve += tax_reserve_delta
+    account.save(update_fields=['balance', 'tax_reserve', 'updated_at'])
+    return OrganizationTransaction.objects.create(
+        organization_account=account,
+        transaction_type=transaction_type,
+        amount=amount,
+        balance_delta=balance_delta,
+        tax_reserve_delta=tax_reserve_delta,
+        rolled_up=True,
+        balance_before=balance_before,
+        balance_after=account.balance,
+        tax_reserve_before=tax_reserve_before,
+        tax_reserve_after=account.tax_reserve,
+        **fields
+    )
+
+
+def withdraw(amount, user, description):
+    """Вывод средств со счета организации"""
+    with transaction.atomic():
+        account = _locked_account()
+        _fold(account)
+        if not account.can_withdraw(amount):
+            raise InsufficientFunds(f'Недостаточно средств на счете организации. Доступно: {account.balance} ₽, запрошено: {amount} ₽')
+        return _debit(account, 'withdrawal', amount, -amount, ZERO,
+                      description=description, created_by=user)
+
+
+def pay_tax(amount, user):
+    """Оплата налога из резерва (списывается и с баланса)"""
+    with transaction.atomic():
+        account = _locked_account()
+        _fold(account)
+        if not account.can_pay_tax(amount):
+            if account.tax_reserve < amount:
+                raise InsufficientFunds(f'Недостаточно средств в резерве на налоги. Доступно: {account.tax_reserve} ₽, запрошено: {amount} ₽')
+            if account.balance < amount:
+                raise InsufficientFunds(f'Недостаточно средств на счете организации. Доступно: {account.balance} ₽, запрошено: {amount} ₽')
+            raise InsufficientFunds('Недостаточно средств для оплаты налога')
+        return _debit(account, 'tax_payment', amount, -amount, -amount,
+                      description='Оплата налога', created_by=user)
+
+
+def refund_orders(orders, user, description=None):
+    """
+    Возвраты по отмене нескольких оплаченных заказов (cancellation.py): одна
+    блокировка и свертка счета, одно обновление его строки и одна вставка
+    операций. Заказы проверяются по порядку с тем же результатом, что и при
+    отмене по одному. Возвращает (операции, заказы без возврата из-за
+    нехватки средств на счете).
+    """
+    from .models import OrganizationTransaction
+
+    with transaction.atomic():
+        account = _locked_account()
+        _fold(account)
+        rows, rejected = [], []
+        balance, tax_reserve = account.balance, account.tax_reserve
+        for order in orders:
+            if balance < order.total_amount:
+                rejected.append(order)
+                continue
+            tax_amount = min(order.tax_amount or ZERO, tax_reserve)
+            rows.append(OrganizationTransaction(
+                organization_account=account,
+                transaction_type='order_refund',
+                amount=order.total_amount,
+                balance_delta=-order.total_amount,
+                tax_reserve_delta=-tax_amount,
+                rolled_up=True,
+                balance_before=balance,
+                balance_after=balance - order.total_amount,
+                tax_reserve_before=tax_reserve,
+                tax_reserve_after=tax_reserve - tax_amount,
+                description=description or f'Возврат по отмене заказа #{order.id}',
+                order=order,
+                created_by=user,
+            ))
+            balance -= order.total_amount
+            tax_reserve -= tax_amount
+        if rows:
+            # Одновременное уменьшение баланса и резерва триггер check_org_account_tax_payment
+            # (миграция 0015) проверяет как оплату налога, а возврат больше налога с заказа,
+            # поэтому резерв и баланс уменьшаются отдельными UPDATE
+            account.tax_reserve = tax_reserve
+            account.save(update_fields=['tax_reserve', 'updated_at'])
+            account.balance = balance
+            account.save(update_fields=['balance', 'updated_at'])
+            OrganizationTransaction.objects.bulk_create(rows)
+        return rows, rejected
+
+
+def refund_order(order, user, description=None):
+    """Возврат по отмене оплаченного заказа: сумма заказа и зарезервированный с него налог"""
+    rows, rejected = refund_orders([order], user, description)
+    if rejected:
+        raise InsufficientFunds('Недостаточно средств на счете организации для возврата.')
+    return rows[0]
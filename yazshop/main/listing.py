@@ -0,0 +1,192 @@
+"""
+Легкая сериализация товаров для списков.
+
+ProductSerializer создает модель на каждую строку и прогоняет все поля через
+поля DRF. Для списков (каталог, избранное, управление товарами) строки читаются
+через .values() только с нужными колонками и превращаются в словари напрямую;
+размеры, теги и миниатюры (images.py) подгружаются запросом на всю страницу. Каталог берет
+готовые строки из общего снимка (serialize_ids, см. snapshot.py).
+
+Без параметра отдаются все поля товара (DEFAULT_FIELDS, те же, что отдавал
+ProductSerializer, плюс размеры, теги и миниатюры). Параметр
+?fields=id,product_name,price (sparse fieldset) сужает ответ, например до
+LISTING_FIELDS — того, что нужно карточке товара.
+"""
+from collections import defaultdict
+
+from django.utils import timezone
+
+from .images import describe
+
+# Поля карточки товара в списках
+LISTING_FIELDS = (
+    'id', 'product_name', 'main_image_url', 'category', 'category_name',
+    'brand', 'brand_name', 'price', 'discount', 'final_price',
+    'stock_quantity', 'is_available', 'is_new', 'added_at',
+    'avg_rating', 'review_count', 'sizes', 'tags', 'images',
+)
+
+# Остальные поля товара: описание, дополнительные фотографии, поставщик и т.д.
+EXTRA_FIELDS = (
+    'product_description', 'image_url_1', 'image_url_2', 'image_url_3', 'image_url_4',
+    'supplier', 'popularity_score', 'rating_histogram', 'updated_at',
+)
+
+# Поля ответа без ?fields=
+DEFAULT_FIELDS = LISTING_FIELDS + EXTRA_FIELDS
+
+ALLOWED_FIELDS = frozenset(DEFAULT_FIELDS)
+
+# Поле ответа -> колонки .values(), из которых оно строится
+_COLUMNS = {
+    'category': ('category_id',),
+    'category_name': ('category__category_name',),
+    'brand': ('brand_id',),
+    'brand_name': ('brand__brand_name',),
+    'supplier': ('supplier_id',),
+    'is_new': ('added_at',),
+    'rating_histogram': tuple(f'rating_{value}' for value in range(5, 0, -1)),
+    'sizes': (),
+    'tags': (),
+    'images': (),
+}
+
+_DECIMAL_FIELDS = frozenset(('price', 'discount', 'final_price'))
+
+NEW_PRODUCT_DAYS = 30
+
+
+def parse_fields(value):
+    """
+    Разбирает параметр ?fields=. Возвращает кортеж полей или None, если параметр
+    не задан. При неизвестном поле — ValueError.
+    """
+    if not value:
+        return None
+    fields = []
+    for name in value.split(','):
+        name = name.strip()
+        if not name or name in fields:
+            continue
+        if name not in ALLOWED_FIELDS:
+            raise ValueError(f'Неизвестное поле: {name}')
+        fields.append(name)
+    return tuple(fields) or None
+
+
+def listing_values(queryset, fields=None):
+    """Возвращает queryset.values() только с колонками, нужными для fields"""
+    fields = fields or DEFAULT_FIELDS
+    columns = ['id']
+    for name in fields:
+        for column in _COLUMNS.get(name, (name,)):
+            if column not in columns:
+                columns.append(column)
+    return queryset.values(*columns)
+
+
+def _format_datetime(value):
+    # Тот же формат, что у DateTimeField в DRF
+    if value is None:
+        return None
+    if timezone.is_aware(value):
+        value = timezone.localtime(value)
+    value = value.isoformat()
+    if value.endswith('+00:00'):
+        value = value[:-6] + 'Z'
+    return value
+
+
+def _load_sizes(product_ids):
+    from .models import ProductSize
+
+    sizes = defaultdict(list)
+    rows = (ProductSize.objects.filter(product_id__in=product_ids)
+            .values('product_id', 'id', 'size_label', 'size_type', 'size_stock')
+            .order_by('id'))
+    for row in rows:
+        sizes[row.pop('product_id')].append(row)
+    return sizes
+
+
+def _load_tags(product_ids):
+    from .models import ProductTag
+
+    tags = defaultdict(list)
+    rows = (ProductTag.objects.filter(product_id__in=product_ids)
+            .values_list('product_id', 'tag_id', 'tag__tag_name')
+            .order_by('tag__tag_name'))
+    for product_id, tag_id, tag_name in rows:
+        tags[product_id].append({'id': tag_id, 'tag_name': tag_name})
+    return tags
+
+
+def _load_images(product_ids):
+    from .models import ProductImage
+
+    images = defaultdict(dict)
+    rows = ProductImage.objects.filter(product_id__in=product_ids).values_list('product_id', 'slot', 'variants')
+    for product_id, slot, variants in rows:
+        images[product_id][slot] = variants
+    return images
+
+
+def serialize_rows(rows, fields=None):
+    """Превращает строки listing_values() в словари ответа"""
+    fields = fields or DEFAULT_FIELDS
+    rows = list(rows)
+    # Строки из снимка каталога (snapshot.py) уже содержат размеры и теги
+    product_ids = [row['id'] for row in rows if 'sizes' not in row]
+    sizes = _load_sizes(product_ids) if 'sizes' in fields and product_ids else {}
+    tags = _load_tags(product_ids) if 'tags' in fields and product_ids else {}
+    image_ids = [row['id'] for row in rows if 'images' not in row]
+    images = _load_images(image_ids) if 'images' in fields and image_ids else {}
+    new_since = timezone.now() - timezone.timedelta(days=NEW_PRODUCT_DAYS)
+
+    result = []
+    for row in rows:
+        item = {}
+        for name in fields:
+            if name in _DECIMAL_FIELDS:
+                value = row[name]
+                item[name] = str(value) if value is not None else None
+            elif name in ('added_at', 'updated_at'):
+                item[name] = _format_datetime(row[name])
+            elif name == 'is_new':
+                item[name] = bool(row['added_at'] and row['added_at'] >= new_since)
+            elif name == 'sizes':
+                item[name] = row['sizes'] if 'sizes' in row else sizes.get(row['id'], [])
+            elif name == 'tags':
+                item[name] = row['tags'] if 'tags' in row else tags.get(row['id'], [])
+            elif name == 'images':
+                variants = row['images'] if 'images' in row else images.get(row['id'], {})
+                item[name] = {slot: describe(value) for slot, value in variants.items()}
+            elif name == 'rating_histogram':
+                item[name] = {str(value): row[f'rating_{value}'] for value in range(5, 0, -1)}
+            else:
+                columns = _COLUMNS.get(name)
+                item[name] = row[columns[0] if columns else name]
+        result.append(item)
+    return result
+
+
+def serialize_products(queryset, fields=None):
+    """Сериализует товары queryset для списка"""
+    return serialize_rows(listing_values(queryset, fields), fields)
+
+
+def serialize_ids(product_ids, fields=None):
+    """
+    Сериализует товары по списку id в его порядке. Строки берутся из снимка
+    каталога, товары, которых в нем нет, — из БД.
+    """
+    from .models import Product
+    from . import snapshot
+
+    product_ids = list(product_ids)
+    rows = snapshot.get_rows(product_ids)
+    missing = [product_id for product_id in product_ids if product_id not in rows]
+    if missing:
+        for row in listing_values(Product.objects.filter(pk__in=missing), fields):
+            rows[row['id']] = row
+    return serialize_rows([rows[product_id] for product_id in product_ids if product_id in rows], fields)
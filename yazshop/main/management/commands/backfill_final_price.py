@@ -0,0 +1,31 @@
+"""
+Management command для пересчета сохраненной цены со скидкой (final_price)
+Нужен после импорта данных в обход ORM или ручного редактирования БД
+"""
+from django.core.management.base import BaseCommand
+from django.db.models import F
+from main.models import Product
+
+
+class Command(BaseCommand):
+    help = 'Пересчитывает цену со скидкой (final_price) у всех товаров'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=1000,
+            help='Количество товаров, обновляемых одним запросом',
+        )
+
+    def handle(self, *args, **options):
+        batch_size = max(1, options['batch_size'])
+        ids = list(Product.objects.order_by('pk').values_list('pk', flat=True))
+
+        updated = 0
+        for start in range(0, len(ids), batch_size):
+            chunk = ids[start:start + batch_size]
+            # ProductQuerySet.update сам пересчитывает final_price из price и discount
+            updated += Product.objects.filter(pk__in=chunk).update(price=F('price'))
+
+        self.stdout.write(self.style.SUCCESS(f'Пересчитана цена со скидкой у {updated} товаров'))
@@ -0,0 +1,94 @@
+"""
+Management command для замера расчета итогов корзины:
+обход позиций в Python против агрегатного запроса и закэшированных итогов pricing.py
+"""
+import time
+import uuid
+from decimal import Decimal
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from main import pricing
+from main.models import Cart, CartItem, Product
+
+
+class Command(BaseCommand):
+    help = 'Сравнивает время расчета итогов корзины на 1, 20 и 200 позициях'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--sizes',
+            default='1,20,200',
+            help='Количество позиций в корзинах через запятую',
+        )
+        parser.add_argument(
+            '--repeat',
+            type=int,
+            default=50,
+            help='Количество повторов, берется медиана',
+        )
+
+    def _measure(self, func, repeat):
+        timings = []
+        queries = 0
+        for _ in range(repeat):
+            with CaptureQueriesContext(connection) as context:
+                started = time.perf_counter()
+                func()
+                timings.append(time.perf_counter() - started)
+            queries = len(context.captured_queries)
+        timings.sort()
+        return timings[len(timings) // 2], queries
+
+    def handle(self, *args, **options):
+        repeat = max(1, options['repeat'])
+        try:
+            sizes = [max(1, int(size)) for size in options['sizes'].split(',') if size.strip()]
+        except ValueError:
+            raise CommandError('Неверный список размеров корзин')
+
+        products = list(Product.objects.order_by('id').values_list('id', 'final_price')[:max(sizes)])
+        if not products:
+            raise CommandError('В базе нет товаров')
+
+        # Временный пользователь с корзиной удаляется вместе с ней после замера
+        user = User.objects.create(username=f'benchmark-{uuid.uuid4().hex[:12]}', is_active=False)
+        try:
+            cart = Cart.objects.create(user=user)
+            for size in sizes:
+                CartItem.objects.filter(cart=cart).delete()
+                CartItem.objects.bulk_create([
+                    CartItem(cart=cart, product_id=products[i % len(products)][0],
+                             unit_price=products[i % len(products)][1], quantity=1 + i % 3)
+                    for i in range(size)
+                ])
+                pricing.invalidate_cart(cart.pk)
+
+                def walk():
+                    # Как раньше: позиции читаются и суммируются в Python
+                    subtotal = sum((item.subtotal() for item in cart.items.select_related('product', 'size')),
+                                   Decimal('0'))
+                    return pricing.OrderSummary(subtotal)
+
+                def aggregate():
+                    pricing.invalidate_cart(cart.pk)
+                    return pricing.cart_summary(cart)
+
+                def cached():
+                    return pricing.cart_summary(cart)
+
+                walk_time, walk_queries = self._measure(walk, repeat)
+                aggregate_time, aggregate_queries = self._measure(aggregate, repeat)
+                pricing.cart_summary(cart)
+                cached_time, cached_queries = self._measure(cached, repeat)
+
+                self.stdout.write(f'Позиций в корзине: {size}, повторов: {repeat}')
+                self.stdout.write(f'  Обход позиций: {walk_time * 1000:.3f} мс, запросов: {walk_queries}')
+                self.stdout.write(f'  Агрегатный запрос: {aggregate_time * 1000:.3f} мс, запросов: {aggregate_queries}')
+                self.stdout.write(f'  Из кэша: {cached_time * 1000:.3f} мс, запросов: {cached_queries}')
+        finally:
+            user.delete()
+
+        self.stdout.write(self.style.SUCCESS('Замер завершен'))
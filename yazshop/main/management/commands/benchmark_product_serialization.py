@@ -0,0 +1,83 @@
+"""
+Management command для замера времени сериализации списка товаров:
+ProductSerializer (как раньше в списках) против легкого сериализатора listing.py
+"""
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from main.models import Product
+from main.serializers import ProductSerializer
+from main.listing import parse_fields, serialize_products
+
+
+class Command(BaseCommand):
+    help = 'Сравнивает время сериализации страницы товаров ProductSerializer и легким сериализатором'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--size',
+            type=int,
+            default=100,
+            help='Количество товаров на странице',
+        )
+        parser.add_argument(
+            '--repeat',
+            type=int,
+            default=20,
+            help='Количество повторов, берется медиана',
+        )
+        parser.add_argument(
+            '--fields',
+            default='',
+            help='Поля для легкого сериализатора через запятую (как ?fields=)',
+        )
+
+    def _measure(self, func, repeat):
+        timings = []
+        queries = 0
+        for _ in range(repeat):
+            with CaptureQueriesContext(connection) as context:
+                started = time.perf_counter()
+                func()
+                timings.append(time.perf_counter() - started)
+            queries = len(context.captured_queries)
+        timings.sort()
+        return timings[len(timings) // 2], queries
+
+    def handle(self, *args, **options):
+        size = max(1, options['size'])
+        repeat = max(1, options['repeat'])
+        try:
+            fields = parse_fields(options['fields'])
+        except ValueError as e:
+            raise CommandError(str(e))
+
+        ids = list(Product.objects.order_by('-added_at', '-id').values_list('id', flat=True)[:size])
+        if not ids:
+            raise CommandError('В базе нет товаров')
+
+        def before():
+            qs = (Product.objects.select_related('category', 'brand')
+                  .prefetch_related('sizes', 'producttag_set__tag', 'images')
+                  .filter(id__in=ids).order_by('-added_at', '-id'))
+            return ProductSerializer(qs, many=True).data
+
+        def after():
+            qs = Product.objects.filter(id__in=ids).order_by('-added_at', '-id')
+            return serialize_products(qs, fields)
+
+        before_time, before_queries = self._measure(before, repeat)
+        after_time, after_queries = self._measure(after, repeat)
+        per_100 = 100 / len(ids)
+
+        self.stdout.write(f'Товаров на странице: {len(ids)}, повторов: {repeat}')
+        self.stdout.write(
+            f'ProductSerializer: {before_time * per_100 * 1000:.2f} мс на 100 товаров, запросов: {before_queries}'
+        )
+        self.stdout.write(
+            f'Легкий сериализатор: {after_time * per_100 * 1000:.2f} мс на 100 товаров, запросов: {after_queries}'
+        )
+        if after_time:
+            self.stdout.write(self.style.SUCCESS(f'Ускорение: x{before_time / after_time:.1f}'))
@@ -0,0 +1,38 @@
+"""
+Management command для построения WebP-миниатюр изображений товаров
+Обрабатывает все товары (или один) — для заполнения после развертывания и
+после массовых изменений адресов изображений через update()
+"""
+from django.core.management.base import BaseCommand
+from main import images
+from main.models import Product
+
+
+class Command(BaseCommand):
+    help = 'Строит WebP-миниатюры изображений товаров для srcset'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--product',
+            type=int,
+            help='Обработать только товар с этим id',
+        )
+        parser.add_argument(
+            '--force',
+            action='store_true',
+            help='Пересоздать миниатюры, даже если адрес изображения не менялся',
+        )
+
+    def handle(self, *args, **options):
+        product_ids = Product.objects.order_by('id').values_list('id', flat=True)
+        if options['product']:
+            product_ids = product_ids.filter(pk=options['product'])
+
+        total = 0
+        for product_id in product_ids.iterator():
+            processed = images.process_product(product_id, force=options['force'])
+            if processed:
+                total += processed
+                self.stdout.write(f'Товар #{product_id}: обработано изображений {processed}')
+
+        self.stdout.write(self.style.SUCCESS(f'Готово, обработано изображений: {total}'))
@@ -0,0 +1,19 @@
+"""
+Management command для просмотра метрик очереди outbox
+Глубина очереди по темам, число событий с ошибкой и задержка самого старого события
+"""
+from django.core.management.base import BaseCommand
+from main import outbox
+
+
+class Command(BaseCommand):
+    help = 'Показывает глубину и задержку очереди фоновой работы'
+
+    def handle(self, *args, **options):
+        stats = outbox.stats()
+        for topic, depth in sorted(stats['by_topic'].items()):
+            self.stdout.write(f'{topic}: в очереди {depth}')
+        self.stdout.write(self.style.SUCCESS(
+            f'Всего в очереди: {stats["depth"]}, с ошибкой: {stats["failed"]}, '
+            f'задержка: {stats["lag_seconds"]} с'
+        ))
@@ -0,0 +1,39 @@
+"""
+Management command для просмотра статистики кэша страниц анонимных посетителей
+Показывает попадания и промахи по каждой странице, чтобы подобрать размер кэша
+"""
+from django.core.management.base import BaseCommand
+from main import page_cache
+# Страницы регистрируются декоратором cache_anonymous_page при импорте views
+from main import views  # noqa: F401
+
+
+class Command(BaseCommand):
+    help = 'Показывает попадания и промахи кэша страниц для анонимных посетителей'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--reset',
+            action='store_true',
+            help='Обнулить счетчики после вывода',
+        )
+
+    def handle(self, *args, **options):
+        total_hits = total_misses = 0
+        for page, counts in page_cache.get_stats().items():
+            hits, misses = counts['hits'], counts['misses']
+            total_hits += hits
+            total_misses += misses
+            requests = hits + misses
+            ratio = hits / requests * 100 if requests else 0
+            self.stdout.write(f'{page}: попаданий {hits}, промахов {misses}, доля попаданий {ratio:.1f}%')
+
+        requests = total_hits + total_misses
+        ratio = total_hits / requests * 100 if requests else 0
+        self.stdout.write(self.style.SUCCESS(
+            f'Всего: попаданий {total_hits}, промахов {total_misses}, доля попаданий {ratio:.1f}%'
+        ))
+
+        if options['reset']:
+            page_cache.reset_stats()
+            self.stdout.write(self.style.WARNING('Счетчики обнулены'))
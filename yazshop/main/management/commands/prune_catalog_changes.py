@@ -0,0 +1,26 @@
+"""
+Management command для очистки журнала изменений каталога
+Клиенты с токеном старше оставшихся записей получат reset и загрузят каталог заново
+"""
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from main.models import CatalogChange
+
+
+class Command(BaseCommand):
+    help = 'Удаляет записи журнала изменений каталога старше заданного количества дней'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--days',
+            type=int,
+            default=30,
+            help='Сколько дней хранить записи журнала',
+        )
+
+    def handle(self, *args, **options):
+        cutoff = timezone.now() - timezone.timedelta(days=max(1, options['days']))
+        # Последняя запись остается всегда, чтобы токен конца журнала не устаревал
+        last_id = CatalogChange.objects.order_by('-id').values_list('id', flat=True).first()
+        deleted, _ = CatalogChange.objects.filter(changed_at__lt=cutoff).exclude(id=last_id).delete()
+        self.stdout.write(self.style.SUCCESS(f'Удалено записей журнала: {deleted}'))
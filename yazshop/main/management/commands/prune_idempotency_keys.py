@@ -0,0 +1,15 @@
+"""
+Management command для очистки просроченных ключей идемпотентности
+Повтор запроса с удаленным ключом выполняется как новый запрос
+"""
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from main.models import IdempotencyKey
+
+
+class Command(BaseCommand):
+    help = 'Удаляет ключи идемпотентности с истекшим сроком хранения'
+
+    def handle(self, *args, **options):
+        deleted, _ = IdempotencyKey.objects.filter(expires_at__lte=timezone.now()).delete()
+        self.stdout.write(self.style.SUCCESS(f'Удалено ключей: {deleted}'))
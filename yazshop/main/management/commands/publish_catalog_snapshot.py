@@ -0,0 +1,29 @@
+"""
+Management command для публикации снимка каталога, общего для воркеров gunicorn
+Запускается при деплое, после изменений каталога в обход Django (ручные правки БД)
+и по расписанию, если фоновая публикация отключена (CATALOG_SNAPSHOT_BACKGROUND = False)
+"""
+import time
+
+from django.core.management.base import BaseCommand
+from main import snapshot
+
+
+class Command(BaseCommand):
+    help = 'Публикует снимок доступных товаров, размеров, тегов и справочников фасетов в общий файл'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--path',
+            default=None,
+            help='Путь к файлу снимка (по умолчанию CATALOG_SNAPSHOT_PATH)',
+        )
+
+    def handle(self, *args, **options):
+        path = options['path'] or snapshot.SNAPSHOT_PATH
+        started = time.perf_counter()
+        count = snapshot.publish(path)
+        elapsed = time.perf_counter() - started
+        self.stdout.write(self.style.SUCCESS(
+            f'Снимок каталога опубликован: {path}, товаров: {count}, {elapsed * 1000:.0f} мс'
+        ))
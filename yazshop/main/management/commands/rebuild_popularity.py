@@ -0,0 +1,37 @@
+"""
+Management command для полного пересчета популярности товаров по истории заказов
+"""
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from main.models import Product
+from main.popularity import compute_scores
+
+
+class Command(BaseCommand):
+    help = 'Пересчитывает популярность товаров (продажи с затуханием) по истории заказов'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=500,
+            help='Количество товаров в одном пакетном обновлении',
+        )
+
+    def handle(self, *args, **options):
+        batch_size = max(1, options['batch_size'])
+
+        with transaction.atomic():
+            scores = compute_scores()
+            Product.objects.exclude(popularity_score=0).update(popularity_score=0)
+
+            batch = []
+            for product_id, score in scores.items():
+                batch.append(Product(pk=product_id, popularity_score=score))
+                if len(batch) >= batch_size:
+                    Product.objects.bulk_update(batch, ['popularity_score'])
+                    batch = []
+            if batch:
+                Product.objects.bulk_update(batch, ['popularity_score'])
+
+        self.stdout.write(self.style.SUCCESS(f'Популярность пересчитана для {len(scores)} товаров'))
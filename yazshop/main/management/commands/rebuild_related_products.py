@@ -0,0 +1,22 @@
+"""
+Management command для построения таблицы товаров, которые покупают вместе
+Пересчитывает совместные покупки по всей истории заказов (см. main/related.py)
+"""
+from django.core.management.base import BaseCommand
+from main import related
+
+
+class Command(BaseCommand):
+    help = 'Перестраивает товары, которые покупают вместе, по истории заказов'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=2000,
+            help='Количество строк в одной пакетной вставке',
+        )
+
+    def handle(self, *args, **options):
+        count = related.rebuild(batch_size=max(1, options['batch_size']))
+        self.stdout.write(self.style.SUCCESS(f'Совместные покупки пересчитаны для {count} товаров'))
@@ -0,0 +1,20 @@
+"""
+Management command для полного перестроения поискового индекса товаров
+"""
+from django.core.management.base import BaseCommand
+from main import search
+
+
+class Command(BaseCommand):
+    help = 'Перестраивает полнотекстовый индекс товаров каталога'
+
+    def handle(self, *args, **options):
+        search.reset_index_state()
+        if not search.index_available():
+            self.stdout.write(self.style.ERROR(
+                'Таблица поискового индекса не найдена. Выполните migrate.'
+            ))
+            return
+
+        count = search.rebuild_index()
+        self.stdout.write(self.style.SUCCESS(f'Проиндексировано товаров: {count}'))
@@ -0,0 +1,47 @@
+"""
+Management command для сверки сводки отзывов товаров с таблицей отзывов
+Исправляет расхождения после ручных правок БД или сбоев
+"""
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from main.models import Product
+from main.ratings import compute_summaries, RATING_VALUES
+
+
+class Command(BaseCommand):
+    help = 'Пересчитывает средний рейтинг, количество отзывов и гистограмму оценок товаров'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Только показать расхождения, не исправляя их',
+        )
+
+    def handle(self, *args, **options):
+        dry_run = options['dry_run']
+        fields = ['review_count', 'rating_sum', 'avg_rating'] + [f'rating_{value}' for value in RATING_VALUES]
+        empty = {field: 0 for field in fields}
+        empty['avg_rating'] = 0.0
+
+        fixed = 0
+        with transaction.atomic():
+            summaries = compute_summaries()
+            for product in Product.objects.only('id', *fields).select_for_update().iterator(chunk_size=500):
+                expected = summaries.get(product.pk, empty)
+                mismatched = [
+                    field for field in fields
+                    if (abs(getattr(product, field) - expected[field]) > 1e-9 if field == 'avg_rating'
+                        else getattr(product, field) != expected[field])
+                ]
+                if not mismatched:
+                    continue
+                fixed += 1
+                self.stdout.write(f'Товар #{product.pk}: расхождение в полях {", ".join(mismatched)}')
+                if not dry_run:
+                    Product.objects.filter(pk=product.pk).update(**expected)
+
+        if dry_run:
+            self.stdout.write(self.style.WARNING(f'Найдено товаров с расхождениями: {fixed}'))
+        else:
+            self.stdout.write(self.style.SUCCESS(f'Исправлено товаров: {fixed}'))
@@ -0,0 +1,20 @@
+"""
+Management command для свертки журнала счета организации
+Поступления от заказов переносятся в строку счета и получают остатки до/после.
+Поступления сами сворачивают журнал, когда в нем накапливается
+ORG_LEDGER_ROLLUP_THRESHOLD операций; команду запускать по расписанию
+(например, раз в час), чтобы остатки до/после появлялись и при редких заказах
+"""
+from django.core.management.base import BaseCommand
+from main import ledger
+
+
+class Command(BaseCommand):
+    help = 'Сворачивает новые операции счета организации в баланс и резерв на налоги'
+
+    def handle(self, *args, **options):
+        folded = ledger.rollup()
+        balances = ledger.balances()
+        self.stdout.write(self.style.SUCCESS(
+            f'Свернуто операций: {folded}. Баланс: {balances.balance} ₽, резерв на налоги: {balances.tax_reserve} ₽'
+        ))
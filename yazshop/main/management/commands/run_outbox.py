@@ -0,0 +1,55 @@
+"""
+Management command воркера очереди outbox
+Обрабатывает чеки, поступления на счет организации и записи журнала после оформления заказов;
+запускается постоянным процессом рядом с gunicorn или периодически с --once
+"""
+import time
+
+from django.core.management.base import BaseCommand
+from main import outbox
+# Обработчики событий регистрируются при импорте модулей
+from main import placement  # noqa: F401
+
+
+class Command(BaseCommand):
+    help = 'Разбирает очередь фоновой работы (outbox)'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--once',
+            action='store_true',
+            help='Обработать готовые события и завершиться',
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=100,
+            help='Сколько событий брать за один проход',
+        )
+        parser.add_argument(
+            '--sleep',
+            type=float,
+            default=1.0,
+            help='Пауза в секундах, когда очередь пуста',
+        )
+
+    def handle(self, *args, **options):
+        batch_size = max(1, options['batch_size'])
+        processed = 0
+        try:
+            while True:
+                done = outbox.drain(batch_size)
+                processed += done
+                if options['once'] and done < batch_size:
+                    break
+                if not done:
+                    # Очередь пуста: заодно удаляются старые выполненные события
+                    outbox.prune()
+                    time.sleep(options['sleep'])
+        except KeyboardInterrupt:
+            pass
+
+        stats = outbox.stats()
+        self.stdout.write(self.style.SUCCESS(
+            f'Обработано событий: {processed}. В очереди: {stats["depth"]}, с ошибкой: {stats["failed"]}'
+        ))
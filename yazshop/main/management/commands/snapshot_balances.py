@@ -0,0 +1,60 @@
+"""
+Management command для месячных снимков остатков баланса и карт
+По снимкам выписка находит остаток на начало периода, суммируя не больше
+месяца операций (statements.py). Запускать в начале каждого месяца;
+при первом запуске — с --backfill, чтобы создать снимки за всю историю
+"""
+from datetime import datetime, timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Min
+from django.utils import timezone
+from main import statements
+from main.models import BalanceTransaction, CardTransaction
+
+
+class Command(BaseCommand):
+    help = 'Создает снимки остатков баланса и карт на начало месяца'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--month',
+            help='Месяц YYYY-MM: снимок на его первое число (по умолчанию — текущий месяц)',
+        )
+        parser.add_argument(
+            '--backfill',
+            action='store_true',
+            help='Создать недостающие снимки на начало каждого месяца с первой операции',
+        )
+
+    def handle(self, *args, **options):
+        if options['month']:
+            try:
+                month = datetime.strptime(options['month'], '%Y-%m')
+            except ValueError:
+                raise CommandError('Месяц указывается в формате YYYY-MM')
+            boundary = timezone.make_aware(month)
+        else:
+            boundary = statements.month_start(timezone.now())
+        if boundary > timezone.now():
+            raise CommandError('Снимок на начало месяца создается после того, как месяц начался')
+
+        boundaries = [boundary]
+        if options['backfill']:
+            first = min(filter(None, [
+                BalanceTransaction.objects.aggregate(first=Min('created_at'))['first'],
+                CardTransaction.objects.aggregate(first=Min('created_at'))['first'],
+            ]), default=None)
+            if first is not None:
+                # Снимки создаются по порядку: каждый считается от предыдущего
+                boundaries = []
+                current = statements.month_start(statements.month_start(first) + timedelta(days=32))
+                while current < boundary:
+                    boundaries.append(current)
+                    current = statements.month_start(current + timedelta(days=32))
+                boundaries.append(boundary)
+
+        for current in boundaries:
+            accounts = statements.take_snapshots(current)
+            self.stdout.write(f'{timezone.localtime(current):%Y-%m}: счетов {accounts}')
+        self.stdout.write(self.style.SUCCESS(f'Снимков на начало месяца: {len(boundaries)}'))
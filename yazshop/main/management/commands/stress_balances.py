@@ -0,0 +1,170 @@
+"""
+Management command для нагрузочной проверки операций с балансом (wallet.py):
+параллельные пополнения, выводы и списания по одному пользователю и одной карте
+без потерянных изменений и ухода баланса в минус
+"""
+import random
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import OperationalError, close_old_connections, transaction
+from main import wallet
+from main.models import BalanceTransaction, CardTransaction, SavedPaymentMethod, UserProfile
+
+
+class Command(BaseCommand):
+    help = 'Параллельно меняет баланс временного пользователя и проверяет, что ни одно изменение не потеряно'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--threads',
+            type=int,
+            default=16,
+            help='Количество параллельных потоков',
+        )
+        parser.add_argument(
+            '--operations',
+            type=int,
+            default=2000,
+            help='Общее количество операций',
+        )
+        parser.add_argument(
+            '--initial',
+            default='1000.00',
+            help='Начальный баланс пользователя и карты',
+        )
+        parser.add_argument(
+            '--naive',
+            action='store_true',
+            help='Для сравнения: прежняя схема «прочитать, изменить в Python, сохранить»',
+        )
+
+    def _naive(self, user, card, operation, amount):
+        # Как раньше: select_for_update (на SQLite ничего не блокирует) и сохранение строки
+        with transaction.atomic():
+            profile = UserProfile.objects.select_for_update().get(user=user)
+            card = SavedPaymentMethod.objects.select_for_update().get(pk=card.pk)
+            if operation == 'card_to_balance':
+                if card.balance < amount:
+                    raise wallet.InsufficientBalance('card', card.balance)
+                time.sleep(0.001)
+                card.balance -= amount
+                profile.balance += amount
+            else:
+                if profile.balance < amount:
+                    raise wallet.InsufficientBalance('balance', profile.balance)
+                time.sleep(0.001)
+                profile.balance -= amount
+                if operation == 'balance_to_card':
+                    card.balance += amount
+            card.save(update_fields=['balance'])
+            profile.save(update_fields=['balance'])
+
+    def _atomic(self, user, card, operation, amount):
+        if operation == 'card_to_balance':
+            wallet.card_to_balance(user, card, amount, 'Нагрузочная проверка', 'Нагрузочная проверка')
+        elif operation == 'balance_to_card':
+            wallet.balance_to_card(user, card, amount, 'Нагрузочная проверка', 'Нагрузочная проверка')
+        else:
+            wallet.debit(user, amount, 'withdrawal', 'Нагрузочная проверка')
+
+    def handle(self, *args, **options):
+        threads = max(1, options['threads'])
+        operations = max(1, options['operations'])
+        try:
+            initial = Decimal(options['initial'])
+        except Exception:
+            raise CommandError('Неверный начальный баланс')
+        run = self._naive if options['naive'] else self._atomic
+
+        # Временный пользователь с профилем и картой удаляется после проверки
+        user = User.objects.create(username=f'stress-{uuid.uuid4().hex[:12]}', is_active=False)
+        try:
+            UserProfile.objects.update_or_create(user=user, defaults={'balance': initial})
+            card = SavedPaymentMethod.objects.create(
+                user=user, card_number='0000', card_holder_name='STRESS TEST',
+                expiry_month='12', expiry_year='2099', balance=initial,
+            )
+
+            rng = random.Random(0)
+            plan = [
+                (rng.choice(['card_to_balance', 'balance_to_card', 'debit']), Decimal(rng.randint(1, 5000)) / 100)
+                for _ in range(operations)
+            ]
+            lock = threading.Lock()
+            stats = {'done': 0, 'rejected': 0, 'errors': 0}
+            expected = {'profile': initial, 'card': initial}
+
+            def execute(step):
+                operation, amount = step
+                try:
+                    run(user, card, operation, amount)
+                except wallet.InsufficientBalance:
+                    outcome = 'rejected'
+                except OperationalError:
+                    # Например, «database is locked» на SQLite: транзакция откатана целиком
+                    outcome = 'errors'
+                else:
+                    outcome = 'done'
+                finally:
+                    close_old_connections()
+                with lock:
+                    stats[outcome] += 1
+                    if outcome == 'done':
+                        if operation == 'card_to_balance':
+                            expected['card'] -= amount
+                            expected['profile'] += amount
+                        else:
+                            expected['profile'] -= amount
+                            if operation == 'balance_to_card':
+                                expected['card'] += amount
+
+            started = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=threads) as executor:
+                list(executor.map(execute, plan))
+            elapsed = time.perf_counter() - started
+
+            profile_balance = UserProfile.objects.get(user=user).balance
+            card_balance = SavedPaymentMethod.objects.get(pk=card.pk).balance
+
+            self.stdout.write(f'Потоков: {threads}, операций: {operations}, время: {elapsed:.2f} с')
+            self.stdout.write(f"  Выполнено: {stats['done']}, отклонено (не хватает средств): {stats['rejected']}, "
+                              f"ошибок базы: {stats['errors']}")
+            self.stdout.write(f"  Баланс: {profile_balance} ₽ (ожидается {expected['profile']} ₽)")
+            self.stdout.write(f"  Карта: {card_balance} ₽ (ожидается {expected['card']} ₽)")
+
+            problems = []
+            if profile_balance != expected['profile']:
+                problems.append('баланс пользователя не совпадает с суммой выполненных операций')
+            if card_balance != expected['card']:
+                problems.append('баланс карты не совпадает с суммой выполненных операций')
+            if profile_balance < 0 or card_balance < 0:
+                problems.append('баланс ушел в минус')
+
+            if not options['naive']:
+                # Остатки «до/после» операций должны складываться в непрерывную цепочку
+                previous = initial
+                for row in BalanceTransaction.objects.filter(user=user).order_by('id').iterator():
+                    if row.balance_before != previous or row.balance_after < 0:
+                        problems.append(f'разрыв в цепочке остатков на операции #{row.pk}')
+                        break
+                    previous = row.balance_after
+                card_rows = CardTransaction.objects.filter(saved_payment_method_id=card.pk)
+                card_total = sum((row.amount if row.transaction_type == 'deposit' else -row.amount
+                                  for row in card_rows), Decimal('0'))
+                if initial + card_total != card_balance:
+                    problems.append('операции по карте не сходятся с ее балансом')
+
+            if problems:
+                for problem in problems:
+                    self.stdout.write(self.style.ERROR(f'  {problem}'))
+                raise CommandError('Обнаружены потерянные изменения баланса')
+        finally:
+            user.delete()
+
+        self.stdout.write(self.style.SUCCESS('Потерянных изменений нет'))
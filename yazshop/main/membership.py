@@ -0,0 +1,77 @@
+"""
+Наборы товаров пользователя: избранное и корзина.
+
+Для отметок на карточках каталога нужны только id товаров, поэтому оба набора
+читаются двумя запросами values_list и кэшируются в кэше Django по пользователю.
+Кэш сбрасывается сигналами Favorite и CartItem (см. signals.py) после коммита,
+так что все способы изменить избранное или корзину (страницы, API, оформление
+заказа, админка) инвалидируют его одинаково. Кэш общий для воркеров (Redis или
+файловый, см. settings.CACHES), поэтому сброс в одном воркере виден остальным.
+"""
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+MEMBERSHIP_TTL = getattr(settings, 'MEMBERSHIP_CACHE_TTL', 300)
+
+# Максимальное количество товаров в одном пакетном запросе статусов
+MAX_BATCH_IDS = 200
+
+
+def _key(user_id):
+    return f'membership:{user_id}'
+
+
+def get_membership(user_id):
+    """Возвращает (frozenset id в избранном, frozenset id в корзине)"""
+    from .models import Favorite, CartItem
+
+    cached = cache.get(_key(user_id))
+    if cached is not None:
+        return frozenset(cached[0]), frozenset(cached[1])
+
+    favorites = list(Favorite.objects.filter(user_id=user_id).values_list('product_id', flat=True))
+    in_cart = list(
+        CartItem.objects.filter(cart__user_id=user_id, product_id__isnull=False)
+        .values_list('product_id', flat=True).distinct()
+    )
+    cache.set(_key(user_id), (favorites, in_cart), MEMBERSHIP_TTL)
+    return frozenset(favorites), frozenset(in_cart)
+
+
+def get_statuses(user, product_ids):
+    """Статусы товаров для пользователя: {id: {'is_favorite': bool, 'is_in_cart': bool}}"""
+    if not user.is_authenticated:
+        return {product_id: {'is_favorite': False, 'is_in_cart': False} for product_id in product_ids}
+    favorites, in_cart = get_membership(user.pk)
+    return {
+        product_id: {'is_favorite': product_id in favorites, 'is_in_cart': product_id in in_cart}
+        for product_id in product_ids
+    }
+
+
+def parse_ids(raw):
+    """Разбирает строку '1,2,3' в список уникальных id. При ошибке — ValueError."""
+    ids, seen = [], set()
+    for part in (raw or '').split(','):
+        part = part.strip()
+        if not part:
+            continue
+        try:
+            product_id = int(part)
+        except ValueError:
+            raise ValueError('Неверный список ids')
+        if product_id in seen:
+            continue
+        if len(ids) == MAX_BATCH_IDS:
+            raise ValueError(f'Не более {MAX_BATCH_IDS} товаров за запрос')
+        seen.add(product_id)
+        ids.append(product_id)
+    return ids
+
+
+def invalidate(user_id):
+    """Сбрасывает кэш наборов пользователя после коммита текущей транзакции"""
+    if user_id is None:
+        return
+    transaction.on_commit(lambda: cache.delete(_key(user_id)))
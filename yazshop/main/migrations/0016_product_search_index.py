@@ -0,0 +1,68 @@
+# Generated manually
+
+from django.db import migrations
+
+
+def create_search_index(apps, schema_editor):
+    """Создает таблицу полнотекстового индекса товаров и заполняет ее"""
+    from main import search
+
+    vendor = schema_editor.connection.vendor
+    Product = apps.get_model('main', 'Product')
+
+    if vendor == 'sqlite':
+        try:
+            schema_editor.execute(f"""
+                CREATE VIRTUAL TABLE IF NOT EXISTS {search.SQLITE_TABLE}
+                USING fts5(product_name, product_description, tokenize = 'unicode61 remove_diacritics 2');
+            """)
+        except Exception:
+            # SQLite собран без FTS5 — поиск будет работать через icontains
+            return
+        for product in Product.objects.only('id', 'product_name', 'product_description').iterator():
+            schema_editor.execute(
+                f'INSERT INTO {search.SQLITE_TABLE} (rowid, product_name, product_description) VALUES (%s, %s, %s)',
+                [product.pk, search._document(product.product_name), search._document(product.product_description)]
+            )
+    elif vendor == 'postgresql':
+        schema_editor.execute(f"""
+            CREATE TABLE IF NOT EXISTS {search.POSTGRES_TABLE} (
+                product_id bigint PRIMARY KEY REFERENCES main_product(id) ON DELETE CASCADE DEFERRABLE INITIALLY DEFERRED,
+                document tsvector NOT NULL
+            );
+        """)
+        schema_editor.execute(
+            f'CREATE INDEX IF NOT EXISTS {search.POSTGRES_TABLE}_document_gin ON {search.POSTGRES_TABLE} USING GIN (document);'
+        )
+        schema_editor.execute(f"""
+            INSERT INTO {search.POSTGRES_TABLE} (product_id, document)
+            SELECT id,
+                   setweight(to_tsvector('russian', coalesce(product_name, '')), 'A') ||
+                   setweight(to_tsvector('russian', coalesce(product_description, '')), 'B')
+            FROM main_product
+            ON CONFLICT (product_id) DO NOTHING;
+        """)
+    search.reset_index_state()
+
+
+def drop_search_index(apps, schema_editor):
+    """Удаляет таблицу полнотекстового индекса"""
+    from main import search
+
+    vendor = schema_editor.connection.vendor
+    if vendor == 'sqlite':
+        schema_editor.execute(f'DROP TABLE IF EXISTS {search.SQLITE_TABLE};')
+    elif vendor == 'postgresql':
+        schema_editor.execute(f'DROP TABLE IF EXISTS {search.POSTGRES_TABLE};')
+    search.reset_index_state()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0015_add_org_account_triggers'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
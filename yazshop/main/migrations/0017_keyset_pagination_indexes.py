@@ -0,0 +1,31 @@
+# Generated by Django 5.2.7 on 2026-10-16 21:02
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0016_product_search_index'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='activitylog',
+            index=models.Index(fields=['created_at', 'id'], name='activitylog_created_at_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='databasebackup',
+            index=models.Index(fields=['created_at', 'id'], name='backup_created_at_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['created_at', 'id'], name='order_created_at_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['added_at', 'id'], name='product_added_at_id_idx'),
+        ),
+    ]
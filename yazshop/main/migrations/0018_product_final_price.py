@@ -0,0 +1,39 @@
+# Generated by Django 5.2.7 on 2026-10-16 21:03
+
+from decimal import Decimal, ROUND_HALF_UP
+
+from django.db import migrations, models
+
+
+def backfill_final_price(apps, schema_editor):
+    """Заполняет цену со скидкой для существующих товаров"""
+    Product = apps.get_model('main', 'Product')
+    batch = []
+    for product in Product.objects.only('id', 'price', 'discount').iterator(chunk_size=500):
+        price = product.price or Decimal('0')
+        discount = product.discount or Decimal('0')
+        product.final_price = (price * (Decimal('100') - discount) / Decimal('100')).quantize(
+            Decimal('0.01'), rounding=ROUND_HALF_UP
+        )
+        batch.append(product)
+        if len(batch) >= 500:
+            Product.objects.bulk_update(batch, ['final_price'])
+            batch = []
+    if batch:
+        Product.objects.bulk_update(batch, ['final_price'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0017_keyset_pagination_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='final_price',
+            field=models.DecimalField(db_index=True, decimal_places=2, default=0, editable=False, max_digits=10),
+        ),
+        migrations.RunPython(backfill_final_price, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,50 @@
+# Generated by Django 5.2.7 on 2026-10-16 21:04
+
+from django.db import migrations, models
+
+
+def build_tree_paths(apps, schema_editor):
+    """Заполняет материализованные пути для существующих категорий"""
+    Category = apps.get_model('main', 'Category')
+    parents = dict(Category.objects.values_list('id', 'parent_category_id'))
+    paths = {}
+
+    def path_for(category_id):
+        chain = []
+        current = category_id
+        # Идем вверх до корня; при зацикливании в старых данных считаем категорию корневой
+        while current is not None and current in parents and current not in chain:
+            if current in paths:
+                break
+            chain.append(current)
+            current = parents[current]
+        prefix = paths.get(current, '/') if current is not None and current not in chain else '/'
+        for node in reversed(chain):
+            prefix = f'{prefix}{node}/'
+            paths[node] = prefix
+        return paths[category_id]
+
+    for category_id in parents:
+        path = path_for(category_id)
+        Category.objects.filter(pk=category_id).update(tree_path=path, depth=path.count('/') - 2)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0018_product_final_price'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='category',
+            name='depth',
+            field=models.PositiveSmallIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='category',
+            name='tree_path',
+            field=models.CharField(db_index=True, default='', editable=False, max_length=255),
+        ),
+        migrations.RunPython(build_tree_paths, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,69 @@
+# Generated by Django 5.2.7 on 2026-10-16 21:06
+
+from django.db import migrations, models
+from django.db.models import Count, Sum, Q
+
+
+def fill_rating_summary(apps, schema_editor):
+    """Заполняет сводку отзывов по существующим отзывам"""
+    Product = apps.get_model('main', 'Product')
+    ProductReview = apps.get_model('main', 'ProductReview')
+    aggregates = {'review_count': Count('id'), 'rating_sum': Sum('rating_value')}
+    for value in range(1, 6):
+        aggregates[f'rating_{value}'] = Count('id', filter=Q(rating_value=value))
+    for row in ProductReview.objects.values('product_id').annotate(**aggregates).order_by():
+        product_id = row.pop('product_id')
+        row['rating_sum'] = row['rating_sum'] or 0
+        row['avg_rating'] = row['rating_sum'] / row['review_count'] if row['review_count'] else 0.0
+        Product.objects.filter(pk=product_id).update(**row)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0019_category_tree_path'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='avg_rating',
+            field=models.FloatField(db_index=True, default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='rating_1',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='rating_2',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='rating_3',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='rating_4',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='rating_5',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='rating_sum',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='review_count',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(fill_rating_summary, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 5.2.7 on 2026-10-16 21:07
+
+from django.db import migrations, models
+
+
+def fill_popularity(apps, schema_editor):
+    """Заполняет популярность по истории заказов"""
+    from main.popularity import sale_weight
+
+    Product = apps.get_model('main', 'Product')
+    OrderItem = apps.get_model('main', 'OrderItem')
+    scores = {}
+    rows = OrderItem.objects.exclude(order__order_status='cancelled').filter(
+        product__isnull=False
+    ).values_list('product_id', 'quantity', 'order__created_at')
+    for product_id, quantity, created_at in rows.iterator():
+        scores[product_id] = scores.get(product_id, 0.0) + quantity * sale_weight(created_at)
+    for product_id, score in scores.items():
+        Product.objects.filter(pk=product_id).update(popularity_score=score)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0020_product_rating_summary'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='popularity_score',
+            field=models.FloatField(db_index=True, default=0, editable=False),
+        ),
+        migrations.RunPython(fill_popularity, migrations.RunPython.noop),
+    ]
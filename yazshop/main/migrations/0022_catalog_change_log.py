@@ -0,0 +1,39 @@
+# Generated by Django 5.2.7 on 2026-10-16 22:10
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+def fill_updated_at(apps, schema_editor):
+    """Для существующих товаров время изменения равно времени добавления"""
+    Product = apps.get_model('main', 'Product')
+    Product.objects.update(updated_at=models.F('added_at'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0021_product_popularity_score'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True, db_index=True, default=django.utils.timezone.now),
+            preserve_default=False,
+        ),
+        migrations.RunPython(fill_updated_at, migrations.RunPython.noop),
+        migrations.CreateModel(
+            name='CatalogChange',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('object_type', models.CharField(choices=[('product', 'Товар'), ('productsize', 'Размер товара'), ('producttag', 'Тег товара'), ('category', 'Категория'), ('brand', 'Бренд')], max_length=20)),
+                ('object_id', models.BigIntegerField()),
+                ('changed_at', models.DateTimeField(db_index=True, default=django.utils.timezone.now)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['object_type', 'object_id'], name='catalogchange_object_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 5.2.7 on 2026-10-16 23:05
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0022_catalog_change_log'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProductImage',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('slot', models.CharField(choices=[('main_image_url', 'Главная фотография'), ('image_url_1', 'Фото 1'), ('image_url_2', 'Фото 2'), ('image_url_3', 'Фото 3'), ('image_url_4', 'Фото 4')], max_length=20)),
+                ('source_url', models.URLField()),
+                ('content_hash', models.CharField(max_length=32)),
+                ('width', models.IntegerField()),
+                ('height', models.IntegerField()),
+                ('variants', models.JSONField(default=dict)),
+                ('processed_at', models.DateTimeField(auto_now=True)),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='images', to='main.product')),
+            ],
+            options={
+                'unique_together': {('product', 'slot')},
+            },
+        ),
+    ]
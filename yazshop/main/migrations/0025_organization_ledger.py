@@ -0,0 +1,69 @@
+# Generated by Django 5.2.7 on 2026-10-16 23:55
+
+import decimal
+from django.db import migrations, models
+from django.db.models import F
+
+
+def backfill_deltas(apps, schema_editor):
+    """Приращения существующих операций — по их остаткам до/после; все они уже учтены в счете"""
+    OrganizationTransaction = apps.get_model('main', 'OrganizationTransaction')
+    OrganizationTransaction.objects.update(
+        balance_delta=F('balance_after') - F('balance_before'),
+        tax_reserve_delta=F('tax_reserve_after') - F('tax_reserve_before'),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0024_relatedproduct'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='organizationtransaction',
+            name='balance_delta',
+            field=models.DecimalField(decimal_places=2, default=decimal.Decimal('0.00'), max_digits=12),
+        ),
+        migrations.AddField(
+            model_name='organizationtransaction',
+            name='tax_reserve_delta',
+            field=models.DecimalField(decimal_places=2, default=decimal.Decimal('0.00'), max_digits=12),
+        ),
+        migrations.AddField(
+            model_name='organizationtransaction',
+            name='rolled_up',
+            field=models.BooleanField(default=True, verbose_name='Учтено в балансе счета'),
+        ),
+        migrations.RunPython(backfill_deltas, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='organizationtransaction',
+            name='rolled_up',
+            field=models.BooleanField(default=False, verbose_name='Учтено в балансе счета'),
+        ),
+        migrations.AlterField(
+            model_name='organizationtransaction',
+            name='balance_before',
+            field=models.DecimalField(blank=True, decimal_places=2, max_digits=12, null=True),
+        ),
+        migrations.AlterField(
+            model_name='organizationtransaction',
+            name='balance_after',
+            field=models.DecimalField(blank=True, decimal_places=2, max_digits=12, null=True),
+        ),
+        migrations.AlterField(
+            model_name='organizationtransaction',
+            name='tax_reserve_before',
+            field=models.DecimalField(blank=True, decimal_places=2, max_digits=12, null=True),
+        ),
+        migrations.AlterField(
+            model_name='organizationtransaction',
+            name='tax_reserve_after',
+            field=models.DecimalField(blank=True, decimal_places=2, max_digits=12, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='organizationtransaction',
+            index=models.Index(condition=models.Q(('rolled_up', False)), fields=['id'], name='org_transaction_pending_idx'),
+        ),
+    ]
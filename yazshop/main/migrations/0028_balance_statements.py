@@ -0,0 +1,52 @@
+# Generated by Django 5.2.7 on 2026-10-17 03:10
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0027_outboxevent'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BalanceSnapshot',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('account_type', models.CharField(choices=[('balance', 'Баланс'), ('card', 'Карта')], max_length=10)),
+                ('closing_at', models.DateTimeField()),
+                ('closing_balance', models.DecimalField(decimal_places=2, max_digits=12)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='balancetransaction',
+            index=models.Index(fields=['user', 'created_at', 'id'], name='balancetx_user_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='cardtransaction',
+            index=models.Index(fields=['saved_payment_method', 'created_at', 'id'], name='cardtx_card_created_idx'),
+        ),
+        migrations.AddField(
+            model_name='balancesnapshot',
+            name='saved_payment_method',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='snapshots', to='main.savedpaymentmethod'),
+        ),
+        migrations.AddField(
+            model_name='balancesnapshot',
+            name='user',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='balance_snapshots', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddConstraint(
+            model_name='balancesnapshot',
+            constraint=models.UniqueConstraint(condition=models.Q(('account_type', 'balance')), fields=('user', 'closing_at'), name='balancesnapshot_balance_uniq'),
+        ),
+        migrations.AddConstraint(
+            model_name='balancesnapshot',
+            constraint=models.UniqueConstraint(condition=models.Q(('account_type', 'card')), fields=('saved_payment_method', 'closing_at'), name='balancesnapshot_card_uniq'),
+        ),
+    ]
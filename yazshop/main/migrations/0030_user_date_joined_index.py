@@ -0,0 +1,34 @@
+# Generated manually
+
+from django.conf import settings
+from django.db import migrations
+
+INDEX_NAME = 'auth_user_date_joined_id_idx'
+
+
+def _table(apps, schema_editor):
+    User = apps.get_model(settings.AUTH_USER_MODEL)
+    return schema_editor.quote_name(User._meta.db_table)
+
+
+def create_index(apps, schema_editor):
+    """Индекс (date_joined, id) для курсорной пагинации пользователей (модель User не из этого приложения)"""
+    schema_editor.execute(
+        f'CREATE INDEX IF NOT EXISTS {INDEX_NAME} ON {_table(apps, schema_editor)} (date_joined, id);'
+    )
+
+
+def drop_index(apps, schema_editor):
+    schema_editor.execute(f'DROP INDEX IF EXISTS {INDEX_NAME};')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0029_data_version'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RunPython(create_index, drop_index),
+    ]
@@ -1,9 +1,11 @@
 from django.db import models
 from django.contrib.auth.models import User
 from django.utils import timezone
-from decimal import Decimal
+from decimal import Decimal, ROUND_HALF_UP
 from django.core.exceptions import ValidationError
-from django.db.models import Sum, F
+from django.db.models import Sum, F, Value, DecimalField
+from django.db.models.functions import Round, Concat, Substr
+from django.db import transaction
 
 # ==== Роли пользователей ====
 class Role(models.Model):
@@ -59,10 +61,55 @@ class Category(models.Model):
     parent_category = models.ForeignKey(
         'self', on_delete=models.SET_NULL, null=True, blank=True, related_name='subcategories'
     )
+    # Материализованный путь от корня вида "/1/5/12/" и глубина (0 — корневая категория)
+    tree_path = models.CharField(max_length=255, default='', db_index=True, editable=False)
+    depth = models.PositiveSmallIntegerField(default=0, editable=False)
 
     def __str__(self):
         return self.category_name
 
+    def save(self, *args, **kwargs):
+        with transaction.atomic():
+            parent_path, parent_depth = '/', -1
+            if self.parent_category_id:
+                parent = Category.objects.filter(pk=self.parent_category_id).values_list('tree_path', 'depth').first()
+                if parent:
+                    parent_path, parent_depth = parent
+                    if self.pk and f'/{self.pk}/' in parent_path:
+                        raise ValidationError('Категория не может быть вложена в саму себя или в свою подкатегорию')
+
+            old = None
+            if self.pk:
+                old = Category.objects.filter(pk=self.pk).values_list('tree_path', 'depth').first()
+                self.tree_path = f'{parent_path}{self.pk}/'
+                self.depth = parent_depth + 1
+
+            update_fields = kwargs.get('update_fields')
+            if update_fields is not None:
+                kwargs['update_fields'] = set(update_fields) | {'tree_path', 'depth'}
+            super().save(*args, **kwargs)
+
+            if old is None:
+                # Новая категория: путь известен только после получения pk
+                self.tree_path = f'{parent_path}{self.pk}/'
+                self.depth = parent_depth + 1
+                Category.objects.filter(pk=self.pk).update(tree_path=self.tree_path, depth=self.depth)
+            elif old[0] and old[0] != self.tree_path:
+                # Перенос поддерева одним запросом
+                old_path, old_depth = old
+                from . import changes
+                changes.record('category', Category.objects.filter(
+                    tree_path__startswith=old_path).exclude(pk=self.pk).values_list('pk', flat=True))
+                Category.objects.filter(tree_path__startswith=old_path).exclude(pk=self.pk).update(
+                    tree_path=Concat(Value(self.tree_path), Substr('tree_path', len(old_path) + 1),
+                                     output_field=models.CharField()),
+                    depth=F('depth') + (self.depth - old_depth),
+                )
+
+    def get_ancestor_ids(self):
+        """id категорий от корня до текущей (включительно) по материализованному пути"""
+        return [int(part) for part in self.tree_path.strip('/').split('/') if part]
+
 
 # ==== Бренды ====
 class Brand(models.Model):
@@ -89,6 +136,83 @@ class Supplier(models.Model):
 
 
 # ==== Товары ====
+class ProductQuerySet(models.QuerySet):
+    """
+    QuerySet товаров, который поддерживает сохраненную цену со скидкой (final_price)
+    при массовых операциях update/bulk_update/bulk_create.
+    Массовые операции не вызывают сигналов, поэтому версия таблицы для ETag
+    (versions.py), журнал изменений (changes.py) и публикация снимка каталога
+    (snapshot.py) обновляются здесь же. Обновления только остатков и счетчиков
+    (snapshot.VOLATILE_FIELDS) версию таблицы не увеличивают и снимок не
+    публикуют: они идут с каждым заказом и отзывом (см. conditional.py).
+    """
+
+    def _changed(self, product_ids, fields=None):
+        from . import versions, snapshot, changes
+        if product_ids is not None:
+            changes.record('product', product_ids)
+        if fields is None or not snapshot.VOLATILE_FIELDS.issuperset(fields):
+            versions.bump_on_commit(versions.table_name(self.model))
+            snapshot.schedule_publish()
+
+    def update(self, **kwargs):
+        fields = set(kwargs)
+        if ('price' in kwargs or 'discount' in kwargs) and 'final_price' not in kwargs:
+            price = kwargs.get('price', F('price'))
+            discount = kwargs.get('discount', F('discount'))
+            if not hasattr(price, 'resolve_expression'):
+                price = Value(Decimal(str(price)), output_field=DecimalField(max_digits=10, decimal_places=2))
+            if not hasattr(discount, 'resolve_expression'):
+                discount = Value(Decimal(str(discount)), output_field=DecimalField(max_digits=5, decimal_places=2))
+            kwargs['final_price'] = Round(
+                price * (Value(Decimal('100')) - discount) / Value(Decimal('100')), 2,
+                output_field=DecimalField(max_digits=10, decimal_places=2)
+            )
+        kwargs.setdefault('updated_at', timezone.now())
+        with transaction.atomic():
+            # Id нужны только для журнала синхронизации
+            product_ids = (list(self.values_list('pk', flat=True))
+                           if fields - self.model.UNSYNCED_FIELDS else None)
+            rows = super().update(**kwargs)
+            if rows:
+                self._changed(product_ids, fields)
+        return rows
+
+    update.alters_data = True
+
+    def bulk_update(self, objs, fields, *args, **kwargs):
+        objs = list(objs)
+        fields = list(fields)
+        if ('price' in fields or 'discount' in fields) and 'final_price' not in fields:
+            for obj in objs:
+                obj.final_price = Product.compute_final_price(obj.price, obj.discount)
+            fields.append('final_price')
+        if 'updated_at' not in fields:
+            now = timezone.now()
+            for obj in objs:
+                obj.updated_at = now
+            fields.append('updated_at')
+        with transaction.atomic():
+            rows = super().bulk_update(objs, fields, *args, **kwargs)
+            if rows:
+                self._changed([obj.pk for obj in objs], fields)
+        return rows
+
+    bulk_update.alters_data = True
+
+    def bulk_create(self, objs, *args, **kwargs):
+        objs = list(objs)
+        for obj in objs:
+            obj.final_price = Product.compute_final_price(obj.price, obj.discount)
+        with transaction.atomic():
+            created = super().bulk_create(objs, *args, **kwargs)
+            if created:
+                self._changed([obj.pk for obj in created if obj.pk is not None])
+        return created
+
+    bulk_create.alters_data = True
+
+
 class Product(models.Model):
     product_name = models.CharField(max_length=255)
     
@@ -106,11 +230,48 @@ class Product(models.Model):
     supplier = models.ForeignKey(Supplier, on_delete=models.SET_NULL, null=True, blank=True)
     price = models.DecimalField(max_digits=10, decimal_places=2)
     discount = models.DecimalField(max_digits=5, decimal_places=2, default=0)
+    # Цена со скидкой, пересчитывается при сохранении и массовых обновлениях
+    final_price = models.DecimalField(max_digits=10, decimal_places=2, default=0, db_index=True, editable=False)
     stock_quantity = models.IntegerField(default=0)
     product_description = models.TextField(blank=True, null=True)
     added_at = models.DateTimeField(auto_now_add=True)
+    # Время последнего изменения, в том числе массовыми update() (см. ProductQuerySet)
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
     is_available = models.BooleanField(default=True)
 
+    # Сводка отзывов, обновляется атомарно сигналами ProductReview (см. ratings.py)
+    avg_rating = models.FloatField(default=0, db_index=True, editable=False)
+    review_count = models.IntegerField(default=0, editable=False)
+    rating_sum = models.IntegerField(default=0, editable=False)
+    rating_1 = models.IntegerField(default=0, editable=False)
+    rating_2 = models.IntegerField(default=0, editable=False)
+    rating_3 = models.IntegerField(default=0, editable=False)
+    rating_4 = models.IntegerField(default=0, editable=False)
+    rating_5 = models.IntegerField(default=0, editable=False)
+
+    # Популярность по продажам с затуханием во времени (см. popularity.py)
+    popularity_score = models.FloatField(default=0, db_index=True, editable=False)
+
+    # Счетчики, которые меняются только через F()-обновления и не должны
+    # перезаписываться устаревшими значениями при обычном save()
+    COUNTER_FIELDS = (
+        'avg_rating', 'review_count', 'rating_sum',
+        'rating_1', 'rating_2', 'rating_3', 'rating_4', 'rating_5',
+        'popularity_score',
+    )
+
+    # Поля, изменения которых не пишутся в журнал синхронизации (changes.py):
+    # оценка популярности меняется при каждой продаже, и клиент получает ее
+    # вместе с остальными изменениями товара
+    UNSYNCED_FIELDS = frozenset(('popularity_score', 'rating_sum', 'updated_at'))
+
+    objects = ProductQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['added_at', 'id'], name='product_added_at_id_idx'),
+        ]
+
     def __str__(self):
         return self.product_name
     
@@ -118,14 +279,34 @@ class Product(models.Model):
         # Автоматически отключаем товар, если он закончился
         if self.stock_quantity <= 0:
             self.is_available = False
+        self.final_price = self.compute_final_price(self.price, self.discount)
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None:
+            extra_fields = {'updated_at'}
+            if 'price' in update_fields or 'discount' in update_fields:
+                extra_fields.add('final_price')
+            kwargs['update_fields'] = set(update_fields) | extra_fields
+        elif update_fields is None and not self._state.adding and not kwargs.get('force_insert') and not args:
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.name not in self.COUNTER_FIELDS
+            ]
         super().save(*args, **kwargs)
 
     @property
-    def final_price(self):
+    def rating_histogram(self):
+        """Количество отзывов по оценкам: {5: n, 4: n, ...}"""
+        return {value: getattr(self, f'rating_{value}') for value in range(5, 0, -1)}
+
+    @staticmethod
+    def compute_final_price(price, discount):
+        """Цена со скидкой, округленная до копеек"""
         try:
-            return (self.price or Decimal('0')) * (Decimal('1') - (self.discount or Decimal('0')) / Decimal('100'))
+            price = Decimal(str(price or 0))
+            discount = Decimal(str(discount or 0))
+            return (price * (Decimal('100') - discount) / Decimal('100')).quantize(Decimal('0.01'), rounding=ROUND_HALF_UP)
         except Exception:
-            return self.price
+            return price
 
     @property
     def is_new(self):
@@ -134,6 +315,21 @@ class Product(models.Model):
             return False
         return added >= timezone.now() - timezone.timedelta(days=30)
 
+    @property
+    def image_variants(self):
+        """Производные изображения по полям: {'main_image_url': {ширина: путь}, ...}"""
+        return {image.slot: image.variants for image in self.images.all()}
+
+    @property
+    def main_srcset(self):
+        from .images import srcset
+        return srcset(self.image_variants.get('main_image_url'))
+
+    @property
+    def main_thumbnail_url(self):
+        from .images import thumbnail_url
+        return thumbnail_url(self.image_variants.get('main_image_url'))
+
 # ==== Размеры товаров ====
 class ProductSize(models.Model):
     product = models.ForeignKey('Product', on_delete=models.CASCADE, related_name='sizes')
@@ -173,6 +369,56 @@ class ProductSize(models.Model):
         super().save(*args, **kwargs)
 
 
+# ==== Производные изображения товаров ====
+class ProductImage(models.Model):
+    """
+    WebP-миниатюры одного изображения товара (см. images.py).
+    slot — поле товара с адресом исходника, variants — {ширина: путь в MEDIA_ROOT}.
+    """
+    SLOTS = [
+        ('main_image_url', 'Главная фотография'),
+        ('image_url_1', 'Фото 1'),
+        ('image_url_2', 'Фото 2'),
+        ('image_url_3', 'Фото 3'),
+        ('image_url_4', 'Фото 4'),
+    ]
+
+    product = models.ForeignKey('Product', on_delete=models.CASCADE, related_name='images')
+    slot = models.CharField(max_length=20, choices=SLOTS)
+    source_url = models.URLField()
+    content_hash = models.CharField(max_length=32)
+    width = models.IntegerField()
+    height = models.IntegerField()
+    variants = models.JSONField(default=dict)
+    processed_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        unique_together = ('product', 'slot')
+
+    def __str__(self):
+        return f'{self.product_id} - {self.slot}'
+
+
+# ==== Товары, которые покупают вместе ====
+class RelatedProduct(models.Model):
+    """
+    Сосед товара по совместным покупкам (см. related.py): related_product
+    встречается вместе с product в co_orders заказах. Хранятся top-K на товар.
+    """
+    product = models.ForeignKey('Product', on_delete=models.CASCADE, related_name='related_links')
+    related_product = models.ForeignKey('Product', on_delete=models.CASCADE, related_name='+')
+    co_orders = models.IntegerField(default=0)
+
+    class Meta:
+        unique_together = ('product', 'related_product')
+        indexes = [
+            models.Index(fields=['product', '-co_orders'], name='related_product_rank_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.product_id} -> {self.related_product_id} ({self.co_orders})'
+
+
 # ==== Теги ====
 class Tag(models.Model):
     tag_name = models.CharField(max_length=100, unique=True)
@@ -207,9 +453,9 @@ class Cart(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
 
     def total_price(self):
-        return self.items.aggregate(
-            total=Sum(F('unit_price') * F('quantity'))
-        )['total'] or 0
+        # Сумма товаров из закэшированных итогов корзины (pricing.py)
+        from .pricing import cart_totals
+        return cart_totals(self.pk)[0]
 
     def __str__(self):
         return f"Корзина {self.user.username}"
@@ -253,6 +499,11 @@ class Order(models.Model):
     tax_rate = models.DecimalField(max_digits=5, decimal_places=2, default=Decimal('13.00'), verbose_name='Налог на прибыль (%)')
     tax_amount = models.DecimalField(max_digits=10, decimal_places=2, default=Decimal('0.00'), verbose_name='Сумма налога (13%)')
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['created_at', 'id'], name='order_created_at_id_idx'),
+        ]
+
     def __str__(self):
         return f"Order #{self.id}"
     
@@ -325,6 +576,10 @@ class CardTransaction(models.Model):
     
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            # Выписка по карте за период (statements.py)
+            models.Index(fields=['saved_payment_method', 'created_at', 'id'], name='cardtx_card_created_idx'),
+        ]
     
     def __str__(self):
         return f"{self.get_transaction_type_display()} - {self.amount} ₽ ({self.saved_payment_method.mask_card_number()})"
@@ -399,6 +654,9 @@ class DatabaseBackup(models.Model):
         verbose_name = 'Бэкап базы данных'
         verbose_name_plural = 'Бэкапы базы данных'
         ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['created_at', 'id'], name='backup_created_at_id_idx'),
+        ]
     
     def __str__(self):
         return f"{self.backup_name} ({self.created_at.strftime('%d.%m.%Y %H:%M')})"
@@ -417,6 +675,11 @@ class ActivityLog(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     ip_address = models.CharField(max_length=50, blank=True, null=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['created_at', 'id'], name='activitylog_created_at_id_idx'),
+        ]
+
 # ==== Транзакции баланса ====
 class BalanceTransaction(models.Model):
     TRANSACTION_TYPES = [
@@ -438,10 +701,44 @@ class BalanceTransaction(models.Model):
     
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            # Выписка по балансу за период (statements.py)
+            models.Index(fields=['user', 'created_at', 'id'], name='balancetx_user_created_idx'),
+        ]
     
     def __str__(self):
         return f"{self.get_transaction_type_display()} - {self.amount} ₽ ({self.user.username})"
 
+
+class BalanceSnapshot(models.Model):
+    """
+    Остаток баланса пользователя или карты по всем операциям до closing_at
+    (начало месяца). Снимки создает команда snapshot_balances; по ним выписка
+    находит входящий остаток, не суммируя всю историю (statements.py).
+    """
+    ACCOUNT_TYPES = [
+        ('balance', 'Баланс'),
+        ('card', 'Карта'),
+    ]
+
+    account_type = models.CharField(max_length=10, choices=ACCOUNT_TYPES)
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='balance_snapshots')
+    saved_payment_method = models.ForeignKey('SavedPaymentMethod', on_delete=models.CASCADE, null=True, blank=True, related_name='snapshots')
+    closing_at = models.DateTimeField()
+    closing_balance = models.DecimalField(max_digits=12, decimal_places=2)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'closing_at'], condition=models.Q(account_type='balance'),
+                                    name='balancesnapshot_balance_uniq'),
+            models.UniqueConstraint(fields=['saved_payment_method', 'closing_at'], condition=models.Q(account_type='card'),
+                                    name='balancesnapshot_card_uniq'),
+        ]
+
+    def __str__(self):
+        return f"{self.get_account_type_display()} {self.closing_balance} ₽ на {self.closing_at:%d.%m.%Y}"
+
 # ==== Чеки ====
 class ReceiptConfig(models.Model):
     company_name = models.CharField(max_length=255, default='ООО «YazShop»')
@@ -502,7 +799,11 @@ class ReceiptItem(models.Model):
 
 # ==== Счет организации ====
 class OrganizationAccount(models.Model):
-    """Счет организации (магазина) для хранения средств от продаж"""
+    """
+    Счет организации (магазина) для хранения средств от продаж.
+    balance и tax_reserve — свертка журнала OrganizationTransaction;
+    текущие значения с учетом несвернутых операций дает ledger.balances().
+    """
     balance = models.DecimalField(max_digits=12, decimal_places=2, default=Decimal('0.00'), verbose_name='Баланс')
     tax_reserve = models.DecimalField(max_digits=12, decimal_places=2, default=Decimal('0.00'), verbose_name='Резерв на налоги (13%)')
     created_at = models.DateTimeField(auto_now_add=True)
@@ -556,15 +857,134 @@ class OrganizationTransaction(models.Model):
     order = models.ForeignKey('Order', on_delete=models.SET_NULL, null=True, blank=True, related_name='org_transactions')
     created_by = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, verbose_name='Создано пользователем')
     created_at = models.DateTimeField(auto_now_add=True)
-    balance_before = models.DecimalField(max_digits=12, decimal_places=2, default=Decimal('0.00'))
-    balance_after = models.DecimalField(max_digits=12, decimal_places=2, default=Decimal('0.00'))
-    tax_reserve_before = models.DecimalField(max_digits=12, decimal_places=2, default=Decimal('0.00'))
-    tax_reserve_after = models.DecimalField(max_digits=12, decimal_places=2, default=Decimal('0.00'))
+    # Изменение баланса и резерва со знаком; строка счета — свертка этих приращений (ledger.py)
+    balance_delta = models.DecimalField(max_digits=12, decimal_places=2, default=Decimal('0.00'))
+    tax_reserve_delta = models.DecimalField(max_digits=12, decimal_places=2, default=Decimal('0.00'))
+    rolled_up = models.BooleanField(default=False, verbose_name='Учтено в балансе счета')
+    # Остатки до/после у поступлений от заказов заполняются при свертке
+    balance_before = models.DecimalField(max_digits=12, decimal_places=2, null=True, blank=True)
+    balance_after = models.DecimalField(max_digits=12, decimal_places=2, null=True, blank=True)
+    tax_reserve_before = models.DecimalField(max_digits=12, decimal_places=2, null=True, blank=True)
+    tax_reserve_after = models.DecimalField(max_digits=12, decimal_places=2, null=True, blank=True)
     
     class Meta:
         ordering = ['-created_at']
         verbose_name = 'Транзакция счета организации'
         verbose_name_plural = 'Транзакции счета организации'
+        indexes = [
+            models.Index(fields=['id'], condition=models.Q(rolled_up=False), name='org_transaction_pending_idx'),
+        ]
     
     def __str__(self):
         return f"{self.get_transaction_type_display()} - {self.amount} ₽ ({self.created_at.strftime('%d.%m.%Y %H:%M')})"
+
+
+# ==== Журнал изменений каталога ====
+class CatalogChange(models.Model):
+    """
+    Запись журнала для дельта-синхронизации каталога (см. changes.py):
+    объект object_type с id object_id был изменен или удален. id записи
+    служит позицией токена синхронизации.
+    """
+    OBJECT_TYPES = [
+        ('product', 'Товар'),
+        ('productsize', 'Размер товара'),
+        ('producttag', 'Тег товара'),
+        ('category', 'Категория'),
+        ('brand', 'Бренд'),
+    ]
+
+    object_type = models.CharField(max_length=20, choices=OBJECT_TYPES)
+    object_id = models.BigIntegerField()
+    changed_at = models.DateTimeField(default=timezone.now, db_index=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['object_type', 'object_id'], name='catalogchange_object_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.object_type} #{self.object_id} ({self.changed_at})'
+
+
+# ==== Ключи идемпотентности ====
+class IdempotencyKey(models.Model):
+    """
+    Ключ идемпотентности запроса scope пользователя user (см. idempotency.py):
+    пока запрос выполняется — status='pending', после — сохраненный ответ,
+    который возвращается на повторы с тем же ключом до expires_at.
+    """
+    STATUS_CHOICES = [
+        ('pending', 'Выполняется'),
+        ('done', 'Выполнен'),
+    ]
+
+    user = models.ForeignKey(User, on_delete=models.CASCADE, null=True, blank=True, related_name='+')
+    scope = models.CharField(max_length=50)
+    key = models.CharField(max_length=255)
+    request_hash = models.CharField(max_length=64)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='pending')
+    response_status = models.PositiveSmallIntegerField(null=True, blank=True)
+    response_body = models.TextField(blank=True, default='')
+    response_content_type = models.CharField(max_length=100, blank=True, default='')
+    response_location = models.CharField(max_length=500, blank=True, default='')
+    is_api = models.BooleanField(default=False)
+    created_at = models.DateTimeField(default=timezone.now)
+    expires_at = models.DateTimeField(db_index=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'scope', 'key'], name='idempotency_key_unique'),
+        ]
+
+    def __str__(self):
+        return f'{self.scope}: {self.key} ({self.status})'
+
+
+# ==== Очередь фоновой работы ====
+class OutboxEvent(models.Model):
+    """
+    Событие очереди фоновой работы (см. outbox.py): записывается в транзакции
+    породившей его операции и обрабатывается воркером run_outbox.
+    """
+    STATUS_CHOICES = [
+        ('pending', 'Ожидает'),
+        ('processing', 'Обрабатывается'),
+        ('done', 'Выполнено'),
+        ('failed', 'Ошибка'),
+    ]
+
+    topic = models.CharField(max_length=50)
+    key = models.CharField(max_length=100, blank=True, default='', db_index=True)
+    payload = models.JSONField(default=dict)
+    status = models.CharField(max_length=12, choices=STATUS_CHOICES, default='pending')
+    attempts = models.PositiveIntegerField(default=0)
+    available_at = models.DateTimeField(default=timezone.now)
+    locked_until = models.DateTimeField(null=True, blank=True)
+    last_error = models.TextField(blank=True, default='')
+    created_at = models.DateTimeField(default=timezone.now)
+    processed_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'available_at'], name='outbox_ready_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.topic} #{self.pk} ({self.status})'
+
+
+# ==== Версии данных ====
+class DataVersion(models.Model):
+    """
+    Счетчик версии набора данных name (см. versions.py): увеличивается при
+    изменении данных и служит основой ETag, ключей кэша страниц и проверки
+    актуальности индексов в памяти воркеров. Хранится в БД, чтобы изменение
+    в одном воркере видели все остальные.
+    """
+    name = models.CharField(max_length=100, unique=True)
+    version = models.BigIntegerField()
+    modified_at = models.DateTimeField()
+
+    def __str__(self):
+        return f'{self.name}: {self.version}'
@@ -0,0 +1,223 @@
+"""
+Очередь фоновой работы в базе (transactional outbox).
+
+enqueue() записывает событие OutboxEvent в текущую транзакцию, поэтому
+событие появляется тогда и только тогда, когда зафиксирована породившая
+его работа (например, заказ). Обработчики регистрируются декоратором
+handler(topic) и выполняются в своей транзакции вместе с отметкой
+о выполнении: если обработчик упал, его изменения откатываются и событие
+повторяется целиком.
+
+Очередь разбирает команда run_outbox (в цикле или --once из cron).
+Событие занимается условным UPDATE pending -> processing с арендой LEASE
+секунд, поэтому несколько воркеров не берут его одновременно; событие с
+истекшей арендой (воркер упал) берется снова, а отметка о выполнении
+проверяет, что аренда не перешла к другому воркеру. При ошибке событие
+повторяется с экспоненциальной задержкой, после MAX_ATTEMPTS попыток
+помечается failed (попадает в статистику ошибок), но не бросается: воркер
+повторяет его раз в BACKOFF_MAX секунд, пока обработчик не выполнится
+(например, после исправления данных или восстановления внешнего сервиса).
+
+Чтобы событие не ждало следующего прохода воркера, после коммита оно
+передается фоновому потоку процесса (OUTBOX_BACKGROUND, как обработка
+изображений в images.py); воркер подбирает то, что поток не успел
+(перезапуск процесса, ошибки). При OUTBOX_SYNC = True (тесты) события
+обрабатываются синхронно сразу после коммита. flush(key)
+обрабатывает события одного объекта немедленно — например, перед отменой
+заказа, чтобы возврат не опередил поступление на счет.
+"""
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.db.models import Count, Min, Q, F
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+SYNC = getattr(settings, 'OUTBOX_SYNC', False)
+BACKGROUND = getattr(settings, 'OUTBOX_BACKGROUND', True)
+LEASE = getattr(settings, 'OUTBOX_LEASE_SECONDS', 60)
+MAX_ATTEMPTS = getattr(settings, 'OUTBOX_MAX_ATTEMPTS', 8)
+RETENTION_DAYS = getattr(settings, 'OUTBOX_RETENTION_DAYS', 7)
+BACKOFF_BASE = 5
+BACKOFF_MAX = 60 * 60
+
+_handlers = {}
+_executor = None
+
+
+class LeaseLost(Exception):
+    """Аренда события истекла и перешла к другому воркеру"""
+
+
+def handler(topic):
+    """Регистрирует обработчик событий topic: func(payload)"""
+    def register(func):
+        _handlers[topic] = func
+        return func
+    return register
+
+
+def enqueue(topic, payload, key=''):
+    """Добавляет событие в текущую транзакцию"""
+    from .models import OutboxEvent
+
+    event = OutboxEvent.objects.create(topic=topic, payload=payload, key=key)
+    if SYNC:
+        transaction.on_commit(lambda: process(event.pk))
+    elif BACKGROUND:
+        transaction.on_commit(lambda: _submit(event.pk))
+    return event
+
+
+def _run(event_id):
+    try:
+        process(event_id)
+    except Exception:
+        logger.exception('Ошибка обработки события outbox #%s', event_id)
+    finally:
+        close_old_connections()
+
+
+def _submit(event_id):
+    """Передает событие фоновому потоку процесса"""
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='outbox')
+    _executor.submit(_run, event_id)
+
+
+def _claim(event_id, now, force=False):
+    """Занимает событие; возвращает срок аренды или None, если событие занято или не готово"""
+    from .models import OutboxEvent
+
+    if force:
+        ready = Q(status__in=['pending', 'failed'])
+    else:
+        ready = Q(status__in=['pending', 'failed'], available_at__lte=now)
+    ready |= Q(status='processing', locked_until__lt=now)
+    locked_until = now + timedelta(seconds=LEASE)
+    claimed = OutboxEvent.objects.filter(ready, pk=event_id).update(
+        status='processing',
+        locked_until=locked_until,
+        attempts=F('attempts') + 1,
+    )
+    return locked_until if claimed else None
+
+
+def _fail(event, error):
+    from .models import OutboxEvent
+
+    now = timezone.now()
+    if event.attempts >= MAX_ATTEMPTS:
+        fields = {'status': 'failed', 'available_at': now + timedelta(seconds=BACKOFF_MAX)}
+        logger.error('Событие outbox #%s (%s) не обработано за %s попыток: %s', event.pk, event.topic, event.attempts, error)
+    else:
+        delay = min(BACKOFF_BASE * 2 ** (event.attempts - 1), BACKOFF_MAX)
+        fields = {'status': 'pending', 'available_at': now + timedelta(seconds=delay)}
+        logger.warning('Событие outbox #%s (%s), попытка %s: %s', event.pk, event.topic, event.attempts, error)
+    OutboxEvent.objects.filter(pk=event.pk, locked_until=event.locked_until).update(
+        locked_until=None, last_error=f'{type(error).__name__}: {error}'[:2000], **fields
+    )
+
+
+def process(event_id, force=False):
+    """Обрабатывает событие, если его удалось занять. True — событие выполнено."""
+    from .models import OutboxEvent
+
+    locked_until = _claim(event_id, timezone.now(), force)
+    if locked_until is None:
+        return False
+    event = OutboxEvent.objects.get(pk=event_id)
+    try:
+        func = _handlers.get(event.topic)
+        if func is None:
+            raise LookupError(f'Нет обработчика событий {event.topic}')
+        with transaction.atomic():
+            func(event.payload)
+            done = OutboxEvent.objects.filter(pk=event.pk, locked_until=locked_until).update(
+                status='done', processed_at=timezone.now(), locked_until=None, last_error=''
+            )
+            if not done:
+                raise LeaseLost(f'Аренда события #{event.pk} истекла')
+    except LeaseLost:
+        logger.warning('Событие outbox #%s обработано другим воркером', event.pk)
+        return False
+    except Exception as e:
+        _fail(event, e)
+        return False
+    return True
+
+
+def drain(batch_size=100):
+    """
+    Обрабатывает готовые события (не больше batch_size), включая события с
+    ошибкой, у которых подошло время повтора. Возвращает число выполненных.
+    """
+    from .models import OutboxEvent
+
+    now = timezone.now()
+    ids = list(
+        OutboxEvent.objects.filter(
+            Q(status__in=['pending', 'failed'], available_at__lte=now) | Q(status='processing', locked_until__lt=now)
+        ).order_by('id').values_list('id', flat=True)[:batch_size]
+    )
+    return sum(1 for event_id in ids if process(event_id))
+
+
+def flush(key):
+    """
+    Немедленно обрабатывает незавершенные события объекта key (в том числе
+    отложенные и с ошибкой). True — незавершенных событий не осталось.
+    """
+    from .models import OutboxEvent
+
+    unfinished = OutboxEvent.objects.filter(key=key).exclude(status='done')
+    for event_id in unfinished.order_by('id').values_list('id', flat=True):
+        process(event_id, force=True)
+    return not unfinished.exists()
+
+
+def flush_many(keys):
+    """
+    flush() для нескольких объектов: незавершенные события ищутся одним
+    запросом. Возвращает ключи, у которых незавершенные события остались.
+    """
+    from .models import OutboxEvent
+
+    pending = set(OutboxEvent.objects.filter(key__in=keys).exclude(status='done').values_list('key', flat=True))
+    return {key for key in pending if not flush(key)}
+
+
+def prune(days=RETENTION_DAYS):
+    """Удаляет выполненные события старше days дней"""
+    from .models import OutboxEvent
+
+    cutoff = timezone.now() - timedelta(days=days)
+    deleted, _ = OutboxEvent.objects.filter(status='done', processed_at__lt=cutoff).delete()
+    return deleted
+
+
+def stats():
+    """Глубина очереди, число событий с ошибкой и задержка самого старого незавершенного события"""
+    from .models import OutboxEvent
+
+    now = timezone.now()
+    queued = OutboxEvent.objects.filter(status__in=['pending', 'processing']).aggregate(
+        depth=Count('id'), oldest=Min('created_at'),
+    )
+    by_topic = dict(
+        OutboxEvent.objects.filter(status__in=['pending', 'processing'])
+        .values('topic').annotate(depth=Count('id')).values_list('topic', 'depth')
+    )
+    oldest = queued['oldest']
+    return {
+        'depth': queued['depth'],
+        'failed': OutboxEvent.objects.filter(status='failed').count(),
+        'lag_seconds': round((now - oldest).total_seconds(), 1) if oldest else 0,
+        'oldest_created_at': oldest,
+        'by_topic': by_topic,
+    }
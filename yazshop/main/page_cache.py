@@ -0,0 +1,126 @@
+"""
+Кэш целых HTML-страниц для анонимных посетителей.
+
+Ключ — путь страницы, нормализованная строка запроса (только параметры, от
+которых зависит страница) и версии таблиц, из которых она собрана (versions.py).
+Изменение товара, акции, категории, бренда или тега увеличивает версию своей
+таблицы, поэтому устаревают только страницы, которые от нее зависят; старые
+записи просто истекают через PAGE_CACHE_TTL. Версии хранятся в БД, а страницы —
+в общем кэше (settings.CACHES), поэтому после изменения в одном воркере
+остальные перестают отдавать старую страницу не позже VERSION_CHECK_INTERVAL.
+
+Продажи и отзывы меняют только остатки и счетчики товаров, а они версию таблицы
+не увеличивают (см. conditional.py). Страницы с товарами и размерами поэтому
+хранятся не дольше окна conditional.VOLATILE_TTL и входят в ключ вместе с ним:
+остатки и популярность обновляются раз в окно, как и ETag этих страниц.
+
+Авторизованные пользователи и запросы с непоказанными сообщениями идут мимо
+кэша. Попадания и промахи считаются в кэше Django по каждой странице
+(см. команду page_cache_stats).
+"""
+import functools
+import hashlib
+
+from django.conf import settings
+from django.core.cache import cache
+from django.http import HttpResponse
+from django.middleware.csrf import get_token
+
+from . import versions
+from .conditional import VOLATILE_TABLES, VOLATILE_TTL, has_pending_messages, volatile_window
+
+PAGE_CACHE_TTL = getattr(settings, 'PAGE_CACHE_TTL', 300)
+
+# Параметры запроса, от которых зависят кэшируемые страницы
+CACHED_PARAMS = ('category', 'brand', 'tag', 'sort', 'q')
+
+# Имена страниц, для которых ведется статистика
+_pages = set()
+
+
+def _stats_key(page, kind):
+    return f'page_cache_stats:{page}:{kind}'
+
+
+def _count(page, kind):
+    key = _stats_key(page, kind)
+    if not cache.add(key, 1, None):
+        try:
+            cache.incr(key)
+        except ValueError:
+            pass
+
+
+def normalize_query(query_dict):
+    """Строка запроса из CACHED_PARAMS в постоянном порядке, без пустых значений"""
+    parts = []
+    for name in CACHED_PARAMS:
+        value = ' '.join(query_dict.get(name, '').split())
+        if value:
+            parts.append(f'{name}={value}')
+    return '&'.join(parts)
+
+
+def _is_anonymous(request):
+    # Без cookie сессии пользователь точно анонимный, сессию из БД не читаем
+    if settings.SESSION_COOKIE_NAME not in request.COOKIES:
+        return True
+    return not request.user.is_authenticated
+
+
+def cache_anonymous_page(page, tables=()):
+    """
+    Декоратор view: кэширует ответ для анонимных GET-запросов.
+    tables — таблицы (product, promotion, ...), при изменении которых страница устаревает.
+    """
+    names = [f'table:main.{table}' for table in tables]
+    volatile = any(table in VOLATILE_TABLES for table in tables)
+    ttl = min(PAGE_CACHE_TTL, VOLATILE_TTL) if volatile else PAGE_CACHE_TTL
+    _pages.add(page)
+
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(request, *args, **kwargs):
+            if request.method not in ('GET', 'HEAD') or not _is_anonymous(request) \
+                    or has_pending_messages(request):
+                return view(request, *args, **kwargs)
+
+            current = versions.get_versions(names)
+            parts = [request.path, normalize_query(request.GET)]
+            parts += [f'{name}={current[name][0]}' for name in names]
+            if volatile:
+                parts.append(f'volatile={volatile_window()}')
+            state = '|'.join(parts)
+            key = f'page_cache:{page}:{hashlib.md5(state.encode()).hexdigest()}'
+            cached = cache.get(key)
+            if cached is not None:
+                _count(page, 'hits')
+                content, content_type = cached
+                # Свой CSRF-cookie посетителю выдается как при обычной отрисовке
+                get_token(request)
+                return HttpResponse(content, content_type=content_type)
+
+            _count(page, 'misses')
+            response = view(request, *args, **kwargs)
+            if response.status_code == 200 and not response.streaming:
+                if hasattr(response, 'render') and callable(response.render):
+                    response.render()
+                cache.set(key, (response.content, response['Content-Type']), ttl)
+            return response
+        return wrapper
+    return decorator
+
+
+def get_stats():
+    """Статистика по страницам: {page: {'hits': n, 'misses': n}}"""
+    keys = [_stats_key(page, kind) for page in sorted(_pages) for kind in ('hits', 'misses')]
+    values = cache.get_many(keys)
+    return {
+        page: {kind: values.get(_stats_key(page, kind), 0) for kind in ('hits', 'misses')}
+        for page in sorted(_pages)
+    }
+
+
+def reset_stats():
+    """Обнуляет счетчики попаданий и промахов"""
+    cache.delete_many([_stats_key(page, kind) for page in _pages for kind in ('hits', 'misses')])
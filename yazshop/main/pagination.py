@@ -0,0 +1,128 @@
+"""
+Курсорная (keyset) пагинация.
+
+Вместо OFFSET и COUNT(*) следующая страница выбирается условием
+(field, id) < (последнее значение, последний id), поэтому стоимость любой
+страницы одинакова. Курсор — непрозрачная строка base64 с позицией и направлением.
+"""
+import base64
+import json
+from datetime import datetime, date
+from decimal import Decimal
+
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+
+
+class InvalidCursor(ValueError):
+    """Курсор поврежден или не подходит к списку"""
+
+
+def encode_cursor(value, pk, direction='next'):
+    """Кодирует позицию (значение поля сортировки, id) в курсор"""
+    if isinstance(value, (datetime, date)):
+        value = value.isoformat()
+    elif isinstance(value, Decimal):
+        value = str(value)
+    payload = json.dumps({'v': value, 'id': pk, 'd': direction}, separators=(',', ':'))
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    """Декодирует курсор. Возвращает (value, id, direction)."""
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded.encode()).decode())
+        direction = payload.get('d', 'next')
+        if direction not in ('next', 'prev'):
+            raise InvalidCursor('Неверный курсор')
+        return payload['v'], int(payload['id']), direction
+    except (ValueError, KeyError, TypeError, AttributeError) as e:
+        raise InvalidCursor('Неверный курсор') from e
+
+
+class CursorPage:
+    """Страница курсорной пагинации"""
+
+    def __init__(self, object_list, next_cursor=None, previous_cursor=None):
+        self.object_list = object_list
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def has_previous(self):
+        return self.previous_cursor is not None
+
+    def as_dict(self):
+        return {
+            'next_cursor': self.next_cursor,
+            'previous_cursor': self.previous_cursor,
+            'has_next': self.has_next(),
+            'has_previous': self.has_previous(),
+        }
+
+
+def is_cursor_mode(request):
+    """Курсорный режим включается параметром ?cursor= (в том числе пустым)"""
+    return 'cursor' in request.GET
+
+
+def _position(item, field):
+    # Строки .values() — словари, остальные элементы — модели
+    if isinstance(item, dict):
+        return item[field], item['id']
+    return getattr(item, field), item.pk
+
+
+def paginate_by_cursor(queryset, cursor, page_size, field='created_at', descending=True):
+    """
+    Возвращает CursorPage для queryset, отсортированного по (field, id)
+    (по умолчанию по убыванию). Пустой cursor означает первую страницу.
+    queryset может быть и .values(): тогда в строках должны быть field и id.
+    При неверном курсоре — InvalidCursor.
+    """
+    direction = 'next'
+    if cursor:
+        value, pk, direction = decode_cursor(cursor)
+        model_field = queryset.model._meta.get_field(field)
+        if model_field.get_internal_type() == 'DateTimeField':
+            parsed = parse_datetime(value) if isinstance(value, str) else None
+            if parsed is None:
+                raise InvalidCursor('Неверный курсор')
+            value = parsed
+        # Вперед по убывающей сортировке — это значения меньше курсора
+        lookup = 'lt' if (direction == 'next') == descending else 'gt'
+        queryset = queryset.filter(
+            Q(**{f'{field}__{lookup}': value}) | Q(**{field: value, f'pk__{lookup}': pk})
+        )
+
+    if (direction == 'next') == descending:
+        queryset = queryset.order_by(f'-{field}', '-pk')
+    else:
+        queryset = queryset.order_by(field, 'pk')
+
+    items = list(queryset[:page_size + 1])
+    has_more = len(items) > page_size
+    items = items[:page_size]
+    if direction == 'prev':
+        items.reverse()
+
+    if not items:
+        return CursorPage([])
+
+    first, last = _position(items[0], field), _position(items[-1], field)
+    if direction == 'next':
+        next_cursor = encode_cursor(*last, 'next') if has_more else None
+        previous_cursor = encode_cursor(*first, 'prev') if cursor else None
+    else:
+        next_cursor = encode_cursor(*last, 'next')
+        previous_cursor = encode_cursor(*first, 'prev') if has_more else None
+    return CursorPage(items, next_cursor, previous_cursor)
@@ -0,0 +1,229 @@
+"""
+Оформление заказа из корзины: позиции, списание остатков, чек.
+
+Используется страницей оформления заказа (views.checkout) и API заказов
+(OrderAPIView.post) внутри их транзакции. Количество запросов не зависит от
+числа позиций:
+
+- позиции заказа и строки чека создаются через bulk_create;
+- остатки размеров и товаров списываются одним UPDATE на таблицу вида
+  SET stock = stock - n WHERE id = ... AND stock >= n. Если хотя бы одна
+  строка не обновилась (остаток кончился, пока покупатель оформлял заказ),
+  выбрасывается OutOfStock и транзакция откатывается целиком, поэтому
+  продать больше, чем есть на складе, нельзя даже при параллельных заказах;
+- корзина очищается одним DELETE;
+- чек, поступление на счет организации и запись в журнал действий
+  выполняются после коммита через outbox (after_checkout).
+"""
+from collections import defaultdict
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import Case, When, Value, F, Q, IntegerField, BooleanField
+
+from . import changes, facets, ledger, membership, outbox, pricing, popularity, related
+from .helpers import _client_ip, _log_activity
+
+
+class OutOfStock(Exception):
+    """Остатка не хватает хотя бы для одной позиции"""
+
+    def __init__(self, errors):
+        self.errors = errors
+        super().__init__('; '.join(errors))
+
+
+def cart_items(cart):
+    """Позиции корзины вместе с товарами и размерами (один запрос)"""
+    return list(cart.items.select_related('product', 'size'))
+
+
+def stock_errors(items):
+    """Сообщения о нехватке остатков для позиций корзины"""
+    errors = []
+    for item in items:
+        if item.product is None:
+            errors.append('Товар из корзины больше не продается')
+        elif item.size:
+            if item.size.size_stock < item.quantity:
+                errors.append(f"Товар '{item.product.product_name}' размера {item.size.size_label}: недостаточно на складе (доступно: {item.size.size_stock}, запрошено: {item.quantity})")
+        elif item.product.stock_quantity < item.quantity:
+            errors.append(f"Товар '{item.product.product_name}': недостаточно на складе (доступно: {item.product.stock_quantity}, запрошено: {item.quantity})")
+    return errors
+
+
+def _guarded_decrement(queryset, field, quantities, extra=None):
+    """
+    Уменьшает field у строк quantities ({id: n}) одним UPDATE, только если
+    остатка хватает у каждой. Возвращает True, если обновлены все строки.
+    """
+    if not quantities:
+        return True
+    condition = Q()
+    for pk, quantity in quantities.items():
+        condition |= Q(pk=pk, **{f'{field}__gte': quantity})
+    values = {
+        field: Case(
+            *[When(pk=pk, then=F(field) - quantity) for pk, quantity in quantities.items()],
+            output_field=IntegerField(),
+        ),
+    }
+    values.update(extra or {})
+    return queryset.filter(condition).update(**values) == len(quantities)
+
+
+def decrement_stock(items):
+    """Списывает остатки по позициям; при нехватке — OutOfStock (транзакцию откатывает вызывающий)"""
+    from .models import Product, ProductSize
+
+    size_quantities = defaultdict(int)
+    product_quantities = defaultdict(int)
+    for item in items:
+        if item.size_id:
+            size_quantities[item.size_id] += item.quantity
+        product_quantities[item.product_id] += item.quantity
+
+    # Товар, у которого списывается весь остаток, снимается с продажи (как в Product.save)
+    sold_out = Case(
+        *[When(pk=pk, stock_quantity__lte=quantity, then=Value(False))
+          for pk, quantity in product_quantities.items()],
+        default=F('is_available'),
+        output_field=BooleanField(),
+    )
+    if not (_guarded_decrement(ProductSize.objects.all(), 'size_stock', size_quantities)
+            and _guarded_decrement(Product.objects.all(), 'stock_quantity', product_quantities,
+                                   {'is_available': sold_out})):
+        # Сообщения строятся по актуальным остаткам; сама транзакция будет откатана
+        for item in items:
+            item.product.refresh_from_db(fields=['stock_quantity'])
+            if item.size:
+                item.size.refresh_from_db(fields=['size_stock'])
+        raise OutOfStock(stock_errors(items) or ['Товар закончился во время оформления заказа'])
+
+    # Массовые UPDATE не вызывают сигналов: журнал изменений и фасеты обновляются
+    # здесь (товары — в ProductQuerySet.update). Версии таблиц остатки не меняют
+    # (см. conditional.py)
+    changes.record('productsize', size_quantities)
+    product_ids = list(product_quantities)
+    transaction.on_commit(lambda: facets.refresh_products(product_ids))
+
+
+def place_items(order, items):
+    """
+    Создает позиции заказа по позициям корзины, списывает остатки и учитывает
+    продажи в популярности и совместных покупках. Вызывается внутри transaction.atomic.
+    """
+    from .models import OrderItem
+
+    items = [item for item in items if item.product_id is not None]
+    order_items = OrderItem.objects.bulk_create([
+        OrderItem(
+            order=order,
+            product=item.product,
+            size=item.size,
+            quantity=item.quantity,
+            unit_price=item.unit_price,
+        )
+        for item in items
+    ])
+    decrement_stock(items)
+    popularity.record_sale(((item.product_id, item.quantity) for item in items), order.created_at)
+    related.record_products(item.product_id for item in items)
+    return order_items
+
+
+def clear_cart(cart):
+    """
+    Очищает корзину одним DELETE. Сигналы CartItem при массовом удалении
+    сбрасывали бы кэши по запросу на позицию, поэтому кэши сбрасываются здесь.
+    """
+    from .models import CartItem
+
+    queryset = CartItem.objects.filter(cart=cart)
+    queryset._raw_delete(queryset.db)
+    membership.invalidate(cart.user_id)
+    pricing.invalidate_cart(cart.pk)
+
+
+def create_receipt(order, payment_method):
+    """Чек заказа по сохраненным суммам заказа: позиции и доставка одной вставкой"""
+    from .models import Receipt, ReceiptItem
+
+    items = list(order.items.select_related('product'))
+    subtotal = sum((item.unit_price * item.quantity for item in items), Decimal('0'))
+    receipt = Receipt.objects.create(
+        user=order.user,
+        order=order,
+        status='executed',
+        total_amount=order.total_amount,
+        subtotal=pricing.money(subtotal),
+        delivery_cost=order.delivery_cost,
+        discount_amount=order.discount_amount,
+        vat_rate=order.vat_rate,
+        vat_amount=order.vat_amount,
+        payment_method=payment_method if payment_method in ['cash', 'balance', 'card'] else 'card'
+    )
+
+    lines = []
+    for item in items:
+        line_total = pricing.money(item.unit_price * item.quantity)
+        lines.append(ReceiptItem(
+            receipt=receipt,
+            product_name=item.product.product_name if item.product else 'Товар',
+            article=str(item.product_id or ''),
+            quantity=item.quantity,
+            unit_price=item.unit_price,
+            line_total=line_total,
+            vat_amount=pricing.percent_of(line_total, order.vat_rate),
+        ))
+    lines.append(ReceiptItem(
+        receipt=receipt,
+        product_name='Доставка',
+        article='DELIVERY',
+        quantity=1,
+        unit_price=order.delivery_cost,
+        line_total=order.delivery_cost,
+        vat_amount=pricing.percent_of(order.delivery_cost, order.vat_rate),
+    ))
+    ReceiptItem.objects.bulk_create(lines)
+    return receipt
+
+
+# ----- После оформления -----
+
+def order_key(order_id):
+    """Ключ событий outbox заказа"""
+    return f'order:{order_id}'
+
+
+def after_checkout(order, payment_method, credit, request=None):
+    """
+    Чек, поступление на счет организации (credit — платеж прошел и не
+    наличными) и запись в журнал действий не нужны до ответа покупателю:
+    они записываются событием в транзакцию заказа и выполняются после
+    коммита воркером outbox.
+    """
+    outbox.enqueue('order.placed', {
+        'order_id': order.pk,
+        'payment_method': payment_method,
+        'credit': bool(credit),
+        'ip_address': _client_ip(request),
+    }, key=order_key(order.pk))
+
+
+@outbox.handler('order.placed')
+def finish_order(payload):
+    """Обработчик события оформления заказа; повторный вызов ничего не дублирует"""
+    from .models import Order, Receipt
+
+    order = Order.objects.select_related('user').filter(pk=payload['order_id']).first()
+    if order is None:
+        return
+
+    if not Receipt.objects.filter(order=order).exists():
+        create_receipt(order, payload['payment_method'])
+    if payload['credit'] and not order.org_transactions.filter(transaction_type='order_payment').exists():
+        ledger.credit_order(order, order.total_amount, order.tax_amount, order.user)
+    # Отметка о выполнении события в той же транзакции, поэтому запись не повторится
+    _log_activity(order.user, 'create', f'order_{order.pk}', f'Создан заказ на сумму {order.total_amount} ₽',
+                  ip_address=payload.get('ip_address'))
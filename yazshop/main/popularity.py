@@ -0,0 +1,106 @@
+"""
+Популярность товаров по скорости продаж.
+
+Оценка — количество проданных единиц с экспоненциальным затуханием по времени
+(период полураспада POPULARITY_HALF_LIFE_DAYS). Чтобы не пересчитывать все
+товары при течении времени, вес продажи отсчитывается от фиксированной эпохи:
+продажа в момент t добавляет quantity * 2 ** ((t - EPOCH) / half_life).
+Порядок товаров по такой сумме совпадает с порядком по затухающей оценке
+на текущий момент, а отмена заказа вычитает ровно тот же вес.
+"""
+import math
+from collections import defaultdict
+from datetime import datetime, timezone as dt_timezone
+
+from django.conf import settings
+from django.db.models import Case, F, FloatField, Value, When
+
+HALF_LIFE_DAYS = getattr(settings, 'POPULARITY_HALF_LIFE_DAYS', 14)
+
+# Точка отсчета весов. При периоде 14 дней значения float хватает примерно на 39 лет
+EPOCH = datetime(2025, 1, 1, tzinfo=dt_timezone.utc)
+
+
+def sale_weight(sold_at):
+    """Вес одной проданной единицы в момент sold_at"""
+    days = (sold_at - EPOCH).total_seconds() / 86400
+    return math.pow(2.0, days / HALF_LIFE_DAYS)
+
+
+def decayed_score(stored_score, now=None):
+    """Переводит сохраненную оценку в «единицы продаж» на момент now (для отображения)"""
+    from django.utils import timezone
+    return stored_score / sale_weight(now or timezone.now())
+
+
+def _update(amounts):
+    """Прибавляет к оценкам товаров amounts ({product_id: приращение}) одним UPDATE"""
+    from .models import Product
+
+    if not amounts:
+        return
+    Product.objects.filter(pk__in=amounts).update(
+        popularity_score=F('popularity_score') + Case(
+            *[When(pk=product_id, then=Value(amount)) for product_id, amount in amounts.items()],
+            output_field=FloatField(),
+        )
+    )
+
+
+def _apply(items, sold_at, sign):
+    weight = sale_weight(sold_at) * sign
+    amounts = defaultdict(float)
+    for product_id, quantity in items:
+        if product_id is not None:
+            amounts[product_id] += weight * quantity
+    # Все товары заказа одним UPDATE
+    _update(amounts)
+
+
+def record_sale(items, sold_at):
+    """Учитывает продажу: items — пары (product_id, quantity)"""
+    _apply(items, sold_at, 1)
+
+
+def revert_sale(items, sold_at):
+    """Отменяет учет продажи (отмена заказа)"""
+    _apply(items, sold_at, -1)
+
+
+def order_items(order):
+    return list(order.items.values_list('product_id', 'quantity'))
+
+
+def record_order(order):
+    """Учитывает все позиции заказа"""
+    record_sale(order_items(order), order.created_at)
+
+
+def revert_order(order):
+    """Убирает позиции отмененного заказа из популярности"""
+    revert_sale(order_items(order), order.created_at)
+
+
+def revert_orders(rows):
+    """
+    Убирает из популярности позиции нескольких отмененных заказов одним
+    UPDATE: rows — тройки (product_id, quantity, дата заказа)
+    """
+    amounts = defaultdict(float)
+    for product_id, quantity, sold_at in rows:
+        if product_id is not None:
+            amounts[product_id] -= sale_weight(sold_at) * quantity
+    _update(amounts)
+
+
+def compute_scores():
+    """Считает оценки по всей истории неотмененных заказов: {product_id: score}"""
+    from .models import OrderItem
+
+    scores = defaultdict(float)
+    rows = OrderItem.objects.exclude(order__order_status='cancelled').filter(
+        product__isnull=False
+    ).values_list('product_id', 'quantity', 'order__created_at')
+    for product_id, quantity, created_at in rows.iterator(chunk_size=2000):
+        scores[product_id] += quantity * sale_weight(created_at)
+    return scores
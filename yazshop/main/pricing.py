@@ -0,0 +1,168 @@
+"""
+Расчет итогов заказа по корзине.
+
+Одни и те же правила используют страница оформления заказа (GET и POST),
+API заказов, проверка промокода и обновление количества в корзине:
+
+    скидка      = товары * процент промокода
+    до НДС      = товары - скидка + доставка
+    НДС         = до НДС * VAT_RATE
+    итого       = до НДС + НДС
+    налог       = итого * PROFIT_TAX_RATE (резервируется на счете организации)
+
+Суммы округляются до копеек на каждом шаге. Сумма, количество и число позиций
+корзины считаются одним агрегатным запросом и кэшируются по корзине; кэш
+сбрасывается сигналами CartItem (signals.py) после коммита, так что любое
+добавление, удаление, смена количества или размера его инвалидирует.
+Кэш нужен только для отображения: сброс в одном воркере может дойти до
+остальных с опозданием, поэтому оформление заказа считает итоги по тем же
+загруженным позициям, из которых создается заказ (items_summary).
+Цена позиции фиксируется в CartItem.unit_price при добавлении, поэтому
+изменение цены товара на итоги уже собранной корзины не влияет.
+"""
+from decimal import Decimal, ROUND_HALF_UP
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Count, F, Sum
+from django.utils import timezone
+
+DELIVERY_COST = Decimal(str(getattr(settings, 'DELIVERY_COST', '1000.00')))
+VAT_RATE = Decimal(str(getattr(settings, 'VAT_RATE', '20.00')))
+PROFIT_TAX_RATE = Decimal(str(getattr(settings, 'PROFIT_TAX_RATE', '13.00')))
+
+CART_SUMMARY_TTL = getattr(settings, 'CART_SUMMARY_CACHE_TTL', 600)
+
+CENT = Decimal('0.01')
+
+
+class PromoError(ValueError):
+    """Промокод не действует"""
+
+
+class PromoNotFound(PromoError):
+    """Промокода с таким кодом нет"""
+
+
+def money(value):
+    """Округляет сумму до копеек"""
+    return Decimal(value).quantize(CENT, rounding=ROUND_HALF_UP)
+
+
+def percent_of(amount, rate):
+    """rate процентов от amount, с округлением до копеек"""
+    return money(amount * rate / Decimal('100'))
+
+
+class OrderSummary:
+    """Итоги заказа для суммы товаров subtotal и скидки discount_percent"""
+
+    def __init__(self, subtotal, discount_percent=None, item_count=0, line_count=0):
+        self.subtotal = money(subtotal or 0)
+        self.item_count = item_count
+        self.line_count = line_count
+        self.discount_percent = Decimal(discount_percent or 0)
+        self.discount_amount = percent_of(self.subtotal, self.discount_percent)
+        self.subtotal_after_discount = self.subtotal - self.discount_amount
+        self.delivery_cost = DELIVERY_COST
+        self.delivery_vat = percent_of(self.delivery_cost, VAT_RATE)
+        self.vat_rate = VAT_RATE
+        self.pre_vat_amount = self.subtotal_after_discount + self.delivery_cost
+        self.vat_amount = percent_of(self.pre_vat_amount, VAT_RATE)
+        self.total = money(self.pre_vat_amount + self.vat_amount)
+        self.tax_rate = PROFIT_TAX_RATE
+        self.tax_amount = percent_of(self.total, PROFIT_TAX_RATE)
+
+    def with_promo(self, promo):
+        """Те же товары со скидкой промокода promo (или без скидки)"""
+        return OrderSummary(self.subtotal, promo.discount if promo else None, self.item_count, self.line_count)
+
+    def line_vat(self, line_total):
+        """НДС позиции чека"""
+        return percent_of(line_total, VAT_RATE)
+
+    def as_dict(self):
+        return {
+            'subtotal': str(self.subtotal),
+            'discount_percent': str(self.discount_percent),
+            'discount': str(self.discount_amount),
+            'subtotal_after_discount': str(self.subtotal_after_discount),
+            'delivery': str(self.delivery_cost),
+            'vat_rate': str(self.vat_rate),
+            'vat_amount': str(self.vat_amount),
+            'total': str(self.total),
+            'item_count': self.item_count,
+            'line_count': self.line_count,
+        }
+
+
+# ----- Корзина -----
+
+def _key(cart_id):
+    return f'cart_summary:{cart_id}'
+
+
+def cart_totals(cart_id):
+    """(сумма товаров, количество единиц, число позиций) корзины — из кэша или одним запросом"""
+    from .models import CartItem
+
+    cached = cache.get(_key(cart_id))
+    if cached is not None:
+        return Decimal(cached[0]), cached[1], cached[2]
+
+    totals = CartItem.objects.filter(cart_id=cart_id).aggregate(
+        subtotal=Sum(F('unit_price') * F('quantity')),
+        quantity=Sum('quantity'),
+        lines=Count('id'),
+    )
+    subtotal = money(totals['subtotal'] or 0)
+    quantity = totals['quantity'] or 0
+    # Внутри транзакции данные могут еще откатиться, в кэш пишутся только зафиксированные
+    if not transaction.get_connection().in_atomic_block:
+        cache.set(_key(cart_id), (str(subtotal), quantity, totals['lines']), CART_SUMMARY_TTL)
+    return subtotal, quantity, totals['lines']
+
+
+def cart_summary(cart, promo=None):
+    """Итоги заказа по корзине с учетом промокода"""
+    subtotal, quantity, lines = cart_totals(cart.pk)
+    return OrderSummary(subtotal, promo.discount if promo else None, quantity, lines)
+
+
+def items_summary(items, promo=None):
+    """Итоги заказа по загруженным позициям корзины (без кэша) с учетом промокода"""
+    subtotal = sum((item.unit_price * item.quantity for item in items), Decimal('0'))
+    quantity = sum(item.quantity for item in items)
+    return OrderSummary(subtotal, promo.discount if promo else None, quantity, len(items))
+
+
+def invalidate_cart(cart_id):
+    """Сбрасывает закэшированные итоги корзины сейчас и после коммита текущей транзакции"""
+    if cart_id is None:
+        return
+    cache.delete(_key(cart_id))
+    transaction.on_commit(lambda: cache.delete(_key(cart_id)))
+
+
+# ----- Промокоды -----
+
+def get_promo(code):
+    """Действующий промокод по коду; иначе PromoError с причиной"""
+    from .models import Promotion
+
+    code = (code or '').strip().upper()
+    if not code:
+        raise PromoError('Введите промокод')
+    try:
+        promo = Promotion.objects.get(promo_code=code)
+    except Promotion.DoesNotExist:
+        raise PromoNotFound('Неверный промокод')
+    if not promo.is_active:
+        raise PromoError('Промокод неактивен')
+    today = timezone.now().date()
+    if promo.start_date and promo.start_date > today:
+        raise PromoError('Промокод еще не действует')
+    if promo.end_date and promo.end_date < today:
+        raise PromoError('Промокод истек')
+    return promo
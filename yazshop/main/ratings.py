@@ -0,0 +1,65 @@
+"""
+Денормализованная сводка отзывов товара.
+
+Средняя оценка, количество отзывов и гистограмма 1–5 хранятся в Product и
+обновляются одним UPDATE с F()-выражениями при создании, изменении и удалении
+отзыва (сигналы в signals.py), поэтому каталог и модальное окно не выполняют
+агрегаты по ProductReview. Расхождения исправляет команда reconcile_ratings.
+"""
+from django.db.models import F, Value, FloatField
+from django.db.models.functions import Cast, Coalesce, NullIf
+
+RATING_VALUES = (1, 2, 3, 4, 5)
+
+
+def apply_review_change(product_id, old_rating=None, new_rating=None):
+    """
+    Учитывает изменение отзыва в сводке товара.
+    old_rating=None — отзыв добавлен, new_rating=None — отзыв удален.
+    """
+    from .models import Product
+
+    if old_rating == new_rating:
+        return
+    count_delta = (new_rating is not None) - (old_rating is not None)
+    sum_delta = (new_rating or 0) - (old_rating or 0)
+
+    updates = {
+        'review_count': F('review_count') + count_delta,
+        'rating_sum': F('rating_sum') + sum_delta,
+        # В UPDATE правая часть видит старые значения столбцов
+        'avg_rating': Coalesce(
+            Cast(F('rating_sum') + sum_delta, FloatField()) / NullIf(F('review_count') + count_delta, 0),
+            Value(0.0),
+            output_field=FloatField(),
+        ),
+    }
+    if old_rating in RATING_VALUES:
+        updates[f'rating_{old_rating}'] = F(f'rating_{old_rating}') - 1
+    if new_rating in RATING_VALUES:
+        updates[f'rating_{new_rating}'] = F(f'rating_{new_rating}') + 1
+
+    Product.objects.filter(pk=product_id).update(**updates)
+
+
+def compute_summaries(product_ids=None):
+    """Считает сводку по таблице отзывов: {product_id: {поле: значение}}"""
+    from django.db.models import Count, Sum, Q
+    from .models import ProductReview
+
+    qs = ProductReview.objects.all()
+    if product_ids is not None:
+        qs = qs.filter(product_id__in=product_ids)
+    aggregates = {
+        'review_count': Count('id'),
+        'rating_sum': Coalesce(Sum('rating_value'), 0),
+    }
+    for value in RATING_VALUES:
+        aggregates[f'rating_{value}'] = Count('id', filter=Q(rating_value=value))
+
+    summaries = {}
+    for row in qs.values('product_id').annotate(**aggregates).order_by():
+        product_id = row.pop('product_id')
+        row['avg_rating'] = row['rating_sum'] / row['review_count'] if row['review_count'] else 0.0
+        summaries[product_id] = row
+    return summaries
@@ -0,0 +1,196 @@
+"""
+Товары, которые покупают вместе.
+
+Команда rebuild_related_products строит по истории неотмененных заказов
+разреженную матрицу совместных покупок: для каждой пары товаров — число
+заказов, в которых они встречаются вместе. Для каждого товара в таблице
+RelatedProduct хранятся только TOP_K соседей с наибольшим числом совместных
+заказов, поэтому выдача (/api/products/<id>/related/, окно товара в каталоге)
+— один запрос по индексу.
+
+Новые заказы учитываются сразу (record_order): счетчики уже сохраненных пар
+увеличиваются одним UPDATE, новые пары добавляются, пока у товара есть
+свободные места в top-K. Пары, не попавшие в top-K при построении, между
+перестроениями не отслеживаются, поэтому команду стоит запускать периодически.
+"""
+import heapq
+from collections import Counter, defaultdict
+from itertools import combinations
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Case, Count, F, IntegerField, Q, Value, When
+
+from . import versions
+
+TOP_K = getattr(settings, 'RELATED_PRODUCTS_TOP_K', 12)
+
+# Заказы с большим числом разных товаров (оптовые) не учитываются: пар в них
+# квадратично много, а связи между товарами они почти не отражают
+MAX_ORDER_PRODUCTS = 50
+
+
+def _bump():
+    from .models import RelatedProduct
+    versions.bump_on_commit(versions.table_name(RelatedProduct))
+
+
+def _basket(product_ids):
+    basket = {product_id for product_id in product_ids if product_id is not None}
+    return basket if 2 <= len(basket) <= MAX_ORDER_PRODUCTS else set()
+
+
+def order_baskets():
+    """Множества товаров неотмененных заказов (по одному на заказ)"""
+    from .models import OrderItem
+
+    rows = (OrderItem.objects.exclude(order__order_status='cancelled').filter(product__isnull=False)
+            .values_list('order_id', 'product_id').order_by('order_id'))
+    current_order, product_ids = None, []
+    for order_id, product_id in rows.iterator(chunk_size=5000):
+        if order_id != current_order:
+            if product_ids:
+                yield product_ids
+            current_order, product_ids = order_id, []
+        product_ids.append(product_id)
+    if product_ids:
+        yield product_ids
+
+
+def compute_neighbours(baskets, top_k=TOP_K):
+    """
+    Считает совместные покупки по корзинам и оставляет top_k соседей каждого
+    товара: {product_id: [(related_id, co_orders), ...]} по убыванию co_orders.
+    """
+    # Верхний треугольник разреженной матрицы: (a, b) при a < b
+    pairs = defaultdict(int)
+    for product_ids in baskets:
+        for pair in combinations(sorted(_basket(product_ids)), 2):
+            pairs[pair] += 1
+
+    # Куча минимальной длины top_k на товар; при равенстве выше товар с меньшим id
+    heaps = defaultdict(list)
+    for (a, b), count in pairs.items():
+        for product_id, related_id in ((a, b), (b, a)):
+            heap = heaps[product_id]
+            item = (count, -related_id)
+            if len(heap) < top_k:
+                heapq.heappush(heap, item)
+            elif item > heap[0]:
+                heapq.heapreplace(heap, item)
+
+    return {
+        product_id: [(-negative_id, count) for count, negative_id in sorted(heap, reverse=True)]
+        for product_id, heap in heaps.items()
+    }
+
+
+def rebuild(batch_size=2000):
+    """Перестраивает таблицу соседей по всей истории заказов. Возвращает количество товаров."""
+    from .models import RelatedProduct
+
+    neighbours = compute_neighbours(order_baskets())
+    with transaction.atomic():
+        RelatedProduct.objects.all().delete()
+        RelatedProduct.objects.bulk_create([
+            RelatedProduct(product_id=product_id, related_product_id=related_id, co_orders=count)
+            for product_id, related in neighbours.items()
+            for related_id, count in related
+        ], batch_size=batch_size)
+        _bump()
+    return len(neighbours)
+
+
+def record_products(product_ids):
+    """Учитывает новый заказ с товарами product_ids"""
+    from .models import RelatedProduct
+
+    basket = _basket(product_ids)
+    if not basket:
+        return
+    pairs = RelatedProduct.objects.filter(product_id__in=basket, related_product_id__in=basket)
+    pairs.update(co_orders=F('co_orders') + 1)
+
+    existing = set(pairs.values_list('product_id', 'related_product_id'))
+    sizes = dict(
+        RelatedProduct.objects.filter(product_id__in=basket)
+        .values('product_id').annotate(size=Count('id')).values_list('product_id', 'size')
+    )
+    new_pairs = []
+    for product_id in basket:
+        room = TOP_K - sizes.get(product_id, 0)
+        for related_id in sorted(basket - {product_id}):
+            if room <= 0:
+                break
+            if (product_id, related_id) not in existing:
+                new_pairs.append(RelatedProduct(product_id=product_id, related_product_id=related_id, co_orders=1))
+                room -= 1
+    RelatedProduct.objects.bulk_create(new_pairs, ignore_conflicts=True)
+    _bump()
+
+
+def revert_products(product_ids):
+    """Убирает отмененный заказ с товарами product_ids"""
+    from .models import RelatedProduct
+
+    basket = _basket(product_ids)
+    if not basket:
+        return
+    pairs = RelatedProduct.objects.filter(product_id__in=basket, related_product_id__in=basket)
+    pairs.update(co_orders=F('co_orders') - 1)
+    pairs.filter(co_orders__lte=0).delete()
+    _bump()
+
+
+def revert_baskets(baskets, batch_size=500):
+    """
+    Убирает несколько отмененных заказов (baskets — наборы товаров по
+    заказам): счетчики пар уменьшаются на число заказов с этой парой
+    одним UPDATE на batch_size пар
+    """
+    from .models import RelatedProduct
+
+    counts = Counter()
+    for product_ids in baskets:
+        basket = _basket(product_ids)
+        counts.update((a, b) for a in basket for b in basket if a != b)
+    if not counts:
+        return
+    pairs = list(counts.items())
+    for start in range(0, len(pairs), batch_size):
+        chunk = pairs[start:start + batch_size]
+        condition = Q()
+        for (product_id, related_id), _ in chunk:
+            condition |= Q(product_id=product_id, related_product_id=related_id)
+        RelatedProduct.objects.filter(condition).update(co_orders=F('co_orders') - Case(
+            *[When(product_id=product_id, related_product_id=related_id, then=Value(count))
+              for (product_id, related_id), count in chunk],
+            output_field=IntegerField(),
+        ))
+    RelatedProduct.objects.filter(product_id__in={product_id for product_id, _ in counts}, co_orders__lte=0).delete()
+    _bump()
+
+
+def order_products(order):
+    return list(order.items.values_list('product_id', flat=True))
+
+
+def record_order(order):
+    """Учитывает все товары заказа"""
+    record_products(order_products(order))
+
+
+def revert_order(order):
+    """Убирает товары отмененного заказа из совместных покупок"""
+    revert_products(order_products(order))
+
+
+def related_ids(product_id, limit=TOP_K):
+    """id доступных товаров, которые чаще всего покупают вместе с product_id"""
+    from .models import RelatedProduct
+
+    return list(
+        RelatedProduct.objects.filter(product_id=product_id, related_product__is_available=True)
+        .order_by('-co_orders', 'related_product_id')
+        .values_list('related_product_id', flat=True)[:limit]
+    )
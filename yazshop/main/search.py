@@ -0,0 +1,232 @@
+"""
+Полнотекстовый поиск по товарам каталога.
+
+На SQLite индекс хранится в виртуальной таблице FTS5, на PostgreSQL — в таблице
+с колонкой tsvector и GIN-индексом. Индекс обновляется сигналами модели Product
+(см. signals.py) и полностью перестраивается командой rebuild_search_index.
+Если индекс отсутствует, поиск откатывается на icontains.
+"""
+import re
+
+from django.db import connection, transaction, DatabaseError
+from django.db.models import Case, When, Q, IntegerField
+from django.db.models.expressions import RawSQL
+
+SQLITE_TABLE = 'main_product_fts'
+POSTGRES_TABLE = 'main_product_search'
+
+_WORD_RE = re.compile(r'\w+', re.UNICODE)
+_CYRILLIC_RE = re.compile(r'[а-я]')
+
+# Окончания для упрощенного русского стемминга (от длинных к коротким)
+_RU_ENDINGS = sorted([
+    'иями', 'ями', 'ами', 'иях', 'ях', 'ах', 'ией', 'ей', 'ой', 'ий', 'ый',
+    'ого', 'его', 'ому', 'ему', 'ыми', 'ими', 'ых', 'их', 'ая', 'яя', 'ое',
+    'ее', 'ые', 'ие', 'ую', 'юю', 'ом', 'ем', 'ам', 'ям', 'ов', 'ев', 'ию',
+    'ью', 'ия', 'ья', 'ье', 'ость', 'ости', 'ы', 'и', 'а', 'я', 'о', 'е',
+    'у', 'ю', 'ь', 'й',
+], key=len, reverse=True)
+
+# Кэш наличия индекса: (alias, vendor) -> bool
+_index_state = {}
+
+
+def stem(word):
+    """Приводит слово к упрощенной основе (нижний регистр, ё -> е, без окончания)"""
+    word = word.lower().replace('ё', 'е')
+    if len(word) <= 4 or not _CYRILLIC_RE.search(word):
+        return word
+    for ending in _RU_ENDINGS:
+        if word.endswith(ending) and len(word) - len(ending) >= 3:
+            return word[:-len(ending)]
+    return word
+
+
+def tokenize(text):
+    """Разбивает текст на основы слов"""
+    if not text:
+        return []
+    return [stem(word) for word in _WORD_RE.findall(text)]
+
+
+def _document(text):
+    return ' '.join(tokenize(text))
+
+
+def _vendor():
+    return connection.vendor
+
+
+def index_available():
+    """Проверяет, создан ли поисковый индекс для текущей базы данных"""
+    key = (connection.alias, connection.vendor)
+    if key not in _index_state:
+        table = SQLITE_TABLE if connection.vendor == 'sqlite' else POSTGRES_TABLE
+        try:
+            _index_state[key] = table in connection.introspection.table_names()
+        except DatabaseError:
+            _index_state[key] = False
+    return _index_state[key]
+
+
+def reset_index_state():
+    """Сбрасывает кэш наличия индекса (после миграции или перестроения)"""
+    _index_state.clear()
+
+
+def index_product(product):
+    """Добавляет или обновляет товар в поисковом индексе"""
+    if not index_available():
+        return
+    with connection.cursor() as cursor:
+        if _vendor() == 'sqlite':
+            cursor.execute(f'DELETE FROM {SQLITE_TABLE} WHERE rowid = %s', [product.pk])
+            cursor.execute(
+                f'INSERT INTO {SQLITE_TABLE} (rowid, product_name, product_description) VALUES (%s, %s, %s)',
+                [product.pk, _document(product.product_name), _document(product.product_description)]
+            )
+        elif _vendor() == 'postgresql':
+            cursor.execute(
+                f"""
+                INSERT INTO {POSTGRES_TABLE} (product_id, document)
+                VALUES (%s, setweight(to_tsvector('russian', %s), 'A') || setweight(to_tsvector('russian', %s), 'B'))
+                ON CONFLICT (product_id) DO UPDATE SET document = EXCLUDED.document
+                """,
+                [product.pk, product.product_name or '', product.product_description or '']
+            )
+
+
+def remove_product(product_id):
+    """Удаляет товар из поискового индекса"""
+    if not index_available():
+        return
+    with connection.cursor() as cursor:
+        if _vendor() == 'sqlite':
+            cursor.execute(f'DELETE FROM {SQLITE_TABLE} WHERE rowid = %s', [product_id])
+        elif _vendor() == 'postgresql':
+            cursor.execute(f'DELETE FROM {POSTGRES_TABLE} WHERE product_id = %s', [product_id])
+
+
+def rebuild_index():
+    """Полностью перестраивает поисковый индекс. Возвращает количество товаров."""
+    from .models import Product
+
+    reset_index_state()
+    if not index_available():
+        return 0
+    count = 0
+    with transaction.atomic():
+        with connection.cursor() as cursor:
+            if _vendor() == 'sqlite':
+                cursor.execute(f'DELETE FROM {SQLITE_TABLE}')
+            elif _vendor() == 'postgresql':
+                cursor.execute(f'DELETE FROM {POSTGRES_TABLE}')
+        for product in Product.objects.only('id', 'product_name', 'product_description').iterator(chunk_size=500):
+            index_product(product)
+            count += 1
+    return count
+
+
+def _match(query):
+    """
+    SQL совпадений с запросом для текущей базы: (ids_sql, rank_sql, params,
+    descending). ids_sql выбирает id товаров, rank_sql — коррелированный
+    подзапрос релевантности строки main_product. None — индекс недоступен.
+    """
+    from .models import Product
+
+    if not index_available():
+        return None
+    product_id = f'{connection.ops.quote_name(Product._meta.db_table)}.{connection.ops.quote_name("id")}'
+    if _vendor() == 'sqlite':
+        terms = tokenize(query)
+        if not terms:
+            return None
+        # Префиксный поиск по каждой основе, все слова обязательны
+        match = ' '.join(f'"{term}"*' for term in terms)
+        return (
+            f'SELECT rowid FROM {SQLITE_TABLE} WHERE {SQLITE_TABLE} MATCH %s',
+            f'SELECT bm25({SQLITE_TABLE}, 10.0, 1.0) FROM {SQLITE_TABLE} '
+            f'WHERE {SQLITE_TABLE} MATCH %s AND rowid = {product_id}',
+            [match],
+            False,
+        )
+    if _vendor() == 'postgresql':
+        words = [word.lower() for word in _WORD_RE.findall(query or '')]
+        if not words:
+            return None
+        ts_query = ' & '.join(f'{word}:*' for word in words)
+        return (
+            f"SELECT product_id FROM {POSTGRES_TABLE} WHERE document @@ to_tsquery('russian', %s)",
+            f"SELECT ts_rank(document, to_tsquery('russian', %s)) FROM {POSTGRES_TABLE} "
+            f"WHERE product_id = {product_id}",
+            [ts_query],
+            True,
+        )
+    return None
+
+
+def search_product_ids(query, limit=None):
+    """
+    Возвращает id всех совпавших товаров (не больше limit, если он задан),
+    отсортированные по релевантности. None означает, что индекс недоступен
+    и нужно использовать icontains.
+    """
+    match = _match(query)
+    if match is None:
+        return None
+    ids_sql, _, params, _ = match
+    if _vendor() == 'sqlite':
+        sql = f'{ids_sql} ORDER BY bm25({SQLITE_TABLE}, 10.0, 1.0)'
+    else:
+        sql = f"{ids_sql} ORDER BY ts_rank(document, to_tsquery('russian', %s)) DESC"
+        params = params * 2
+    if limit is not None:
+        sql += ' LIMIT %s'
+        params = params + [limit]
+    try:
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.execute(sql, params)
+            return [row[0] for row in cursor.fetchall()]
+    except DatabaseError:
+        return None
+
+
+def rank_by_search(queryset, query):
+    """
+    Сортирует queryset товаров по релевантности запросу подзапросом к
+    индексу (без списка id в запросе). Без индекса queryset не меняется.
+    """
+    match = _match(query)
+    if match is None:
+        return queryset
+    _, rank_sql, params, descending = match
+    if 'search_rank' not in queryset.query.annotations:
+        queryset = queryset.annotate(search_rank=RawSQL(rank_sql, params))
+    return queryset.order_by('-search_rank' if descending else 'search_rank', 'pk')
+
+
+def filter_by_search(queryset, query, fields=('product_name', 'product_description')):
+    """
+    Фильтрует queryset товаров по поисковому запросу с сортировкой по релевантности.
+    Совпадения выбираются подзапросом к индексу, поэтому количество и
+    пагинация учитывают все найденные товары. Если индекс недоступен,
+    используется прежний поиск через icontains по fields.
+    """
+    match = _match(query)
+    if match is None:
+        condition = Q()
+        for field in fields:
+            condition |= Q(**{f'{field}__icontains': query})
+        return queryset.filter(condition)
+    ids_sql, _, params, _ = match
+    return rank_by_search(queryset.filter(pk__in=RawSQL(ids_sql, params)), query)
+
+
+def order_by_ids(queryset, ids):
+    """Сортирует queryset в порядке следования ids (по релевантности)"""
+    ranking = Case(
+        *[When(pk=pk, then=position) for position, pk in enumerate(ids)],
+        output_field=IntegerField()
+    )
+    return queryset.order_by(ranking)
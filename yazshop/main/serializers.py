@@ -6,6 +6,8 @@ from .models import (
 	SavedPaymentMethod, CardTransaction, BalanceTransaction, Receipt, ReceiptItem,
 	OrganizationAccount, OrganizationTransaction
 )
+from .images import describe
+from .pricing import cart_summary
 
 class RoleSerializer(serializers.ModelSerializer):
 	class Meta:
@@ -28,6 +30,12 @@ class CategorySerializer(serializers.ModelSerializer):
 		model = Category
 		fields = '__all__'
 
+	def validate_parent_category(self, value):
+		# Та же проверка, что в Category.save, но с ответом 400 вместо ошибки сервера
+		if value is not None and self.instance is not None and f'/{self.instance.pk}/' in (value.tree_path or ''):
+			raise serializers.ValidationError('Категория не может быть вложена в саму себя или в свою подкатегорию')
+		return value
+
 class BrandSerializer(serializers.ModelSerializer):
 	class Meta:
 		model = Brand
@@ -43,13 +51,32 @@ class ProductSizeSerializer(serializers.ModelSerializer):
 		model = ProductSize
 		fields = '__all__'
 
-class ProductSerializer(serializers.ModelSerializer):
+class SparseFieldsetMixin:
+	"""Оставляет только поля, перечисленные в аргументе fields или в ?fields= запроса"""
+	def __init__(self, *args, **kwargs):
+		fields = kwargs.pop('fields', None)
+		super().__init__(*args, **kwargs)
+		if fields is None:
+			request = self.context.get('request')
+			# На запись отдаем все поля, чтобы ?fields= не влиял на валидацию
+			if request is not None and request.method == 'GET' and request.GET.get('fields'):
+				fields = [name.strip() for name in request.GET['fields'].split(',') if name.strip()]
+		if fields:
+			for name in set(self.fields) - set(fields):
+				self.fields.pop(name)
+
+class ProductSerializer(SparseFieldsetMixin, serializers.ModelSerializer):
 	final_price = serializers.DecimalField(max_digits=10, decimal_places=2, read_only=True)
 	is_new = serializers.BooleanField(read_only=True)
+	# WebP-миниатюры по полям изображений: srcset, миниатюра и URL по ширинам
+	images = serializers.SerializerMethodField()
 	class Meta:
 		model = Product
 		fields = '__all__'
 
+	def get_images(self, obj):
+		return {slot: describe(variants) for slot, variants in obj.image_variants.items()}
+
 class TagSerializer(serializers.ModelSerializer):
 	class Meta:
 		model = Tag
@@ -66,10 +93,19 @@ class FavoriteSerializer(serializers.ModelSerializer):
 		fields = '__all__'
 
 class CartSerializer(serializers.ModelSerializer):
+	total_price = serializers.SerializerMethodField()
+	# Итоги оформления заказа без промокода: доставка, НДС, итого (pricing.py)
+	summary = serializers.SerializerMethodField()
 	class Meta:
 		model = Cart
 		fields = '__all__'
 
+	def get_total_price(self, obj):
+		return str(obj.total_price())
+
+	def get_summary(self, obj):
+		return cart_summary(obj).as_dict()
+
 class CartItemSerializer(serializers.ModelSerializer):
 	class Meta:
 		model = CartItem
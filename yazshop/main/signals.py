@@ -0,0 +1,272 @@
+"""
+Сигналы приложения main
+"""
+from django.db import transaction, DatabaseError
+from django.db.models import F, Value, CharField
+from django.db.models.functions import Concat, Substr
+from django.db.models.signals import pre_save, post_save, pre_delete, post_delete
+from django.dispatch import receiver
+
+from .models import (
+    Product, ProductTag, ProductSize, Category, ProductReview, Order, Brand, Tag,
+    Favorite, Cart, CartItem, Promotion, Supplier, ProductImage,
+)
+from . import search, facets, ratings, popularity, versions, suggest, membership, snapshot, changes, images, related, pricing
+
+# Поля товара, участвующие в поисковом индексе
+SEARCH_FIELDS = {'product_name', 'product_description'}
+
+
+@receiver(post_save, sender=Product)
+def update_product_search_index(sender, instance, created, update_fields=None, **kwargs):
+    """Обновляет товар в поисковом индексе после сохранения"""
+    if update_fields is not None and not SEARCH_FIELDS.intersection(update_fields):
+        return
+    try:
+        with transaction.atomic():
+            search.index_product(instance)
+    except DatabaseError:
+        # Ошибка индекса не должна мешать сохранению товара
+        pass
+
+
+@receiver(post_delete, sender=Product)
+def remove_product_from_search_index(sender, instance, **kwargs):
+    """Удаляет товар из поискового индекса"""
+    try:
+        with transaction.atomic():
+            search.remove_product(instance.pk)
+    except DatabaseError:
+        pass
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+def update_product_facets(sender, instance, **kwargs):
+    """Обновляет товар в битовом индексе фасетов после фиксации транзакции"""
+    product_id = instance.pk
+    transaction.on_commit(lambda: facets.refresh_product(product_id))
+
+
+@receiver(post_save, sender=ProductTag)
+@receiver(post_delete, sender=ProductTag)
+@receiver(post_save, sender=ProductSize)
+@receiver(post_delete, sender=ProductSize)
+def update_product_facets_by_relation(sender, instance, **kwargs):
+    """Обновляет фасеты товара при изменении его тегов и размеров"""
+    product_id = instance.product_id
+    transaction.on_commit(lambda: facets.refresh_product(product_id))
+
+
+@receiver(post_delete, sender=Category)
+def reroot_category_subtree(sender, instance, **kwargs):
+    """
+    После удаления категории ее подкатегории становятся корневыми (parent_category
+    обнуляется через SET_NULL), поэтому материализованные пути поддерева
+    укорачиваются на путь удаленной категории одним запросом.
+    """
+    old_path = instance.tree_path
+    if not old_path:
+        return
+    Category.objects.filter(tree_path__startswith=old_path).update(
+        tree_path=Concat(Value('/'), Substr('tree_path', len(old_path) + 1), output_field=CharField()),
+        depth=F('depth') - (instance.depth + 1),
+    )
+
+
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+def reset_facets_on_category_change(sender, instance, **kwargs):
+    """Изменение дерева категорий требует полного перестроения фасетов"""
+    transaction.on_commit(facets.invalidate)
+
+
+@receiver(pre_save, sender=ProductReview)
+def remember_previous_review_rating(sender, instance, raw=False, **kwargs):
+    """Запоминает прежние товар и оценку отзыва для обновления сводки"""
+    instance._previous_rating = None
+    if instance.pk and not raw:
+        instance._previous_rating = ProductReview.objects.filter(pk=instance.pk).values_list(
+            'product_id', 'rating_value'
+        ).first()
+
+
+@receiver(post_save, sender=ProductReview)
+def update_rating_summary_on_save(sender, instance, created, raw=False, **kwargs):
+    """Обновляет сводку отзывов товара в той же транзакции, что и отзыв"""
+    if raw:
+        return
+    previous = getattr(instance, '_previous_rating', None)
+    if created or previous is None:
+        ratings.apply_review_change(instance.product_id, None, instance.rating_value)
+    elif previous[0] != instance.product_id:
+        ratings.apply_review_change(previous[0], previous[1], None)
+        ratings.apply_review_change(instance.product_id, None, instance.rating_value)
+    else:
+        ratings.apply_review_change(instance.product_id, previous[1], instance.rating_value)
+
+
+@receiver(post_delete, sender=ProductReview)
+def update_rating_summary_on_delete(sender, instance, **kwargs):
+    """Убирает удаленный отзыв из сводки товара"""
+    ratings.apply_review_change(instance.product_id, instance.rating_value, None)
+
+
+@receiver(pre_save, sender=Order)
+def remember_previous_order_status(sender, instance, raw=False, **kwargs):
+    """Запоминает прежний статус заказа"""
+    instance._previous_status = None
+    if instance.pk and not raw:
+        instance._previous_status = Order.objects.filter(pk=instance.pk).values_list(
+            'order_status', flat=True
+        ).first()
+
+
+@receiver(post_save, sender=Order)
+def update_popularity_on_status_change(sender, instance, created, raw=False, **kwargs):
+    """
+    Отмена заказа (любым путем: пользователем, менеджером, через API) убирает
+    его продажи из популярности и совместных покупок, возврат из отмены — возвращает.
+    Новые заказы учитываются явно после создания позиций (popularity.record_order).
+    """
+    previous = getattr(instance, '_previous_status', None)
+    if raw or created or previous is None or previous == instance.order_status:
+        return
+    if instance.order_status == 'cancelled':
+        popularity.revert_order(instance)
+        related.revert_order(instance)
+    elif previous == 'cancelled':
+        popularity.record_order(instance)
+        related.record_order(instance)
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+@receiver(post_save, sender=Brand)
+@receiver(post_delete, sender=Brand)
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+@receiver(post_save, sender=Tag)
+@receiver(post_delete, sender=Tag)
+@receiver(post_save, sender=ProductTag)
+@receiver(post_delete, sender=ProductTag)
+def bump_catalog_version(sender, update_fields=None, **kwargs):
+    """Помечает устаревшими данные каталога, закэшированные в воркерах"""
+    if _only_volatile(sender, update_fields):
+        return
+    versions.bump_on_commit(suggest.VERSION_NAME)
+
+
+def _only_volatile(sender, update_fields):
+    """Сохранение товара меняет только остатки и счетчики (snapshot.VOLATILE_FIELDS)"""
+    return sender is Product and update_fields is not None and snapshot.VOLATILE_FIELDS.issuperset(update_fields)
+
+
+def bump_table_version(sender, update_fields=None, **kwargs):
+    """Увеличивает версию таблицы модели для ETag/Last-Modified (conditional.py)"""
+    if _only_volatile(sender, update_fields):
+        return
+    versions.bump_on_commit(versions.table_name(sender))
+
+
+for _model in (Product, ProductSize, ProductTag, Category, Brand, Tag, Promotion):
+    post_save.connect(bump_table_version, sender=_model, dispatch_uid=f'bump_table_version_save_{_model.__name__}')
+    post_delete.connect(bump_table_version, sender=_model, dispatch_uid=f'bump_table_version_delete_{_model.__name__}')
+
+
+def publish_catalog_snapshot(sender, update_fields=None, **kwargs):
+    """Ставит публикацию снимка каталога для воркеров (snapshot.py)"""
+    if _only_volatile(sender, update_fields):
+        # Остатки и счетчики снимок берет из БД
+        return
+    snapshot.schedule_publish()
+
+
+for _model in (Product, ProductSize, ProductTag, Category, Brand, Tag, Supplier):
+    post_save.connect(publish_catalog_snapshot, sender=_model,
+                      dispatch_uid=f'publish_catalog_snapshot_save_{_model.__name__}')
+    post_delete.connect(publish_catalog_snapshot, sender=_model,
+                        dispatch_uid=f'publish_catalog_snapshot_delete_{_model.__name__}')
+
+
+@receiver(post_save, sender=Favorite)
+@receiver(post_delete, sender=Favorite)
+def invalidate_favorites_membership(sender, instance, **kwargs):
+    """Сбрасывает закэшированный набор избранного пользователя"""
+    membership.invalidate(instance.user_id)
+
+
+@receiver(post_save, sender=CartItem)
+@receiver(post_delete, sender=CartItem)
+def invalidate_cart_membership(sender, instance, **kwargs):
+    """Сбрасывает закэшированный набор корзины пользователя"""
+    cart = instance._state.fields_cache.get('cart')
+    if cart is not None:
+        user_id = cart.user_id
+    else:
+        user_id = Cart.objects.filter(pk=instance.cart_id).values_list('user_id', flat=True).first()
+    membership.invalidate(user_id)
+
+
+@receiver(post_save, sender=CartItem)
+@receiver(post_delete, sender=CartItem)
+def invalidate_cart_summary(sender, instance, **kwargs):
+    """Сбрасывает закэшированные итоги корзины (pricing.py)"""
+    pricing.invalidate_cart(instance.cart_id)
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+@receiver(post_save, sender=ProductSize)
+@receiver(post_delete, sender=ProductSize)
+@receiver(post_save, sender=ProductTag)
+@receiver(post_delete, sender=ProductTag)
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+@receiver(post_save, sender=Brand)
+@receiver(post_delete, sender=Brand)
+def record_catalog_change(sender, instance, **kwargs):
+    """Записывает изменение в журнал дельта-синхронизации (changes.py)"""
+    changes.record(sender._meta.model_name, [instance.pk])
+
+
+@receiver(pre_delete, sender=Category)
+@receiver(pre_delete, sender=Brand)
+def record_detached_products(sender, instance, **kwargs):
+    """
+    Товары удаляемой категории или бренда обнуляют ссылку через SET_NULL без
+    сигналов, а подкатегории становятся корневыми, поэтому они пишутся в журнал заранее
+    """
+    field = 'category_id' if sender is Category else 'brand_id'
+    changes.record('product', Product.objects.filter(**{field: instance.pk}).values_list('pk', flat=True))
+    if sender is Category and instance.tree_path:
+        changes.record('category', Category.objects.filter(
+            tree_path__startswith=instance.tree_path
+        ).exclude(pk=instance.pk).values_list('pk', flat=True))
+
+
+@receiver(post_save, sender=Product)
+def build_product_images(sender, instance, created, update_fields=None, raw=False, **kwargs):
+    """Строит миниатюры изображений товара в фоне после фиксации транзакции (images.py)"""
+    if raw or (update_fields is not None and not set(images.IMAGE_SLOTS).intersection(update_fields)):
+        return
+    if not any(getattr(instance, slot) for slot in images.IMAGE_SLOTS) and created:
+        return
+    product_id = instance.pk
+    transaction.on_commit(lambda: images.enqueue(product_id))
+
+
+@receiver(post_save, sender=ProductImage)
+@receiver(post_delete, sender=ProductImage)
+def publish_product_images(sender, instance, **kwargs):
+    """Миниатюры входят в данные товара: версия таблицы товаров, снимок и журнал"""
+    versions.bump_on_commit(versions.table_name(Product))
+    snapshot.schedule_publish()
+    changes.record('product', [instance.product_id])
+
+
+@receiver(post_save, sender=Tag)
+def record_renamed_tag(sender, instance, created, **kwargs):
+    """Название тега входит в данные тегов товаров"""
+    if not created:
+        changes.record('producttag', ProductTag.objects.filter(tag=instance).values_list('pk', flat=True))
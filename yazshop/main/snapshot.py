@@ -0,0 +1,515 @@
+"""
+Снимок каталога в файле, общий для всех воркеров gunicorn.
+
+Публикация (publish) собирает доступные товары вместе с ценами, размерами,
+тегами, миниатюрами, брендом и поставщиком, а также справочники категорий, брендов и тегов
+для фасетов и записывает их в один файл. Файл пишется во временный и
+подменяется через os.replace, поэтому читатели видят либо старую, либо новую
+версию целиком.
+
+Сборка снимка читает весь каталог, поэтому изменения не публикуются сразу:
+schedule_publish после фиксации транзакции (signals.py, ProductQuerySet) только
+отмечает каталог измененным, а фоновый поток процесса публикует снимок через
+PUBLISH_DELAY секунд — одной публикацией на все изменения за это время.
+Воркеры публикуют по очереди (блокировка файла <снимок>.lock), и если снимок
+уже собран другим воркером после изменения, публикация пропускается. Без
+фонового потока (CATALOG_SNAPSHOT_BACKGROUND = False) снимок публикует только
+команда publish_catalog_snapshot, запускаемая по расписанию.
+
+Остатки, доступность и счетчики (VOLATILE_FIELDS) меняются при каждом заказе
+и отзыве и публикации не вызывают: get_rows берет их для запрошенных товаров
+из БД одним запросом по первичному ключу.
+
+Версии таблиц каталога (versions.py, от них зависят ETag и кэш страниц)
+увеличиваются сразу после фиксации, а снимок публикуется позже. Пока снимок
+собран раньше последнего изменения этих таблиц, он не используется: строки и
+справочники читаются из БД, иначе устаревшие данные попали бы в ответ с новым
+ETag и в кэш под новым ключом.
+
+Воркеры открывают файл через mmap: страницы общие в page cache ОС, а в памяти
+процесса декодируются только строки запрошенных товаров. Раз в
+VERSION_CHECK_INTERVAL секунд воркер проверяет, не подменен ли файл.
+
+Фильтрация, сортировка и пагинация по-прежнему идут запросами к БД, но только
+за id (по индексам); строки товаров берутся из снимка. Товары, которых в
+снимке нет (например, ставшие доступными до следующей публикации), читаются
+из БД.
+
+Формат (порядок байт — little-endian):
+    заголовок HEADER (64 байта)
+    ids      count * uint64, по возрастанию
+    offsets  count * uint64, смещения записей
+    lengths  count * uint32, длины записей
+    записи   JSON каждого товара
+    meta     JSON справочников
+"""
+import json
+import logging
+import mmap
+import os
+import struct
+import sys
+import threading
+import time
+from array import array
+from bisect import bisect_left
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal
+from types import SimpleNamespace
+
+from django.conf import settings
+from django.db import transaction, DatabaseError, close_old_connections
+from django.db.models import Max
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from . import images, versions
+from .conditional import CATALOG_TABLES
+from .versions import VERSION_CHECK_INTERVAL
+
+try:
+    import fcntl
+except ImportError:  # Windows: публикации воркеров не упорядочиваются
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_PATH = getattr(settings, 'CATALOG_SNAPSHOT_PATH',
+                        os.path.join(settings.BASE_DIR, 'var', 'catalog.snapshot'))
+
+MAGIC = b'YZCATSN1'
+# magic, версия снимка (время публикации, нс), количество товаров, смещение и длина meta
+HEADER = struct.Struct('<8sQIQI')
+HEADER_SIZE = 64
+
+# Публиковать снимок в фоновом потоке после изменений каталога (иначе — только командой)
+BACKGROUND = getattr(settings, 'CATALOG_SNAPSHOT_BACKGROUND', True)
+# Пауза перед публикацией, секунды: изменения за это время попадают в одну публикацию
+PUBLISH_DELAY = getattr(settings, 'CATALOG_SNAPSHOT_DELAY', 5)
+
+# Поля товара, которые при чтении снимка берутся из БД и не требуют публикации
+VOLATILE_FIELDS = frozenset((
+    'stock_quantity', 'is_available', 'updated_at',
+    'avg_rating', 'review_count', 'rating_sum',
+    'rating_1', 'rating_2', 'rating_3', 'rating_4', 'rating_5',
+    'popularity_score',
+))
+
+_DECIMAL_FIELDS = ('price', 'discount', 'final_price')
+_DATETIME_FIELDS = ('added_at', 'updated_at')
+
+# Колонки записи товара; имена совпадают с колонками listing_values()
+_PRODUCT_COLUMNS = (
+    'id', 'product_name', 'main_image_url',
+    'image_url_1', 'image_url_2', 'image_url_3', 'image_url_4',
+    'category_id', 'category__category_name',
+    'brand_id', 'brand__brand_name', 'brand__brand_country',
+    'supplier_id', 'supplier__supplier_name',
+    'price', 'discount', 'final_price', 'stock_quantity', 'is_available',
+    'product_description', 'added_at', 'updated_at', 'avg_rating', 'review_count',
+    'rating_1', 'rating_2', 'rating_3', 'rating_4', 'rating_5', 'popularity_score',
+)
+
+_VOLATILE_COLUMNS = tuple(name for name in _PRODUCT_COLUMNS if name in VOLATILE_FIELDS)
+
+# Счетчики версий таблиц, из которых собран снимок
+_TABLE_VERSIONS = tuple(f'table:main.{table}' for table in CATALOG_TABLES)
+
+_lock = threading.Lock()
+_snapshot = None
+_checked_at = 0.0
+
+_publish_lock = threading.Lock()
+# Время (нс) первого изменения, которое еще не опубликовано
+_dirty_since = None
+_publish_scheduled = False
+_executor = None
+
+
+# ----- Публикация -----
+
+def _collect():
+    """Читает доступные товары и справочники из БД"""
+    from .models import Product, ProductSize, ProductTag, ProductImage, Category, Brand, Tag
+
+    sizes = defaultdict(list)
+    size_rows = (ProductSize.objects.filter(product__is_available=True)
+                 .values('product_id', 'id', 'size_label', 'size_type', 'size_stock').order_by('id'))
+    for row in size_rows.iterator(chunk_size=2000):
+        sizes[row.pop('product_id')].append(row)
+
+    tags = defaultdict(list)
+    tag_rows = (ProductTag.objects.filter(product__is_available=True)
+                .values_list('product_id', 'tag_id', 'tag__tag_name').order_by('tag__tag_name'))
+    for product_id, tag_id, tag_name in tag_rows.iterator(chunk_size=2000):
+        tags[product_id].append({'id': tag_id, 'tag_name': tag_name})
+
+    product_images = defaultdict(dict)
+    image_rows = (ProductImage.objects.filter(product__is_available=True)
+                  .values_list('product_id', 'slot', 'variants'))
+    for product_id, slot, variants in image_rows.iterator(chunk_size=2000):
+        product_images[product_id][slot] = variants
+
+    records = []
+    rows = Product.objects.filter(is_available=True).values(*_PRODUCT_COLUMNS).order_by('id')
+    for row in rows.iterator(chunk_size=2000):
+        for name in _DECIMAL_FIELDS:
+            row[name] = str(row[name])
+        for name in _DATETIME_FIELDS:
+            row[name] = row[name].isoformat() if row[name] else None
+        row['sizes'] = sizes.get(row['id'], [])
+        row['tags'] = tags.get(row['id'], [])
+        row['images'] = product_images.get(row['id'], {})
+        records.append(row)
+
+    meta = {
+        'categories': list(Category.objects.order_by('tree_path').values(
+            'id', 'category_name', 'parent_category_id', 'tree_path', 'depth')),
+        'brands': list(Brand.objects.order_by('id').values('id', 'brand_name', 'brand_country')),
+        'tags': list(Tag.objects.order_by('id').values('id', 'tag_name')),
+    }
+    return records, meta
+
+
+def _pad(length):
+    return -length % 8
+
+
+def publish(path=None):
+    """Собирает снимок и атомарно подменяет файл. Возвращает количество товаров."""
+    path = path or SNAPSHOT_PATH
+    # Недостающие счетчики таблиц создаются до сборки: созданные позже сделали бы снимок устаревшим
+    versions.get_versions(_TABLE_VERSIONS)
+    # Версия снимка — время начала сборки: в снимок попадает все, что зафиксировано до него
+    version = time.time_ns()
+    records, meta = _collect()
+
+    ids = array('Q')
+    offsets = array('Q')
+    lengths = array('I')
+    blobs = [json.dumps(record, separators=(',', ':'), ensure_ascii=False).encode() for record in records]
+    count = len(blobs)
+
+    lengths_end = HEADER_SIZE + 16 * count + 4 * count
+    offset = lengths_end + _pad(lengths_end)
+    for record, blob in zip(records, blobs):
+        ids.append(record['id'])
+        offsets.append(offset)
+        lengths.append(len(blob))
+        offset += len(blob)
+    meta_blob = json.dumps(meta, separators=(',', ':'), ensure_ascii=False).encode()
+
+    if sys.byteorder != 'little':
+        ids.byteswap()
+        offsets.byteswap()
+        lengths.byteswap()
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    with open(tmp_path, 'wb') as f:
+        header = HEADER.pack(MAGIC, version, count, offset, len(meta_blob))
+        f.write(header.ljust(HEADER_SIZE, b'\0'))
+        f.write(ids.tobytes())
+        f.write(offsets.tobytes())
+        f.write(lengths.tobytes())
+        f.write(b'\0' * _pad(lengths_end))
+        for blob in blobs:
+            f.write(blob)
+        f.write(meta_blob)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+    if path == SNAPSHOT_PATH:
+        reset()
+    return count
+
+
+def _published_version(path):
+    """Версия опубликованного снимка или 0, если файла нет или он не читается"""
+    try:
+        with open(path, 'rb') as f:
+            magic, version = HEADER.unpack(f.read(HEADER.size))[:2]
+    except (OSError, struct.error):
+        return 0
+    return version if magic == MAGIC else 0
+
+
+def _tables_modified_ns():
+    """Время (нс) последнего изменения таблиц каталога по счетчикам в БД, без кэша процесса"""
+    from .models import DataVersion
+
+    modified_at = DataVersion.objects.filter(name__in=_TABLE_VERSIONS).aggregate(
+        latest=Max('modified_at'))['latest']
+    return int(modified_at.timestamp() * 1e9) if modified_at else 0
+
+
+def publish_since(changed_at, path=None):
+    """
+    Публикует снимок, если опубликованный собран раньше changed_at (время в нс)
+    или раньше последнего изменения таблиц каталога. Воркеры публикуют по
+    очереди. Возвращает количество товаров или None, если снимок актуален.
+    """
+    path = path or SNAPSHOT_PATH
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(f'{path}.lock', 'a') as lock_file:
+        if fcntl is not None:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            if _published_version(path) >= max(changed_at, _tables_modified_ns()):
+                if path == SNAPSHOT_PATH:
+                    reset()
+                return None
+            return publish(path)
+        finally:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def _run_publish():
+    global _dirty_since, _publish_scheduled
+    time.sleep(PUBLISH_DELAY)
+    with _publish_lock:
+        changed_at, _dirty_since = _dirty_since, None
+        _publish_scheduled = False
+    try:
+        publish_since(changed_at)
+    except (OSError, DatabaseError):
+        # Читатели работают со старым снимком до следующего изменения или запуска команды
+        logger.exception('Не удалось опубликовать снимок каталога')
+    finally:
+        close_old_connections()
+
+
+def _mark_changed():
+    """Отмечает каталог измененным и ставит публикацию в фоновый поток"""
+    global _dirty_since, _publish_scheduled, _executor
+    with _publish_lock:
+        if _dirty_since is None:
+            _dirty_since = time.time_ns()
+        if _publish_scheduled:
+            return
+        _publish_scheduled = True
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='catalog-snapshot')
+    _executor.submit(_run_publish)
+
+
+def schedule_publish():
+    """Ставит публикацию снимка после фиксации текущей транзакции (один раз на транзакцию)"""
+    if not BACKGROUND:
+        return
+    connection = transaction.get_connection()
+    if connection.in_atomic_block and any(entry[1] is _mark_changed for entry in connection.run_on_commit):
+        return
+    transaction.on_commit(_mark_changed)
+
+
+# ----- Чтение -----
+
+class CatalogSnapshot:
+    """Открытый через mmap файл снимка"""
+
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            stat = os.fstat(f.fileno())
+            self.identity = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.version, self.count, meta_offset, meta_length = HEADER.unpack_from(self._mm, 0)
+        if magic != MAGIC or sys.byteorder != 'little':
+            raise ValueError('Неподдерживаемый формат снимка каталога')
+        view = memoryview(self._mm)
+        start = HEADER_SIZE
+        # Массивы читаются напрямую из отображенной памяти, без копирования
+        self._ids = view[start:start + 8 * self.count].cast('Q')
+        start += 8 * self.count
+        self._offsets = view[start:start + 8 * self.count].cast('Q')
+        start += 8 * self.count
+        self._lengths = view[start:start + 4 * self.count].cast('I')
+        self._meta_range = (meta_offset, meta_offset + meta_length)
+        self._meta = None
+
+    def __len__(self):
+        return self.count
+
+    def row(self, product_id):
+        """Строка товара (словарь) или None, если товара в снимке нет"""
+        pos = bisect_left(self._ids, product_id)
+        if pos == self.count or self._ids[pos] != product_id:
+            return None
+        offset = self._offsets[pos]
+        row = json.loads(self._mm[offset:offset + self._lengths[pos]])
+        for name in _DECIMAL_FIELDS:
+            row[name] = Decimal(row[name])
+        for name in _DATETIME_FIELDS:
+            value = row.get(name)
+            row[name] = parse_datetime(value) if value else None
+        return row
+
+    @property
+    def meta(self):
+        if self._meta is None:
+            self._meta = json.loads(self._mm[self._meta_range[0]:self._meta_range[1]])
+        return self._meta
+
+
+def reset():
+    """Заставляет процесс перечитать файл снимка при следующем обращении"""
+    global _checked_at
+    _checked_at = 0.0
+
+
+def get_snapshot():
+    """Текущий снимок процесса или None, если файла нет или он поврежден"""
+    global _snapshot, _checked_at
+    snapshot = _snapshot
+    if time.monotonic() - _checked_at < VERSION_CHECK_INTERVAL:
+        return snapshot
+    with _lock:
+        _checked_at = time.monotonic()
+        try:
+            stat = os.stat(SNAPSHOT_PATH)
+        except FileNotFoundError:
+            _snapshot = None
+            return None
+        except OSError:
+            return _snapshot
+        if _snapshot is None or _snapshot.identity != (stat.st_ino, stat.st_mtime_ns, stat.st_size):
+            try:
+                _snapshot = CatalogSnapshot(SNAPSHOT_PATH)
+            except (OSError, ValueError, struct.error):
+                logger.exception('Не удалось открыть снимок каталога')
+                _snapshot = None
+        return _snapshot
+
+
+def _refresh_volatile(rows):
+    """Подставляет в строки снимка текущие остатки и счетчики товаров и размеров из БД"""
+    from .models import Product, ProductSize
+
+    current = {row['id']: row for row in Product.objects.filter(pk__in=rows).values('id', *_VOLATILE_COLUMNS)}
+    size_stock = dict(ProductSize.objects.filter(product_id__in=current).values_list('id', 'size_stock'))
+    for product_id in list(rows):
+        if product_id not in current:
+            # Товар удален после публикации
+            del rows[product_id]
+            continue
+        rows[product_id].update(current[product_id])
+        for size in rows[product_id]['sizes']:
+            size['size_stock'] = size_stock.get(size['id'], 0)
+
+
+def get_current_snapshot():
+    """
+    Снимок процесса, если он собран после последнего изменения таблиц каталога,
+    иначе None (изменение еще не опубликовано — данные читаются из БД)
+    """
+    snapshot = get_snapshot()
+    if snapshot is None:
+        return None
+    modified_at = max(modified_at for _, modified_at in versions.get_versions(_TABLE_VERSIONS).values())
+    if modified_at * 1e9 >= snapshot.version:
+        return None
+    return snapshot
+
+
+def get_rows(product_ids):
+    """Строки товаров из актуального снимка: {id: строка} (без отсутствующих в снимке)"""
+    snapshot = get_current_snapshot()
+    if snapshot is None:
+        return {}
+    rows = {}
+    for product_id in product_ids:
+        row = snapshot.row(product_id)
+        if row is not None:
+            rows[product_id] = row
+    if rows:
+        _refresh_volatile(rows)
+    return rows
+
+
+# ----- Объекты для шаблонов -----
+
+class _Related(list):
+    """Список, который в шаблоне ведет себя как менеджер связи (product.sizes.all)"""
+
+    def all(self):
+        return self
+
+
+class SnapshotProduct:
+    """Товар из снимка с атрибутами, которые используют шаблоны каталога"""
+
+    def __init__(self, row):
+        self.__dict__.update(row)
+        self.pk = row['id']
+        self.category = (SimpleNamespace(id=row['category_id'], category_name=row['category__category_name'])
+                         if row['category_id'] else None)
+        self.brand = (SimpleNamespace(id=row['brand_id'], brand_name=row['brand__brand_name'],
+                                      brand_country=row['brand__brand_country'])
+                      if row['brand_id'] else None)
+        self.supplier = (SimpleNamespace(id=row['supplier_id'], supplier_name=row['supplier__supplier_name'])
+                         if row['supplier_id'] else None)
+        self.sizes = _Related(SimpleNamespace(**size) for size in row['sizes'])
+        self.tags = _Related(SimpleNamespace(**tag) for tag in row['tags'])
+        self.image_variants = self.__dict__.pop('images', None) or {}
+
+    def __str__(self):
+        return self.product_name
+
+    @property
+    def is_new(self):
+        return bool(self.added_at) and self.added_at >= timezone.now() - timezone.timedelta(days=30)
+
+    @property
+    def main_srcset(self):
+        return images.srcset(self.image_variants.get('main_image_url'))
+
+    @property
+    def main_thumbnail_url(self):
+        return images.thumbnail_url(self.image_variants.get('main_image_url'))
+
+
+def get_products(product_ids):
+    """
+    Товары по списку id в его порядке: из снимка, а отсутствующие в нем — из БД
+    (модели с подгруженными брендом, поставщиком и размерами).
+    """
+    from .models import Product
+
+    product_ids = list(product_ids)
+    rows = get_rows(product_ids)
+    products = {product_id: SnapshotProduct(row) for product_id, row in rows.items()}
+    missing = [product_id for product_id in product_ids if product_id not in products]
+    if missing:
+        fallback = (Product.objects.filter(pk__in=missing)
+                    .select_related('category', 'brand', 'supplier').prefetch_related('sizes', 'images'))
+        for product in fallback:
+            products[product.pk] = product
+    return [products[product_id] for product_id in product_ids if product_id in products]
+
+
+def _reference(name, queryset_factory):
+    snapshot = get_current_snapshot()
+    if snapshot is not None:
+        return [SimpleNamespace(**item) for item in snapshot.meta[name]]
+    return list(queryset_factory())
+
+
+def get_categories():
+    """Категории в порядке материализованного пути"""
+    from .models import Category
+    return _reference('categories', lambda: Category.objects.order_by('tree_path'))
+
+
+def get_brands():
+    """Бренды по id"""
+    from .models import Brand
+    return _reference('brands', lambda: Brand.objects.order_by('id'))
+
+
+def get_tags():
+    """Теги по id"""
+    from .models import Tag
+    return _reference('tags', lambda: Tag.objects.order_by('id'))
@@ -0,0 +1,424 @@
+"""
+Выписки по балансу пользователя и по картам.
+
+История операций (BalanceTransaction, CardTransaction) у давних
+пользователей — тысячи строк, поэтому выписка не читает ее целиком:
+
+- операции за период выбираются курсорной пагинацией (pagination.py) по
+  индексам (user, created_at, id) и (saved_payment_method, created_at, id);
+- остаток на начало страницы или периода — последний месячный снимок
+  BalanceSnapshot до этой даты плюс сумма операций после снимка, то есть
+  не больше месяца операций. Снимки создает команда snapshot_balances
+  (раз в месяц, после начала месяца). Без снимков остаток считается от
+  первой операции: у баланса — от ее остатка «до», у карты — от нуля;
+- выгрузка CSV отдается StreamingHttpResponse: строки читаются через
+  iterator() порциями и сразу пишутся в ответ, память не зависит от длины
+  периода. PDF собирается во временный файл (reportlab держит в памяти только
+  сжатые страницы) и отдается по частям; для очень длинных периодов
+  (больше PDF_MAX_ROWS операций) предлагается CSV.
+
+Остатки в выписке считаются по суммам операций со статусом completed:
+приход — пополнения и возвраты, расход — выводы и оплаты.
+"""
+import csv
+import os
+import tempfile
+from collections import namedtuple
+from datetime import datetime, time, timedelta
+from decimal import Decimal
+
+from django.conf import settings
+from django.db.models import Case, When, F, Q, Sum, DecimalField, Exists, OuterRef, Subquery
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+
+from . import pagination
+
+ZERO = Decimal('0.00')
+
+PAGE_SIZE = getattr(settings, 'STATEMENT_PAGE_SIZE', 50)
+MAX_PAGE_SIZE = 500
+EXPORT_CHUNK = 2000
+PDF_MAX_ROWS = getattr(settings, 'STATEMENT_PDF_MAX_ROWS', 20000)
+
+# Типы операций, которые увеличивают остаток
+CREDIT_TYPES = {
+    'balance': ('deposit', 'order_refund'),
+    'card': ('deposit',),
+}
+
+# Шрифты с кириллицей для PDF (как в чеке): первый найденный
+PDF_FONTS = (
+    r'C:\Windows\Fonts\arial.ttf',
+    '/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf',
+    '/usr/share/fonts/truetype/liberation/LiberationSans-Regular.ttf',
+    '/usr/share/fonts/TTF/DejaVuSans.ttf',
+    '/Library/Fonts/Arial.ttf',
+)
+
+
+class Account(namedtuple('Account', ['account_type', 'user', 'card'])):
+    """Счет выписки: баланс пользователя (card=None) или его карта"""
+
+    def transactions(self):
+        from .models import BalanceTransaction, CardTransaction
+
+        if self.account_type == 'card':
+            queryset = CardTransaction.objects.filter(saved_payment_method=self.card)
+        else:
+            queryset = BalanceTransaction.objects.filter(user=self.user)
+        return queryset.filter(status='completed')
+
+    def snapshots(self):
+        from .models import BalanceSnapshot
+
+        if self.account_type == 'card':
+            return BalanceSnapshot.objects.filter(account_type='card', saved_payment_method=self.card)
+        return BalanceSnapshot.objects.filter(account_type='balance', user=self.user)
+
+    @property
+    def title(self):
+        if self.account_type == 'card':
+            return f'Карта {self.card.mask_card_number()}'
+        return 'Баланс'
+
+
+def account_for(user, card_id=None):
+    """Счет выписки пользователя; чужая или несуществующая карта — SavedPaymentMethod.DoesNotExist"""
+    from .models import SavedPaymentMethod
+
+    if card_id:
+        return Account('card', user, SavedPaymentMethod.objects.get(pk=card_id, user=user))
+    return Account('balance', user, None)
+
+
+def parse_period(date_from=None, date_to=None):
+    """
+    Период выписки из дат YYYY-MM-DD (обе включительно). Возвращает
+    (start, end) — aware datetime или None, end не включается. ValueError
+    при неверной дате.
+    """
+    def moment(value, days=0):
+        if not value:
+            return None
+        parsed = parse_date(str(value))
+        if parsed is None:
+            raise ValueError(f'Неверная дата: {value}')
+        return timezone.make_aware(datetime.combine(parsed + timedelta(days=days), time.min))
+
+    start, end = moment(date_from), moment(date_to, days=1)
+    if start and end and start >= end:
+        raise ValueError('Дата начала периода позже даты окончания')
+    return start, end
+
+
+def _signed(account_type):
+    """Выражение: сумма операции со знаком"""
+    return Case(
+        When(transaction_type__in=CREDIT_TYPES[account_type], then=F('amount')),
+        default=-F('amount'),
+        output_field=DecimalField(max_digits=12, decimal_places=2),
+    )
+
+
+def signed_amount(account, transaction_type, amount):
+    return amount if transaction_type in CREDIT_TYPES[account.account_type] else -amount
+
+
+def _before(moment, pk=None):
+    """Операции до moment (и до операции pk в тот же момент)"""
+    if pk is None:
+        return Q(created_at__lt=moment)
+    return Q(created_at__lt=moment) | Q(created_at=moment, pk__lt=pk)
+
+
+def balance_at(account, moment=None, pk=None):
+    """Остаток счета по операциям до moment (None — текущий по всем операциям)"""
+    queryset = account.transactions()
+    snapshots = account.snapshots()
+    if moment is not None:
+        queryset = queryset.filter(_before(moment, pk))
+        snapshots = snapshots.filter(closing_at__lte=moment)
+
+    snapshot = snapshots.order_by('-closing_at').only('closing_at', 'closing_balance').first()
+    if snapshot is not None:
+        base = snapshot.closing_balance
+        queryset = queryset.filter(created_at__gte=snapshot.closing_at)
+    elif account.account_type == 'balance':
+        first = account.transactions().order_by('created_at', 'id').values_list('balance_before', flat=True).first()
+        base = first if first is not None else ZERO
+    else:
+        base = ZERO
+    return base + (queryset.aggregate(total=Sum(_signed(account.account_type)))['total'] or ZERO)
+
+
+def opening_balance(account, start=None):
+    """Остаток на начало периода (без start — до первой операции счета)"""
+    if start is not None:
+        return balance_at(account, start)
+    first = account.transactions().order_by('created_at', 'id').values('id', 'created_at').first()
+    return balance_at(account, first['created_at'], first['id']) if first else ZERO
+
+
+def _period(account, start, end):
+    queryset = account.transactions()
+    if start:
+        queryset = queryset.filter(created_at__gte=start)
+    if end:
+        queryset = queryset.filter(created_at__lt=end)
+    return queryset.values('id', 'created_at', 'transaction_type', 'amount', 'description')
+
+
+def _row(account, row, running):
+    amount = signed_amount(account, row['transaction_type'], row['amount'])
+    running += amount
+    return {
+        'id': row['id'],
+        'created_at': row['created_at'],
+        'transaction_type': row['transaction_type'],
+        'description': row['description'] or '',
+        'amount': amount,
+        'balance_after': running,
+    }, running
+
+
+def statement_page(account, start=None, end=None, cursor=None, page_size=PAGE_SIZE):
+    """
+    Страница выписки по возрастанию даты. Возвращает словарь с операциями
+    (сумма со знаком и остаток после каждой), остатками на начало и конец
+    периода и курсорами. InvalidCursor — неверный курсор.
+    """
+    page_size = max(1, min(int(page_size), MAX_PAGE_SIZE))
+    page = pagination.paginate_by_cursor(_period(account, start, end), cursor, page_size, descending=False)
+
+    rows = []
+    if page.object_list:
+        first = page.object_list[0]
+        running = balance_at(account, first['created_at'], first['id'])
+        for row in page.object_list:
+            item, running = _row(account, row, running)
+            rows.append(item)
+
+    return {
+        'account': account.account_type,
+        'card_id': account.card.pk if account.card else None,
+        'period_start': start,
+        'period_end': end,
+        'opening_balance': opening_balance(account, start),
+        'closing_balance': balance_at(account, end),
+        'transactions': rows,
+        **page.as_dict(),
+    }
+
+
+# ==== Месячные снимки остатков ====
+
+def month_start(moment):
+    """Начало месяца moment в локальном часовом поясе"""
+    local = timezone.localtime(moment)
+    return timezone.make_aware(datetime(local.year, local.month, 1))
+
+
+def previous_month(boundary):
+    return month_start(boundary - timedelta(days=1))
+
+
+def _sums(queryset, *keys):
+    """Суммы операций со знаком по ключам keys: {ключи: сумма}"""
+    account_type = 'card' if queryset.model._meta.model_name == 'cardtransaction' else 'balance'
+    return {
+        tuple(row[key] for key in keys): row['total'] or ZERO
+        for row in queryset.values(*keys).annotate(total=Sum(_signed(account_type))).order_by()
+    }
+
+
+def take_snapshots(boundary):
+    """
+    Снимки остатков всех счетов на boundary (начало месяца). Остаток —
+    снимок предыдущего месяца плюс операции за месяц, для счетов без такого
+    снимка — вся история до boundary. Существующие снимки не меняются.
+    Возвращает число счетов.
+    """
+    from .models import BalanceSnapshot, BalanceTransaction, CardTransaction
+
+    previous = previous_month(boundary)
+    snapshots = BalanceSnapshot.objects.filter(closing_at=previous)
+    rows = []
+
+    # Баланс пользователей: без снимка остаток начинается с остатка «до» первой операции
+    completed = BalanceTransaction.objects.filter(status='completed', created_at__lt=boundary)
+    recent = _sums(completed.filter(created_at__gte=previous), 'user_id')
+    closing = {
+        user_id: balance + recent.get((user_id,), ZERO)
+        for user_id, balance in snapshots.filter(account_type='balance').values_list('user_id', 'closing_balance')
+    }
+    origin = BalanceTransaction.objects.filter(
+        user_id=OuterRef('user_id'), status='completed'
+    ).order_by('created_at', 'id').values('balance_before')[:1]
+    without_snapshot = completed.filter(~Exists(snapshots.filter(account_type='balance', user_id=OuterRef('user_id'))))
+    for row in without_snapshot.values('user_id').annotate(
+            total=Sum(_signed('balance')), origin=Subquery(origin)).order_by():
+        closing[row['user_id']] = (row['origin'] or ZERO) + (row['total'] or ZERO)
+    rows.extend(
+        BalanceSnapshot(account_type='balance', user_id=user_id, closing_at=boundary, closing_balance=balance)
+        for user_id, balance in closing.items()
+    )
+
+    # Карты: остаток считается от нуля
+    completed = CardTransaction.objects.filter(status='completed', created_at__lt=boundary)
+    card_key = ('saved_payment_method_id', 'saved_payment_method__user_id')
+    recent = _sums(completed.filter(created_at__gte=previous), 'saved_payment_method_id')
+    closing = {
+        (card_id, user_id): balance + recent.get((card_id,), ZERO)
+        for card_id, user_id, balance in snapshots.filter(account_type='card').values_list(
+            'saved_payment_method_id', 'user_id', 'closing_balance')
+    }
+    closing.update(_sums(
+        completed.filter(~Exists(snapshots.filter(
+            account_type='card', saved_payment_method_id=OuterRef('saved_payment_method_id')))),
+        *card_key,
+    ))
+    rows.extend(
+        BalanceSnapshot(account_type='card', user_id=user_id, saved_payment_method_id=card_id,
+                        closing_at=boundary, closing_balance=balance)
+        for (card_id, user_id), balance in closing.items()
+    )
+
+    BalanceSnapshot.objects.bulk_create(rows, batch_size=1000, ignore_conflicts=True)
+    return len(rows)
+
+
+# ==== Выгрузка ====
+
+class _Echo:
+    """Буфер для csv.writer: возвращает строку, а не накапливает ее"""
+
+    def write(self, value):
+        return value
+
+
+def _type_names(account):
+    from .models import BalanceTransaction, CardTransaction
+
+    model = CardTransaction if account.account_type == 'card' else BalanceTransaction
+    return dict(model.TRANSACTION_TYPES)
+
+
+def period_label(start=None, end=None):
+    first = f'{timezone.localtime(start):%d.%m.%Y}' if start else 'начала'
+    last = f'{timezone.localtime(end) - timedelta(days=1):%d.%m.%Y}' if end else 'сегодня'
+    return f'с {first} по {last}'
+
+
+def _export_rows(account, start, end, opening):
+    """Операции периода с остатками; из базы читаются порциями по EXPORT_CHUNK"""
+    running = opening
+    queryset = _period(account, start, end).order_by('created_at', 'id')
+    for row in queryset.iterator(chunk_size=EXPORT_CHUNK):
+        item, running = _row(account, row, running)
+        yield item
+
+
+def stream_csv(account, start=None, end=None):
+    """Строки CSV выписки для StreamingHttpResponse (разделитель «;», UTF-8 с BOM для Excel)"""
+    writer = csv.writer(_Echo(), delimiter=';')
+    names = _type_names(account)
+    opening = opening_balance(account, start)
+
+    yield '\ufeff'
+    yield writer.writerow(['Счет', account.title])
+    yield writer.writerow(['Период', period_label(start, end)])
+    yield writer.writerow(['Остаток на начало', opening])
+    yield writer.writerow(['Дата', 'Операция', 'Описание', 'Сумма', 'Остаток'])
+    closing = opening
+    for item in _export_rows(account, start, end, opening):
+        closing = item['balance_after']
+        yield writer.writerow([
+            f"{timezone.localtime(item['created_at']):%d.%m.%Y %H:%M}",
+            names.get(item['transaction_type'], item['transaction_type']),
+            item['description'],
+            item['amount'],
+            closing,
+        ])
+    yield writer.writerow(['Остаток на конец', closing])
+
+
+def _pdf_font():
+    """Шрифт с кириллицей; если не найден — Helvetica"""
+    from reportlab.pdfbase import pdfmetrics
+    from reportlab.pdfbase.ttfonts import TTFont
+
+    if 'Statement' in pdfmetrics.getRegisteredFontNames():
+        return 'Statement'
+    for path in PDF_FONTS:
+        if os.path.exists(path):
+            try:
+                pdfmetrics.registerFont(TTFont('Statement', path))
+                return 'Statement'
+            except Exception:
+                continue
+    return 'Helvetica'
+
+
+def build_pdf(account, start=None, end=None):
+    """
+    PDF выписки во временном файле (до 1 МБ в памяти, дальше на диске),
+    позиция — в начале файла. ValueError, если операций больше PDF_MAX_ROWS.
+    """
+    from reportlab.lib.pagesizes import A4
+    from reportlab.lib.units import mm
+    from reportlab.pdfgen import canvas
+
+    if _period(account, start, end).count() > PDF_MAX_ROWS:
+        raise ValueError(f'В PDF помещается не больше {PDF_MAX_ROWS} операций, выберите период короче или CSV')
+
+    names = _type_names(account)
+    opening = opening_balance(account, start)
+    output = tempfile.SpooledTemporaryFile(max_size=1024 * 1024)
+    pdf = canvas.Canvas(output, pagesize=A4, pageCompression=1)
+    font = _pdf_font()
+    width, height = A4
+    left, right, bottom = 15 * mm, width - 15 * mm, 15 * mm
+    line = 5 * mm
+
+    def columns(y):
+        pdf.setFont(font, 8)
+        pdf.drawString(left, y, 'Дата')
+        pdf.drawString(left + 28 * mm, y, 'Операция')
+        pdf.drawString(left + 60 * mm, y, 'Описание')
+        pdf.drawRightString(right - 30 * mm, y, 'Сумма')
+        pdf.drawRightString(right, y, 'Остаток')
+        pdf.line(left, y - 1.5 * mm, right, y - 1.5 * mm)
+        return y - line
+
+    y = height - 20 * mm
+    pdf.setFont(font, 14)
+    pdf.drawString(left, y, f'Выписка: {account.title}')
+    y -= 7 * mm
+    pdf.setFont(font, 10)
+    pdf.drawString(left, y, f'Период: {period_label(start, end)}')
+    y -= line
+    pdf.drawString(left, y, f'Остаток на начало: {opening} ₽')
+    y = columns(y - 2 * line)
+
+    closing = opening
+    for item in _export_rows(account, start, end, opening):
+        if y < bottom:
+            pdf.showPage()
+            y = columns(height - 20 * mm)
+        closing = item['balance_after']
+        pdf.drawString(left, y, f"{timezone.localtime(item['created_at']):%d.%m.%Y %H:%M}")
+        pdf.drawString(left + 28 * mm, y, names.get(item['transaction_type'], item['transaction_type'])[:20])
+        pdf.drawString(left + 60 * mm, y, item['description'][:48])
+        pdf.drawRightString(right - 30 * mm, y, f"{item['amount']:+}")
+        pdf.drawRightString(right, y, str(closing))
+        y -= line
+
+    if y < bottom + line:
+        pdf.showPage()
+        y = height - 20 * mm
+    pdf.setFont(font, 10)
+    pdf.drawString(left, y - line, f'Остаток на конец: {closing} ₽')
+    pdf.save()
+    output.seek(0)
+    return output
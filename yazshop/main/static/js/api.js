@@ -22,8 +22,16 @@ function getCookie(name) {
     return cookieValue;
 }
 
+// Ключ идемпотентности: один на операцию, повтор после обрыва связи отправляется с тем же ключом
+function newIdempotencyKey() {
+    if (window.crypto && crypto.randomUUID) {
+        return crypto.randomUUID();
+    }
+    return Date.now().toString(36) + Math.random().toString(36).slice(2) + Math.random().toString(36).slice(2);
+}
+
 // Базовый fetch для API
-async function apiRequest(url, method = 'GET', data = null) {
+async function apiRequest(url, method = 'GET', data = null, idempotencyKey = null, attempt = 0) {
     const options = {
         method: method,
         headers: {
@@ -33,12 +41,21 @@ async function apiRequest(url, method = 'GET', data = null) {
         credentials: 'same-origin'
     };
     
+    if (idempotencyKey) {
+        options.headers['Idempotency-Key'] = idempotencyKey;
+    }
+    
     if (data && (method === 'POST' || method === 'PUT' || method === 'PATCH')) {
         options.body = JSON.stringify(data);
     }
     
     try {
         const response = await fetch(url, options);
+        // Запрос с этим ключом еще выполняется: повторяем через Retry-After и получаем его результат
+        if (response.status === 409 && idempotencyKey && response.headers.has('Retry-After') && attempt < 30) {
+            await new Promise(resolve => setTimeout(resolve, parseFloat(response.headers.get('Retry-After')) * 1000));
+            return apiRequest(url, method, data, idempotencyKey, attempt + 1);
+        }
         const result = await response.json();
         
         if (!response.ok) {
@@ -92,7 +109,7 @@ const CartAPI = {
 // API для заказов
 const OrderAPI = {
     getAll: () => apiRequest('/api/orders/', 'GET'),
-    create: (data) => apiRequest('/api/orders/', 'POST', data),
+    create: (data, idempotencyKey = null) => apiRequest('/api/orders/', 'POST', data, idempotencyKey),
     get: (id) => apiRequest(`/api/orders/${id}/`, 'GET'),
     cancel: (id) => apiRequest(`/api/orders/${id}/`, 'POST', { action: 'cancel' })
 };
@@ -108,7 +125,7 @@ const PaymentMethodAPI = {
 // API для баланса
 const BalanceAPI = {
     get: () => apiRequest('/api/balance/', 'GET'),
-    deposit: (data) => apiRequest('/api/balance/', 'POST', data)
+    deposit: (data, idempotencyKey = null) => apiRequest('/api/balance/', 'POST', data, idempotencyKey)
 };
 
 // API для избранного
@@ -0,0 +1,142 @@
+"""
+Подсказки для строки поиска каталога.
+
+Каждый воркер держит отсортированный массив ключей (названия товаров, брендов,
+категорий и тегов, а также их хвосты с начала каждого слова) и ищет префикс
+бинарным поиском, не обращаясь к БД. Для коротких префиксов, которым
+соответствует много ключей, лучшие подсказки считаются заранее. Массив
+перестраивается лениво, когда меняется версия catalog (versions.py) или
+истекает CATALOG_SUGGEST_TTL.
+Кандидаты ранжируются по популярности товаров.
+"""
+import re
+import threading
+import time
+from bisect import bisect_left
+
+from django.conf import settings
+
+from . import versions
+
+VERSION_NAME = 'catalog'
+
+SUGGEST_TTL = getattr(settings, 'CATALOG_SUGGEST_TTL', 300)
+
+# Префиксы такой длины и короче обслуживаются из заранее посчитанных списков
+SHORT_PREFIX = 3
+TOP_PER_PREFIX = 50
+
+# Сколько ключей просматривается для длинного префикса
+MAX_SCAN = 5000
+
+_WORD_START_RE = re.compile(r'(?:^|(?<=[\s\-/.,(]))\w', re.UNICODE)
+
+_lock = threading.Lock()
+_index = None
+
+
+def normalize(text):
+    """Нижний регистр, ё -> е, схлопнутые пробелы"""
+    return ' '.join((text or '').lower().replace('ё', 'е').split())
+
+
+class SuggestIndex:
+    """Отсортированный массив ключей для поиска по префиксу"""
+
+    def __init__(self, version):
+        self.version = version
+        self.built_at = time.monotonic()
+        self.keys = []
+        self.entries = []
+        self.top = {}
+
+    @classmethod
+    def build(cls, version):
+        from .models import Product, Brand, Category, Tag, ProductTag
+
+        index = cls(version)
+        items = []
+
+        products = Product.objects.filter(is_available=True).values_list(
+            'id', 'product_name', 'popularity_score', 'brand_id', 'category_id'
+        )
+        brand_rank, category_rank = {}, {}
+        product_rank = {}
+        for product_id, name, score, brand_id, category_id in products.iterator(chunk_size=2000):
+            product_rank[product_id] = score
+            items.append(('product', product_id, name, score))
+            if brand_id is not None:
+                brand_rank[brand_id] = brand_rank.get(brand_id, 0.0) + score
+            if category_id is not None:
+                category_rank[category_id] = category_rank.get(category_id, 0.0) + score
+
+        tag_rank = {}
+        for tag_id, product_id in ProductTag.objects.values_list('tag_id', 'product_id'):
+            if product_id in product_rank:
+                tag_rank[tag_id] = tag_rank.get(tag_id, 0.0) + product_rank[product_id]
+
+        # Бренды, категории и теги поднимаются над товарами с той же популярностью
+        for brand_id, name in Brand.objects.values_list('id', 'brand_name'):
+            items.append(('brand', brand_id, name, brand_rank.get(brand_id, 0.0)))
+        for category_id, name in Category.objects.values_list('id', 'category_name'):
+            items.append(('category', category_id, name, category_rank.get(category_id, 0.0)))
+        for tag_id, name in Tag.objects.values_list('id', 'tag_name'):
+            items.append(('tag', tag_id, name, tag_rank.get(tag_id, 0.0)))
+
+        pairs = []
+        for entry in items:
+            text = normalize(entry[2])
+            for match in _WORD_START_RE.finditer(text):
+                pairs.append((text[match.start():], entry))
+        pairs.sort(key=lambda pair: pair[0])
+        index.keys = [key for key, _ in pairs]
+        index.entries = [entry for _, entry in pairs]
+
+        buckets = {}
+        for key, entry in pairs:
+            for length in range(1, min(SHORT_PREFIX, len(key)) + 1):
+                buckets.setdefault(key[:length], {})[(entry[0], entry[1])] = entry
+        index.top = {prefix: _rank(found.values())[:TOP_PER_PREFIX] for prefix, found in buckets.items()}
+        return index
+
+    def lookup(self, prefix, limit=10):
+        """Возвращает до limit подсказок для префикса, отсортированных по популярности"""
+        prefix = normalize(prefix)
+        if not prefix:
+            return []
+        if len(prefix) <= SHORT_PREFIX and limit <= TOP_PER_PREFIX:
+            ranked = self.top.get(prefix, [])
+            return [{'type': kind, 'id': object_id, 'text': text} for kind, object_id, text, _ in ranked[:limit]]
+        start = bisect_left(self.keys, prefix)
+        found = {}
+        keys, entries = self.keys, self.entries
+        for pos in range(start, min(start + MAX_SCAN, len(keys))):
+            if not keys[pos].startswith(prefix):
+                break
+            entry = entries[pos]
+            found[(entry[0], entry[1])] = entry
+        ranked = _rank(found.values())
+        return [{'type': kind, 'id': object_id, 'text': text} for kind, object_id, text, _ in ranked[:limit]]
+
+
+def _rank(entries):
+    """Сортировка по популярности; при равенстве бренды/категории/теги выше товаров"""
+    return sorted(entries, key=lambda entry: (-entry[3], entry[0] == 'product', entry[2]))
+
+
+def get_index():
+    """Возвращает актуальный индекс подсказок процесса"""
+    global _index
+    version = versions.get_version(VERSION_NAME)
+    index = _index
+    if index is not None and index.version == version and time.monotonic() - index.built_at < SUGGEST_TTL:
+        return index
+    with _lock:
+        if _index is index:
+            _index = SuggestIndex.build(version)
+        return _index
+
+
+def suggest(prefix, limit=10):
+    """Подсказки для строки поиска"""
+    return get_index().lookup(prefix, limit)
@@ -1,3 +1,531 @@
-from django.test import TestCase
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from decimal import Decimal
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth.models import User
+from django.db import OperationalError, close_old_connections, transaction
+from django.test import TestCase, TransactionTestCase
+from django.utils import timezone
+
+from . import cancellation, fulfillment, ledger, outbox, placement, statements, wallet
+from .models import (ActivityLog, BalanceSnapshot, BalanceTransaction, CardTransaction, Cart, CartItem, Delivery,
+                     Order, OrderItem, OrganizationAccount, OrganizationTransaction, OutboxEvent, Payment, Product,
+                     ProductSize, SavedPaymentMethod, UserProfile)
+
+
+class WalletConcurrencyTests(TransactionTestCase):
+    """
+    Параллельные операции с балансом (wallet.py) из нескольких потоков:
+    ни одно изменение не теряется, баланс не уходит в минус, а остатки
+    «до/после» операций складываются в непрерывную цепочку.
+    """
+
+    INITIAL = Decimal('100.00')
+    THREADS = 8
+    # Попытки операции, откатанной с «database is locked» (SQLite)
+    ATTEMPTS = 50
+
+    def setUp(self):
+        self.user = User.objects.create(username='wallet-test')
+        UserProfile.objects.update_or_create(user=self.user, defaults={'balance': self.INITIAL})
+        self.card = SavedPaymentMethod.objects.create(
+            user=self.user, card_number='0000', card_holder_name='WALLET TEST',
+            expiry_month='12', expiry_year='2099', balance=self.INITIAL,
+        )
+
+    def _execute(self, operation, amount):
+        # Каждый поток работает со своей копией карты, как отдельный запрос
+        card = SavedPaymentMethod.objects.get(pk=self.card.pk)
+        if operation == 'card_to_balance':
+            wallet.card_to_balance(self.user, card, amount, 'Тест', 'Тест')
+        elif operation == 'balance_to_card':
+            wallet.balance_to_card(self.user, card, amount, 'Тест', 'Тест')
+        else:
+            wallet.debit(self.user, amount, 'withdrawal', 'Тест')
+
+    def _run_concurrently(self, plan):
+        """Выполняет операции plan [(операция, сумма)] в потоках; возвращает выполненные"""
+        lock = threading.Lock()
+        done = []
+
+        def run(step):
+            try:
+                for _ in range(self.ATTEMPTS):
+                    try:
+                        self._execute(*step)
+                    except wallet.InsufficientBalance:
+                        return
+                    except OperationalError:
+                        # Транзакция откатана целиком, ее можно повторить
+                        time.sleep(0.005)
+                        continue
+                    with lock:
+                        done.append(step)
+                    return
+                raise AssertionError(f'Операция {step} не выполнилась за {self.ATTEMPTS} попыток')
+            finally:
+                close_old_connections()
+
+        with ThreadPoolExecutor(max_workers=self.THREADS) as executor:
+            list(executor.map(run, plan))
+        return done
+
+    def _expected(self, done):
+        profile, card = self.INITIAL, self.INITIAL
+        for operation, amount in done:
+            if operation == 'card_to_balance':
+                card -= amount
+                profile += amount
+            else:
+                profile -= amount
+                if operation == 'balance_to_card':
+                    card += amount
+        return profile, card
+
+    def _assert_consistent(self, done):
+        profile_balance = UserProfile.objects.get(user=self.user).balance
+        card_balance = SavedPaymentMethod.objects.get(pk=self.card.pk).balance
+        self.assertEqual((profile_balance, card_balance), self._expected(done))
+        self.assertGreaterEqual(profile_balance, 0)
+        self.assertGreaterEqual(card_balance, 0)
+
+        balance_rows = list(BalanceTransaction.objects.filter(user=self.user).order_by('id'))
+        self.assertEqual(len(balance_rows), len(done))
+        previous = self.INITIAL
+        for row in balance_rows:
+            self.assertEqual(row.balance_before, previous, f'Разрыв цепочки остатков на операции #{row.pk}')
+            self.assertGreaterEqual(row.balance_after, 0)
+            previous = row.balance_after
+        self.assertEqual(previous, profile_balance)
+
+        card_rows = CardTransaction.objects.filter(saved_payment_method_id=self.card.pk)
+        card_total = sum((row.amount if row.transaction_type == 'deposit' else -row.amount
+                          for row in card_rows), Decimal('0'))
+        self.assertEqual(self.INITIAL + card_total, card_balance)
+
+    def test_concurrent_debits_do_not_overdraw(self):
+        done = self._run_concurrently([('debit', Decimal('10.00'))] * 20)
+        self.assertEqual(len(done), 10)
+        self._assert_consistent(done)
+        self.assertEqual(UserProfile.objects.get(user=self.user).balance, Decimal('0.00'))
+
+    def test_concurrent_transfers_keep_balances_and_chain(self):
+        rng = random.Random(0)
+        plan = [
+            (rng.choice(['card_to_balance', 'balance_to_card', 'debit']), Decimal(rng.randint(1, 4000)) / 100)
+            for _ in range(60)
+        ]
+        done = self._run_concurrently(plan)
+        self.assertTrue(done)
+        self._assert_consistent(done)
+
+
+class PlacementTests(TestCase):
+    """Списание остатков при оформлении заказа (placement.py)"""
+
+    def setUp(self):
+        self.user = User.objects.create(username='placement-test')
+        self.cart = Cart.objects.create(user=self.user)
+        self.shirt = Product.objects.create(product_name='Рубашка', price=Decimal('100.00'), stock_quantity=5)
+        self.size_m = ProductSize.objects.create(product=self.shirt, size_label='M', size_type='x', size_stock=3)
+        self.size_l = ProductSize.objects.create(product=self.shirt, size_label='L', size_type='x', size_stock=2)
+        self.cap = Product.objects.create(product_name='Кепка', price=Decimal('50.00'), stock_quantity=2)
+
+    def _add(self, product, quantity, size=None):
+        CartItem.objects.create(cart=self.cart, product=product, size=size, quantity=quantity, unit_price=product.price)
+
+    def _place(self):
+        with transaction.atomic():
+            order = Order.objects.create(user=self.user, total_amount=Decimal('0'))
+            placement.place_items(order, placement.cart_items(self.cart))
+        return order
+
+    def _stock(self):
+        return (
+            dict(Product.objects.values_list('product_name', 'stock_quantity')),
+            dict(ProductSize.objects.values_list('size_label', 'size_stock')),
+        )
+
+    def test_stock_is_decremented_once_per_line(self):
+        self._add(self.shirt, 2, self.size_m)
+        self._add(self.shirt, 1, self.size_l)
+        self._add(self.cap, 1)
+        order = self._place()
+
+        self.assertEqual(OrderItem.objects.filter(order=order).count(), 3)
+        self.assertEqual(self._stock(), ({'Рубашка': 2, 'Кепка': 1}, {'M': 1, 'L': 1}))
+
+    def test_oversell_is_rejected(self):
+        self._add(self.shirt, 1, self.size_l)
+        self._add(self.cap, 3)
+        before = self._stock()
+
+        with self.assertRaises(placement.OutOfStock) as raised:
+            self._place()
+        self.assertIn('Кепка', str(raised.exception))
+        # Транзакция откатана целиком: ни позиций, ни списаний по другим строкам
+        self.assertEqual(self._stock(), before)
+        self.assertFalse(Order.objects.exists())
+        self.assertFalse(OrderItem.objects.exists())
+
+    def test_selling_the_last_unit_takes_the_product_off_sale(self):
+        self._add(self.cap, 2)
+        self._place()
+        cap = Product.objects.get(pk=self.cap.pk)
+        self.assertEqual((cap.stock_quantity, cap.is_available), (0, False))
+
+
+class LedgerTests(TestCase):
+    """Журнал счета организации (ledger.py): свертка не меняет текущий баланс"""
+
+    def setUp(self):
+        self.user = User.objects.create(username='ledger-test')
+        # Процесс запоминает, что строка счета создана, а тесты ее откатывают
+        OrganizationAccount.get_account()
+
+    def _credit(self, *amounts):
+        for amount in amounts:
+            order = Order.objects.create(user=self.user, total_amount=Decimal(amount))
+            ledger.credit_order(order, Decimal(amount), Decimal(amount) / 10, self.user)
+
+    def _pending(self):
+        return OrganizationTransaction.objects.filter(rolled_up=False)
+
+    def _assert_balances_match_account_and_pending(self):
+        account = OrganizationAccount.get_account()
+        deltas = [(row.balance_delta, row.tax_reserve_delta) for row in self._pending()]
+        self.assertEqual(ledger.balances(), (
+            account.balance + sum((delta for delta, _ in deltas), Decimal('0')),
+            account.tax_reserve + sum((delta for _, delta in deltas), Decimal('0')),
+        ))
+
+    def test_balance_is_account_plus_pending_across_rollups(self):
+        self._credit('100.00', '250.00', '40.00')
+        self._assert_balances_match_account_and_pending()
+        self.assertEqual(ledger.balances(), (Decimal('390.00'), Decimal('39.00')))
+
+        self.assertEqual(ledger.rollup(), 3)
+        self.assertFalse(self._pending().exists())
+        self.assertEqual(OrganizationAccount.get_account().balance, Decimal('390.00'))
+        self._assert_balances_match_account_and_pending()
+
+        # Списание сворачивает ожидающие операции перед проверкой остатка
+        self._credit('60.00')
+        ledger.withdraw(Decimal('300.00'), self.user, 'Вывод')
+        self._credit('10.00', '20.00')
+        self._assert_balances_match_account_and_pending()
+        self.assertEqual(ledger.balances(), (Decimal('180.00'), Decimal('48.00')))
+        with self.assertRaises(ledger.InsufficientFunds):
+            ledger.withdraw(Decimal('180.01'), self.user, 'Вывод')
+
+        self.assertEqual(ledger.rollup(), 2)
+        self._assert_balances_match_account_and_pending()
+        self.assertEqual(ledger.balances(), (Decimal('180.00'), Decimal('48.00')))
+
+    def test_rollup_fills_a_continuous_chain(self):
+        self._credit('10.00', '20.00')
+        ledger.withdraw(Decimal('5.00'), self.user, 'Вывод')
+        self._credit('30.00')
+        ledger.rollup()
+
+        previous = Decimal('0.00')
+        for row in OrganizationTransaction.objects.order_by('id'):
+            self.assertEqual(row.balance_before, previous, f'Разрыв цепочки остатков на операции #{row.pk}')
+            self.assertEqual(row.balance_after, row.balance_before + row.balance_delta)
+            previous = row.balance_after
+        self.assertEqual(previous, OrganizationAccount.get_account().balance)
+
+    def test_credit_rolls_up_once_the_threshold_is_reached(self):
+        with mock.patch.object(ledger, 'ROLLUP_THRESHOLD', 3):
+            self._credit('10.00', '10.00')
+            ledger._rollup_if_needed()
+            self.assertEqual(self._pending().count(), 2)
+            self._credit('10.00')
+            ledger._rollup_if_needed()
+            self.assertFalse(self._pending().exists())
+        self._assert_balances_match_account_and_pending()
+        self.assertEqual(ledger.balances(), (Decimal('30.00'), Decimal('3.00')))
+
+
+class BulkTransitionTests(TestCase):
+    """Массовая смена статусов (fulfillment.py): недопустимые переходы пропускаются, остальные применяются"""
+
+    def setUp(self):
+        self.manager = User.objects.create(username='fulfillment-test', is_staff=True)
+        self.orders = {
+            status: Order.objects.create(user=self.manager, total_amount=Decimal('100.00'), order_status=status)
+            for status in ('processing', 'paid', 'delivered', 'cancelled')
+        }
+
+    def _status(self, status):
+        return Order.objects.get(pk=self.orders[status].pk).order_status
+
+    def test_invalid_transitions_are_skipped_and_the_rest_apply(self):
+        ids = [order.pk for order in self.orders.values()]
+        missing_id = max(ids) + 1
+        results = fulfillment.bulk_transition(
+            ids + [missing_id], 'shipped', self.manager, carrier_name='Курьер',
+            tracking_numbers={self.orders['processing'].pk: 'TRACK-1'},
+        )
+
+        self.assertEqual([result['order_id'] for result in results], ids + [missing_id])
+        by_id = {result['order_id']: result for result in results}
+        for status in ('processing', 'paid'):
+            self.assertTrue(by_id[self.orders[status].pk]['changed'])
+            self.assertEqual(self._status(status), 'shipped')
+        for status in ('delivered', 'cancelled'):
+            result = by_id[self.orders[status].pk]
+            self.assertFalse(result['success'])
+            self.assertIn('не разрешен', result['error'])
+            self.assertEqual(self._status(status), status)
+        self.assertEqual(by_id[missing_id]['error'], 'Заказ не найден')
+
+        deliveries = {delivery.order_id: delivery for delivery in Delivery.objects.all()}
+        self.assertEqual(set(deliveries), {self.orders['processing'].pk, self.orders['paid'].pk})
+        for delivery in deliveries.values():
+            self.assertEqual((delivery.carrier_name, delivery.delivery_status), ('Курьер', 'in_transit'))
+            self.assertIsNotNone(delivery.shipped_at)
+        self.assertEqual(deliveries[self.orders['processing'].pk].tracking_number, 'TRACK-1')
+        self.assertEqual(ActivityLog.objects.filter(target_object='orders_bulk').count(), 1)
+
+    def test_repeated_transition_keeps_the_status(self):
+        order_id = self.orders['paid'].pk
+        fulfillment.bulk_transition([order_id], 'shipped', self.manager)
+        result, = fulfillment.bulk_transition([order_id], 'shipped', self.manager)
+        self.assertTrue(result['success'])
+        self.assertFalse(result['changed'])
+        self.assertEqual(Delivery.objects.filter(order_id=order_id).count(), 1)
+
+    def test_cancellation_and_unknown_statuses_are_rejected(self):
+        order_id = self.orders['processing'].pk
+        for status in ('cancelled', 'lost'):
+            with self.assertRaises(ValueError):
+                fulfillment.bulk_transition([order_id], status, self.manager)
+        self.assertEqual(self._status('processing'), 'processing')
+
+
+class CancellationTests(TestCase):
+    """Отмена заказа (cancellation.py): деньги и остатки возвращаются ровно один раз"""
+
+    TOTAL = Decimal('300.00')
+
+    def setUp(self):
+        self.user = User.objects.create(username='cancellation-test')
+        UserProfile.objects.update_or_create(user=self.user, defaults={'balance': Decimal('0.00')})
+        self.card = SavedPaymentMethod.objects.create(
+            user=self.user, card_number='0000', card_holder_name='CANCEL TEST',
+            expiry_month='12', expiry_year='2099', balance=Decimal('0.00'),
+        )
+        OrganizationAccount.get_account()
+        self.shirt = Product.objects.create(product_name='Рубашка', price=Decimal('100.00'), stock_quantity=5)
+        self.size = ProductSize.objects.create(product=self.shirt, size_label='M', size_type='x', size_stock=3)
+        self.cap = Product.objects.create(product_name='Кепка', price=Decimal('100.00'), stock_quantity=4)
+
+    def _paid_order(self, from_balance):
+        cart = Cart.objects.create(user=self.user)
+        CartItem.objects.create(cart=cart, product=self.shirt, size=self.size, quantity=2, unit_price=Decimal('100.00'))
+        CartItem.objects.create(cart=cart, product=self.cap, quantity=1, unit_price=Decimal('100.00'))
+        with transaction.atomic():
+            order = Order.objects.create(user=self.user, total_amount=self.TOTAL, order_status='paid',
+                                         paid_from_balance=from_balance, tax_amount=Decimal('39.00'))
+            placement.place_items(order, placement.cart_items(cart))
+            Payment.objects.create(order=order, payment_method='balance' if from_balance else 'card',
+                                   payment_amount=self.TOTAL, payment_status='paid',
+                                   saved_payment_method=None if from_balance else self.card)
+            ledger.credit_order(order, self.TOTAL, order.tax_amount, self.user)
+        return order
+
+    def _state(self):
+        return {
+            'stock': dict(Product.objects.values_list('product_name', 'stock_quantity')),
+            'size_stock': ProductSize.objects.get(pk=self.size.pk).size_stock,
+            'balance': UserProfile.objects.get(user=self.user).balance,
+            'card': SavedPaymentMethod.objects.get(pk=self.card.pk).balance,
+            'org': ledger.balances(),
+            'refunds': OrganizationTransaction.objects.filter(transaction_type='order_refund').count(),
+        }
+
+    def test_cancel_refunds_once_and_restores_stock(self):
+        order = self._paid_order(from_balance=True)
+        placed = self._state()
+        self.assertEqual((placed['stock'], placed['size_stock']), ({'Рубашка': 3, 'Кепка': 3}, 1))
+
+        result, = cancellation.cancel_orders([order.pk], self.user)
+        self.assertEqual((result['success'], result['refund_to'], result['refund_amount']), (True, 'balance', self.TOTAL))
+        cancelled = self._state()
+        self.assertEqual(cancelled['stock'], {'Рубашка': 5, 'Кепка': 4})
+        self.assertEqual(cancelled['size_stock'], 3)
+        self.assertEqual(cancelled['balance'], self.TOTAL)
+        self.assertEqual(cancelled['org'], (Decimal('0.00'), Decimal('0.00')))
+        self.assertEqual(cancelled['refunds'], 1)
+        self.assertEqual(Order.objects.get(pk=order.pk).order_status, 'cancelled')
+        self.assertEqual(BalanceTransaction.objects.filter(order=order, transaction_type='order_refund').count(), 1)
+
+        # Повторная отмена ничего не меняет
+        result, = cancellation.cancel_orders([order.pk], self.user)
+        self.assertFalse(result['success'])
+        self.assertEqual(self._state(), cancelled)
+        self.assertEqual(BalanceTransaction.objects.filter(order=order, transaction_type='order_refund').count(), 1)
+
+    def test_card_payment_is_refunded_to_the_card(self):
+        order = self._paid_order(from_balance=False)
+        result, = cancellation.cancel_orders([order.pk], self.user)
+        self.assertEqual((result['refund_to'], result['refund_amount']), ('card', self.TOTAL))
+        state = self._state()
+        self.assertEqual((state['card'], state['balance']), (self.TOTAL, Decimal('0.00')))
+        self.assertEqual(CardTransaction.objects.filter(saved_payment_method=self.card).count(), 1)
+
+        cancellation.cancel_orders([order.pk], self.user)
+        self.assertEqual(self._state(), state)
+
+    def test_order_is_not_cancelled_without_funds_for_the_refund(self):
+        order = self._paid_order(from_balance=True)
+        ledger.withdraw(Decimal('100.00'), self.user, 'Вывод')
+        placed = self._state()
+
+        result, = cancellation.cancel_orders([order.pk], self.user)
+        self.assertFalse(result['success'])
+        self.assertEqual(self._state(), placed)
+        self.assertEqual(Order.objects.get(pk=order.pk).order_status, 'paid')
+
+
+def _moment(month, day):
+    return timezone.make_aware(datetime(2026, month, day, 12))
+
+
+class StatementTests(TestCase):
+    """Выписки (statements.py): остатки на начало и конец периода одинаковы со снимками и без них"""
+
+    OPENING = Decimal('50.00')
+
+    def setUp(self):
+        self.user = User.objects.create(username='statement-test')
+        self.card = SavedPaymentMethod.objects.create(
+            user=self.user, card_number='0000', card_holder_name='STATEMENT TEST',
+            expiry_month='12', expiry_year='2099', balance=Decimal('0.00'),
+        )
+        balance = self.OPENING
+        for month, day, transaction_type, amount in [
+            (1, 10, 'deposit', '100.00'), (1, 20, 'withdrawal', '30.00'),
+            (2, 5, 'order_refund', '40.00'), (2, 14, 'order_payment', '25.00'),
+            (2, 25, 'withdrawal', '10.00'), (3, 3, 'deposit', '5.00'),
+        ]:
+            amount = Decimal(amount)
+            after = balance + (amount if transaction_type in statements.CREDIT_TYPES['balance'] else -amount)
+            row = BalanceTransaction.objects.create(user=self.user, transaction_type=transaction_type, amount=amount,
+                                                    balance_before=balance, balance_after=after)
+            BalanceTransaction.objects.filter(pk=row.pk).update(created_at=_moment(month, day))
+            balance = after
+        # Незавершенная операция в остатки не входит
+        pending = BalanceTransaction.objects.create(user=self.user, transaction_type='deposit', amount=Decimal('999.00'),
+                                                    balance_before=balance, balance_after=balance, status='pending')
+        BalanceTransaction.objects.filter(pk=pending.pk).update(created_at=_moment(2, 10))
+
+        for month, day, transaction_type, amount in [
+            (1, 15, 'deposit', '70.00'), (2, 2, 'withdrawal', '20.00'), (2, 20, 'deposit', '15.00'),
+        ]:
+            row = CardTransaction.objects.create(saved_payment_method=self.card, transaction_type=transaction_type,
+                                                 amount=Decimal(amount))
+            CardTransaction.objects.filter(pk=row.pk).update(created_at=_moment(month, day))
+
+    def _february(self, account, page_size=statements.PAGE_SIZE):
+        """Выписка за февраль, собранная по всем страницам"""
+        start, end = statements.parse_period('2026-02-01', '2026-02-28')
+        pages, cursor = [], None
+        while True:
+            page = statements.statement_page(account, start, end, cursor=cursor, page_size=page_size)
+            pages.append(page)
+            if not page['has_next']:
+                return pages
+            cursor = page['next_cursor']
+
+    def _assert_february(self, account, opening, closing, count):
+        pages = self._february(account, page_size=2)
+        rows = [row for page in pages for row in page['transactions']]
+        self.assertEqual(len(rows), count)
+        running = opening
+        for page in pages:
+            self.assertEqual((page['opening_balance'], page['closing_balance']), (opening, closing))
+        for row in rows:
+            running += row['amount']
+            self.assertEqual(row['balance_after'], running)
+        self.assertEqual(running, closing)
+
+    def test_balances_match_transactions_across_monthly_snapshots(self):
+        balance = statements.Account('balance', self.user, None)
+        card = statements.Account('card', self.user, self.card)
+        self._assert_february(balance, Decimal('120.00'), Decimal('125.00'), 3)
+        self._assert_february(card, Decimal('70.00'), Decimal('65.00'), 2)
+
+        for boundary in (_moment(2, 1), _moment(3, 1)):
+            statements.take_snapshots(statements.month_start(boundary))
+        snapshots = dict(BalanceSnapshot.objects.filter(account_type='balance').values_list('closing_at', 'closing_balance'))
+        self.assertEqual(sorted(snapshots.values()), [Decimal('120.00'), Decimal('125.00')])
+
+        # Со снимками остатки те же, что и по полной истории
+        self._assert_february(balance, Decimal('120.00'), Decimal('125.00'), 3)
+        self._assert_february(card, Decimal('70.00'), Decimal('65.00'), 2)
+        self.assertEqual(statements.balance_at(balance), Decimal('130.00'))
+        self.assertEqual(statements.opening_balance(balance), self.OPENING)
+
+        # Повторный запуск не меняет существующие снимки
+        statements.take_snapshots(statements.month_start(_moment(3, 1)))
+        self.assertEqual(BalanceSnapshot.objects.count(), 4)
+
+
+class OutboxTests(TestCase):
+    """Доставка событий outbox: ровно один раз, а упавшие события повторяются"""
+
+    TOPIC = 'test.outbox'
+
+    def setUp(self):
+        self.delivered = []
+        self.failing = False
+
+        def handle(payload):
+            if self.failing:
+                raise RuntimeError('Сервис недоступен')
+            self.delivered.append(payload['n'])
+
+        outbox.handler(self.TOPIC)(handle)
+        self.addCleanup(outbox._handlers.pop, self.TOPIC, None)
+
+    def test_event_is_delivered_once(self):
+        event = outbox.enqueue(self.TOPIC, {'n': 1})
+        self.assertEqual(outbox.drain(), 1)
+        self.assertEqual(outbox.drain(), 0)
+        self.assertFalse(outbox.process(event.pk))
+        self.assertFalse(outbox.process(event.pk, force=True))
+        self.assertEqual(self.delivered, [1])
+        event.refresh_from_db()
+        self.assertEqual((event.status, event.attempts), ('done', 1))
+
+    def test_failed_event_is_retried(self):
+        event = outbox.enqueue(self.TOPIC, {'n': 2})
+        self.failing = True
+        self.assertEqual(outbox.drain(), 0)
+        event.refresh_from_db()
+        self.assertEqual((event.status, event.attempts), ('pending', 1))
+        self.assertGreater(event.available_at, timezone.now())
+        # До истечения задержки событие не берется
+        self.assertEqual(outbox.drain(), 0)
+        self.assertEqual(OutboxEvent.objects.get(pk=event.pk).attempts, 1)
+
+        # Последняя попытка помечает событие failed, но не бросает его
+        OutboxEvent.objects.filter(pk=event.pk).update(attempts=outbox.MAX_ATTEMPTS - 1, available_at=timezone.now())
+        self.assertEqual(outbox.drain(), 0)
+        event.refresh_from_db()
+        self.assertEqual(event.status, 'failed')
+        self.assertIn('Сервис недоступен', event.last_error)
+        self.assertEqual(outbox.drain(), 0)
+
+        self.failing = False
+        OutboxEvent.objects.filter(pk=event.pk).update(available_at=timezone.now() - timedelta(seconds=1))
+        self.assertEqual(outbox.drain(), 1)
+        event.refresh_from_db()
+        self.assertEqual((event.status, event.last_error), ('done', ''))
+        self.assertEqual(self.delivered, [2])
@@ -8,15 +8,15 @@ from .api import (
     ProductReviewViewSet, SupportTicketViewSet, ActivityLogViewSet, CheckEmailView, LoginView, RegisterView, ResetPasswordView, VerifyResetDataView,
     ProfileAPIView, AddressAPIView, AddressDetailAPIView, CartAPIView, CartItemAPIView,
     OrderAPIView, OrderDetailAPIView, PaymentMethodAPIView, PaymentMethodDetailAPIView,
-    BalanceAPIView, ValidatePromoAPIView,     ProductManagementAPIView, ProductManagementDetailAPIView,
+    BalanceAPIView, BalanceStatementAPIView, ValidatePromoAPIView,     ProductManagementAPIView, ProductManagementDetailAPIView,
     CategoryManagementAPIView, CategoryManagementDetailAPIView, BrandManagementAPIView,
     BrandManagementDetailAPIView, OrderManagementAPIView, OrderManagementDetailAPIView,
     UserManagementAPIView, UserManagementDetailAPIView, SupportTicketAPIView,
-    SupportTicketDetailAPIView, CatalogAPIView, FavoritesAPIView, FavoriteDetailAPIView,
+    SupportTicketDetailAPIView, CatalogAPIView, CatalogSuggestAPIView, CatalogStatusAPIView, CatalogChangesAPIView, RelatedProductsAPIView, FavoritesAPIView, FavoriteDetailAPIView,
     ProductReviewAPIView, OrganizationAccountAPIView, PromotionManagementAPIView,
     PromotionManagementDetailAPIView, SupplierManagementAPIView, SupplierManagementDetailAPIView,
     RoleManagementAPIView, RoleManagementDetailAPIView, BackupManagementAPIView,
-    BackupManagementDetailAPIView
+    BackupManagementDetailAPIView, OutboxStatsAPIView, OrderBulkStatusAPIView, OrderBulkCancelAPIView
 )
 from django.contrib.auth import views as auth_views
 from . import views
@@ -81,9 +81,14 @@ urlpatterns = [
     path('profile/balance/', views.balance_view, name='balance'),
     path('profile/balance/deposit/', views.deposit_balance, name='deposit_balance'),
     path('profile/balance/withdraw/', views.withdraw_balance, name='withdraw_balance'),
+    path('profile/balance/statement/export/', views.balance_statement_export, name='balance_statement_export'),
     path('profile/orders/<int:pk>/cancel/', views.cancel_order, name='cancel_order'),
 
     # API
+    # Оформление заказа (checkout.html) идет через OrderAPIView, а не через
+    # OrderViewSet роутера с тем же префиксом, поэтому эти пути стоят раньше роутера
+    path('api/orders/', OrderAPIView.as_view(), name='api-orders'),
+    path('api/orders/<int:order_id>/', OrderDetailAPIView.as_view(), name='api-order-detail'),
     path('api/', include(router.urls)),
     path('api/check-email/', CheckEmailView.as_view(), name='check-email'),
     path('api/login/', LoginView.as_view(), name='api-login'),
@@ -97,11 +102,10 @@ urlpatterns = [
     path('api/addresses/<int:address_id>/', AddressDetailAPIView.as_view(), name='api-address-detail'),
     path('api/cart/', CartAPIView.as_view(), name='api-cart'),
     path('api/cart/items/<int:item_id>/', CartItemAPIView.as_view(), name='api-cart-item'),
-    path('api/orders/', OrderAPIView.as_view(), name='api-orders'),
-    path('api/orders/<int:order_id>/', OrderDetailAPIView.as_view(), name='api-order-detail'),
     path('api/payment-methods/', PaymentMethodAPIView.as_view(), name='api-payment-methods'),
     path('api/payment-methods/<int:card_id>/', PaymentMethodDetailAPIView.as_view(), name='api-payment-method-detail'),
     path('api/balance/', BalanceAPIView.as_view(), name='api-balance'),
+    path('api/balance/statement/', BalanceStatementAPIView.as_view(), name='api-balance-statement'),
     path('api/validate-promo/', ValidatePromoAPIView.as_view(), name='api-validate-promo'),
     
     # API для менеджеров и админов
@@ -112,6 +116,8 @@ urlpatterns = [
     path('api/management/brands/', BrandManagementAPIView.as_view(), name='api-management-brands'),
     path('api/management/brands/<int:brand_id>/', BrandManagementDetailAPIView.as_view(), name='api-management-brand-detail'),
     path('api/management/orders/', OrderManagementAPIView.as_view(), name='api-management-orders'),
+    path('api/management/orders/bulk-status/', OrderBulkStatusAPIView.as_view(), name='api-management-orders-bulk-status'),
+    path('api/management/orders/bulk-cancel/', OrderBulkCancelAPIView.as_view(), name='api-management-orders-bulk-cancel'),
     path('api/management/orders/<int:order_id>/', OrderManagementDetailAPIView.as_view(), name='api-management-order-detail'),
     path('api/management/users/', UserManagementAPIView.as_view(), name='api-management-users'),
     path('api/management/users/<int:user_id>/', UserManagementDetailAPIView.as_view(), name='api-management-user-detail'),
@@ -124,6 +130,7 @@ urlpatterns = [
     path('api/management/roles/<int:role_id>/', RoleManagementDetailAPIView.as_view(), name='api-management-role-detail'),
     path('api/management/backups/', BackupManagementAPIView.as_view(), name='api-management-backups'),
     path('api/management/backups/<int:backup_id>/', BackupManagementDetailAPIView.as_view(), name='api-management-backup-detail'),
+    path('api/management/outbox/', OutboxStatsAPIView.as_view(), name='api-management-outbox'),
     
     # API для поддержки
     path('api/support/', SupportTicketAPIView.as_view(), name='api-support'),
@@ -131,6 +138,10 @@ urlpatterns = [
     
     # API для каталога
     path('api/catalog/', CatalogAPIView.as_view(), name='api-catalog'),
+    path('api/catalog/suggest/', CatalogSuggestAPIView.as_view(), name='api-catalog-suggest'),
+    path('api/catalog/status/', CatalogStatusAPIView.as_view(), name='api-catalog-status'),
+    path('api/catalog/changes/', CatalogChangesAPIView.as_view(), name='api-catalog-changes'),
+    path('api/products/<int:product_id>/related/', RelatedProductsAPIView.as_view(), name='api-product-related'),
     
     # API для избранного
     path('api/favorites/', FavoritesAPIView.as_view(), name='api-favorites'),
@@ -164,6 +175,7 @@ urlpatterns = [
     path('management/users/<int:user_id>/toggle-block/', views.management_user_toggle_block, name='management_user_toggle_block'),
     path('management/orders/', views.management_orders_list, name='management_orders_list'),
     path('management/orders/<int:order_id>/status/', views.management_order_change_status, name='management_order_change_status'),
+    path('management/orders/bulk-cancel/', views.management_orders_bulk_cancel, name='management_orders_bulk_cancel'),
     path('management/analytics/export.csv', views.management_analytics_export_csv, name='management_analytics_export_csv'),
     path('management/promotions/', views.management_promotions_list, name='management_promotions_list'),
     path('management/promotions/add/', views.management_promotion_add, name='management_promotion_add'),
@@ -202,6 +214,7 @@ urlpatterns = [
     
     # Управление заказами
     path('manager/orders/', views.manager_orders_list, name='manager_orders_list'),
+    path('manager/orders/bulk-status/', views.manager_orders_bulk_status, name='manager_orders_bulk_status'),
     path('manager/orders/<int:order_id>/', views.manager_order_detail, name='manager_order_detail'),
     
     # Управление пользователями
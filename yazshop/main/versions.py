@@ -0,0 +1,101 @@
+"""
+Счетчики версий данных для инвалидации кэшей и индексов в памяти воркеров.
+
+Версия хранится в БД (модель DataVersion), поэтому увеличение в одном воркере
+сразу видят все остальные, и она не теряется при очистке кэша. Чтобы не
+обращаться к БД на каждом запросе, прочитанные значения запоминаются в
+процессе на VERSION_CHECK_INTERVAL секунд (все устаревшие имена читаются
+одним запросом); собственные изменения процесса видны сразу.
+
+Кроме наборов данных отдельных индексов есть счетчики таблиц (table_name()):
+они увеличиваются сигналами при любом изменении модели и вместе со временем
+изменения служат основой ETag и Last-Modified (см. conditional.py).
+"""
+import threading
+import time
+from datetime import datetime, timezone as dt_timezone
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+
+VERSION_CHECK_INTERVAL = getattr(settings, 'VERSION_CHECK_INTERVAL', 1.0)
+
+_local = {}
+_lock = threading.Lock()
+
+
+def table_name(model):
+    """Имя счетчика версий таблицы модели (например, table:main.product)"""
+    return f'table:{model._meta.label_lower}'
+
+
+def _create(names):
+    """Создает недостающие счетчики"""
+    from .models import DataVersion
+
+    # Начальная версия — метка времени, чтобы не повторить версию, которую клиенты уже видели
+    started = time.time()
+    DataVersion.objects.bulk_create([
+        DataVersion(name=name, version=int(started * 1000),
+                    modified_at=datetime.fromtimestamp(started, tz=dt_timezone.utc))
+        for name in names
+    ], ignore_conflicts=True)
+
+
+def get_versions(names):
+    """
+    Версии и времена изменения наборов данных names: {name: (версия, unix
+    timestamp изменения)}. Устаревшие в процессе значения читаются одним запросом.
+    """
+    from .models import DataVersion
+
+    now = time.monotonic()
+    stale = [name for name in names if name not in _local or now - _local[name][2] >= VERSION_CHECK_INTERVAL]
+    if stale:
+        rows = DataVersion.objects.filter(name__in=stale).values_list('name', 'version', 'modified_at')
+        loaded = {name: (version, modified_at.timestamp(), now) for name, version, modified_at in rows}
+        missing = [name for name in stale if name not in loaded]
+        if missing:
+            _create(missing)
+            rows = DataVersion.objects.filter(name__in=missing).values_list('name', 'version', 'modified_at')
+            loaded.update({name: (version, modified_at.timestamp(), now) for name, version, modified_at in rows})
+        _local.update(loaded)
+    return {name: _local[name][:2] for name in names}
+
+
+def get_version(name):
+    """Текущая версия набора данных name"""
+    return get_versions([name])[name][0]
+
+
+def get_modified_at(name):
+    """Время (unix timestamp) последнего изменения набора данных name"""
+    return get_versions([name])[name][1]
+
+
+def bump(name):
+    """Увеличивает версию набора данных name и возвращает новое значение"""
+    from .models import DataVersion
+
+    rows = DataVersion.objects.filter(name=name)
+    modified_at = time.time()
+    with _lock, transaction.atomic():
+        # UPDATE и чтение в одной транзакции: читается именно своя версия, а не чужая следующая
+        fields = {'version': F('version') + 1, 'modified_at': datetime.fromtimestamp(modified_at, tz=dt_timezone.utc)}
+        if not rows.update(**fields):
+            _create([name])
+            rows.update(**fields)
+        version = rows.values_list('version', flat=True).get()
+        _local[name] = (version, modified_at, time.monotonic())
+    return version
+
+
+def bump_on_commit(*names):
+    """Увеличивает версии после фиксации текущей транзакции"""
+    from django.db import transaction
+
+    def _bump():
+        for name in names:
+            bump(name)
+    transaction.on_commit(_bump)
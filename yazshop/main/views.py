@@ -7,20 +7,27 @@ from django.contrib.auth.forms import PasswordChangeForm
 from django.contrib.auth.models import User
 from django.http import JsonResponse
 from django.db import transaction
-from django.db.models import Avg, F, Exists, OuterRef, Q, Count, Sum
+from django.db.models import F, Exists, OuterRef, Q, Count, Sum
 from django.views.decorators.http import require_POST
 from django import forms
 from django.core.paginator import Paginator
 from django.utils import timezone
 from django.conf import settings
+from django.core.exceptions import ValidationError
 from decimal import Decimal, InvalidOperation
 import json
 from datetime import timedelta
 
 from .models import (
     Role, Product, Promotion, Tag, Category, Brand, Favorite, UserProfile,
-    UserAddress, Order, OrderItem, Cart, CartItem, ProductReview, SupportTicket, Payment, SavedPaymentMethod, ProductSize, BalanceTransaction, CardTransaction, Receipt, ReceiptItem, ReceiptConfig, Supplier, Delivery, ProductTag, ActivityLog, DatabaseBackup, OrganizationAccount, OrganizationTransaction
+    UserAddress, Order, OrderItem, Cart, CartItem, ProductReview, SupportTicket, Payment, SavedPaymentMethod, ProductSize, BalanceTransaction, CardTransaction, Receipt, ReceiptConfig, Supplier, Delivery, ProductTag, ActivityLog, DatabaseBackup, OrganizationTransaction
 )
+from .search import filter_by_search
+from .facets import filter_catalog
+from .pagination import paginate_by_cursor, InvalidCursor
+from . import membership, snapshot, pricing, placement, ledger, idempotency, fulfillment, cancellation, wallet, statements
+from .conditional import conditional_on, CATALOG_TABLES
+from .page_cache import cache_anonymous_page
 
 # =================== Форма для профиля ===================
 class UserProfileForm(forms.ModelForm):
@@ -37,9 +44,16 @@ def handler404(request, exception=None):
     from django.shortcuts import render
     return render(request, '404.html', status=404)
 
+@conditional_on('product', 'promotion', 'tag', 'category', per_user=True)
+@cache_anonymous_page('home', tables=('product', 'promotion', 'tag', 'category'))
 def home(request):
-    new_products = Product.objects.filter(is_available=True).order_by('-added_at')[:12]
-    popular_products = Product.objects.filter(is_available=True).order_by('-added_at')[:12]
+    # Из БД читаются только id по индексам, карточки товаров — из снимка каталога
+    new_products = snapshot.get_products(
+        Product.objects.filter(is_available=True).order_by('-added_at', '-id').values_list('id', flat=True)[:12]
+    )
+    popular_products = snapshot.get_products(
+        Product.objects.filter(is_available=True).order_by('-popularity_score', '-id').values_list('id', flat=True)[:12]
+    )
     promotions = Promotion.objects.filter(is_active=True).order_by('-start_date')[:5]
     tags = Tag.objects.all()[:10]
     categories = Category.objects.all()[:10]
@@ -74,56 +88,76 @@ def register_view(request):
     return render(request, 'register.html')
 
 # =================== Информационные страницы ===================
+@cache_anonymous_page('contacts')
 def contacts(request):
     return render(request, 'contacts.html')
 
+@cache_anonymous_page('refund')
 def refund(request):
     return render(request, 'refund.html')
 
+@cache_anonymous_page('bonus')
 def bonus(request):
     return render(request, 'bonus.html')
 
+@cache_anonymous_page('delivery')
 def delivery(request):
     return render(request, 'delivery.html')
 
+@cache_anonymous_page('about')
 def about(request):
     return render(request, 'about.html')
 
 # =================== Каталог ===================
+@conditional_on(*CATALOG_TABLES, per_user=True)
+@cache_anonymous_page('catalog', tables=CATALOG_TABLES)
 def catalog(request):
     products = Product.objects.filter(is_available=True)
-    categories = Category.objects.all()
-    brands = Brand.objects.all()
-    tags = Tag.objects.all()
+    # Справочники фасетов берутся из снимка каталога; категории отсортированы
+    # по материализованному пути, чтобы подкатегории шли сразу под родителем
+    categories = snapshot.get_categories()
+    brands = snapshot.get_brands()
+    tags = snapshot.get_tags()
 
     query = request.GET.get('q')
-    if query:
-        products = products.filter(product_name__icontains=query)
-
     category_id = request.GET.get('category')
     brand_id = request.GET.get('brand')
     tag_id = request.GET.get('tag')
     sort = request.GET.get('sort')
 
-    if category_id:
-        products = products.filter(category_id=category_id)
-    if brand_id:
-        products = products.filter(brand_id=brand_id)
-    if tag_id:
-        products = products.filter(producttag__tag_id=tag_id)
+    # Фильтрация и подсчет фасетов через битовый индекс, без JOIN
+    products, facet_counts = filter_catalog(
+        products, query=query, query_fields=('product_name',),
+        category=category_id, brand=brand_id, tag=tag_id,
+    )
+    # Количество товаров считается вместе с подкатегориями
+    for category in categories:
+        category.product_count = facet_counts['categories'].get(category.id, 0)
+        category.indent = '— ' * category.depth
+    for brand in brands:
+        brand.product_count = facet_counts['brands'].get(brand.id, 0)
+    for tag in tags:
+        tag.product_count = facet_counts['tags'].get(tag.id, 0)
 
     if sort == 'price_asc':
-        products = products.order_by('price')
+        products = products.order_by('final_price', 'id')
     elif sort == 'price_desc':
-        products = products.order_by('-price')
+        products = products.order_by('-final_price', '-id')
     elif sort == 'popular':
-        products = products.order_by('-stock_quantity')
+        products = products.order_by('-popularity_score', '-id')
+    elif sort == 'rating':
+        products = products.order_by('-avg_rating', '-review_count', '-id')
+    # Из БД читаются только id в нужном порядке, строки товаров — из снимка
+    products = snapshot.get_products(products.values_list('id', flat=True))
 
     return render(request, 'catalog.html', {
         'products': products,
         'categories': categories,
         'brands': brands,
         'tags': tags,
+        'facet_counts': facet_counts,
+        'breadcrumbs': facet_counts.get('breadcrumbs', []),
+        'status_batch_size': membership.MAX_BATCH_IDS,
         'request': request,
     })
 
@@ -156,23 +190,8 @@ def remove_from_favorites(request, product_id):
 def check_product_status(request, product_id):
     """Проверяет, находится ли товар в избранном и корзине"""
     product = get_object_or_404(Product, id=product_id)
-    
-    if not request.user.is_authenticated:
-        return JsonResponse({
-            'is_favorite': False,
-            'is_in_cart': False
-        })
-    
-    is_favorite = Favorite.objects.filter(user=request.user, product=product).exists()
-    
-    # Проверяем, есть ли товар в корзине (любой размер)
-    cart, _ = Cart.objects.get_or_create(user=request.user)
-    is_in_cart = CartItem.objects.filter(cart=cart, product=product).exists()
-    
-    return JsonResponse({
-        'is_favorite': is_favorite,
-        'is_in_cart': is_in_cart
-    })
+    # Наборы избранного и корзины берутся из кэша (membership.py); корзина здесь не создается
+    return JsonResponse(membership.get_statuses(request.user, [product.id])[product.id])
 
 @login_required
 @require_POST
@@ -385,145 +404,18 @@ def order_detail_view(request, pk):
 @login_required
 @require_POST
 def cancel_order(request, pk):
-    """Отмена заказа с возвратом денег и товара на склад"""
+    """Отмена заказа с возвратом денег и товара на склад (cancellation.py)"""
     order = get_object_or_404(Order, pk=pk, user=request.user)
     
     if not order.can_cancel():
         messages.error(request, "Этот заказ нельзя отменить.")
         return redirect('order_detail', pk=order.pk)
     
-    # Возвращаем товар на склад
-    # ВАЖНО: сначала обновляем product.stock_quantity, потом size_stock,
-    # чтобы валидация ProductSize.clean() не выдавала ошибку
-    # Используем update() для обхода валидации при возврате товара
-    for item in order.items.all():
-        if item.product:
-            # Сначала увеличиваем общий запас товара
-            # Используем F() для атомарного обновления в БД
-            Product.objects.filter(pk=item.product.pk).update(
-                stock_quantity=F('stock_quantity') + item.quantity
-            )
-            
-            # Обновляем объект из БД для дальнейшего использования
-            item.product.refresh_from_db()
-            
-            # Проверяем и обновляем статус доступности товара
-            if item.product.stock_quantity <= 0:
-                item.product.is_available = False
-                item.product.save(update_fields=['is_available'])
-            
-            # Потом увеличиваем запас конкретного размера (если есть)
-            # Используем update() чтобы обойти валидацию clean()
-            if item.size:
-                ProductSize.objects.filter(pk=item.size.pk).update(
-                    size_stock=F('size_stock') + item.quantity
-                )
-    
-    # Возвращаем деньги клиенту и списываем со счета организации
-    # Проверяем, был ли заказ оплачен (не наличными)
-    payment = Payment.objects.filter(order=order).first()
-    was_paid = payment and payment.payment_status == 'paid'
-    
-    with transaction.atomic():
-        # Списываем со счета организации только если заказ был оплачен
-        if was_paid:
-            org_account = OrganizationAccount.get_account()
-            org_balance_before = org_account.balance
-            org_tax_reserve_before = org_account.tax_reserve
-            
-            # Списываем сумму заказа
-            if org_account.balance < order.total_amount:
-                messages.error(request, "Недостаточно средств на счете организации для возврата.")
-                return redirect('order_detail', pk=order.pk)
-            
-            org_account.balance -= order.total_amount
-            
-            # Возвращаем налог из резерва
-            if org_account.tax_reserve >= order.tax_amount:
-                org_account.tax_reserve -= order.tax_amount
-            else:
-                org_account.tax_reserve = Decimal('0.00')
-            
-            org_account.save()
-            
-            # Создаем транзакцию списания со счета организации
-            OrganizationTransaction.objects.create(
-                organization_account=org_account,
-                transaction_type='order_refund',
-                amount=order.total_amount,
-                description=f'Возврат по отмене заказа #{order.id}',
-                order=order,
-                created_by=request.user,
-                balance_before=org_balance_before,
-                balance_after=org_account.balance,
-                tax_reserve_before=org_tax_reserve_before,
-                tax_reserve_after=org_account.tax_reserve
-            )
-        
-        # Возвращаем деньги клиенту
-        if order.paid_from_balance:
-            profile, _ = UserProfile.objects.get_or_create(user=request.user)
-            balance_before = profile.balance
-            profile.balance += order.total_amount
-            profile.save()
-            
-            # Создаем транзакцию возврата
-            BalanceTransaction.objects.create(
-                user=request.user,
-                transaction_type='order_refund',
-                amount=order.total_amount,
-                balance_before=balance_before,
-                balance_after=profile.balance,
-                description=f'Возврат за отмененный заказ #{order.id}',
-                order=order,
-                status='completed'
-            )
-        elif was_paid and payment and payment.saved_payment_method:
-            # Если оплата была картой, возвращаем на карту
-            try:
-                card = payment.saved_payment_method
-                card.balance += order.total_amount
-                card.save()
-                
-                # Создаем транзакцию по карте
-                CardTransaction.objects.create(
-                    saved_payment_method=card,
-                    transaction_type='deposit',
-                    amount=order.total_amount,
-                    description=f'Возврат за отмененный заказ #{order.id}',
-                    status='completed'
-                )
-            except Exception as e:
-                # Если не удалось вернуть на карту, возвращаем на баланс
-                profile, _ = UserProfile.objects.get_or_create(user=request.user)
-                profile.balance += order.total_amount
-                profile.save()
-                
-                BalanceTransaction.objects.create(
-                    user=request.user,
-                    transaction_type='order_refund',
-                    amount=order.total_amount,
-                    balance_before=profile.balance - order.total_amount,
-                    balance_after=profile.balance,
-                    description=f'Возврат за отмененный заказ #{order.id} (карта недоступна)',
-                    order=order,
-                    status='completed'
-                )
-    
-    # Обновляем статус заказа
-    order.order_status = 'cancelled'
-    order.can_be_cancelled = False
-    order.save()
-
-    # Аннулируем чек, если есть
-    try:
-        if hasattr(order, 'receipt') and order.receipt:
-            order.receipt.status = 'annulled'
-            order.receipt.save()
-    except Exception:
-        pass
+    result = cancellation.cancel_orders([order.pk], request.user, request)[0]
+    if not result['success']:
+        messages.error(request, result['error'])
+        return redirect('order_detail', pk=order.pk)
     
-    _log_activity(request.user, 'update', f'order_{order.id}', 'Заказ отменен пользователем', request)
     messages.success(request, "Заказ отменен. Деньги возвращены на баланс, товар возвращен на склад.")
     return redirect('order_detail', pk=order.pk)
 
@@ -598,11 +490,44 @@ def balance_view(request):
     return render(request, 'profile/balance.html', {
         'profile': profile,
         'transactions': transactions,
-        'saved_payments': saved_payments
+        'saved_payments': saved_payments,
+        'idempotency_key': idempotency.new_key(),
     })
 
+@login_required
+def balance_statement_export(request):
+    """Выписка по балансу или карте за период в CSV (потоком) или PDF"""
+    from django.http import StreamingHttpResponse, FileResponse
+
+    card_id = request.GET.get('card_id') or None
+    export_format = request.GET.get('format', 'csv')
+    try:
+        account = statements.account_for(request.user, card_id)
+        start, end = statements.parse_period(request.GET.get('date_from'), request.GET.get('date_to'))
+    except (SavedPaymentMethod.DoesNotExist, ValueError) as e:
+        messages.error(request, "Карта не найдена." if isinstance(e, SavedPaymentMethod.DoesNotExist) else str(e))
+        return redirect('balance')
+
+    filename = f"statement_{account.account_type}_{timezone.localtime():%Y%m%d}"
+    if export_format == 'pdf':
+        try:
+            output = statements.build_pdf(account, start, end)
+        except ImportError:
+            messages.error(request, "PDF генератор не установлен. Пожалуйста, установите reportlab.")
+            return redirect('balance')
+        except ValueError as e:
+            messages.error(request, str(e))
+            return redirect('balance')
+        return FileResponse(output, as_attachment=True, filename=f'{filename}.pdf', content_type='application/pdf')
+
+    # Строки отдаются по мере чтения из базы, выписка не собирается в памяти целиком
+    response = StreamingHttpResponse(statements.stream_csv(account, start, end), content_type='text/csv; charset=utf-8')
+    response['Content-Disposition'] = f'attachment; filename="{filename}.csv"'
+    return response
+
 @login_required
 @require_POST
+@idempotency.idempotent('balance_deposit')
 def deposit_balance(request):
     """Пополнение баланса с карты"""
     try:
@@ -619,45 +544,18 @@ def deposit_balance(request):
         
         # Проверяем, что карта принадлежит пользователю
         card = get_object_or_404(SavedPaymentMethod, id=card_id, user=request.user)
-        with transaction.atomic():
-            # Блокируем строку карты для корректного списания
-            card = SavedPaymentMethod.objects.select_for_update().get(id=card.id)
-            profile, _ = UserProfile.objects.select_for_update().get_or_create(user=request.user)
-            if card.balance < amount:
-                messages.error(request, f"Недостаточно средств на карте. Баланс карты: {card.balance} ₽")
-                return redirect('balance')
-            balance_before = profile.balance
-            # Списание с карты (проверяем, что баланс не станет отрицательным)
-            new_card_balance = card.balance - amount
-            if new_card_balance < 0:
-                messages.error(request, f"Недостаточно средств на карте. Баланс карты: {card.balance} ₽")
-                return redirect('balance')
-            card.balance = new_card_balance
-            card.save()
-            # Пополнение баланса пользователя
-            profile.balance += amount
-            profile.save()
-            
-            # Создаем транзакцию баланса
-            BalanceTransaction.objects.create(
-                user=request.user,
-                transaction_type='deposit',
-                amount=amount,
-                balance_before=balance_before,
-                balance_after=profile.balance,
-                description=f'Пополнение баланса с карты {card.mask_card_number()}',
-                status='completed'
-            )
-            
-            # Создаем транзакцию по карте (списание)
-            CardTransaction.objects.create(
-                saved_payment_method=card,
-                transaction_type='withdrawal',
-                amount=amount,
-                description=f'Перевод на баланс пользователя {amount} ₽',
-                status='completed'
+        # Списание с карты и пополнение баланса — условными UPDATE (wallet.py)
+        try:
+            balance_row, _ = wallet.card_to_balance(
+                request.user, card, amount,
+                f'Пополнение баланса с карты {card.mask_card_number()}',
+                f'Перевод на баланс пользователя {amount} ₽',
             )
-        messages.success(request, f"Баланс пополнен на {amount} ₽ с карты {card.mask_card_number()}. Текущий баланс: {profile.balance} ₽")
+        except wallet.InsufficientBalance as e:
+            messages.error(request, str(e))
+            return redirect('balance')
+        messages.success(request, f"Баланс пополнен на {amount} ₽ с карты {card.mask_card_number()}. Текущий баланс: {balance_row.balance_after} ₽")
+        idempotency.succeeded(request)
     except (ValueError, TypeError):
         messages.error(request, "Неверная сумма.")
     
@@ -665,6 +563,7 @@ def deposit_balance(request):
 
 @login_required
 @require_POST
+@idempotency.idempotent('balance_withdraw')
 def withdraw_balance(request):
     """Вывод средств с баланса на карту"""
     try:
@@ -682,45 +581,19 @@ def withdraw_balance(request):
         # Проверяем, что карта принадлежит пользователю
         card = get_object_or_404(SavedPaymentMethod, id=card_id, user=request.user)
         
-        profile, _ = UserProfile.objects.get_or_create(user=request.user)
-        
-        if profile.balance < amount:
-            messages.error(request, f"Недостаточно средств на балансе. Текущий баланс: {profile.balance} ₽")
-            return redirect('balance')
-        
-        with transaction.atomic():
-            # блокируем профиль и карту
-            profile = UserProfile.objects.select_for_update().get(user=request.user)
-            card = SavedPaymentMethod.objects.select_for_update().get(id=card.id)
-            balance_before = profile.balance
-            # Списываем с баланса пользователя
-            profile.balance -= amount
-            profile.save()
-            # Пополняем баланс карты
-            card.balance += amount
-            card.save()
-            
-            # Создаем транзакцию баланса
-            BalanceTransaction.objects.create(
-                user=request.user,
-                transaction_type='withdrawal',
-                amount=amount,
-                balance_before=balance_before,
-                balance_after=profile.balance,
-                description=f'Вывод средств на карту {card.mask_card_number()}',
-                status='completed'
-            )
-            
-            # Создаем транзакцию по карте (пополнение)
-            CardTransaction.objects.create(
-                saved_payment_method=card,
-                transaction_type='deposit',
-                amount=amount,
-                description=f'Пополнение карты на {amount} ₽ с внутреннего баланса',
-                status='completed'
+        # Остаток проверяется в том же UPDATE, что и списание (wallet.py)
+        try:
+            balance_row, _ = wallet.balance_to_card(
+                request.user, card, amount,
+                f'Вывод средств на карту {card.mask_card_number()}',
+                f'Пополнение карты на {amount} ₽ с внутреннего баланса',
             )
+        except wallet.InsufficientBalance as e:
+            messages.error(request, str(e))
+            return redirect('balance')
         
-        messages.success(request, f"Средства выведены: {amount} ₽ на карту {card.mask_card_number()}. Текущий баланс: {profile.balance} ₽")
+        messages.success(request, f"Средства выведены: {amount} ₽ на карту {card.mask_card_number()}. Текущий баланс: {balance_row.balance_after} ₽")
+        idempotency.succeeded(request)
     except (ValueError, TypeError):
         messages.error(request, "Неверная сумма.")
     
@@ -754,6 +627,7 @@ def get_card_transactions(request, card_id):
 
 @login_required
 @require_POST
+@idempotency.idempotent('card_deposit')
 def deposit_from_card(request, card_id):
     """Пополнение баланса с конкретной карты"""
     try:
@@ -762,45 +636,19 @@ def deposit_from_card(request, card_id):
             return JsonResponse({'success': False, 'message': 'Сумма должна быть больше нуля'}, status=400)
         
         card = get_object_or_404(SavedPaymentMethod, id=card_id, user=request.user)
-        with transaction.atomic():
-            card = SavedPaymentMethod.objects.select_for_update().get(id=card.id)
-            profile, _ = UserProfile.objects.select_for_update().get_or_create(user=request.user)
-            if card.balance < amount:
-                return JsonResponse({'success': False, 'message': 'Недостаточно средств на карте'}, status=400)
-            # Списываем с карты (проверяем, что баланс не станет отрицательным)
-            new_card_balance = card.balance - amount
-            if new_card_balance < 0:
-                return JsonResponse({'success': False, 'message': 'Недостаточно средств на карте'}, status=400)
-            card.balance = new_card_balance
-            card.save()
-            # Пополняем баланс пользователя
-            balance_before = profile.balance
-            profile.balance += amount
-            profile.save()
-            
-            # Создаем транзакции
-            BalanceTransaction.objects.create(
-                user=request.user,
-                transaction_type='deposit',
-                amount=amount,
-                balance_before=balance_before,
-                balance_after=profile.balance,
-                description=f'Пополнение баланса с карты {card.mask_card_number()}',
-                status='completed'
-            )
-            
-            CardTransaction.objects.create(
-                saved_payment_method=card,
-                transaction_type='withdrawal',  # списание с карты при переводе на счет
-                amount=amount,
-                description=f'Перевод на счет пользователя {amount} ₽',
-                status='completed'
+        try:
+            balance_row, _ = wallet.card_to_balance(
+                request.user, card, amount,
+                f'Пополнение баланса с карты {card.mask_card_number()}',
+                f'Перевод на счет пользователя {amount} ₽',
             )
+        except wallet.InsufficientBalance:
+            return JsonResponse({'success': False, 'message': 'Недостаточно средств на карте'}, status=400)
         
         return JsonResponse({
             'success': True,
             'message': f'Баланс пополнен на {amount} ₽',
-            'new_balance': float(profile.balance),
+            'new_balance': float(balance_row.balance_after),
             'card_balance': float(card.balance)
         })
     except (ValueError, TypeError):
@@ -808,6 +656,7 @@ def deposit_from_card(request, card_id):
 
 @login_required
 @require_POST
+@idempotency.idempotent('card_withdraw')
 def withdraw_to_card(request, card_id):
     """Вывод средств на конкретную карту"""
     try:
@@ -816,42 +665,19 @@ def withdraw_to_card(request, card_id):
             return JsonResponse({'success': False, 'message': 'Сумма должна быть больше нуля'}, status=400)
         
         card = get_object_or_404(SavedPaymentMethod, id=card_id, user=request.user)
-        with transaction.atomic():
-            profile, _ = UserProfile.objects.select_for_update().get_or_create(user=request.user)
-            if profile.balance < amount:
-                return JsonResponse({'success': False, 'message': 'Недостаточно средств на внутреннем балансе'}, status=400)
-            # блокируем карту
-            card = SavedPaymentMethod.objects.select_for_update().get(id=card.id)
-            balance_before = profile.balance
-            # списываем с баланса профиля
-            profile.balance -= amount
-            profile.save()
-            # пополняем карту
-            card.balance += amount
-            card.save()
-            # транзакция баланса
-            BalanceTransaction.objects.create(
-                user=request.user,
-                transaction_type='withdrawal',
-                amount=amount,
-                balance_before=balance_before,
-                balance_after=profile.balance,
-                description=f'Вывод средств на карту {card.mask_card_number()}',
-                status='completed'
-            )
-            # транзакция по карте
-            CardTransaction.objects.create(
-                saved_payment_method=card,
-                transaction_type='deposit',
-                amount=amount,
-                description=f'Пополнение карты на {amount} ₽',
-                status='completed'
+        try:
+            balance_row, _ = wallet.balance_to_card(
+                request.user, card, amount,
+                f'Вывод средств на карту {card.mask_card_number()}',
+                f'Пополнение карты на {amount} ₽',
             )
+        except wallet.InsufficientBalance:
+            return JsonResponse({'success': False, 'message': 'Недостаточно средств на внутреннем балансе'}, status=400)
         
         return JsonResponse({
             'success': True,
             'message': f'Карта пополнена на {amount} ₽',
-            'new_balance': float(profile.balance),
+            'new_balance': float(balance_row.balance_after),
             'card_balance': float(card.balance)
         })
     except (ValueError, TypeError):
@@ -860,6 +686,7 @@ def withdraw_to_card(request, card_id):
 
 @login_required
 @require_POST
+@idempotency.idempotent('card_topup')
 def topup_card_balance(request, card_id):
     """Прямое пополнение баланса конкретной карты (без списания откуда-либо)"""
     try:
@@ -868,17 +695,7 @@ def topup_card_balance(request, card_id):
             return JsonResponse({'success': False, 'message': 'Сумма должна быть больше нуля'}, status=400)
         
         card = get_object_or_404(SavedPaymentMethod, id=card_id, user=request.user)
-        card.balance += amount
-        card.save()
-        
-        # Лог транзакции по карте
-        CardTransaction.objects.create(
-            saved_payment_method=card,
-            transaction_type='deposit',
-            amount=amount,
-            description=f'Пополнение карты на {amount} ₽',
-            status='completed'
-        )
+        wallet.credit_card(card, amount, f'Пополнение карты на {amount} ₽')
         
         return JsonResponse({
             'success': True,
@@ -998,7 +815,7 @@ def management_dashboard(request):
     recent_activity = ActivityLog.objects.filter(created_at__gte=week_ago).count()
     
     # Счет организации
-    org_account = OrganizationAccount.get_account()
+    org_balances = ledger.balances()
     
     stats = {
         'total_users': total_users,
@@ -1008,8 +825,8 @@ def management_dashboard(request):
         'new_tickets': new_tickets,
         'recent_activity': recent_activity,
         'recent_logs': recent_logs,
-        'org_balance': org_account.balance,
-        'org_tax_reserve': org_account.tax_reserve,
+        'org_balance': org_balances.balance,
+        'org_tax_reserve': org_balances.tax_reserve,
     }
     
     blocks = [
@@ -1158,6 +975,30 @@ def management_order_change_status(request, order_id: int):
             messages.success(request, 'Статус заказа обновлен')
     return redirect('management_orders_list')
 
+@login_required
+def management_orders_bulk_cancel(request):
+    """Массовая отмена выбранных заказов с возвратом денег и товара"""
+    if not _user_is_admin(request.user):
+        return redirect('profile')
+    if request.method != 'POST':
+        return redirect('management_orders_list')
+    reason = request.POST.get('reason', '').strip()
+    try:
+        results = cancellation.cancel_orders(
+            request.POST.getlist('order_ids'), request.user, request,
+            description='Массовая отмена заказов администратором' + (f': {reason}' if reason else ''),
+        )
+    except ValueError as e:
+        messages.error(request, str(e))
+    else:
+        failed = [result for result in results if not result['success']]
+        messages.success(request, f'Отменено заказов: {len(results) - len(failed)}')
+        for result in failed[:10]:
+            messages.error(request, f"Заказ #{result['order_id']}: {result['error']}")
+        if len(failed) > 10:
+            messages.error(request, f'И еще заказов с ошибкой: {len(failed) - 10}')
+    return redirect('management_orders_list')
+
 @login_required
 def management_analytics_export_csv(request):
     if not _user_is_admin(request.user):
@@ -1294,40 +1135,28 @@ def validate_promo(request):
     if not code:
         return JsonResponse({'success': False, 'message': 'Укажите промокод'}, status=400)
     cart = Cart.objects.filter(user=request.user).first()
-    if not cart or not cart.items.exists():
+    if not cart:
+        return JsonResponse({'success': False, 'message': 'Корзина пуста'}, status=400)
+    base = pricing.cart_summary(cart)
+    if not base.line_count:
         return JsonResponse({'success': False, 'message': 'Корзина пуста'}, status=400)
     try:
-        promo = Promotion.objects.get(promo_code=code)
-        # Проверяем активность промокода
-        if not promo.is_active:
-            return JsonResponse({'success': False, 'message': 'Промокод неактивен'}, status=400)
-        from django.utils import timezone
-        today = timezone.now().date()
-        if promo.start_date and promo.start_date > today:
-            return JsonResponse({'success': False, 'message': 'Промокод еще не действует'}, status=400)
-        if promo.end_date and promo.end_date < today:
-            return JsonResponse({'success': False, 'message': 'Промокод истек'}, status=400)
-        cart_total = cart.total_price()
-        delivery_cost = Decimal('1000.00')
-        discount_amount = (cart_total * (promo.discount / Decimal('100'))).quantize(Decimal('0.01'))
-        subtotal_after_discount = cart_total - discount_amount
-        pre_vat = subtotal_after_discount + delivery_cost  # Товары - скидка + доставка
-        vat_rate = Decimal('20.00')
-        vat_amount = (pre_vat * vat_rate / Decimal('100')).quantize(Decimal('0.01'))
-        total = (pre_vat + vat_amount).quantize(Decimal('0.01'))
-        return JsonResponse({
-            'success': True,
-            'promo': {'code': promo.promo_code, 'discount_percent': str(promo.discount)},
-            'amounts': {
-                'subtotal': float(cart_total),
-                'discount': float(discount_amount),
-                'delivery': float(delivery_cost),
-                'vat': float(vat_amount),
-                'total': float(total)
-            }
-        })
-    except Promotion.DoesNotExist:
-        return JsonResponse({'success': False, 'message': 'Неверный промокод'}, status=404)
+        promo = pricing.get_promo(code)
+    except pricing.PromoError as e:
+        return JsonResponse({'success': False, 'message': str(e)},
+                            status=404 if isinstance(e, pricing.PromoNotFound) else 400)
+    summary = base.with_promo(promo)
+    return JsonResponse({
+        'success': True,
+        'promo': {'code': promo.promo_code, 'discount_percent': str(promo.discount)},
+        'amounts': {
+            'subtotal': float(summary.subtotal),
+            'discount': float(summary.discount_amount),
+            'delivery': float(summary.delivery_cost),
+            'vat': float(summary.vat_amount),
+            'total': float(summary.total)
+        }
+    })
 
 @login_required
 def receipt_pdf(request, receipt_id: int):
@@ -1695,7 +1524,7 @@ def update_cart_quantity(request, item_id):
         return JsonResponse({
             'success': True, 
             'subtotal': float(item.subtotal()), 
-            'total': float(item.cart.total_price())
+            'total': float(pricing.cart_totals(item.cart_id)[0])
         })
     
     # Иначе редирект
@@ -1703,6 +1532,7 @@ def update_cart_quantity(request, item_id):
     return redirect('cart')
 
 @login_required
+@idempotency.idempotent('checkout')
 def checkout(request):
     cart = Cart.objects.filter(user=request.user).first()
     if not cart or not cart.items.exists():
@@ -1726,15 +1556,9 @@ def checkout(request):
             messages.error(request, "Пожалуйста, выберите адрес доставки.")
             return redirect('checkout')
 
-        # Проверка количества товара на складе
-        errors = []
-        for item in cart.items.all():
-            if item.size:
-                if item.size.size_stock < item.quantity:
-                    errors.append(f"Товар '{item.product.product_name}' размера {item.size.size_label}: недостаточно на складе (доступно: {item.size.size_stock}, запрошено: {item.quantity})")
-            elif item.product.stock_quantity < item.quantity:
-                errors.append(f"Товар '{item.product.product_name}': недостаточно на складе (доступно: {item.product.stock_quantity}, запрошено: {item.quantity})")
-        
+        # Проверка количества товара на складе (окончательно остатки проверяет списание)
+        items = placement.cart_items(cart)
+        errors = placement.stock_errors(items)
         if errors:
             for error in errors:
                 messages.error(request, error)
@@ -1742,42 +1566,19 @@ def checkout(request):
 
         # Проверка промокода
         promo = None
-        discount_amount = Decimal('0')
         if promo_code:
             try:
-                promo = Promotion.objects.get(promo_code=promo_code.upper(), is_active=True)
-                # Проверяем даты действия промокода
-                from django.utils import timezone
-                today = timezone.now().date()
-                if promo.start_date and promo.start_date > today:
-                    messages.error(request, "Промокод еще не действует.")
-                    return redirect('checkout')
-                if promo.end_date and promo.end_date < today:
-                    messages.error(request, "Промокод истек.")
-                    return redirect('checkout')
-                # Вычисляем скидку
-                cart_total = cart.total_price()
-                discount_amount = cart_total * (promo.discount / Decimal('100'))
-            except Promotion.DoesNotExist:
-                messages.error(request, "Неверный промокод.")
+                promo = pricing.get_promo(promo_code)
+            except pricing.PromoError as e:
+                messages.error(request, f"{e}.")
                 return redirect('checkout')
 
         address = UserAddress.objects.get(id=address_id, user=request.user)
         
-        # Вычисляем итоговую сумму с учетом скидки и доставки
-        cart_total = cart.total_price()
-        delivery_cost = Decimal('1000.00')  # Доставка всегда 1000 рублей
-        subtotal_after_discount = cart_total - discount_amount
-        pre_vat_amount = subtotal_after_discount + delivery_cost  # Сумма товаров + доставка
-        vat_rate = Decimal('20.00')
-        vat_amount = (pre_vat_amount * vat_rate / Decimal('100')).quantize(Decimal('0.01'))
-        
-        # Налог на прибыль 13% рассчитывается с суммы после НДС
-        amount_after_vat = pre_vat_amount + vat_amount
-        tax_rate = Decimal('13.00')
-        tax_amount = (amount_after_vat * tax_rate / Decimal('100')).quantize(Decimal('0.01'))
-        
-        final_amount = amount_after_vat.quantize(Decimal('0.01'))
+        # Итоги заказа с учетом скидки, доставки, НДС и налога на прибыль (pricing.py)
+        # по проверенным позициям, а не по кэшу итогов корзины
+        summary = pricing.items_summary(items, promo)
+        final_amount = summary.total
 
         # Проверяем способ оплаты
         payment_method = request.POST.get('payment_method', 'cash')  # cash, card или balance
@@ -1792,248 +1593,104 @@ def checkout(request):
             paid_from_balance = True
 
         # Вся логика оформления в транзакции
-        with transaction.atomic():
-            # Создаем заказ
-            order = Order.objects.create(
-                user=request.user,
-                address=address,
-                total_amount=final_amount,
-                delivery_cost=delivery_cost,
-                promo_code=promo,
-                discount_amount=discount_amount,
-                vat_rate=vat_rate,
-                vat_amount=vat_amount,
-                tax_rate=tax_rate,
-                tax_amount=tax_amount,
-                paid_from_balance=paid_from_balance,
-                order_status='paid' if paid_from_balance else 'processing'
-            )
+        try:
+            with transaction.atomic():
+                # Создаем заказ
+                order = Order.objects.create(
+                    user=request.user,
+                    address=address,
+                    total_amount=final_amount,
+                    delivery_cost=summary.delivery_cost,
+                    promo_code=promo,
+                    discount_amount=summary.discount_amount,
+                    vat_rate=summary.vat_rate,
+                    vat_amount=summary.vat_amount,
+                    tax_rate=summary.tax_rate,
+                    tax_amount=summary.tax_amount,
+                    paid_from_balance=paid_from_balance,
+                    order_status='paid' if paid_from_balance else 'processing'
+                )
 
-            # Обработка способа оплаты
-            saved_payment = None
-            payment_method_type = 'cash'
-            payment_status = 'pending'
-            
-            if payment_method == 'cash':
+                # Обработка способа оплаты
+                saved_payment = None
                 payment_method_type = 'cash'
                 payment_status = 'pending'
-            elif payment_method == 'balance':
-                payment_method_type = 'balance'
-                payment_status = 'paid'
-                
-                # Списываем с баланса
-                profile, _ = UserProfile.objects.select_for_update().get_or_create(user=request.user)
-                if profile.balance < final_amount:
-                    order.delete()
-                    messages.error(request, f"Недостаточно средств на балансе. Текущий баланс: {profile.balance} ₽, требуется: {final_amount} ₽")
-                    return redirect('checkout')
-                balance_before = profile.balance
-                profile.balance -= final_amount
-                profile.save()
+            
+                if payment_method == 'cash':
+                    payment_method_type = 'cash'
+                    payment_status = 'pending'
+                elif payment_method == 'balance':
+                    payment_method_type = 'balance'
+                    payment_status = 'paid'
                 
-                # Создаем транзакцию
-                BalanceTransaction.objects.create(
-                    user=request.user,
-                    transaction_type='order_payment',
-                    amount=final_amount,
-                    balance_before=balance_before,
-                    balance_after=profile.balance,
-                    description=f'Оплата заказа #{order.id}',
-                    order=order,
-                    status='completed'
-                )
-            elif payment_method == 'card':
-                payment_status = 'paid'
-                # Используем сохраненную карту
-                if saved_payment_id and saved_payment_id != '':
-                    saved_payment = SavedPaymentMethod.objects.select_for_update().get(id=saved_payment_id, user=request.user)
-                    payment_method_type = saved_payment.card_type or 'card'
-                    if saved_payment.balance < final_amount:
-                        order.delete()
-                        messages.error(request, f"Недостаточно средств на выбранной карте. Баланс карты: {saved_payment.balance} ₽, требуется: {final_amount} ₽")
-                        return redirect('checkout')
-                    # Списываем (проверяем, что баланс не станет отрицательным)
-                    new_card_balance = saved_payment.balance - final_amount
-                    if new_card_balance < 0:
-                        order.delete()
-                        messages.error(request, f"Недостаточно средств на выбранной карте. Баланс карты: {saved_payment.balance} ₽, требуется: {final_amount} ₽")
-                        return redirect('checkout')
-                    saved_payment.balance = new_card_balance
-                    saved_payment.save()
-                    # Фиксируем транзакцию по карте
-                    CardTransaction.objects.create(
-                        saved_payment_method=saved_payment,
-                        transaction_type='withdrawal',
-                        amount=final_amount,
-                        description=f'Оплата заказа #{order.id}',
-                        status='completed'
-                    )
-                # Новая карта: разрешаем только если карта будет сохранена и на ней достаточно средств
-                elif card_number and card_holder_name and expiry_month and expiry_year:
-                    payment_method_type = 'visa' if card_number.startswith('4') else 'mastercard' if card_number.startswith('5') else 'card'
-                    if save_card:
-                        card_type = payment_method_type
-                        card_last_4 = card_number[-4:] if len(card_number) >= 4 else card_number
-                        is_default = not SavedPaymentMethod.objects.filter(user=request.user).exists()
-                        saved_payment = SavedPaymentMethod.objects.create(
-                            user=request.user,
-                            card_number=card_last_4,
-                            card_holder_name=card_holder_name,
-                            expiry_month=expiry_month,
-                            expiry_year=expiry_year,
-                            card_type=card_type,
-                            is_default=is_default
-                        )
-                        if saved_payment.balance < final_amount:
-                            order.delete()
-                            messages.error(request, f"Недостаточно средств на карте. Баланс карты: {saved_payment.balance} ₽, требуется: {final_amount} ₽")
-                            return redirect('checkout')
-                        # Списываем (проверяем, что баланс не станет отрицательным)
-                        new_card_balance = saved_payment.balance - final_amount
-                        if new_card_balance < 0:
+                    # Списываем с баланса условным UPDATE (wallet.py); при нехватке
+                    # средств InsufficientBalance откатывает всю транзакцию заказа
+                    wallet.debit(request.user, final_amount, 'order_payment', f'Оплата заказа #{order.id}', order)
+                elif payment_method == 'card':
+                    payment_status = 'paid'
+                    # Используем сохраненную карту
+                    if saved_payment_id and saved_payment_id != '':
+                        saved_payment = SavedPaymentMethod.objects.get(id=saved_payment_id, user=request.user)
+                        payment_method_type = saved_payment.card_type or 'card'
+                        wallet.debit_card(saved_payment, final_amount, f'Оплата заказа #{order.id}')
+                    # Новая карта: разрешаем только если карта будет сохранена и на ней достаточно средств
+                    elif card_number and card_holder_name and expiry_month and expiry_year:
+                        payment_method_type = 'visa' if card_number.startswith('4') else 'mastercard' if card_number.startswith('5') else 'card'
+                        if save_card:
+                            card_type = payment_method_type
+                            card_last_4 = card_number[-4:] if len(card_number) >= 4 else card_number
+                            is_default = not SavedPaymentMethod.objects.filter(user=request.user).exists()
+                            saved_payment = SavedPaymentMethod.objects.create(
+                                user=request.user,
+                                card_number=card_last_4,
+                                card_holder_name=card_holder_name,
+                                expiry_month=expiry_month,
+                                expiry_year=expiry_year,
+                                card_type=card_type,
+                                is_default=is_default
+                            )
+                            wallet.debit_card(saved_payment, final_amount, f'Оплата заказа #{order.id}')
+                        else:
                             order.delete()
-                            messages.error(request, f"Недостаточно средств на карте. Баланс карты: {saved_payment.balance} ₽, требуется: {final_amount} ₽")
+                            messages.error(request, "Для оплаты новой картой сначала сохраните карту и убедитесь в наличии средств.")
                             return redirect('checkout')
-                        saved_payment.balance = new_card_balance
-                        saved_payment.save()
-                        CardTransaction.objects.create(
-                            saved_payment_method=saved_payment,
-                            transaction_type='withdrawal',
-                            amount=final_amount,
-                            description=f'Оплата заказа #{order.id}',
-                            status='completed'
-                        )
                     else:
                         order.delete()
-                        messages.error(request, "Для оплаты новой картой сначала сохраните карту и убедитесь в наличии средств.")
+                        messages.error(request, "Пожалуйста, выберите или введите данные карты.")
                         return redirect('checkout')
-                else:
-                    order.delete()
-                    messages.error(request, "Пожалуйста, выберите или введите данные карты.")
-                    return redirect('checkout')
             
-            # Создаем запись о платеже
-            payment = Payment.objects.create(
-                order=order,
-                payment_method=payment_method_type,
-                payment_amount=final_amount,
-                payment_status=payment_status,
-                saved_payment_method=saved_payment,
-                promo_code=promo
-            )
-
-            # Если платеж прошел (balance или card), переводим заказ в 'paid'
-            if payment_status == 'paid' and order.order_status != 'paid':
-                order.order_status = 'paid'
-                order.save(update_fields=['order_status'])
-            
-            # Переводим средства на счет организации (если платеж прошел, но не наличными)
-            # Наличные оплачиваются при получении, поэтому средства переводятся позже
-            if payment_status == 'paid' and payment_method != 'cash':
-                org_account = OrganizationAccount.get_account()
-                balance_before = org_account.balance
-                tax_reserve_before = org_account.tax_reserve
-                
-                # Зачисляем сумму заказа на счет организации
-                org_account.balance += final_amount
-                
-                # Резервируем налог 13% от суммы заказа
-                org_account.tax_reserve += tax_amount
-                
-                org_account.save()
-                
-                # Создаем транзакцию
-                OrganizationTransaction.objects.create(
-                    organization_account=org_account,
-                    transaction_type='order_payment',
-                    amount=final_amount,
-                    description=f'Поступление от заказа #{order.id}',
-                    order=order,
-                    created_by=request.user,
-                    balance_before=balance_before,
-                    balance_after=org_account.balance,
-                    tax_reserve_before=tax_reserve_before,
-                    tax_reserve_after=org_account.tax_reserve
-                )
-
-            # Создаем позиции заказа и вычитаем количество со склада
-            order_items = list(cart.items.all())
-            for item in order_items:
-                OrderItem.objects.create(
+                # Создаем запись о платеже
+                payment = Payment.objects.create(
                     order=order,
-                    product=item.product,
-                    size=item.size,
-                    quantity=item.quantity,
-                    unit_price=item.unit_price,
+                    payment_method=payment_method_type,
+                    payment_amount=final_amount,
+                    payment_status=payment_status,
+                    saved_payment_method=saved_payment,
+                    promo_code=promo
                 )
-                
-                # Вычитаем количество со склада
-                if item.size:
-                    # блокировка на уровне ORM отсутствует, полагаемся на транзакцию
-                    item.size.size_stock -= item.quantity
-                    item.size.save()
-                    item.product.stock_quantity -= item.quantity
-                    item.product.save()
-                else:
-                    item.product.stock_quantity -= item.quantity
-                    item.product.save()
-            
-            cart.items.all().delete()
 
-            # Формируем чек
-            receipt_subtotal = Decimal('0.00')
-            receipt_vat_total = Decimal('0.00')
-            
-            # Рассчитываем НДС для доставки
-            delivery_vat = (delivery_cost * vat_rate / Decimal('100')).quantize(Decimal('0.01'))
+                # Если платеж прошел (balance или card), переводим заказ в 'paid'
+                if payment_status == 'paid' and order.order_status != 'paid':
+                    order.order_status = 'paid'
+                    order.save(update_fields=['order_status'])
             
-            receipt = Receipt.objects.create(
-                user=request.user,
-                order=order,
-                status='executed',
-                total_amount=final_amount,
-                subtotal=cart_total,
-                delivery_cost=delivery_cost,
-                discount_amount=discount_amount,
-                vat_rate=vat_rate,
-                vat_amount=vat_amount,
-                payment_method=payment_method if payment_method in ['cash', 'balance', 'card'] else 'card'
-            )
-            
-            # Добавляем товары в чек
-            for item in order.items.select_related('product').all():
-                line_total = (item.unit_price * item.quantity).quantize(Decimal('0.01'))
-                line_vat = (line_total * vat_rate / Decimal('100')).quantize(Decimal('0.01'))
-                ReceiptItem.objects.create(
-                    receipt=receipt,
-                    product_name=item.product.product_name if item.product else 'Товар',
-                    article=str(item.product.id if item.product else ''),
-                    quantity=item.quantity,
-                    unit_price=item.unit_price,
-                    line_total=line_total,
-                    vat_amount=line_vat
-                )
-                receipt_subtotal += line_total
-                receipt_vat_total += line_vat
-            
-            # Добавляем доставку как отдельную позицию в чек
-            ReceiptItem.objects.create(
-                receipt=receipt,
-                product_name='Доставка',
-                article='DELIVERY',
-                quantity=1,
-                unit_price=delivery_cost,
-                line_total=delivery_cost,
-                vat_amount=delivery_vat
-            )
-            receipt_vat_total += delivery_vat
-            
-            # Обновляем итоговые суммы в чеке
-            receipt.total_amount = final_amount.quantize(Decimal('0.01'))
-            receipt.vat_amount = receipt_vat_total.quantize(Decimal('0.01'))
-            receipt.save()
-            _log_activity(request.user, 'create', f'order_{order.id}', f'Создан заказ на сумму {final_amount} ₽', request)
+                # Позиции заказа, списание остатков и очистка корзины (placement.py)
+                placement.place_items(order, items)
+                placement.clear_cart(cart)
+                # Чек, поступление на счет организации (если платеж прошел, но не наличными:
+                # наличные оплачиваются при получении) и журнал действий — после коммита, в фоне
+                placement.after_checkout(order, payment_method,
+                                         credit=payment_status == 'paid' and payment_method != 'cash',
+                                         request=request)
+        except placement.OutOfStock as e:
+            for error in e.errors:
+                messages.error(request, error)
+            return redirect('checkout')
+        except wallet.InsufficientBalance as e:
+            messages.error(request, f"{e}, требуется: {final_amount} ₽")
+            return redirect('checkout')
         messages.success(request, "Заказ успешно оформлен!")
+        idempotency.succeeded(request)
         return redirect('order_detail', pk=order.pk)
 
     # GET запрос - показываем форму
@@ -2041,25 +1698,20 @@ def checkout(request):
     saved_payments = SavedPaymentMethod.objects.filter(user=request.user)
     profile, _ = UserProfile.objects.get_or_create(user=request.user)
     
-    # Рассчитываем суммы для отображения
-    cart_total = cart.total_price()
-    delivery_cost = Decimal('1000.00')
-    vat_rate = Decimal('20.00')
-    # НДС рассчитывается с суммы товаров + доставка
-    pre_vat_amount = cart_total + delivery_cost
-    vat_amount = (pre_vat_amount * vat_rate / Decimal('100')).quantize(Decimal('0.01'))
-    total_with_vat = pre_vat_amount + vat_amount
+    # Суммы для отображения (без промокода, он применяется на странице)
+    summary = pricing.cart_summary(cart)
     
     return render(request, 'checkout.html', {
         'cart': cart,
         'addresses': addresses,
         'saved_payments': saved_payments,
         'user_balance': profile.balance,
-        'delivery_cost': delivery_cost,
-        'vat_rate': vat_rate,
-        'vat_amount': vat_amount,
-        'total_with_vat': total_with_vat,
-        'subtotal': cart_total
+        'delivery_cost': summary.delivery_cost,
+        'vat_rate': summary.vat_rate,
+        'vat_amount': summary.vat_amount,
+        'total_with_vat': summary.total,
+        'subtotal': summary.subtotal,
+        'idempotency_key': idempotency.new_key(),
     })
 
 @login_required
@@ -2105,19 +1757,21 @@ def add_review(request, product_id):
         return JsonResponse({'success': False, 'message': 'Вы можете оставить отзыв только на купленный товар'}, status=403)
     
     # Проверяем, не оставлял ли пользователь уже отзыв на этот товар
-    existing_review = ProductReview.objects.filter(user=request.user, product=product).first()
-    if existing_review:
-        existing_review.rating_value = rating
-        existing_review.review_text = review_text
-        existing_review.save()
-        return JsonResponse({'success': True, 'message': 'Отзыв обновлен'})
-    
-    ProductReview.objects.create(
-        user=request.user,
-        product=product,
-        rating_value=rating,
-        review_text=review_text
-    )
+    # Сводка рейтинга товара обновляется сигналом в той же транзакции
+    with transaction.atomic():
+        existing_review = ProductReview.objects.select_for_update().filter(user=request.user, product=product).first()
+        if existing_review:
+            existing_review.rating_value = rating
+            existing_review.review_text = review_text
+            existing_review.save()
+            return JsonResponse({'success': True, 'message': 'Отзыв обновлен'})
+        
+        ProductReview.objects.create(
+            user=request.user,
+            product=product,
+            rating_value=rating,
+            review_text=review_text
+        )
     return JsonResponse({'success': True, 'message': 'Отзыв добавлен'})
 
 def get_product_reviews(request, product_id):
@@ -2138,9 +1792,9 @@ def get_product_reviews(request, product_id):
             'created_at': review.created_at.strftime('%d.%m.%Y %H:%M')
         })
     
-    # Средний рейтинг
-    avg_rating = reviews.aggregate(avg=Avg('rating_value'))['avg'] or 0
-    total_reviews = reviews.count()
+    # Сводка рейтинга хранится в товаре
+    avg_rating = product.avg_rating
+    total_reviews = product.review_count
     
     # Можно ли пользователю оставить отзыв (для модального окна)
     user_can_review = False
@@ -2162,6 +1816,7 @@ def get_product_reviews(request, product_id):
         'reviews': reviews_data,
         'avg_rating': round(avg_rating, 1),
         'total_reviews': total_reviews,
+        'rating_histogram': product.rating_histogram,
         'has_more': total_reviews > limit,
         'user_can_review': user_can_review
     })
@@ -2186,9 +1841,9 @@ def product_reviews_page(request, product_id):
             Q(order__order_status__in=['paid', 'shipped', 'delivered'])
         ).exists()
     
-    # Средний рейтинг
-    avg_rating = reviews.aggregate(avg=Avg('rating_value'))['avg'] or 0
-    total_reviews = reviews.count()
+    # Сводка рейтинга хранится в товаре
+    avg_rating = product.avg_rating
+    total_reviews = product.review_count
     
     # Проверяем, оставлял ли пользователь уже отзыв
     user_review = None
@@ -2200,6 +1855,7 @@ def product_reviews_page(request, product_id):
         'reviews': reviews,
         'avg_rating': round(avg_rating, 1),
         'total_reviews': total_reviews,
+        'rating_histogram': product.rating_histogram,
         'user_has_purchased': user_has_purchased,
         'user_review': user_review
     })
@@ -2313,7 +1969,7 @@ def manager_products_list(request):
     qs = Product.objects.select_related('category', 'brand').prefetch_related('sizes', 'producttag_set__tag').all()
     
     if q:
-        qs = qs.filter(Q(product_name__icontains=q) | Q(product_description__icontains=q))
+        qs = filter_by_search(qs, q)
     if category_id:
         qs = qs.filter(category_id=category_id)
     if brand_id:
@@ -2570,7 +2226,11 @@ def manager_category_edit(request, category_id):
         category.category_name = request.POST.get('category_name', '').strip()
         category.category_description = request.POST.get('category_description', '').strip()
         category.parent_category_id = request.POST.get('parent_category_id') or None
-        category.save()
+        try:
+            category.save()
+        except ValidationError as e:
+            messages.error(request, ' '.join(e.messages))
+            return redirect('manager_category_edit', category_id=category_id)
         _log_activity(request.user, 'update', f'category_{category_id}', f'Обновлена категория: {old_name} -> {category.category_name}', request)
         messages.success(request, 'Категория обновлена')
         return redirect('manager_categories_list')
@@ -2647,6 +2307,34 @@ def manager_orders_list(request):
         'statuses': Order.ORDER_STATUSES
     })
 
+@login_required
+def manager_orders_bulk_status(request):
+    """Массовая смена статуса выбранных заказов и назначение курьера"""
+    if not _user_is_manager(request.user):
+        return redirect('profile')
+    if request.method != 'POST':
+        return redirect('manager_orders_list')
+
+    try:
+        results = fulfillment.bulk_transition(
+            request.POST.getlist('order_ids'),
+            request.POST.get('order_status', ''),
+            request.user,
+            carrier_name=request.POST.get('carrier_name'),
+            request=request,
+        )
+    except ValueError as e:
+        messages.error(request, str(e))
+    else:
+        changed = sum(1 for result in results if result['changed'])
+        failed = [result for result in results if not result['success']]
+        messages.success(request, f'Статус изменен у заказов: {changed}')
+        for result in failed[:10]:
+            messages.error(request, f"Заказ #{result['order_id']}: {result['error']}")
+        if len(failed) > 10:
+            messages.error(request, f'И еще заказов с ошибкой: {len(failed) - 10}')
+    return redirect('manager_orders_list')
+
 @login_required
 def manager_order_detail(request, order_id):
     """Детали заказа для менеджера"""
@@ -3767,7 +3455,7 @@ def admin_analytics(request):
     ).aggregate(Sum('tax_amount'))['tax_amount__sum'] or Decimal('0')
     
     # Счет организации
-    org_account = OrganizationAccount.get_account()
+    org_balances = ledger.balances()
     
     stats = {
         'orders_today': orders_today,
@@ -3792,8 +3480,8 @@ def admin_analytics(request):
         'active_users_list': active_users_list,
         'total_tax_month': total_tax_month,
         'total_tax_year': total_tax_year,
-        'org_balance': org_account.balance,
-        'org_tax_reserve': org_account.tax_reserve,
+        'org_balance': org_balances.balance,
+        'org_tax_reserve': org_balances.tax_reserve,
     }
     
     return render(request, 'main/admin/analytics.html', stats)
@@ -3809,13 +3497,12 @@ def admin_analytics_export_csv(request):
     return manager_analytics_export_csv(request)
 
 @login_required
+@idempotency.idempotent('org_account')
 def admin_org_account(request):
     """Управление счетом организации"""
     if not _user_is_admin(request.user):
         return redirect('profile')
     
-    org_account = OrganizationAccount.get_account()
-    
     if request.method == 'POST':
         action = request.POST.get('action')
         
@@ -3833,13 +3520,6 @@ def admin_org_account(request):
                 messages.error(request, "Сумма должна быть больше нуля.")
                 return redirect('admin_org_account')
             
-            # Обновляем объект из БД для актуальных данных
-            org_account.refresh_from_db()
-            
-            if not org_account.can_withdraw(amount):
-                messages.error(request, f"Недостаточно средств на счете организации. Доступно: {org_account.balance} ₽, запрошено: {amount} ₽")
-                return redirect('admin_org_account')
-            
             if not card_id:
                 messages.error(request, "Выберите карту для вывода средств.")
                 return redirect('admin_org_account')
@@ -3852,44 +3532,17 @@ def admin_org_account(request):
             
             try:
                 with transaction.atomic():
-                    # Блокируем запись для обновления
-                    org_account = OrganizationAccount.objects.select_for_update().get(pk=org_account.pk)
-                    
-                    # Повторная проверка после блокировки
-                    if not org_account.can_withdraw(amount):
-                        messages.error(request, f"Недостаточно средств на счете организации. Доступно: {org_account.balance} ₽, запрошено: {amount} ₽")
-                        return redirect('admin_org_account')
-                    
-                    balance_before = org_account.balance
-                    org_account.balance -= amount
-                    org_account.save()
+                    # Остаток проверяется под блокировкой счета (ledger.py)
+                    ledger.withdraw(amount, request.user, f'Вывод на карту {card.mask_card_number()}')
                     
-                    card.balance += amount
-                    card.save()
-                    
-                    # Создаем транзакции
-                    OrganizationTransaction.objects.create(
-                        organization_account=org_account,
-                        transaction_type='withdrawal',
-                        amount=amount,
-                        description=f'Вывод на карту {card.mask_card_number()}',
-                        created_by=request.user,
-                        balance_before=balance_before,
-                        balance_after=org_account.balance,
-                        tax_reserve_before=org_account.tax_reserve,
-                        tax_reserve_after=org_account.tax_reserve
-                    )
-                    
-                    CardTransaction.objects.create(
-                        saved_payment_method=card,
-                        transaction_type='deposit',
-                        amount=amount,
-                        description=f'Поступление со счета организации',
-                        status='completed'
-                    )
+                    wallet.credit_card(card, amount, 'Поступление со счета организации')
                     
                     _log_activity(request.user, 'update', 'org_account', f'Вывод {amount} ₽ на карту {card.mask_card_number()}', request)
                     messages.success(request, f"Средства в размере {amount} ₽ переведены на карту {card.mask_card_number()}")
+                idempotency.succeeded(request)
+            except ledger.InsufficientFunds as e:
+                messages.error(request, str(e))
+                return redirect('admin_org_account')
             except Exception as e:
                 messages.error(request, f"Ошибка при выводе средств: {str(e)}")
                 return redirect('admin_org_account')
@@ -3906,54 +3559,16 @@ def admin_org_account(request):
                 messages.error(request, "Сумма должна быть больше нуля.")
                 return redirect('admin_org_account')
             
-            # Обновляем объект из БД для актуальных данных
-            org_account.refresh_from_db()
-            
-            if not org_account.can_pay_tax(amount):
-                if org_account.tax_reserve < amount:
-                    messages.error(request, f"Недостаточно средств в резерве на налоги. Доступно: {org_account.tax_reserve} ₽, запрошено: {amount} ₽")
-                elif org_account.balance < amount:
-                    messages.error(request, f"Недостаточно средств на счете организации. Доступно: {org_account.balance} ₽, запрошено: {amount} ₽")
-                else:
-                    messages.error(request, f"Недостаточно средств для оплаты налога.")
-                return redirect('admin_org_account')
-            
             try:
                 with transaction.atomic():
-                    # Блокируем запись для обновления
-                    org_account = OrganizationAccount.objects.select_for_update().get(pk=org_account.pk)
-                    
-                    # Повторная проверка после блокировки
-                    if not org_account.can_pay_tax(amount):
-                        if org_account.tax_reserve < amount:
-                            messages.error(request, f"Недостаточно средств в резерве на налоги. Доступно: {org_account.tax_reserve} ₽, запрошено: {amount} ₽")
-                        elif org_account.balance < amount:
-                            messages.error(request, f"Недостаточно средств на счете организации. Доступно: {org_account.balance} ₽, запрошено: {amount} ₽")
-                        else:
-                            messages.error(request, f"Недостаточно средств для оплаты налога.")
-                        return redirect('admin_org_account')
-                    
-                    balance_before = org_account.balance
-                    tax_reserve_before = org_account.tax_reserve
-                    
-                    org_account.balance -= amount
-                    org_account.tax_reserve -= amount
-                    org_account.save()
-                    
-                    OrganizationTransaction.objects.create(
-                        organization_account=org_account,
-                        transaction_type='tax_payment',
-                        amount=amount,
-                        description=f'Оплата налога',
-                        created_by=request.user,
-                        balance_before=balance_before,
-                        balance_after=org_account.balance,
-                        tax_reserve_before=tax_reserve_before,
-                        tax_reserve_after=org_account.tax_reserve
-                    )
+                    ledger.pay_tax(amount, request.user)
                     
                     _log_activity(request.user, 'update', 'org_account', f'Оплата налога {amount} ₽', request)
                     messages.success(request, f"Налог в размере {amount} ₽ оплачен")
+                idempotency.succeeded(request)
+            except ledger.InsufficientFunds as e:
+                messages.error(request, str(e))
+                return redirect('admin_org_account')
             except Exception as e:
                 messages.error(request, f"Ошибка при оплате налога: {str(e)}")
                 return redirect('admin_org_account')
@@ -3962,16 +3577,17 @@ def admin_org_account(request):
     
     # Получаем транзакции
     transactions = OrganizationTransaction.objects.filter(
-        organization_account=org_account
+        organization_account_id=ledger.ACCOUNT_ID
     ).select_related('order', 'created_by').order_by('-created_at')[:50]
     
     # Получаем карты админа
     admin_cards = SavedPaymentMethod.objects.filter(user=request.user)
     
     return render(request, 'main/admin/org_account.html', {
-        'org_account': org_account,
+        'org_account': ledger.balances(),
         'transactions': transactions,
         'admin_cards': admin_cards,
+        'idempotency_key': idempotency.new_key(),
     })
 
 @login_required
@@ -4023,8 +3639,20 @@ def admin_activity_logs(request):
         except ValueError:
             pass
     
-    paginator = Paginator(qs, 50)
-    page_obj = paginator.get_page(request.GET.get('page') or 1)
+    # По умолчанию курсорная пагинация (журнал постоянно листают вглубь),
+    # старые ссылки вида ?page=N продолжают работать через Paginator
+    cursor_mode = 'page' not in request.GET
+    cursor_error = None
+    if cursor_mode:
+        try:
+            page_obj = paginate_by_cursor(qs, request.GET.get('cursor'), 50)
+        except InvalidCursor as e:
+            # Испорченная ссылка: показываем первую страницу с ошибкой, а не молча подменяем страницу
+            cursor_error = f'{e}: ссылка на страницу журнала повреждена, показана первая страница.'
+            page_obj = paginate_by_cursor(qs, None, 50)
+    else:
+        paginator = Paginator(qs, 50)
+        page_obj = paginator.get_page(request.GET.get('page') or 1)
     
     # Уникальные типы действий для фильтра
     action_types = ActivityLog.objects.values_list('action_type', flat=True).distinct()
@@ -4034,14 +3662,16 @@ def admin_activity_logs(request):
     
     return render(request, 'main/admin/activity_logs.html', {
         'page_obj': page_obj,
+        'cursor_mode': cursor_mode,
         'q': q,
         'action_filter': action_filter,
         'user_filter': user_filter,
         'date_from': date_from,
         'date_to': date_to,
         'action_types': action_types,
-        'users_with_logs': users_with_logs
-    })
+        'users_with_logs': users_with_logs,
+        'cursor_error': cursor_error,
+    }, status=400 if cursor_error else 200)
 
 @login_required
 def admin_activity_log_detail(request, log_id):
@@ -0,0 +1,137 @@
+"""
+Операции с балансом пользователя (UserProfile.balance) и балансом карт
+(SavedPaymentMethod.balance).
+
+Раньше представления читали строку под select_for_update(), меняли баланс
+в Python и сохраняли всю строку. На SQLite (база по умолчанию)
+select_for_update() ничего не блокирует, поэтому два параллельных запроса
+читали один и тот же баланс и одно из изменений терялось, а проверка
+«хватает ли денег» проходила у обоих.
+
+Здесь баланс меняется только условным UPDATE:
+
+    UPDATE ... SET balance = balance - x WHERE id = ... AND balance >= x
+
+Проверка и изменение выполняются базой в одном операторе, поэтому
+изменения не теряются и баланс не уходит в минус ни на SQLite, ни на
+Postgres. Если UPDATE не изменил строку, средств не хватает
+(InsufficientBalance). Остатки «до/после» для операции читаются сразу
+после UPDATE в той же транзакции: строка уже заблокирована записью
+(на SQLite — вся база), и между UPDATE и чтением ее никто не изменит.
+
+Переводы между балансом и картой выполняются в одной транзакции и всегда
+сначала меняют профиль, потом карту, поэтому встречные переводы на
+Postgres не блокируют друг друга взаимно. Проверить отсутствие потерянных
+изменений под нагрузкой можно командой stress_balances.
+"""
+from django.db import transaction
+from django.db.models import F
+
+
+class InsufficientBalance(ValueError):
+    """На балансе или на карте недостаточно средств"""
+
+    def __init__(self, message, available):
+        self.available = available
+        super().__init__(message)
+
+
+def _change(queryset, delta):
+    """
+    Прибавляет delta к balance строки queryset одним UPDATE (списание — только
+    если хватает средств). Возвращает баланс после изменения или None.
+    """
+    guarded = queryset.filter(balance__gte=-delta) if delta < 0 else queryset
+    if not guarded.update(balance=F('balance') + delta):
+        return None
+    return queryset.values_list('balance', flat=True).get()
+
+
+def current_balance(user):
+    """Баланс пользователя (профиль создается при первом обращении)"""
+    from .models import UserProfile
+    profile, _ = UserProfile.objects.get_or_create(user=user)
+    return profile.balance
+
+
+def _change_profile(user, delta, transaction_type, description, order=None):
+    from .models import BalanceTransaction, UserProfile
+
+    # Первым в транзакции идет UPDATE, а не чтение: на SQLite транзакция сразу
+    # занимает блокировку записи и ждет ее, а не падает с «database is locked»
+    # при повышении блокировки чтения
+    profiles = UserProfile.objects.filter(user=user)
+    balance_after = _change(profiles, delta)
+    if balance_after is None and not profiles.exists():
+        UserProfile.objects.get_or_create(user=user)
+        balance_after = _change(profiles, delta)
+    if balance_after is None:
+        available = current_balance(user)
+        raise InsufficientBalance(f'Недостаточно средств на балансе. Текущий баланс: {available} ₽', available)
+    return BalanceTransaction.objects.create(
+        user=user,
+        transaction_type=transaction_type,
+        amount=abs(delta),
+        balance_before=balance_after - delta,
+        balance_after=balance_after,
+        description=description,
+        order=order,
+        status='completed'
+    )
+
+
+def credit(user, amount, transaction_type, description, order=None):
+    """Зачисление на баланс пользователя. Возвращает BalanceTransaction."""
+    with transaction.atomic():
+        return _change_profile(user, amount, transaction_type, description, order)
+
+
+def debit(user, amount, transaction_type, description, order=None):
+    """Списание с баланса пользователя; InsufficientBalance, если средств не хватает"""
+    with transaction.atomic():
+        return _change_profile(user, -amount, transaction_type, description, order)
+
+
+def _change_card(card, delta, transaction_type, description):
+    from .models import CardTransaction, SavedPaymentMethod
+
+    balance_after = _change(SavedPaymentMethod.objects.filter(pk=card.pk), delta)
+    if balance_after is None:
+        card.refresh_from_db(fields=['balance'])
+        raise InsufficientBalance(f'Недостаточно средств на карте. Баланс карты: {card.balance} ₽', card.balance)
+    card.balance = balance_after
+    return CardTransaction.objects.create(
+        saved_payment_method=card,
+        transaction_type=transaction_type,
+        amount=abs(delta),
+        description=description,
+        status='completed'
+    )
+
+
+def credit_card(card, amount, description):
+    """Зачисление на карту (card.balance обновляется). Возвращает CardTransaction."""
+    with transaction.atomic():
+        return _change_card(card, amount, 'deposit', description)
+
+
+def debit_card(card, amount, description):
+    """Списание с карты; InsufficientBalance, если средств не хватает"""
+    with transaction.atomic():
+        return _change_card(card, -amount, 'withdrawal', description)
+
+
+def card_to_balance(user, card, amount, balance_description, card_description):
+    """Перевод с карты на баланс пользователя. Возвращает (BalanceTransaction, CardTransaction)."""
+    with transaction.atomic():
+        balance_row = _change_profile(user, amount, 'deposit', balance_description)
+        card_row = _change_card(card, -amount, 'withdrawal', card_description)
+        return balance_row, card_row
+
+
+def balance_to_card(user, card, amount, balance_description, card_description):
+    """Вывод с баланса пользователя на карту. Возвращает (BalanceTransaction, CardTransaction)."""
+    with transaction.atomic():
+        balance_row = _change_profile(user, -amount, 'withdrawal', balance_description)
+        card_row = _change_card(card, amount, 'deposit', card_description)
+        return balance_row, card_row
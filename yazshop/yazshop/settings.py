@@ -1,5 +1,6 @@
 from pathlib import Path
 import os
+import sys
 from dotenv import load_dotenv
 
 # Загрузка переменных окружения из .env файла
@@ -89,6 +90,39 @@ else:
         }
     }
 
+# ================== Кэш ==================
+# Общий кэш воркеров (наборы избранного/корзины пользователей, страницы, итоги корзин).
+# Без REDIS_URL используется файловый кэш: он общий для всех воркеров gunicorn
+# на одном сервере. Кэш в памяти процесса не подходит — сброс записи в одном
+# воркере не виден остальным. Для нескольких серверов нужен REDIS_URL.
+if os.environ.get('REDIS_URL'):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': os.environ.get('REDIS_URL'),
+            'KEY_PREFIX': 'yazshop',
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+            'LOCATION': os.environ.get('CACHE_DIR', str(BASE_DIR / '.cache')),
+            'KEY_PREFIX': 'yazshop',
+            'OPTIONS': {
+                # По умолчанию 300 записей: кэш страниц и наборов пользователей вытеснял бы сам себя
+                'MAX_ENTRIES': int(os.environ.get('CACHE_MAX_ENTRIES', 20000)),
+            },
+        }
+    }
+
+# ================== Снимок каталога ==================
+# Снимок (main/snapshot.py) публикуется фоновым потоком воркера после изменений
+# каталога. Со значением False его публикует только команда publish_catalog_snapshot
+# по расписанию; в тестах поток пережил бы тестовую БД
+CATALOG_SNAPSHOT_BACKGROUND = (os.environ.get('CATALOG_SNAPSHOT_BACKGROUND', 'True') == 'True'
+                               and 'test' not in sys.argv[1:2])
+
 # ================== Валидация пароля ==================
 AUTH_PASSWORD_VALIDATORS = [
     {'NAME': 'django.contrib.auth.password_validation.UserAttributeSimilarityValidator'},
@@ -116,6 +150,9 @@ STATICFILES_STORAGE = 'whitenoise.storage.CompressedManifestStaticFilesStorage'
 # ================== Медиа ==================
 MEDIA_URL = '/media/'
 MEDIA_ROOT = BASE_DIR / 'media'
+# Хосты, с которых скачиваются исходные изображения товаров для миниатюр
+# (main/images.py), через запятую: 'cdn.example.com,.example.com'
+PRODUCT_IMAGE_SOURCE_HOSTS = [host for host in os.environ.get('PRODUCT_IMAGE_SOURCE_HOSTS', '').split(',') if host]
 
 # ================== Сессии и Cookies ==================
 # Для продакшена с HTTPS установите в True